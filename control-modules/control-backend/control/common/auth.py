@@ -4,18 +4,29 @@
 #  The session cookie: named "session", HttpOnly (logout is
 #  a real endpoint, not JavaScript), browser-session
 #  lifetime. Passwords are bcrypt hashes. The session
-#  stores only the user's ID; the user row is re-read from
-#  the DB on every request, so permission/enabled changes
-#  apply immediately.
+#  stores only the user's ID and session epoch; the user row
+#  is read from the DB when the auth cache (below) has no
+#  current answer, so permission/enabled changes apply
+#  immediately.
 #
 #  load_user only accepts Enabled accounts, so disabling a
-#  user cuts off their live session everywhere at once.
+#  user cuts off their live session everywhere at once. A
+#  session whose epoch is behind the user's is dead — that
+#  is how signed-cookie sessions (settings SESSION_BACKEND)
+#  are revoked, there being no row to delete.
 ############################################################
 
 import json
+import os
+import tempfile
+import threading
+import time
 from dataclasses import dataclass
 from functools import wraps
 
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
 from django.http import JsonResponse
 from django.utils import timezone
 
@@ -23,12 +34,27 @@ from control.users.models import SystemUser, RecentActivity
 
 
 SESSION_USER_KEY = 'user_id'
+SESSION_EPOCH_KEY = 'epoch'
+
+SIGNED_SESSION_ENGINE = 'django.contrib.sessions.backends.signed_cookies'
 
 # Verified against when a login attempt names an unknown user,
 # so the response takes as long as a real bcrypt check and the
 # timing can't be used to enumerate accounts
 DUMMY_BCRYPT_HASH = '$2b$12$37rvWwtdP/sb.pZwBklPFeUxoH.KWOXIDjTxiiC9awCYpXIB8EbmS'
 
+# Longest a cached session → user or VM access answer is
+# trusted without an invalidation in between
+AUTH_CACHE_SECONDS = 10
+AUTH_CACHE_MAX_ENTRIES = 10000
+
+# Shared by every process of the container (gunicorn workers
+# and the monitor): its mtime is the auth generation
+AUTH_GENERATION_FILE = os.path.join(tempfile.gettempdir(), 'control-auth-generation')
+
+_authCache = {}
+_authCacheLock = threading.Lock()
+
 
 
 
@@ -91,22 +117,138 @@ def get_json(request):
 # SessionUser
 ############################################################
 #
-# The request's user, re-read from the database on every
-# request. admin/enabled are carried as integers (0/1) even
-# though the model stores booleans — that is what the JSON
-# contract exposes, and the conversion happens once, here.
+# The request's user. admin/enabled are carried as integers
+# (0/1) even though the model stores booleans — that is what
+# the JSON contract exposes, and the conversion happens once,
+# here. Frozen: one cached instance serves many requests.
+# session_epoch is compared against the session's stamp.
 #
 # Used by:
 #   - login_required / admin_required — set request.current_user
 ############################################################
 
-@dataclass
+@dataclass(frozen=True)
 class SessionUser:
     id: int
     email: str
     password: str
     admin: int
     enabled: int
+    session_epoch: int = 0
+
+
+
+
+
+
+
+
+############################################################
+# auth cache
+############################################################
+#
+# Every API call resolves its session to a user, and every
+# asset a :8443 VM tool page loads passes the forward_auth
+# gate (checkauth/vm/<id>) — two or three queries per static
+# file. So the two answers are cached per process:
+#
+#   ('session', key)            → SessionUser
+#   ('vm', userId, admin, vmId) → True (only grants are kept)
+#
+# for at most AUTH_CACHE_SECONDS, and only while the auth
+# generation is the one they were read under.
+#
+# invalidate_auth_cache() is how a change that can take
+# access away — a user disabled, demoted, edited or deleted,
+# a logout, a VM deleted — makes every process
+# forget: it clears this process's entries at once, and once
+# the change is COMMITTED moves the generation (the mtime of
+# AUTH_GENERATION_FILE, a stat away for every worker). A
+# lookup reads the generation BEFORE its queries, so an
+# answer read before the commit is always filed under the
+# old generation — "disable cuts off immediately" holds.
+#
+# Used by:
+#   - get_current_user, check_user_is_allowed_to_access_vm
+#     (below)
+#   - auth_views (logout), users_views (admin edits),
+#     vm_views / hosting/jobs (VM deletes) — invalidation
+#   - auth_views.bump_last_seen — its once-a-minute marker
+############################################################
+
+def read_auth_generation():
+    try:
+        return os.stat(AUTH_GENERATION_FILE).st_mtime_ns
+    except OSError:
+        return 0
+
+
+
+def auth_cache_get(cacheKey):
+    with _authCacheLock:
+        entry = _authCache.get(cacheKey)
+    if entry is None:
+        return None
+    expiresAt, generation, value = entry
+    if time.monotonic() >= expiresAt or generation != read_auth_generation():
+        return None
+    return value
+
+
+
+def auth_cache_put(cacheKey, value, generation, seconds=AUTH_CACHE_SECONDS):
+    with _authCacheLock:
+        if len(_authCache) >= AUTH_CACHE_MAX_ENTRIES:
+            _authCache.clear()
+        _authCache[cacheKey] = (time.monotonic() + seconds, generation, value)
+
+
+
+def bump_auth_generation():
+    try:
+        with open(AUTH_GENERATION_FILE, 'a'):
+            pass
+        nextGeneration = max(time.time_ns(), read_auth_generation() + 1)
+        os.utime(AUTH_GENERATION_FILE, ns=(nextGeneration, nextGeneration))
+    except OSError as e:
+        print(f'Auth generation bump failed: {e}')
+
+
+
+def invalidate_auth_cache():
+    with _authCacheLock:
+        _authCache.clear()
+    transaction.on_commit(bump_auth_generation)
+
+
+
+
+
+
+
+
+############################################################
+# sessions_are_signed / revoke_sessions
+############################################################
+#
+# A signed-cookie session has no server-side row to delete:
+# revoke_sessions moves the user's session epoch instead,
+# which ends EVERY session of theirs (each device) — a db
+# session flush only ends the one. Never call it for db
+# sessions on a plain logout.
+#
+# Used by:
+#   - auth_views.logout_view
+############################################################
+
+def sessions_are_signed():
+    return settings.SESSION_ENGINE == SIGNED_SESSION_ENGINE
+
+
+
+def revoke_sessions(userId):
+    SystemUser.objects.filter(id=userId).update(session_epoch=F('session_epoch') + 1)
+    invalidate_auth_cache()
 
 
 
@@ -135,7 +277,8 @@ def load_user(user_id):
     thisUser = SystemUser.objects.filter(id=user_id, enabled=True).first()
     if thisUser is None:
         return None
-    return SessionUser(thisUser.id, thisUser.email, thisUser.password, int(thisUser.admin), int(thisUser.enabled))
+    return SessionUser(thisUser.id, thisUser.email, thisUser.password, int(thisUser.admin), int(thisUser.enabled),
+                       thisUser.session_epoch)
 
 
 
@@ -143,7 +286,8 @@ def get_user_by_email(email):
     thisUser = SystemUser.objects.filter(email=email).first()
     if thisUser is None:
         return None
-    return SessionUser(thisUser.id, thisUser.email, thisUser.password, int(thisUser.admin), int(thisUser.enabled))
+    return SessionUser(thisUser.id, thisUser.email, thisUser.password, int(thisUser.admin), int(thisUser.enabled),
+                       thisUser.session_epoch)
 
 
 
@@ -153,30 +297,61 @@ def get_user_by_email(email):
 
 
 ############################################################
-# login / get_current_user
+# login / user_for_session / get_current_user
 ############################################################
 #
 # login() rotates the session key (fixation defense) and
-# stores the user's ID — nothing else lives in the session.
-# Logout lives in auth_views.logout_view (a session flush);
-# the cookie itself is HttpOnly and JavaScript never touches
-# it.
+# stores the user's ID and current session epoch — nothing
+# else lives in the session. Logout lives in
+# auth_views.logout_view (a session flush, plus
+# revoke_sessions for signed cookies); the cookie itself is
+# HttpOnly and JavaScript never touches it. Logout
+# invalidates the auth cache; login does not — it takes no
+# access away, and the key it rotates out expires from the
+# cache within AUTH_CACHE_SECONDS.
+#
+# user_for_session resolves a loaded session — the user must
+# be Enabled and the session's epoch current.
+#
+# get_current_user answers from the auth cache when it can —
+# by the cookie's value, without loading the session — and
+# files what it reads there otherwise.
 #
 # Used by:
 #   - auth_views.login_view, the decorators below
+#   - hosting/vm_push — the event stream's cookie
 ############################################################
 
 def login(request, user):
     request.session.cycle_key()
     request.session[SESSION_USER_KEY] = user.id
+    request.session[SESSION_EPOCH_KEY] = user.session_epoch
 
 
 
-def get_current_user(request):
-    user_id = request.session.get(SESSION_USER_KEY)
+def user_for_session(session):
+    user_id = session.get(SESSION_USER_KEY)
     if user_id is None:
         return None
-    return load_user(user_id)
+    thisUser = load_user(user_id)
+    if thisUser is None or thisUser.session_epoch != session.get(SESSION_EPOCH_KEY, 0):
+        return None
+    return thisUser
+
+
+
+def get_current_user(request):
+    sessionKey = request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if sessionKey:
+        thisUser = auth_cache_get(('session', sessionKey))
+        if thisUser is not None:
+            return thisUser
+
+    generation = read_auth_generation()
+    thisUser = user_for_session(request.session)
+    if thisUser is not None and sessionKey and request.session.session_key == sessionKey:
+        auth_cache_put(('session', sessionKey), thisUser, generation)
+    return thisUser
 
 
 
@@ -242,7 +417,9 @@ def admin_required(func):
 # :8443 forward_auth gate — without it, an admin's tool tab
 # for a dead id would be proxied into a dead upstream (502)
 # instead of denied. Missing or deleted VMs answer False
-# (→ 401), never an error.
+# (→ 401), never an error. Grants are kept in the auth cache
+# — a VM delete invalidates it; refusals are always asked
+# again, so a brand-new VM needs no invalidation.
 #
 # Used by:
 #   - auth_views.checkauth (the :8443 forward_auth gate)
@@ -255,14 +432,20 @@ def check_user_is_allowed_to_access_vm(user, virtualServerID):
     if virtualServerID is None:
         return False
 
-    if user.admin == 1:
-        return VirtualServer.objects.filter(id=virtualServerID, deleted=False).exists()
-
-    ownerID = VirtualServer.objects.filter(id=virtualServerID, deleted=False).values_list('owner_id', flat=True).first()
-    if ownerID is not None and ownerID == user.id:
+    cacheKey = ('vm', user.id, user.admin, virtualServerID)
+    if auth_cache_get(cacheKey):
         return True
+    generation = read_auth_generation()
 
-    return False
+    if user.admin == 1:
+        allowed = VirtualServer.objects.filter(id=virtualServerID, deleted=False).exists()
+    else:
+        ownerID = VirtualServer.objects.filter(id=virtualServerID, deleted=False).values_list('owner_id', flat=True).first()
+        allowed = ownerID is not None and ownerID == user.id
+
+    if allowed:
+        auth_cache_put(cacheKey, True, generation)
+    return allowed
 
 
 
@@ -0,0 +1,125 @@
+############################################################
+#  [*] Pooled HTTP — one keep-alive session per process
+#
+#  Bare requests.get opens (and tears down) a TCP connection
+#  per call; the monitor alone makes hundreds of sidecar and
+#  cAdvisor calls a minute. Everything that talks to the
+#  internal services goes through SESSION instead: one
+#  requests.Session per process whose urllib3 pools keep
+#  connections alive and hand them to whichever thread asks
+#  next (the pools are thread-safe; the session holds no
+#  per-call state — its cookie jar refuses to store anything,
+#  so one caller's Set-Cookie can never ride along on
+#  another's request).
+#
+#  HTTP_POOL_SIZE bounds the idle connections kept PER HOST.
+#  It is not a concurrency cap: a burst beyond it still gets
+#  fresh connections, they are just closed instead of pooled.
+#  Timeouts stay per call, exactly as before.
+#
+#  pool_stats() counts requests sent vs. connections opened;
+#  the difference is the number of requests that reused a
+#  pooled connection.
+#
+#  Used by:
+#    - hosting/docker_controller — every sidecar call
+#    - monitor_containers — the cAdvisor polls
+############################################################
+
+import os
+import threading
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '32'))
+
+_statsLock = threading.Lock()
+_stats = {'requests': 0, 'opened': 0}
+
+
+
+
+
+
+
+
+############################################################
+# Counting pools + adapter
+############################################################
+#
+# urllib3 calls _new_conn exactly when a pool has no idle
+# connection to hand out — the one place a connection is
+# really opened. The adapter counts every request sent.
+############################################################
+
+def _count(key):
+    with _statsLock:
+        _stats[key] += 1
+
+
+
+class CountingHTTPConnectionPool(HTTPConnectionPool):
+
+    def _new_conn(self):
+        _count('opened')
+        return super()._new_conn()
+
+
+
+class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+
+    def _new_conn(self):
+        _count('opened')
+        return super()._new_conn()
+
+
+
+class CountingAdapter(HTTPAdapter):
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': CountingHTTPConnectionPool,
+            'https': CountingHTTPSConnectionPool,
+        }
+
+    def send(self, request, **kwargs):
+        _count('requests')
+        return super().send(request, **kwargs)
+
+
+
+
+
+
+
+
+############################################################
+# SESSION / pool_stats
+############################################################
+
+def build_session(poolSize=HTTP_POOL_SIZE):
+    session = requests.Session()
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    adapter = CountingAdapter(pool_connections=8, pool_maxsize=poolSize)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+
+SESSION = build_session()
+
+
+
+def pool_stats():
+    with _statsLock:
+        return {
+            'requests': _stats['requests'],
+            'opened': _stats['opened'],
+            'reused': max(0, _stats['requests'] - _stats['opened']),
+        }
@@ -1,8 +1,9 @@
 ############################################################
 #  [*] dashboard app — admin Home metrics
 #
-#  The three read-only endpoints behind the admin dashboard
-#  widgets: system gauges from cAdvisor, the five newest
+#  The read-only endpoints behind the admin dashboard
+#  widgets: system gauges from cAdvisor (as sampled by the
+#  monitor, hosting/cadvisor_sampler), the five newest
 #  activity rows, and the platform totals. No models and no
 #  migrations of its own — it reads the users/hosting tables
 #  and the external services, which is why this app is just
@@ -11,11 +12,12 @@
 #  Layout:
 #    api/dashboard_views.py  — /api/dashboard/system,
 #                              /api/dashboard/recentactivity,
-#                              /api/dashboard/hostingsystem
+#                              /api/dashboard/hostingsystem,
+#                              /api/dashboard/usage
 #    registry_monitor.py     — the Docker Hub rate-limit
-#                              check (cached 60 s per worker,
-#                              reached through the egress
-#                              exit proxy)
+#                              check (run by the monitor
+#                              every 60 s through the egress
+#                              exit proxy, read from its feed)
 #    apps.py                 — the AppConfig INSTALLED_APPS
 #                              points at
 ############################################################
@@ -2,35 +2,34 @@
 #  [*] Dashboard views — the admin home's three widgets
 #
 #  Admin-only, polled every 2 seconds by the dashboard:
-#  host metrics computed from cAdvisor samples, the global
-#  activity feed and the platform totals. Response shapes
+#  host metrics from the monitor's cAdvisor sampler, the
+#  global activity feed and the platform totals. Response shapes
 #  are load-bearing — the widgets poll every 2 seconds and
-#  render these keys verbatim.
+#  render these keys verbatim. The host's usage history
+#  (hosting/usage_history) is read on demand.
 #
 #  Used by:
 #    - SystemOverviewWidget — /api/dashboard/system
 #    - RecentActivityWidget — /api/dashboard/recentactivity
 #    - HostingSystemWidget  — /api/dashboard/hostingsystem
+#    - admin tooling        — /api/dashboard/usage
 ############################################################
 
 import logging
-import os
-from datetime import datetime
 
-import requests
 from django.http import JsonResponse
 
 from control.common.auth import admin_required, format_datetime
 from control.dashboard.registry_monitor import get_rate_limit
+from control.hosting.cadvisor_sampler import FEED_CADVISOR
 from control.hosting.models import DomainName, VirtualServer
+from control.hosting.monitor_feeds import read_feed
+from control.hosting.usage_history import HOST_SERIES_ID, USAGE_RANGES, load_series, top_consumers
 from control.users.models import RecentActivity, SystemUser
 
 
 logger = logging.getLogger(__name__)
 
-CADVISOR_HOST = os.getenv('CADVISOR_HOST', 'hosting-control-cadvisor')
-CADVISOR_PORT = os.getenv('CADVISOR_PORT', '8080')
-
 
 
 
@@ -44,109 +43,51 @@ CADVISOR_PORT = os.getenv('CADVISOR_PORT', '8080')
 #
 # GET /api/dashboard/system — CPU (delta of cAdvisor's last
 # two samples), memory working-set, the largest real
-# filesystem, and the Docker Hub pull budget (60 s cache in
-# registry_monitor).
+# filesystem, and the Docker Hub pull budget (the monitor's
+# "dockerhub" feed, registry_monitor). The cAdvisor figures are the monitor's
+# "cadvisor" feed (hosting/cadvisor_sampler) — no request
+# ever calls cAdvisor. A failed sample keeps its old
+# answer: 500 unreachable / unparseable, 504 timeout, 503 no
+# sample yet — and 503 as well while the feed is older than
+# SYSTEM_FEED_MAX_AGE_SECONDS (the monitor is not running).
 #
 # Used by:
 #   - SystemOverviewWidget — 2 s poll
 ############################################################
 
+SYSTEM_FEED_MAX_AGE_SECONDS = 15
+
+SYSTEM_FEED_ERRORS = {
+    'connect': (500, 'Failed to connect to cAdvisor'),
+    'parse': (500, 'Failed to parse cAdvisor data'),
+    'timeout': (504, 'cAdvisor request timeout'),
+}
+
+
+
 @admin_required
 def dashboard_system(request):
-    try:
-        # Fetch machine info and container stats from cAdvisor
-        machine_resp = requests.get(f'http://{CADVISOR_HOST}:{CADVISOR_PORT}/api/v1.3/machine', timeout=5)
-        containers_resp = requests.get(f'http://{CADVISOR_HOST}:{CADVISOR_PORT}/api/v1.3/containers', timeout=5)
-
-        if machine_resp.status_code != 200 or containers_resp.status_code != 200:
-            return JsonResponse({'message': 'Failed to fetch cAdvisor data'}, status=500)
-
-        machine_info = machine_resp.json()
-        root_stats = containers_resp.json().get('stats', [])
-
-        if len(root_stats) < 1:
-            return JsonResponse({'message': 'No stats data available yet', 'cpu_percent': 0, 'memory_percent': 0, 'disk_percent': 0}, status=503)
-
-        latest = root_stats[-1]
-
-        # CPU calculation (requires 2 data points)
-        cpu_percent = 0
-        if len(root_stats) >= 2:
-            previous = root_stats[-2]
-            cpu_delta = latest['cpu']['usage']['total'] - previous['cpu']['usage']['total']
-            latest_time = datetime.fromisoformat(latest['timestamp'].replace('Z', '+00:00'))
-            previous_time = datetime.fromisoformat(previous['timestamp'].replace('Z', '+00:00'))
-            time_delta = (latest_time - previous_time).total_seconds() * 1e9
-            num_cores = machine_info['num_cores']
-            cpu_percent = (cpu_delta / time_delta / num_cores) * 100.0 if time_delta > 0 and num_cores > 0 else 0
-
-        # Memory calculation
-        memory_used = latest['memory']['working_set']
-        memory_total = machine_info['memory_capacity']
-        memory_percent = (memory_used / memory_total) * 100.0 if memory_total > 0 else 0
-
-        # Disk calculation - find largest real filesystem
-        disk_used = disk_total = 0
-
-        if 'filesystems' in machine_info:
-            for fs_info in machine_info['filesystems']:
-                capacity = fs_info.get('capacity', 0)
-                if capacity > disk_total:
-                    disk_total = capacity
-                    device = fs_info.get('device', '')
-                    if 'filesystem' in latest:
-                        for fs_stat in latest['filesystem']:
-                            if fs_stat.get('device') == device:
-                                disk_used = fs_stat.get('usage', 0)
-                                break
-
-        # Fallback: find largest filesystem from stats
-        if disk_total == 0 and 'filesystem' in latest:
-            for fs in latest['filesystem']:
-                capacity = fs.get('capacity', 0)
-                device = fs.get('device', '')
-                if capacity > disk_total and capacity > 1e9:  # > 1GB
-                    if not device.startswith(('/dev/loop', 'tmpfs', 'devtmpfs', 'overlay')):
-                        disk_total = capacity
-                        disk_used = fs.get('usage', 0)
-
-        disk_percent = (disk_used / disk_total) * 100.0 if disk_total > 0 else 0
-
-
-        # DockerHub pull limits
-        dockerhub_pull_limits = get_rate_limit()
-        if dockerhub_pull_limits:
-            dockerhub_pull_limits = {
-                'limit': dockerhub_pull_limits['limit'],
-                'remaining': dockerhub_pull_limits['remaining'],
-                'used': dockerhub_pull_limits['used'],
-                'percent': dockerhub_pull_limits['percent'],
-            }
+    feed, _ = read_feed(FEED_CADVISOR, SYSTEM_FEED_MAX_AGE_SECONDS)
 
+    if feed is not None and feed.get('error') in SYSTEM_FEED_ERRORS:
+        status, message = SYSTEM_FEED_ERRORS[feed['error']]
+        return JsonResponse({'message': message}, status=status)
 
-        # Convert to GB
-        GB = 1024 ** 3
+    if feed is None or 'system' not in feed:
+        return JsonResponse({'message': 'No stats data available yet', 'cpu_percent': 0, 'memory_percent': 0, 'disk_percent': 0}, status=503)
 
-        return JsonResponse({
-            'cpu_percent': round(cpu_percent, 1),
-            'memory_percent': round(memory_percent, 1),
-            'disk_percent': round(disk_percent, 1),
-            'cpu_cores': machine_info.get('num_cores', 0),
-            'memory_total_gb': round(memory_total / GB, 2),
-            'memory_used_gb': round(memory_used / GB, 2),
-            'disk_total_gb': round(disk_total / GB, 2),
-            'disk_used_gb': round(disk_used / GB, 2),
-            'dockerhub_pull_limits': dockerhub_pull_limits,
-        }, status=200)
 
-    except requests.exceptions.Timeout:
-        return JsonResponse({'message': 'cAdvisor request timeout'}, status=504)
-    except requests.exceptions.RequestException as e:
-        logger.exception('Failed to connect to cAdvisor')
-        return JsonResponse({'message': 'Failed to connect to cAdvisor'}, status=500)
-    except (KeyError, IndexError, ValueError) as e:
-        logger.exception('Failed to parse cAdvisor data')
-        return JsonResponse({'message': 'Failed to parse cAdvisor data'}, status=500)
+    # DockerHub pull limits
+    dockerhub_pull_limits = get_rate_limit()
+    if dockerhub_pull_limits:
+        dockerhub_pull_limits = {
+            'limit': dockerhub_pull_limits['limit'],
+            'remaining': dockerhub_pull_limits['remaining'],
+            'used': dockerhub_pull_limits['used'],
+            'percent': dockerhub_pull_limits['percent'],
+        }
+
+    return JsonResponse({**feed['system'], 'dockerhub_pull_limits': dockerhub_pull_limits}, status=200)
 
 
 
@@ -216,3 +157,37 @@ def dashboard_hostingsystem(request):
     except Exception as e:
         logger.exception('Failed to get hosting system information')
         return JsonResponse({'message': 'Failed to get hosting system information'}, status=500)
+
+
+
+
+
+
+
+
+############################################################
+# dashboard_usage
+############################################################
+#
+# GET /api/dashboard/usage?range=1d — the host's CPU/RAM/
+# disk series over the range (same ranges and point shape
+# as /api/vm/usage/<id>) and the five VMs with the highest
+# mean CPU over it: the noisy neighbours.
+#
+# Used by:
+#   - admin tooling — host sizing, noisy neighbours
+############################################################
+
+@admin_required
+def dashboard_usage(request):
+    rangeName = request.GET.get('range', '1h')
+    if rangeName not in USAGE_RANGES:
+        return JsonResponse({'message': f'Invalid range, expected one of {", ".join(USAGE_RANGES)}'}, status=400)
+
+    step, points = load_series(HOST_SERIES_ID, rangeName)
+    return JsonResponse({
+        'range': rangeName,
+        'step_seconds': step,
+        'points': points,
+        'top_cpu': top_consumers(rangeName),
+    })
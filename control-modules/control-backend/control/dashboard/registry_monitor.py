@@ -7,21 +7,37 @@
 #  to the hosting-control-backend-exit SNI proxy, the one
 #  whitelisted way out.
 #
-#  The result (success OR failure) is cached for 60 seconds
-#  per worker: the admin dashboard polls its endpoint every
-#  2 seconds, and without the cache each poll would pay both
-#  outbound calls — with the registry unreachable, two 2 s
-#  timeouts per poll.
+#  The check runs in the MONITOR only, on its own schedule:
+#  refresh_rate_limit every RATE_LIMIT_REFRESH_SECONDS, on a
+#  thread of its own (two 2 s timeouts must not stall the
+#  3-second pass), publishing the result as the "dockerhub"
+#  monitor feed. The dashboard's get_rate_limit only reads
+#  that row — the five gunicorn workers no longer each pay
+#  their own token + HEAD round trip through the exit proxy,
+#  and no check ever spends a pull on behalf of a poll.
+#
+#  Single flight: one check at a time per process (a
+#  non-blocking lock — a second caller returns at once).
+#  Stale while revalidate: a failed check publishes nothing,
+#  so readers keep the last good figures until they are
+#  older than RATE_LIMIT_MAX_STALE_SECONDS; only then is the
+#  budget reported unknown (None).
 ############################################################
 
-import time
+import threading
 
 import requests
+from django.db import close_old_connections
+
+from control.hosting.monitor_feeds import publish_feed, read_feed
 
 
-CACHE_TTL_SECONDS = 60
+FEED_DOCKERHUB = 'dockerhub'
 
-_cache = {'checked_at': None, 'value': None}
+RATE_LIMIT_REFRESH_SECONDS = 60
+RATE_LIMIT_MAX_STALE_SECONDS = 600
+
+_checkLock = threading.Lock()
 
 
 
@@ -34,24 +50,68 @@ _cache = {'checked_at': None, 'value': None}
 # get_rate_limit
 ############################################################
 #
-# {limit, remaining, used, percent, ip} or None. The check
-# costs one pull against the preview repo, so the cache also
-# keeps the check itself from eating the budget it measures.
+# {limit, remaining, used, percent, ip} or None — the last
+# good check, as long as it is not older than
+# RATE_LIMIT_MAX_STALE_SECONDS. One single-row read.
 #
 # Used by:
 #   - dashboard_views.dashboard_system
 ############################################################
 
 def get_rate_limit():
+    payload, _ = read_feed(FEED_DOCKERHUB, RATE_LIMIT_MAX_STALE_SECONDS)
+    return payload
+
+
+
+
+
+
+
+
+############################################################
+# refresh_rate_limit
+############################################################
+#
+# One check, published when it succeeds. Returns the
+# figures, or None when the check failed or another one was
+# already in flight. A thread target — it closes its own
+# database connection.
+#
+# Used by:
+#   - monitor_containers — every RATE_LIMIT_REFRESH_SECONDS
+############################################################
+
+def refresh_rate_limit():
+    if not _checkLock.acquire(blocking=False):
+        return None
+    try:
+        figures = check_rate_limit()
+        if figures is not None:
+            publish_feed(FEED_DOCKERHUB, figures)
+        return figures
+    finally:
+        _checkLock.release()
+        close_old_connections()
+
+
+
 
-    # Serve from cache — successes and failures alike
-    if _cache['checked_at'] is not None and time.monotonic() - _cache['checked_at'] < CACHE_TTL_SECONDS:
-        return _cache['value']
 
-    _cache['checked_at'] = time.monotonic()
-    _cache['value'] = None
 
 
+
+############################################################
+# check_rate_limit
+############################################################
+#
+# The check itself: {limit, remaining, used, percent, ip} or
+# None. It costs one pull against the preview repo — which
+# is why it only runs on the monitor's schedule.
+############################################################
+
+def check_rate_limit():
+
     # Step 1: Get authentication token
     token_url = 'https://auth.docker.io/token'
     token_params = {
@@ -87,14 +147,13 @@ def get_rate_limit():
             used = limit - remaining
             percent = (remaining * 100) // limit
 
-            _cache['value'] = {
+            return {
                 'limit': limit,
                 'remaining': remaining,
                 'used': used,
                 'percent': percent,
                 'ip': source_ip,
             }
-            return _cache['value']
     except Exception as e:
         print(f'Error checking rate limit: {e}')
 
@@ -11,13 +11,21 @@
 #
 #  Layout:
 #    models.py               — VirtualServer,
-#                              DockerContainer, DomainName
+#                              DockerContainer (+ its ports
+#                              and networks), DomainName
 #    api/vm_views.py         — the VM list + start/stop/
 #                              create/delete/rename control
 #    api/dns_views.py        — domain validation + CRUD
 #                              (regenerates the users Caddy)
 #    api/sshrouter_views.py  — the SSH router's shared-
 #                              secret lookup endpoint
+#    api/usage_views.py      — a VM's usage history
+#    usage_history.py        — the usage history: ring
+#                              buffers, rollups, readers
+#    cadvisor_sampler.py     — the monitor's one cAdvisor
+#                              client
+#    monitor_feeds.py        — what the monitor publishes
+#                              for the workers to read
 #    docker_controller.py    — HTTP client for the
 #                              hosting-control-docker sidecar
 #    management/commands/    — monitor_containers
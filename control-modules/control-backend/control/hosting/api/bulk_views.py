@@ -0,0 +1,160 @@
+############################################################
+#  [*] Bulk VM views — one action over many VMs
+#
+#  Semester start and end: hundreds of creates, or stops and
+#  deletes, at once. Instead of one /api/vm/control POST per
+#  VM, an admin sends the whole list once:
+#
+#    POST /api/vm/bulk   — queue the job, answer its id
+#
+#  and polls /api/jobs/<jobId> (job_views) for the per-VM
+#  progress. The work is ONE vm_bulk BackgroundJob (see
+#  hosting/jobs): the monitor's job runner hands the list to
+#  the sidecar as one bulk job, which runs it through its
+#  bounded executor (BULK_CONCURRENCY operations against the
+#  host daemon at a time) and reports each VM as it
+#  finishes; the runner mirrors that progress into the job's
+#  result.
+#
+#  The database follows the single-VM rules exactly: created
+#  rows commit BEFORE the job can run (ids claimed, no orphan
+#  adoption), a delete's intent commits up front (both
+#  Caddyfiles regenerated once for the whole list), and each
+#  VM's outcome is recorded when the job is done — a failed
+#  create soft-deletes its row, a failed delete reverts its
+#  flag, a successful start/stop flips enabled.
+#
+#  Used by:
+#    - admin tooling / scripts — semester start and end
+############################################################
+
+from django.db import transaction
+from django.http import JsonResponse
+
+from control.common.auth import admin_required, get_json
+from control.hosting.api.vm_views import commit_delete_intent, validate_vm_name
+from control.hosting.jobs import enqueue_job
+from control.hosting.models import VirtualServer
+from control.hosting.vm_snapshot import mark_stale
+from control.users.models import SystemUser
+
+
+BULK_ACTIONS = ('create', 'start', 'stop', 'delete')
+
+
+
+
+
+
+
+
+############################################################
+# parse_id_list
+############################################################
+#
+# A JSON list of ids → a de-duplicated list of ints in the
+# order given, or None when it is not a non-empty list of
+# integers.
+############################################################
+
+def parse_id_list(value):
+    if not isinstance(value, list) or not value:
+        return None
+    parsedIds = []
+    for thisValue in value:
+        try:
+            thisId = int(thisValue)
+        except (TypeError, ValueError):
+            return None
+        if thisId not in parsedIds:
+            parsedIds.append(thisId)
+    return parsedIds
+
+
+
+
+
+
+
+
+############################################################
+# vm_bulk
+############################################################
+#
+# POST /api/vm/bulk — admin only:
+#   {"action": "start"|"stop"|"delete", "virtualServerIDs": [...]}
+#   {"action": "create", "ownerIDs": [...], "name": "..."}
+#       — one new VM named <name> per listed owner
+#
+# Every listed VM must exist and not be deleted (every owner
+# must exist) — otherwise 404 with the missing ids and nothing
+# happens. Answers 202 {"jobId", "virtualServerIDs"}; the ids
+# are the new VMs' on create.
+#
+# Runs outside the request transaction, like vm_control: the
+# rows and the job commit together, before the runner can
+# pick the job up.
+############################################################
+
+@transaction.non_atomic_requests
+@admin_required
+def vm_bulk(request):
+    if request.method != 'POST':
+        return JsonResponse({'message': 'Method not allowed'}, status=405)
+
+    postData = get_json(request)
+    if postData is None:
+        return JsonResponse({'message': 'Invalid request'}, status=400)
+
+    action = postData.get('action')
+    if action not in BULK_ACTIONS:
+        return JsonResponse({'message': 'Invalid action'}, status=400)
+    actorUserId = request.current_user.id
+
+
+
+    # --- CREATE: the rows first, committed ---
+    if action == 'create':
+        ownerIds = parse_id_list(postData.get('ownerIDs'))
+        if ownerIds is None:
+            return JsonResponse({'message': 'ownerIDs must be a non-empty list of user ids'}, status=400)
+
+        if 'name' not in postData:
+            return JsonResponse({'message': 'Name is required'}, status=400)
+        serverName = postData['name'].strip()
+        nameError = validate_vm_name(serverName)
+        if nameError:
+            return JsonResponse({'message': nameError}, status=400)
+
+        missingIds = sorted(set(ownerIds) - set(SystemUser.objects.filter(id__in=ownerIds).values_list('id', flat=True)))
+        if missingIds:
+            return JsonResponse({'message': 'Users not found', 'missing': missingIds}, status=404)
+
+        with transaction.atomic():
+            virtualServerIDs = [
+                VirtualServer.objects.create(owner_id=ownerId, name=serverName, enabled=True, deleted=False).id
+                for ownerId in ownerIds
+            ]
+            thisJob = enqueue_job('vm_bulk', {'action': action, 'virtualServerIDs': virtualServerIDs}, actorUserId)
+            mark_stale()
+
+
+
+    # --- START / STOP / DELETE: existing live VMs ---
+    else:
+        virtualServerIDs = parse_id_list(postData.get('virtualServerIDs'))
+        if virtualServerIDs is None:
+            return JsonResponse({'message': 'virtualServerIDs must be a non-empty list of ids'}, status=400)
+
+        liveIds = set(VirtualServer.objects.filter(id__in=virtualServerIDs, deleted=False).exclude(id=0).values_list('id', flat=True))
+        missingIds = sorted(set(virtualServerIDs) - liveIds)
+        if missingIds:
+            return JsonResponse({'message': 'Virtual servers not found', 'missing': missingIds}, status=404)
+
+        jobPayload = {'action': action, 'virtualServerIDs': virtualServerIDs}
+        if action == 'delete':
+            thisJob = commit_delete_intent(virtualServerIDs, actorUserId, 'vm_bulk', jobPayload)
+        else:
+            thisJob = enqueue_job('vm_bulk', jobPayload, actorUserId)
+
+    return JsonResponse({'message': 'OK', 'jobId': thisJob.id, 'virtualServerIDs': virtualServerIDs}, status=202)
@@ -1,12 +1,17 @@
 ############################################################
 #  [*] DNS views — domain names of a virtual server
 #
-#  The domain CRUD. Every successful change pushes the whole
-#  domain table to the docker sidecar, which rewrites the
-#  users Caddyfile and reloads the users Caddy — and that
-#  push happens INSIDE the request transaction, so a Caddy
-#  failure rolls the database change back and the two can
-#  never diverge.
+#  The domain CRUD. Every change commits with its revision
+#  (docker_controller.next_config_revision), THEN pushes to
+#  the docker sidecar, which rewrites the users Caddyfile
+#  and reloads the users Caddy: the change itself as a delta
+#  (add / update / remove one domain), or the whole table
+#  when the sidecar cannot place it. The push runs outside
+#  the SQLite write lock, so concurrent edits reach the
+#  sidecar together and share one reload. When the push
+#  fails, the change is undone in a new transaction and the
+#  table resent (push_domain_change) — the caller still gets
+#  the 500, and the table and the Caddyfile end up matching.
 #
 #  PUT and DELETE resolve the domain by (domain id AND
 #  virtual server id) — an id belonging to another VM
@@ -32,6 +37,7 @@ from control.common.auth import (
 )
 from control.hosting import docker_controller
 from control.hosting.models import DomainName
+from control.hosting.vm_snapshot import mark_stale
 
 
 
@@ -132,6 +138,45 @@ def dns_isvalid(request):
 
 
 
+############################################################
+# push_domain_change
+############################################################
+#
+# The committed change → the users Caddy; on failure undo()
+# runs in a fresh transaction (with its own revision), the
+# whole table is resent, and the push's error is raised. An
+# undo that lost a race (the old name taken meanwhile, the
+# VM gone) leaves the change in place — the resend still
+# makes the Caddyfile match the table.
+#
+# Used by:
+#   - vm_dns (below) — POST / PUT / DELETE
+############################################################
+
+def push_domain_change(revision, operations, undo):
+    try:
+        docker_controller.update_caddy_config(operations, revision)
+    except Exception:
+        try:
+            with transaction.atomic():
+                undo()
+                docker_controller.next_config_revision('caddy')
+                mark_stale()
+        except IntegrityError as e:
+            print(f'Domain change not undone: {e}')
+        try:
+            docker_controller.update_caddy_config()
+        except Exception as e:
+            print(f'Caddy resync after a failed domain change failed: {e}')
+        raise
+
+
+
+
+
+
+
+
 ############################################################
 # vm_dns
 ############################################################
@@ -142,12 +187,15 @@ def dns_isvalid(request):
 # DELETE /api/vm/dns/<vmID>/<domID>  — remove
 #
 # Owner or admin only. Mutations answer {"message": "ok"}
-# after the Caddy push succeeds.
+# after the Caddy push succeeds. Runs outside the request
+# transaction: each change commits before its push
+# (push_domain_change).
 #
 # Used by:
 #   - DomainsListTable.jsx / AddEditDomain.jsx
 ############################################################
 
+@transaction.non_atomic_requests
 @login_required
 def vm_dns(request, virtualServerID, domainID=None):
 
@@ -184,16 +232,27 @@ def vm_dns(request, virtualServerID, domainID=None):
 
         # Update the domain name — scoped to THIS virtual
         # server, so a foreign domain id changes nothing
-        updated = DomainName.objects.filter(id=postData['domainid'], virtual_server_id=virtualServerID).update(
-            domain_name=postData['domainname'].lower(),
-            is_cloudflare=bool(postData['iscloudflare']),
-            ssl=bool(postData['ssl']),
+        with transaction.atomic():
+            previous = DomainName.objects.filter(id=postData['domainid'], virtual_server_id=virtualServerID).first()
+            if previous is None:
+                return JsonResponse({'message': 'Error', 'reason': 'Domain not found'}, status=404)
+            DomainName.objects.filter(id=previous.id).update(
+                domain_name=postData['domainname'].lower(),
+                is_cloudflare=bool(postData['iscloudflare']),
+                ssl=bool(postData['ssl']),
+            )
+            revision = docker_controller.next_config_revision('caddy')
+            log_activity(request.current_user.id, f'Domain name "{postData["domainname"]}" updated for virtual server #{virtualServerID}')
+            mark_stale()
+            thisDomain = DomainName.objects.get(id=previous.id)
+
+        push_domain_change(
+            revision,
+            [{'op': 'update', 'domain': docker_controller.domain_payload(thisDomain)}],
+            lambda: DomainName.objects.filter(id=previous.id).update(
+                domain_name=previous.domain_name, is_cloudflare=previous.is_cloudflare, ssl=previous.ssl,
+            ),
         )
-        if updated == 0:
-            return JsonResponse({'message': 'Error', 'reason': 'Domain not found'}, status=404)
-
-        log_activity(request.current_user.id, f'Domain name "{postData["domainname"]}" updated for virtual server #{virtualServerID}')
-        docker_controller.update_caddy_config()
         return JsonResponse({'message': 'ok'}, status=200)
 
 
@@ -211,17 +270,23 @@ def vm_dns(request, virtualServerID, domainID=None):
         # unique constraint; answer like any taken domain
         try:
             with transaction.atomic():
-                DomainName.objects.create(
+                thisDomain = DomainName.objects.create(
                     virtual_server_id=virtualServerID,
                     domain_name=postData['domainname'].lower(),
                     is_cloudflare=bool(postData['iscloudflare']),
                     ssl=bool(postData['ssl']),
                 )
+                revision = docker_controller.next_config_revision('caddy')
+                log_activity(request.current_user.id, f'Domain name "{postData["domainname"]}" added for virtual server #{virtualServerID}')
+                mark_stale()
         except IntegrityError:
             return JsonResponse({'message': 'Error', 'reason': 'Domain name is already taken'}, status=400)
 
-        log_activity(request.current_user.id, f'Domain name "{postData["domainname"]}" added for virtual server #{virtualServerID}')
-        docker_controller.update_caddy_config()
+        push_domain_change(
+            revision,
+            [{'op': 'add', 'domain': docker_controller.domain_payload(thisDomain)}],
+            lambda: DomainName.objects.filter(id=thisDomain.id).delete(),
+        )
         return JsonResponse({'message': 'ok'}, status=200)
 
 
@@ -229,15 +294,16 @@ def vm_dns(request, virtualServerID, domainID=None):
     elif request.method == 'DELETE':
 
         # Scoped to THIS virtual server, like PUT
-        thisDomain = DomainName.objects.filter(id=domainID, virtual_server_id=virtualServerID).first()
-        if thisDomain is None:
-            return JsonResponse({'message': 'Error', 'reason': 'Domain not found'}, status=404)
-
-        domainName = thisDomain.domain_name
-        thisDomain.delete()
-
-        log_activity(request.current_user.id, f'Domain name "{domainName}" deleted for virtual server #{virtualServerID}')
-        docker_controller.update_caddy_config()
+        with transaction.atomic():
+            thisDomain = DomainName.objects.filter(id=domainID, virtual_server_id=virtualServerID).first()
+            if thisDomain is None:
+                return JsonResponse({'message': 'Error', 'reason': 'Domain not found'}, status=404)
+            DomainName.objects.filter(id=thisDomain.id).delete()
+            revision = docker_controller.next_config_revision('caddy')
+            log_activity(request.current_user.id, f'Domain name "{thisDomain.domain_name}" deleted for virtual server #{virtualServerID}')
+            mark_stale()
+
+        push_domain_change(revision, [{'op': 'remove', 'id': domainID}], lambda: thisDomain.save(force_insert=True))
         return JsonResponse({'message': 'ok'}, status=200)
 
 
@@ -0,0 +1,80 @@
+############################################################
+#  [*] Job views — the background job status API
+#
+#    GET /api/jobs            — recent jobs, newest first
+#    GET /api/jobs/<jobId>    — one job
+#
+#  What a 202 from /api/vm/control (create/delete) or
+#  /api/vm/bulk hands back is a BackgroundJob id; these
+#  endpoints are how it is followed: state queued/running/
+#  succeeded/failed, attempts, the last error, and — for a
+#  bulk job — the live per-VM progress in result.
+#
+#  Everyone sees the jobs they started; admins see all.
+#
+#  Used by:
+#    - admin tooling / scripts — bulk progress
+#    - anything following a create/delete past the 202
+############################################################
+
+from django.http import JsonResponse
+
+from control.common.auth import login_required
+from control.hosting.jobs import serialize_job
+from control.hosting.models import BackgroundJob
+
+
+JOB_LIST_LIMIT = 100
+
+
+
+
+
+
+
+
+############################################################
+# job_list
+############################################################
+#
+# GET /api/jobs — the newest JOB_LIST_LIMIT jobs the caller
+# may see; ?state= narrows to one state.
+############################################################
+
+@login_required
+def job_list(request):
+    jobs = BackgroundJob.objects.order_by('-id')
+    if request.current_user.admin == 0:
+        jobs = jobs.filter(created_by_id=request.current_user.id)
+
+    state = request.GET.get('state')
+    if state:
+        jobs = jobs.filter(state=state)
+
+    return JsonResponse([serialize_job(thisJob) for thisJob in jobs[:JOB_LIST_LIMIT]], safe=False, json_dumps_params={'indent': 4})
+
+
+
+
+
+
+
+
+############################################################
+# job_detail
+############################################################
+#
+# GET /api/jobs/<jobId> — the job as an object; 404 when it
+# does not exist, 401 when it is someone else's (non-admin).
+############################################################
+
+@login_required
+def job_detail(request, jobId):
+    thisJob = BackgroundJob.objects.filter(id=jobId).first()
+    if thisJob is None:
+        return JsonResponse({'message': 'Job not found'}, status=404)
+
+    if request.current_user.admin == 0 and thisJob.created_by_id != request.current_user.id:
+        return JsonResponse({'message': 'Unauthorized'}, status=401)
+
+    return JsonResponse(serialize_job(thisJob), json_dumps_params={'indent': 4})
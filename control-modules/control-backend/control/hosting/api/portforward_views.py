@@ -1,13 +1,14 @@
 ############################################################
 #  [*] Port forward views — public TCP ports of a VM
 #
-#  The port forward CRUD. Every successful change pushes the
-#  whole forward table to the docker sidecar, which rewrites
-#  the portforwarder Caddyfile and reloads the portforwarder
-#  Caddy — and that push happens INSIDE the request
-#  transaction, so a reload failure rolls the database change
-#  back and the two can never diverge (the dns_views pattern
-#  exactly).
+#  The port forward CRUD. Every change commits with its
+#  revision (docker_controller.next_config_revision), THEN
+#  pushes the whole forward table to the docker sidecar,
+#  which rewrites the portforwarder Caddyfile and reloads
+#  the portforwarder Caddy. The push runs outside the SQLite
+#  write lock, so concurrent edits share one reload; when it
+#  fails, the change is undone and the table resent
+#  (push_forward_change) — the dns_views pattern exactly.
 #
 #  The public pool is PORTFORWARD_RANGE_START..END — the SAME
 #  env values docker-compose publishes on the portforwarder
@@ -37,6 +38,7 @@ from control.common.auth import (
 )
 from control.hosting import docker_controller
 from control.hosting.models import PortForward
+from control.hosting.vm_snapshot import mark_stale
 
 
 # The public pool — must mirror the range docker-compose
@@ -158,6 +160,45 @@ def portforward_isvalid(request):
 
 
 
+############################################################
+# push_forward_change
+############################################################
+#
+# The committed change → the portforwarder; on failure
+# undo() runs in a fresh transaction (with its own
+# revision), the table is resent, and the push's error is
+# raised. An undo that lost a race (the old port taken
+# meanwhile, the VM gone) leaves the change in place — the
+# resend still makes the listeners match the table.
+#
+# Used by:
+#   - vm_portforward (below) — POST / PUT / DELETE
+############################################################
+
+def push_forward_change(undo):
+    try:
+        docker_controller.update_portforwarder_config()
+    except Exception:
+        try:
+            with transaction.atomic():
+                undo()
+                docker_controller.next_config_revision('portforwarder')
+                mark_stale()
+        except IntegrityError as e:
+            print(f'Port forward change not undone: {e}')
+        try:
+            docker_controller.update_portforwarder_config()
+        except Exception as e:
+            print(f'Portforwarder resync after a failed forward change failed: {e}')
+        raise
+
+
+
+
+
+
+
+
 ############################################################
 # vm_portforward
 ############################################################
@@ -170,12 +211,15 @@ def portforward_isvalid(request):
 # Owner or admin only. Mutations answer {"message": "ok"}
 # after the portforwarder push succeeds. POST additionally
 # enforces the per-VM quota; the IntegrityError catches cover
-# the race two requests can win against the same port.
+# the race two requests can win against the same port. Runs
+# outside the request transaction: each change commits
+# before its push (push_forward_change).
 #
 # Used by:
 #   - PortForwardsListTable.jsx / AddEditPortForward.jsx
 ############################################################
 
+@transaction.non_atomic_requests
 @login_required
 def vm_portforward(request, virtualServerID, portForwardID=None):
 
@@ -217,22 +261,26 @@ def vm_portforward(request, virtualServerID, portForwardID=None):
             return JsonResponse({'message': 'Error', 'reason': 'Description is too long'}, status=400)
 
         # Update the forward — scoped to THIS virtual server,
-        # so a foreign forward id changes nothing. The savepoint
-        # makes catching the port race safe mid-transaction.
+        # so a foreign forward id changes nothing
         try:
             with transaction.atomic():
-                updated = PortForward.objects.filter(id=postData['portforwardid'], virtual_server_id=virtualServerID).update(
+                previous = PortForward.objects.filter(id=postData['portforwardid'], virtual_server_id=virtualServerID).first()
+                if previous is None:
+                    return JsonResponse({'message': 'Error', 'reason': 'Port forward not found'}, status=404)
+                PortForward.objects.filter(id=previous.id).update(
                     public_port=int(postData['publicport']),
                     internal_port=int(postData['internalport']),
                     description=description,
                 )
+                docker_controller.next_config_revision('portforwarder')
+                log_activity(request.current_user.id, f'Port forward {int(postData["publicport"])}→{int(postData["internalport"])} updated for virtual server #{virtualServerID}')
+                mark_stale()
         except IntegrityError:
             return JsonResponse({'message': 'Error', 'reason': 'Public port is already taken'}, status=400)
-        if updated == 0:
-            return JsonResponse({'message': 'Error', 'reason': 'Port forward not found'}, status=404)
 
-        log_activity(request.current_user.id, f'Port forward {int(postData["publicport"])}→{int(postData["internalport"])} updated for virtual server #{virtualServerID}')
-        docker_controller.update_portforwarder_config()
+        push_forward_change(lambda: PortForward.objects.filter(id=previous.id).update(
+            public_port=previous.public_port, internal_port=previous.internal_port, description=previous.description,
+        ))
         return JsonResponse({'message': 'ok'}, status=200)
 
 
@@ -259,17 +307,19 @@ def vm_portforward(request, virtualServerID, portForwardID=None):
         # unique constraint; answer like any taken port
         try:
             with transaction.atomic():
-                PortForward.objects.create(
+                thisForward = PortForward.objects.create(
                     virtual_server_id=virtualServerID,
                     public_port=int(postData['publicport']),
                     internal_port=int(postData['internalport']),
                     description=description,
                 )
+                docker_controller.next_config_revision('portforwarder')
+                log_activity(request.current_user.id, f'Port forward {int(postData["publicport"])}→{int(postData["internalport"])} added for virtual server #{virtualServerID}')
+                mark_stale()
         except IntegrityError:
             return JsonResponse({'message': 'Error', 'reason': 'Public port is already taken'}, status=400)
 
-        log_activity(request.current_user.id, f'Port forward {int(postData["publicport"])}→{int(postData["internalport"])} added for virtual server #{virtualServerID}')
-        docker_controller.update_portforwarder_config()
+        push_forward_change(lambda: PortForward.objects.filter(id=thisForward.id).delete())
         return JsonResponse({'message': 'ok'}, status=200)
 
 
@@ -277,16 +327,16 @@ def vm_portforward(request, virtualServerID, portForwardID=None):
     elif request.method == 'DELETE':
 
         # Scoped to THIS virtual server, like PUT
-        thisForward = PortForward.objects.filter(id=portForwardID, virtual_server_id=virtualServerID).first()
-        if thisForward is None:
-            return JsonResponse({'message': 'Error', 'reason': 'Port forward not found'}, status=404)
-
-        publicPort = thisForward.public_port
-        internalPort = thisForward.internal_port
-        thisForward.delete()
-
-        log_activity(request.current_user.id, f'Port forward {publicPort}→{internalPort} deleted for virtual server #{virtualServerID}')
-        docker_controller.update_portforwarder_config()
+        with transaction.atomic():
+            thisForward = PortForward.objects.filter(id=portForwardID, virtual_server_id=virtualServerID).first()
+            if thisForward is None:
+                return JsonResponse({'message': 'Error', 'reason': 'Port forward not found'}, status=404)
+            PortForward.objects.filter(id=thisForward.id).delete()
+            docker_controller.next_config_revision('portforwarder')
+            log_activity(request.current_user.id, f'Port forward {thisForward.public_port}→{thisForward.internal_port} deleted for virtual server #{virtualServerID}')
+            mark_stale()
+
+        push_forward_change(lambda: thisForward.save(force_insert=True))
         return JsonResponse({'message': 'ok'}, status=200)
 
 
@@ -0,0 +1,46 @@
+############################################################
+#  [*] Usage views — a VM's resource history
+#
+#    GET /api/vm/usage/<virtualServerID>?range=1h
+#
+#  The VM's CPU/RAM/disk over the range (1h, 6h, 1d, 7d, 30d,
+#  90d — default 1h), downsampled by hosting/usage_history
+#  to at most USAGE_MAX_POINTS points. Owners see their own
+#  VMs, admins every VM (check_user_is_allowed_to_access_vm);
+#  the host's series is on /api/dashboard/usage.
+#
+#  Used by:
+#    - the VM detail page / admin tooling
+############################################################
+
+from django.http import JsonResponse
+
+from control.common.auth import check_user_is_allowed_to_access_vm, login_required
+from control.hosting.usage_history import USAGE_RANGES, load_series
+
+
+
+
+
+
+
+
+############################################################
+# vm_usage_history
+############################################################
+#
+# GET — {range, step_seconds, points}; 400 for an unknown
+# range, 401 when the VM is not the caller's.
+############################################################
+
+@login_required
+def vm_usage_history(request, virtualServerID):
+    rangeName = request.GET.get('range', '1h')
+    if rangeName not in USAGE_RANGES:
+        return JsonResponse({'message': f'Invalid range, expected one of {", ".join(USAGE_RANGES)}'}, status=400)
+
+    if virtualServerID == 0 or check_user_is_allowed_to_access_vm(request.current_user, virtualServerID) == False:
+        return JsonResponse({'message': 'Unauthorized'}, status=401)
+
+    step, points = load_series(virtualServerID, rangeName)
+    return JsonResponse({'range': rangeName, 'step_seconds': step, 'points': points})
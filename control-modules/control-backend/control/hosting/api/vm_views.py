@@ -1,43 +1,41 @@
 ############################################################
 #  [*] VM views — the list and the control actions
 #
-#  GET /api/vm assembles the whole card payload in Python:
+#  GET /api/vm serves the card payload out of the
+#  materialized VM list snapshot (see hosting/vm_snapshot):
 #  the REGISTRY drives the list (every non-deleted VM shows)
-#  and the containers cache decorates it with live state — a
-#  row whose container the monitor has not seen yet renders
-#  as "creating" (fresh row) or "unknown" (old row). Ids are
-#  integers; stacks/domains/portforwards are null when empty.
-#  The frontend polls this every 3 seconds.
+#  and the containers cache decorates it with live state. The
+#  frontend polls this every 3 seconds; an unchanged list is
+#  a 304 via ETag/If-None-Match. Every mutation below marks
+#  the snapshot stale in its own transaction.
 #
 #  POST /api/vm/control proxies to the docker sidecar;
-#  create and delete answer 202 and finish in one-shot
-#  background threads (see vm_control).
+#  create and delete answer 202 with a background job id —
+#  the monitor's job runner does the physical work (see
+#  vm_control and hosting/jobs).
 #
 #  Used by:
 #    - VirtualServersTable.jsx — list + card actions
 #    - VirtualServer.jsx — the detail page (same endpoint)
 ############################################################
 
-import threading
-from datetime import timedelta
-
-from django.db import close_old_connections, transaction
-from django.http import JsonResponse
+from django.db import transaction
+from django.http import HttpResponse, JsonResponse
 from django.utils import timezone
 
 import requests
 
 from control.common.auth import (
     check_user_is_allowed_to_access_vm,
-    format_datetime,
     get_json,
+    invalidate_auth_cache,
     log_activity,
     login_required,
 )
 from control.hosting import docker_controller
-from control.hosting.api.portforward_views import PORTFORWARD_PUBLIC_HOST
-from control.hosting.models import DIND_PREFIX, DockerContainer, DomainName, PortForward, VirtualServer, VmUsage
-from control.users.models import SystemUser
+from control.hosting.jobs import enqueue_job
+from control.hosting.models import DIND_PREFIX, DomainName, PortForward, VirtualServer
+from control.hosting.vm_snapshot import load_snapshot, mark_stale
 
 
 # Names may use every Lithuanian letter, digits, underscore,
@@ -51,49 +49,24 @@ LITHUANIAN_CHARS = 'aąbcčdeęėfghiįyjklmnopqrsštuųūvwxyzž0123456789_() '
 
 
 
-############################################################
-# parse_stack_name
-############################################################
-#
-# Extracts the compose project ("stack") name out of the
-# cached comma-joined Labels string. Containers started
-# outside compose have no such label — those group under ''
-# on purpose.
-#
-# Used by:
-#   - vm_list (below) — grouping each VM's containers
-############################################################
-
-def parse_stack_name(labels):
-    marker = 'com.docker.compose.project='
-    position = labels.find(marker)
-    if position == -1:
-        return ''
-    value = labels[position + len(marker):]
-    commaPosition = value.find(',')
-    if commaPosition != -1:
-        value = value[:commaPosition]
-    return value.strip()
-
-
-
-
-
-
-
-
 ############################################################
 # vm_list
 ############################################################
 #
 # GET /api/vm — every VM the caller may see (a JSON array,
-# ids as integers), driven by the containers cache.
-# GET /api/vm/<id> — that one VM as a plain object, or 404
-# while it has no container in the cache (a just-created VM
-# becomes visible on the monitor's next pass).
+# ids as integers), driven by the registry.
+# GET /api/vm/<id> — that one VM as a plain object.
 # ?showOtherUsers=true is admin-only; with a specific id it
 # is ignored — ownership is what gates single-VM access.
 #
+# Served from the materialized snapshot (see vm_snapshot):
+# the body is the stored cards joined, and the ETag names
+# the snapshot version plus everything that selects out of
+# it (caller, admin flag, scope). A poll whose If-None-Match
+# still matches answers 304 with no body — the common case
+# for an idle tab. "no-cache" makes the browser revalidate
+# every poll instead of guessing a freshness lifetime.
+#
 # Used by:
 #   - VirtualServersTable.jsx (3 s poll), VirtualServer.jsx
 ############################################################
@@ -111,132 +84,50 @@ def vm_list(request, virtualServerID=None):
             return JsonResponse({'message': 'Unauthorized'}, status=401)
 
 
-    # The dind containers on the host — one per live VM
-    dindRows = {}
-    for thisRow in DockerContainer.objects.filter(parent_server_id=0, names__startswith=DIND_PREFIX).order_by('id'):
-        vmIdText = thisRow.names.replace(DIND_PREFIX, '')
-        if vmIdText.isdigit() and vmIdText not in dindRows:
-            dindRows[vmIdText] = thisRow
-
-
-    # ALL non-deleted VM rows — the REGISTRY drives the list;
-    # the cache only decorates it with live state. A row whose
-    # container the monitor has not seen yet still shows, as
-    # "creating" (fresh row) or "unknown" (old row — manually
-    # removed container, or the sidecar is unreachable).
-    virtualServers = {
-        thisVm.id: thisVm
-        for thisVm in VirtualServer.objects.filter(deleted=False).exclude(id=0)
-    }
-    ownerEmails = dict(
-        SystemUser.objects.filter(id__in=[thisVm.owner_id for thisVm in virtualServers.values() if thisVm.owner_id is not None])
-        .values_list('id', 'email')
-    )
-
-
-    # Every VM's containers grouped by stack, in one query
-    stacksByVm = {}
-    for thisRow in DockerContainer.objects.exclude(parent_server_id=0).order_by('id'):
-        stackName = parse_stack_name(thisRow.labels)
-        stacksByVm.setdefault(thisRow.parent_server_id, {}).setdefault(stackName, []).append({
-            'image': thisRow.image,
-            'names': thisRow.names,
-            'runningfor': thisRow.running_for,
-            'state': thisRow.state,
-            'status': thisRow.status,
-        })
-
-
-    # Every VM's domains, in one query
-    domainsByVm = {}
-    for thisDomain in DomainName.objects.order_by('id'):
-        domainsByVm.setdefault(thisDomain.virtual_server_id, []).append({
-            'id': thisDomain.id,
-            'domainname': thisDomain.domain_name,
-            'iscloudflare': int(thisDomain.is_cloudflare),
-            'ssl': int(thisDomain.ssl),
-        })
-
-
-    # Every VM's port forwards, in one query — publichost rides
-    # along so the card can render the exact connect string
-    portForwardsByVm = {}
-    for thisForward in PortForward.objects.order_by('id'):
-        portForwardsByVm.setdefault(thisForward.virtual_server_id, []).append({
-            'id': thisForward.id,
-            'publichost': PORTFORWARD_PUBLIC_HOST,
-            'publicport': thisForward.public_port,
-            'internalport': thisForward.internal_port,
-            'description': thisForward.description,
-        })
-
-
-    # Every VM's live usage (the monitor's telemetry), in one
-    # query — null while nothing has been measured
-    usageByVm = {
-        thisUsage.virtual_server_id: {
-            'cpu_percent': round(thisUsage.cpu_percent, 1) if thisUsage.cpu_percent is not None else None,
-            'memory_mb': thisUsage.memory_mb,
-            'disk_mb': thisUsage.disk_mb,
-            'cpu_measured_at': format_datetime(thisUsage.cpu_measured_at),
-            'disk_measured_at': format_datetime(thisUsage.disk_measured_at),
-        }
-        for thisUsage in VmUsage.objects.all()
-    }
-
-
-    # Assemble, in numeric id order
-    responseData = []
-    for vmId in sorted(virtualServers):
-        thisVm = virtualServers[vmId]
+    # The version decides the ETag before a single card is read
+    version, entries_loader = load_snapshot()
+    if virtualServerID is not None:
+        scope = f'vm{virtualServerID}'
+    else:
+        scope = 'all' if showOtherUsersVMs else 'own'
+    etag = f'"vm-{version}-{request.current_user.id}-{request.current_user.admin}-{scope}"'
+
+    if etag in [thisTag.strip() for thisTag in request.headers.get('If-None-Match', '').split(',')]:
+        response = HttpResponse(status=304)
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+
+    # Select out of the snapshot, in its numeric id order
+    cards = []
+    for vmId, ownerId, encodedCard in entries_loader():
 
         # A specific id was asked for — only that one
         if virtualServerID is not None and vmId != virtualServerID:
             continue
 
         # Non-admin view of the list — own VMs only
-        if virtualServerID is None and showOtherUsersVMs == False and thisVm.owner_id != request.current_user.id:
+        if virtualServerID is None and showOtherUsersVMs == False and ownerId != request.current_user.id:
             continue
 
-        # Live state from the cache; without a cache row the
-        # registry row speaks for itself — a fresh one is a
-        # create in flight, an old one is honestly unknown
-        dindRow = dindRows.get(str(vmId))
-        if dindRow is not None:
-            state, status = dindRow.state, dindRow.status
-        elif timezone.now() - thisVm.created_at < timedelta(minutes=5):
-            state, status = 'creating', None
-        else:
-            state, status = 'unknown', None
-
-        stacks = [
-            {'stackname': stackName, 'containers': containers}
-            for stackName, containers in sorted(stacksByVm.get(thisVm.id, {}).items())
-        ]
-
-        responseData.append({
-            'id': thisVm.id,
-            'name': thisVm.name,
-            'status': status,
-            'state': state,
-            'enabled': int(thisVm.enabled),
-            'owneremail': ownerEmails.get(thisVm.owner_id),
-            'stacks': stacks or None,
-            'domains': domainsByVm.get(thisVm.id) or None,
-            'portforwards': portForwardsByVm.get(thisVm.id) or None,
-            'usage': usageByVm.get(thisVm.id),
-        })
+        cards.append(encodedCard)
 
 
     # A specific id → the object itself. The access check
     # already guaranteed the row exists — the 404 only guards
     # the race of a delete landing mid-request.
     if virtualServerID is not None:
-        if not responseData:
+        if not cards:
             return JsonResponse({'message': 'Virtual server not found'}, status=404)
-        return JsonResponse(responseData[0], json_dumps_params={'indent': 4})
+        body = cards[0]
+    else:
+        body = '[' + ','.join(cards) + ']'
 
-    return JsonResponse(responseData, safe=False, json_dumps_params={'indent': 4})
+    response = HttpResponse(body, content_type='application/json')
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
 
 
 
@@ -246,33 +137,27 @@ def vm_list(request, virtualServerID=None):
 
 
 ############################################################
-# run_in_background
+# validate_vm_name
 ############################################################
 #
-# One-shot daemon thread for the slow physical work (a sysbox
-# docker run takes a minute, the data archive longer) — the
-# request answers 202 immediately and the frontend's 3-second
-# poll observes the outcome. Failures are handled INSIDE the
-# target (flag revert + activity row); the wrapper only
-# guarantees the thread's DB connections are returned.
-#
-# Deliberately not a job queue: one attempt, state in the
-# registry row, reconciliation by the monitor — the same
-# pattern the rest of the platform runs on. A deploy landing
-# mid-create self-heals (the monitor adopts the finished
-# container into the already-committed row).
+# The create-time name rules, checked on the stripped name so
+# padding can't smuggle past the 3-char minimum or store
+# padded labels. Returns the error message, or None.
 #
 # Used by:
-#   - vm_control (below) — the create and delete actions
+#   - vm_control (below) — create
+#   - bulk_views — bulk create
 ############################################################
 
-def run_in_background(target):
-    def wrapped():
-        try:
-            target()
-        finally:
-            close_old_connections()
-    threading.Thread(target=wrapped, daemon=True).start()
+def validate_vm_name(serverName):
+    if len(serverName) < 3:
+        return 'New name must be at least 3 characters long'
+    if len(serverName) > 30:
+        return 'Name must be less than 30 characters long'
+    for character in serverName:
+        if character.lower() not in LITHUANIAN_CHARS:
+            return 'Name can only contain letters, numbers, spaces, underscores and parentheses'
+    return None
 
 
 
@@ -282,49 +167,55 @@ def run_in_background(target):
 
 
 ############################################################
-# create_vm_physically / delete_vm_physically
+# commit_delete_intent
 ############################################################
 #
-# The thread targets. Create: one sidecar attempt; failure
-# soft-deletes the row again (the "creating" card vanishes on
-# the next poll) and logs why. Delete: one sidecar attempt;
-# failure REVERTS the deleted flag (the card comes back, the
-# user can retry) and logs why — the domains were already
-# removed in the request, and stay removed.
+# The part of a delete that happens BEFORE the teardown: the
+# flags commit now (the cards disappear on the next poll) and
+# the domains and public ports are freed immediately — the
+# global uniqueness must not be held by a dying VM. The cache
+# rows are the monitor's to prune. The teardown job (kind +
+# payload) commits in the same transaction, so a flagged VM
+# always has its teardown queued; it is returned.
+#
+# Then the users Caddyfile (only when the VMs had domains)
+# and the portforwarder Caddyfile are regenerated ONCE, so
+# the VMs' vhosts and listeners die with the flags, before
+# the slow teardown. A Caddy hiccup
+# must not fail the delete — the revisions were bumped with
+# it, so the next push finds the gap and resends the table.
 #
 # Used by:
-#   - vm_control (below) via run_in_background
+#   - vm_control (below) — delete
+#   - bulk_views — bulk delete
 ############################################################
 
-def create_vm_physically(virtualServerID, actorUserId):
-    containerName = DIND_PREFIX + str(virtualServerID)
-    try:
-        resp = docker_controller.create_vm(containerName)
-        createFailed = resp.status_code != 200
-    except requests.RequestException:
-        createFailed = True
-
+def commit_delete_intent(virtualServerIDs, actorUserId, jobKind, jobPayload):
     with transaction.atomic():
-        if createFailed:
-            VirtualServer.objects.filter(id=virtualServerID).update(deleted=True, updated_at=timezone.now())
-            log_activity(actorUserId, f'Virtual server #{virtualServerID} creation failed')
-        else:
-            log_activity(actorUserId, f'Virtual server #{virtualServerID} created')
-
-
-
-def delete_vm_physically(virtualServerID, actorUserId):
-    containerName = DIND_PREFIX + str(virtualServerID)
+        VirtualServer.objects.filter(id__in=virtualServerIDs).update(deleted=True, updated_at=timezone.now())
+        domainIds = list(DomainName.objects.filter(virtual_server_id__in=virtualServerIDs).values_list('id', flat=True))
+        DomainName.objects.filter(virtual_server_id__in=virtualServerIDs).delete()
+        PortForward.objects.filter(virtual_server_id__in=virtualServerIDs).delete()
+        if domainIds:
+            caddyRevision = docker_controller.next_config_revision('caddy')
+        docker_controller.next_config_revision('portforwarder')
+        for virtualServerID in virtualServerIDs:
+            log_activity(actorUserId, f'Virtual server #{virtualServerID} deleted')
+        thisJob = enqueue_job(jobKind, jobPayload, actorUserId, maxAttempts=5)
+        mark_stale()
+        invalidate_auth_cache()     # the :8443 gate must close with the flag
+
+    if domainIds:
+        try:
+            docker_controller.update_caddy_config([{'op': 'remove', 'id': domainId} for domainId in domainIds], caddyRevision)
+        except Exception as e:
+            print(f'Caddy config update after VM delete failed: {e}')
     try:
-        resp = docker_controller.delete_vm(containerName)
-        deleteFailed = resp.status_code != 200
-    except requests.RequestException:
-        deleteFailed = True
+        docker_controller.update_portforwarder_config()
+    except Exception as e:
+        print(f'Portforwarder config update after VM delete failed: {e}')
 
-    if deleteFailed:
-        with transaction.atomic():
-            VirtualServer.objects.filter(id=virtualServerID).update(deleted=False, updated_at=timezone.now())
-            log_activity(actorUserId, f'Virtual server #{virtualServerID} deletion failed')
+    return thisJob
 
 
 
@@ -342,14 +233,16 @@ def delete_vm_physically(virtualServerID, actorUserId):
 #   start/stop/delete/rename {virtualServerID, [newName]}
 #                                 — owner or admin
 #
-# create and delete are ASYNC: the database change commits,
-# the response is 202, and the physical work runs in a
-# one-shot background thread — the card shows "creating" (or
-# disappears) on the next poll and reverts if the thread
-# fails. start/stop/rename stay synchronous (they are fast).
+# create and delete are ASYNC: the database change and a
+# BackgroundJob row commit together, the response is 202
+# {"message", "jobId"}, and the monitor's job runner does the
+# physical work — the card shows "creating" (or disappears)
+# on the next poll and reverts if the job fails. The job is
+# pollable at /api/jobs/<jobId>. start/stop/rename stay
+# synchronous (they are fast).
 #
 # Runs OUTSIDE the request transaction on purpose: on create
-# the row must be COMMITTED before the thread starts, so the
+# the row must be COMMITTED before the job can run, so the
 # ID is claimed and the monitor can never adopt the new
 # container as an ownerless orphan while the create is in
 # flight.
@@ -385,23 +278,22 @@ def vm_control(request):
     # --- CREATE ---
     if action == 'create':
 
-        # Validation — on the stripped name, so padding can't
-        # smuggle past the 3-char minimum or store padded labels
+        # Validation — on the stripped name
         if 'name' not in postData:
             return JsonResponse({'message': 'Name is required'}, status=400)
 
         serverName = postData['name'].strip()
-        if len(serverName) < 3:
-            return JsonResponse({'message': 'New name must be at least 3 characters long'}, status=400)
-        if len(serverName) > 30:
-            return JsonResponse({'message': 'Name must be less than 30 characters long'}, status=400)
-        for character in serverName:
-            if character.lower() not in LITHUANIAN_CHARS:
-                return JsonResponse({'message': 'Name can only contain letters, numbers, spaces, underscores and parentheses'}, status=400)
-
-        # Create the row FIRST and commit it, so the ID is
-        # claimed before the container exists and the monitor
-        # can never adopt it as an orphan
+        nameError = validate_vm_name(serverName)
+        if nameError:
+            return JsonResponse({'message': nameError}, status=400)
+
+        # Create the row FIRST and commit it — together with
+        # the job that builds it — so the ID is claimed before
+        # the container exists and the monitor can never adopt
+        # it as an orphan. The card shows "creating" on the
+        # next poll and either flips to running (monitor sees
+        # the container) or vanishes (the job failed, the row
+        # is soft-deleted and the activity says why)
         with transaction.atomic():
             thisVm = VirtualServer.objects.create(
                 owner_id=request.current_user.id,
@@ -409,16 +301,10 @@ def vm_control(request):
                 enabled=True,
                 deleted=False,
             )
-        virtualServerID = thisVm.id
+            thisJob = enqueue_job('vm_create', {'virtualServerID': thisVm.id}, request.current_user.id)
+            mark_stale()
 
-        # The physical build runs in the background — the card
-        # shows "creating" on the next poll and either flips to
-        # running (monitor sees the container) or vanishes
-        # (thread soft-deleted the row and logged why)
-        actorUserId = request.current_user.id
-        run_in_background(lambda: create_vm_physically(virtualServerID, actorUserId))
-
-        return JsonResponse({'message': 'OK'}, status=202)
+        return JsonResponse({'message': 'OK', 'jobId': thisJob.id}, status=202)
 
 
 
@@ -446,6 +332,7 @@ def vm_control(request):
         with transaction.atomic():
             VirtualServer.objects.filter(id=virtualServerID).update(enabled=True, updated_at=timezone.now())
             log_activity(request.current_user.id, f'Virtual server #{virtualServerID} started')
+            mark_stale()
 
         return JsonResponse({'message': 'OK'}, status=200)
 
@@ -464,6 +351,7 @@ def vm_control(request):
         with transaction.atomic():
             VirtualServer.objects.filter(id=virtualServerID).update(enabled=False, updated_at=timezone.now())
             log_activity(request.current_user.id, f'Virtual server #{virtualServerID} stopped')
+            mark_stale()
 
         return JsonResponse({'message': 'OK'}, status=200)
 
@@ -472,38 +360,13 @@ def vm_control(request):
     # --- DELETE ---
     elif action == 'delete':
 
-        # The intent commits NOW: the card disappears on the
-        # next poll and the domains and public ports are freed
-        # immediately (the global uniqueness must not be held
-        # by a dying VM). The cache rows are the monitor's to
-        # prune.
-        with transaction.atomic():
-            VirtualServer.objects.filter(id=virtualServerID).update(deleted=True, updated_at=timezone.now())
-            DomainName.objects.filter(virtual_server_id=virtualServerID).delete()
-            PortForward.objects.filter(virtual_server_id=virtualServerID).delete()
-            log_activity(request.current_user.id, f'Virtual server #{virtualServerID} deleted')
-
-        # Regenerate the users Caddyfile and the portforwarder
-        # Caddyfile so the deleted VM's vhosts and listeners
-        # die with the flag, before the slow teardown. A Caddy
-        # hiccup must not fail the delete — the next domain or
-        # forward change re-syncs anyway.
-        try:
-            docker_controller.update_caddy_config()
-        except Exception as e:
-            print(f'Caddy config update after VM delete failed: {e}')
-        try:
-            docker_controller.update_portforwarder_config()
-        except Exception as e:
-            print(f'Portforwarder config update after VM delete failed: {e}')
-
-        # The physical teardown (stop + rm + data archive) runs
-        # in the background; a failure reverts the flag and the
-        # card comes back
-        actorUserId = request.current_user.id
-        run_in_background(lambda: delete_vm_physically(virtualServerID, actorUserId))
+        # The intent commits NOW (flag, domains, forwards, and
+        # the teardown job — stop + rm + data archive; a failure
+        # reverts the flag and the card comes back) and both
+        # Caddyfiles drop the VM before the slow teardown
+        thisJob = commit_delete_intent([virtualServerID], request.current_user.id, 'vm_delete', {'virtualServerID': virtualServerID})
 
-        return JsonResponse({'message': 'OK'}, status=202)
+        return JsonResponse({'message': 'OK', 'jobId': thisJob.id}, status=202)
 
 
 
@@ -527,6 +390,7 @@ def vm_control(request):
         with transaction.atomic():
             VirtualServer.objects.filter(id=virtualServerID).update(name=newName, updated_at=timezone.now())
             log_activity(request.current_user.id, f'Virtual server #{virtualServerID} renamed to "{newName}"')
+            mark_stale()
 
         return JsonResponse({'message': 'OK'}, status=200)
 
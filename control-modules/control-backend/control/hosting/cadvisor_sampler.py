@@ -0,0 +1,238 @@
+############################################################
+#  [*] cAdvisor sampler — one reader of cAdvisor per platform
+#
+#  The admin dashboard used to fetch cAdvisor's /machine and
+#  /containers itself on every 2-second poll, from every open
+#  dashboard, while the monitor separately fetched /machine
+#  and /docker every pass. Now the monitor's CadvisorSampler
+#  is the only client: once per pass it fetches /docker (per
+#  VM) and /containers (the root cgroup — the host); /machine
+#  is fetched once and kept for the life of the process. The
+#  figures go where the readers are:
+#
+#    per VM  — VmUsage (update_vm_usage) and the usage
+#              history, as before
+#    host    — the usage history, and the dashboard's figures
+#              published as the "cadvisor" monitor feed
+#              (hosting/monitor_feeds), which
+#              /api/dashboard/system only reads
+#
+#  cAdvisor's load is one set of requests per pass, however
+#  many admins have the dashboard open.
+#
+#  Used by:
+#    - monitor_containers — CadvisorSampler.sample every pass
+#    - dashboard_views — reads the feed this publishes
+############################################################
+
+import os
+from datetime import datetime
+
+from control.common.http_pool import SESSION
+from control.hosting.models import DIND_PREFIX
+
+
+CADVISOR_HOST = os.getenv('CADVISOR_HOST', 'hosting-control-cadvisor')
+CADVISOR_PORT = os.getenv('CADVISOR_PORT', '8080')
+
+FEED_CADVISOR = 'cadvisor'
+
+GB = 1024 ** 3
+
+
+
+
+
+
+
+
+############################################################
+# cpu_percent_between
+############################################################
+#
+# CPU% as a share of the whole host between the two newest
+# samples: the delta of the cumulative nanosecond counter
+# over the wall time between them, divided by the core
+# count. None with fewer than two samples or a counter that
+# went backwards (a restarted container).
+############################################################
+
+def cpu_percent_between(stats, numCores):
+    if len(stats) < 2:
+        return None
+
+    # Timestamps carry nanoseconds — trim to microseconds for
+    # fromisoformat, and drop a surviving Z so both ends of
+    # the subtraction are always naive
+    t1 = datetime.fromisoformat(stats[-1]['timestamp'][:26].rstrip('Z'))
+    t0 = datetime.fromisoformat(stats[-2]['timestamp'][:26].rstrip('Z'))
+    wallNs = (t1 - t0).total_seconds() * 1e9
+    cpuNs = stats[-1]['cpu']['usage']['total'] - stats[-2]['cpu']['usage']['total']
+    if wallNs <= 0 or cpuNs < 0:
+        return None
+    return round(cpuNs / wallNs / max(numCores, 1) * 100, 2)
+
+
+
+
+
+
+
+
+############################################################
+# parse_cadvisor_docker
+############################################################
+#
+# cAdvisor's /api/v1.3/docker payload → {vmId: {cpu_percent,
+# memory_mb}} for the dind containers. Fewer than two
+# samples → cpu None (the container just started); memory
+# is the working set of the newest sample.
+#
+# Pure function — the contract tests feed it fake payloads.
+############################################################
+
+def parse_cadvisor_docker(dockerPayload, numCores):
+    usageByVm = {}
+
+    for node in dockerPayload.values():
+        dindAlias = next((a for a in (node.get('aliases') or []) if a.startswith(DIND_PREFIX)), None)
+        if dindAlias is None or not dindAlias.replace(DIND_PREFIX, '').isdigit():
+            continue
+        vmId = int(dindAlias.replace(DIND_PREFIX, ''))
+
+        stats = node.get('stats') or []
+        if not stats:
+            continue
+
+        usageByVm[vmId] = {
+            'cpu_percent': cpu_percent_between(stats, numCores),
+            'memory_mb': round(stats[-1].get('memory', {}).get('working_set', 0) / 1048576),
+        }
+
+    return usageByVm
+
+
+
+
+
+
+
+
+############################################################
+# parse_cadvisor_host
+############################################################
+#
+# cAdvisor's /api/v1.3/containers payload (the root cgroup —
+# the whole host) plus /machine → the host's figures, in
+# bytes: {cpu_percent, cpu_cores, memory_bytes,
+# memory_total_bytes, disk_bytes, disk_total_bytes}. None
+# before cAdvisor has a first sample.
+#
+# Disk is the largest filesystem /machine reports (its
+# usage from the newest sample); when /machine lists none,
+# the largest real filesystem in the sample — over 1 GB, not
+# a loop/tmpfs/overlay mount.
+############################################################
+
+def parse_cadvisor_host(rootPayload, machine):
+    stats = rootPayload.get('stats') or []
+    if not stats:
+        return None
+    latest = stats[-1]
+
+    diskBytes = diskTotalBytes = 0
+    for thisFs in machine.get('filesystems') or []:
+        if thisFs.get('capacity', 0) > diskTotalBytes:
+            diskTotalBytes = thisFs.get('capacity', 0)
+            diskBytes = next(
+                (thisStat.get('usage', 0) for thisStat in latest.get('filesystem') or [] if thisStat.get('device') == thisFs.get('device', '')),
+                0,
+            )
+
+    if diskTotalBytes == 0:
+        for thisStat in latest.get('filesystem') or []:
+            capacity = thisStat.get('capacity', 0)
+            if capacity > diskTotalBytes and capacity > 1e9 and not thisStat.get('device', '').startswith(('/dev/loop', 'tmpfs', 'devtmpfs', 'overlay')):
+                diskTotalBytes = capacity
+                diskBytes = thisStat.get('usage', 0)
+
+    return {
+        'cpu_percent': cpu_percent_between(stats, machine.get('num_cores') or 1),
+        'cpu_cores': machine.get('num_cores', 0),
+        'memory_bytes': latest['memory']['working_set'],
+        'memory_total_bytes': machine['memory_capacity'],
+        'disk_bytes': diskBytes,
+        'disk_total_bytes': diskTotalBytes,
+    }
+
+
+
+
+
+
+
+
+############################################################
+# system_figures
+############################################################
+#
+# The host's figures as /api/dashboard/system renders them —
+# percentages to one decimal, sizes in GB to two. CPU is 0
+# (not null) until there are two samples; the widget draws
+# a number.
+############################################################
+
+def system_figures(host):
+    def percent(used, total):
+        return round(used / total * 100.0, 1) if total > 0 else 0
+
+    return {
+        'cpu_percent': round(host['cpu_percent'] or 0, 1),
+        'memory_percent': percent(host['memory_bytes'], host['memory_total_bytes']),
+        'disk_percent': percent(host['disk_bytes'], host['disk_total_bytes']),
+        'cpu_cores': host['cpu_cores'],
+        'memory_total_gb': round(host['memory_total_bytes'] / GB, 2),
+        'memory_used_gb': round(host['memory_bytes'] / GB, 2),
+        'disk_total_gb': round(host['disk_total_bytes'] / GB, 2),
+        'disk_used_gb': round(host['disk_bytes'] / GB, 2),
+    }
+
+
+
+
+
+
+
+
+############################################################
+# CadvisorSampler
+############################################################
+#
+# sample() → (usage by VM, host figures or None), from one
+# /docker and one /containers request; raises on a failed
+# request or a payload that does not parse. /machine is
+# fetched on the first sample and kept — the core count and
+# capacities do not change under a running process.
+############################################################
+
+class CadvisorSampler:
+
+    def __init__(self, baseUrl=f'http://{CADVISOR_HOST}:{CADVISOR_PORT}', session=SESSION):
+        self.baseUrl = baseUrl
+        self.session = session
+        self.machine = None
+
+
+    def fetch(self, path):
+        response = self.session.get(f'{self.baseUrl}{path}', timeout=5)
+        response.raise_for_status()
+        return response.json()
+
+
+    def sample(self):
+        if self.machine is None:
+            self.machine = self.fetch('/api/v1.3/machine')
+
+        usageByVm = parse_cadvisor_docker(self.fetch('/api/v1.3/docker'), self.machine.get('num_cores') or 1)
+        host = parse_cadvisor_host(self.fetch('/api/v1.3/containers'), self.machine)
+        return usageByVm, host
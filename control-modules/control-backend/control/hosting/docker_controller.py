@@ -4,26 +4,40 @@
 #  The backend never touches docker or the filesystem itself:
 #  every physical operation goes over HTTP to the
 #  hosting-control-docker sidecar on the isolated network.
-#  This module is the one place that URL is spelled.
+#  This module is the one place that URL is spelled. Every
+#  call rides the shared keep-alive pool (common/http_pool),
+#  so the monitor's polling reuses its connections.
 #
 #  Timeouts are sized to what each operation really does (a
 #  sysbox `docker run` takes far longer than a start/stop):
 #    create 120 s   (docker run of the dind image)
 #    start/stop 30 s
 #    delete 300 s   (stop + rm + data-directory move)
-#    status 10 s    (a `docker ps`)
+#    status 10 s    (a `docker ps`; the monitor passes its
+#                    shorter per-VM deadline instead)
+#    bulk 30 s      (queues the job and answers at once; the
+#                    poll is 10 s)
+#    status batch 30 s (READ timeout — entries stream in as
+#                    the sidecar's per-VM fetches finish)
+#    disk 240 s     (READ timeout between streamed VM lines)
+#    events 60 s    (READ timeout of the endless delta stream
+#                    — the sidecar heartbeats every 15 s)
 #
 #  Used by:
-#    - vm_views — create/start/stop/delete
-#    - dns_views + vm_views — update_caddy_config
-#    - portforward_views + vm_views — update_portforwarder_config
-#    - monitor_containers — get_status
+#    - vm_views — start/stop
+#    - hosting/jobs — create/delete, start_bulk, get_bulk_job
+#    - dns_views + vm_views — next_config_revision,
+#      update_caddy_config
+#    - portforward_views + vm_views — next_config_revision,
+#      update_portforwarder_config
+#    - monitor_containers — get_status, get_status_batch,
+#      stream_events
 ############################################################
 
 import json
 import os
 
-import requests
+from control.common.http_pool import SESSION
 
 
 DOCKER_CONTROLLER_HOST = os.getenv('DOCKER_CONTROLLER_HOST', 'hosting-control-docker')
@@ -48,27 +62,82 @@ BASE_URL = f'http://{DOCKER_CONTROLLER_HOST}:{DOCKER_CONTROLLER_PORT}'
 ############################################################
 
 def create_vm(containerName):
-    return requests.get(f'{BASE_URL}/api/create/{containerName}', timeout=120)
+    return SESSION.get(f'{BASE_URL}/api/create/{containerName}', timeout=120)
 
 
 
 def start_vm(containerName):
-    return requests.get(f'{BASE_URL}/api/start/{containerName}', timeout=30)
+    return SESSION.get(f'{BASE_URL}/api/start/{containerName}', timeout=30)
 
 
 
 def stop_vm(containerName):
-    return requests.get(f'{BASE_URL}/api/stop/{containerName}', timeout=30)
+    return SESSION.get(f'{BASE_URL}/api/stop/{containerName}', timeout=30)
 
 
 
 def delete_vm(containerName):
-    return requests.get(f'{BASE_URL}/api/delete/{containerName}', timeout=300)
+    return SESSION.get(f'{BASE_URL}/api/delete/{containerName}', timeout=300)
 
 
 
-def get_status(containerName):
-    return requests.get(f'{BASE_URL}/api/status/{containerName}', timeout=10)
+def get_status(containerName, timeout=10):
+    return SESSION.get(f'{BASE_URL}/api/status/{containerName}', timeout=timeout)
+
+
+
+
+
+
+
+
+############################################################
+# start_bulk / get_bulk_job
+############################################################
+#
+# One lifecycle action over many VMs as ONE sidecar job: the
+# sidecar answers 202 {"job_id", "total"} at once and runs
+# the VMs through its bounded executor; get_bulk_job polls
+# the per-VM progress ({"state": "running"|"done", "vms":
+# {"<name>": {"state": "queued"|"running"|"ok"|"failed",
+# ...}}}). 404 means the sidecar no longer knows the job.
+#
+# Used by:
+#   - hosting/jobs — the vm_bulk job
+############################################################
+
+def start_bulk(action, containerNames):
+    return SESSION.post(f'{BASE_URL}/api/bulk', json={'action': action, 'vms': containerNames}, timeout=30)
+
+
+
+def get_bulk_job(jobId):
+    return SESSION.get(f'{BASE_URL}/api/bulk/{jobId}', timeout=10)
+
+
+
+
+
+
+
+
+############################################################
+# get_status_batch
+############################################################
+#
+# Many VMs' `docker ps` in one round trip: the sidecar fans
+# out to the inner daemons itself and streams back one
+# document keyed by VM name — {"vms": {"<name>":
+# {"containers": [...]} | {"error": ..., "timed_out"?: true},
+# ...}}. The timeout is the READ timeout between streamed
+# entries, not a bound on the whole batch.
+#
+# Used by:
+#   - monitor_containers — the full pass
+############################################################
+
+def get_status_batch(containerNames, timeout=30):
+    return SESSION.post(f'{BASE_URL}/api/status/batch', json={'vms': containerNames}, timeout=timeout)
 
 
 
@@ -81,18 +150,86 @@ def get_status(containerName):
 # get_disk_usage
 ############################################################
 #
-# The sidecar's du sweep over /SERVERS: {"usage": {"<id>":
-# <bytes>}} for every live VM directory. A du over the inner
-# docker trees can take a while — the generous timeout is
-# fine because the monitor calls this from a background
-# thread, never from a request.
+# The sidecar's incremental disk sweep over /SERVERS, as a
+# STREAMED response: NDJSON, one {"id", "bytes", ...} line
+# per live VM directory as soon as that VM is measured — the
+# caller reads it with iter_lines. Later sweeps only re-list
+# what changed, but the first one after a sidecar (re)start
+# walks every tree in full; 240 s is the READ timeout
+# between two lines, so only one pathologically slow tree
+# can trip it. Fine because the monitor calls this from a
+# background thread, never from a request.
 #
 # Used by:
-#   - monitor_containers — the ~5-minute disk refresh
+#   - monitor_containers — the ~30-second disk refresh
 ############################################################
 
 def get_disk_usage():
-    return requests.get(f'{BASE_URL}/api/usage/disk', timeout=240)
+    return SESSION.get(f'{BASE_URL}/api/usage/disk', stream=True, timeout=(5, 240))
+
+
+
+
+
+
+
+
+############################################################
+# stream_events
+############################################################
+#
+# The sidecar's endless NDJSON stream of container deltas
+# (create/start/die/destroy/rename from the host daemon and
+# every running VM's inner daemon, plus heartbeats). Returns
+# the open streaming response — the caller iterates
+# iter_lines() and reconnects when it breaks.
+#
+# Used by:
+#   - monitor_containers --events — the delta consumer thread
+############################################################
+
+def stream_events():
+    return SESSION.get(f'{BASE_URL}/api/events', stream=True, timeout=(5, 60))
+
+
+
+
+
+
+
+
+############################################################
+# next_config_revision / config_revision
+############################################################
+#
+# A generated table's revision (ConfigGeneration: 'caddy' —
+# the domain table, 'portforwarder' — the forward table).
+# next_config_revision bumps and returns it, and must run
+# INSIDE the transaction that changes the table: the write
+# lock numbers the changes in commit order, and a rollback
+# takes the bump back with the change. The push that
+# follows runs AFTER the commit, outside the lock — pushes
+# then overlap and the sidecar coalesces them, so they carry
+# the revision to be put back in order.
+#
+# Used by:
+#   - dns_views / portforward_views — every table change
+#   - vm_views — a VM delete
+############################################################
+
+def next_config_revision(name):
+    from control.hosting.models import ConfigGeneration
+
+    revision = config_revision(name) + 1
+    ConfigGeneration.objects.update_or_create(name=name, defaults={'generation': revision})
+    return revision
+
+
+
+def config_revision(name):
+    from control.hosting.models import ConfigGeneration
+
+    return ConfigGeneration.objects.filter(name=name).values_list('generation', flat=True).first() or 0
 
 
 
@@ -105,15 +242,25 @@ def get_disk_usage():
 # update_caddy_config
 ############################################################
 #
-# Pushes the WHOLE domain table to the sidecar, which renders
-# the users Caddyfile and reloads the users Caddy. Raises on
-# any non-2xx, so callers inside a request transaction get
-# rollback-on-failure — DB and Caddyfile never diverge.
+# Pushes a domain change to the sidecar, which renders the
+# users Caddyfile and reloads the users Caddy. Called after
+# the change committed; raises on any non-2xx, and the
+# caller undoes its change.
 #
-# The payload is the plain JSON object {"domains": [...]} —
-# the sidecar answers 500 when the caddy reload fails, and
-# the raise_for_status below is what turns that into the
-# backend-side transaction rollback.
+# With operations ([{"op": "add"|"update", "domain": row} |
+# {"op": "remove", "id": N}]) and the revision the change
+# committed at, only the change is sent; the sidecar answers
+# 409 when it cannot place it (an earlier change never
+# reached it — a failed push, a restarted sidecar), and the
+# WHOLE table ({"revision", "domains": [...]}) is sent
+# instead — as it is without operations. The full table is
+# read AFTER its revision, so it holds at least that
+# revision's changes: the sidecar skips a table older than
+# the one it applied, never the other way round.
+#
+# A failed push needs no bookkeeping here: the sidecar did
+# not take the revision, so the next change finds the gap
+# and resends the table.
 #
 # Used by:
 #   - dns_views — after every domain change
@@ -121,30 +268,39 @@ def get_disk_usage():
 #     vhosts die with it
 ############################################################
 
-def update_caddy_config():
+def update_caddy_config(operations=None, revision=None):
     from control.hosting.models import DomainName
 
-    # iscloudflare/ssl go over the wire as 0/1 integers — the
-    # sidecar's renderer compares against 1 literally
-    domains = {
-        'domains': [
-            {
-                'id': thisDomain.id,
-                'virtualserverid': thisDomain.virtual_server_id,
-                'domainname': thisDomain.domain_name,
-                'iscloudflare': int(thisDomain.is_cloudflare),
-                'ssl': int(thisDomain.ssl),
-            }
-            for thisDomain in DomainName.objects.order_by('id')
-        ]
-    }
+    response = None
+    if operations is not None and revision is not None:
+        response = SESSION.post(f'{BASE_URL}/api/updatecaddyconfig',
+                                json={'revision': revision, 'operations': operations}, timeout=30)
+
+    if response is None or response.status_code == 409:
+        tableRevision = config_revision('caddy')
+        domains = [domain_payload(thisDomain) for thisDomain in DomainName.objects.order_by('id')]
+        response = SESSION.post(f'{BASE_URL}/api/updatecaddyconfig',
+                                json={'revision': tableRevision, 'domains': domains}, timeout=30)
 
-    response = requests.post(f'{BASE_URL}/api/updatecaddyconfig', json=domains, timeout=30)
     response.raise_for_status()
     return json.loads(response.text)
 
 
 
+# One domain row as the sidecar takes it — iscloudflare/ssl
+# go over the wire as 0/1 integers, the sidecar's renderer
+# compares against 1 literally
+def domain_payload(thisDomain):
+    return {
+        'id': thisDomain.id,
+        'virtualserverid': thisDomain.virtual_server_id,
+        'domainname': thisDomain.domain_name,
+        'iscloudflare': int(thisDomain.is_cloudflare),
+        'ssl': int(thisDomain.ssl),
+    }
+
+
+
 
 
 
@@ -156,16 +312,16 @@ def update_caddy_config():
 #
 # Pushes the WHOLE port forward table to the sidecar, which
 # renders the portforwarder Caddyfile and reloads the
-# portforwarder Caddy. Raises on any non-2xx, so callers
-# inside a request transaction get rollback-on-failure — DB
-# and listeners never diverge.
+# portforwarder Caddy. Called after the change committed;
+# raises on any non-2xx, and the caller undoes its change.
 #
-# The payload is the plain JSON object {"portforwards":
-# [...]} — the sidecar answers 500 when the caddy reload
-# fails, and the raise_for_status below is what turns that
-# into the backend-side transaction rollback. description is
-# deliberately NOT sent: it is user text, and the renderer
-# splices its inputs into config — only integers travel.
+# The payload is the plain JSON object {"revision",
+# "portforwards": [...]} — the table read AFTER its
+# revision, so it holds at least that revision's changes;
+# the sidecar skips a table older than the one it applied.
+# description is deliberately NOT sent: it is user text,
+# and the renderer splices its inputs into config — only
+# integers travel.
 #
 # Used by:
 #   - portforward_views — after every forward change
@@ -177,6 +333,7 @@ def update_portforwarder_config():
     from control.hosting.models import PortForward
 
     portForwards = {
+        'revision': config_revision('portforwarder'),
         'portforwards': [
             {
                 'id': thisForward.id,
@@ -185,9 +342,9 @@ def update_portforwarder_config():
                 'internalport': thisForward.internal_port,
             }
             for thisForward in PortForward.objects.order_by('id')
-        ]
+        ],
     }
 
-    response = requests.post(f'{BASE_URL}/api/updateportforwarderconfig', json=portForwards, timeout=30)
+    response = SESSION.post(f'{BASE_URL}/api/updateportforwarderconfig', json=portForwards, timeout=30)
     response.raise_for_status()
     return json.loads(response.text)
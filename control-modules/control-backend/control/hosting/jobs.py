@@ -0,0 +1,572 @@
+############################################################
+#  [*] Background jobs — the queue and the monitor's runner
+#
+#  The slow physical work (a sysbox `docker run`, a data
+#  archive, a bulk lifecycle run) used to run in one-shot
+#  daemon threads inside whichever gunicorn worker took the
+#  request: no cap, no queue, no visibility, and a worker
+#  recycle silently killed whatever was in flight.
+#
+#  Now the request only INSERTS a BackgroundJob row
+#  (enqueue_job) and answers 202 with its id. The monitor
+#  process runs the one JobRunner: it claims due jobs and
+#  runs at most JOB_CONCURRENCY of them at a time on its own
+#  executor — a burst of 50 creates is 50 rows, not 50
+#  threads, and at most JOB_CONCURRENCY sidecar calls.
+#
+#  Each kind has a handler and a failure hook:
+#    vm_create — one /api/create; failure soft-deletes the row
+#    vm_delete — one /api/delete (idempotent); failure
+#                reverts the deleted flag
+#    vm_bulk   — one sidecar bulk job, followed to the end;
+#                each VM's outcome recorded like a single one
+#
+#  A handler raises RetryableJobError for a transient failure
+#  (the sidecar could not be reached): the job goes back to
+#  queued with an exponential backoff (JOB_RETRY_BASE_SECONDS
+#  doubling, capped at JOB_RETRY_MAX_SECONDS) until it has
+#  used max_attempts. Anything else fails the job at once and
+#  runs the kind's failure hook.
+#
+#  A job found running when the runner starts was cut off by
+#  a monitor restart and is queued again: delete is
+#  idempotent, bulk resumes following its sidecar job, and a
+#  create that may have reached the sidecar first looks for
+#  its dind on the host (it may well have been built).
+#
+#  Used by:
+#    - vm_views / bulk_views — enqueue_job
+#    - job_views — serialize_job
+#    - monitor_containers — JobRunner
+############################################################
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+import requests
+
+from control.common.auth import format_datetime, invalidate_auth_cache, log_activity
+from control.hosting import docker_controller
+from control.hosting.models import DIND_PREFIX, BackgroundJob, VirtualServer
+from control.hosting.vm_snapshot import mark_stale
+
+
+JOB_CONCURRENCY = int(os.getenv('JOB_CONCURRENCY', '4'))
+JOB_POLL_SECONDS = 1
+JOB_RETRY_BASE_SECONDS = 5
+JOB_RETRY_MAX_SECONDS = 300
+
+# vm_bulk: the follower's poll interval, and how long the
+# sidecar may stay unreachable before the job counts as lost
+# (the VMs it had not finished are then looked up on the
+# host — resolve_lost_outcomes)
+BULK_POLL_SECONDS = 2
+BULK_LOST_AFTER_SECONDS = 120
+
+
+
+
+
+
+
+
+############################################################
+# RetryableJobError / enqueue_job / serialize_job
+############################################################
+#
+# enqueue_job: one queued row, due now. Runs inside the
+# caller's transaction when there is one — the job then
+# commits together with the rows it is about.
+#
+# serialize_job: the status API's view of a row.
+############################################################
+
+class RetryableJobError(Exception):
+    pass
+
+
+
+def enqueue_job(kind, payload, actorUserId, maxAttempts=3):
+    return BackgroundJob.objects.create(
+        kind=kind,
+        payload=payload,
+        max_attempts=maxAttempts,
+        run_after=timezone.now(),
+        created_by_id=actorUserId,
+    )
+
+
+
+def serialize_job(thisJob):
+    return {
+        'id': thisJob.id,
+        'kind': thisJob.kind,
+        'state': thisJob.state,
+        'payload': thisJob.payload,
+        'result': thisJob.result,
+        'attempts': thisJob.attempts,
+        'maxattempts': thisJob.max_attempts,
+        'lasterror': thisJob.last_error or None,
+        'createdat': format_datetime(thisJob.created_at),
+        'startedat': format_datetime(thisJob.started_at),
+        'finishedat': format_datetime(thisJob.finished_at),
+        'runafter': format_datetime(thisJob.run_after) if thisJob.state == 'queued' else None,
+    }
+
+
+
+
+
+
+
+
+############################################################
+# finish_create / finish_delete
+############################################################
+#
+# The recorded outcome of one VM's create or delete — shared
+# by the single-VM handlers and the bulk ones. Create failure
+# soft-deletes the row again (the "creating" card vanishes on
+# the next poll); delete failure REVERTS the deleted flag
+# (the card comes back, the user can retry) — the domains
+# were already removed in the request, and stay removed.
+############################################################
+
+def finish_create(virtualServerID, actorUserId, createFailed):
+    with transaction.atomic():
+        if createFailed:
+            VirtualServer.objects.filter(id=virtualServerID).update(deleted=True, updated_at=timezone.now())
+            log_activity(actorUserId, f'Virtual server #{virtualServerID} creation failed')
+            mark_stale()
+            invalidate_auth_cache()
+        else:
+            log_activity(actorUserId, f'Virtual server #{virtualServerID} created')
+
+
+
+def finish_delete(virtualServerID, actorUserId, deleteFailed):
+    if deleteFailed:
+        with transaction.atomic():
+            VirtualServer.objects.filter(id=virtualServerID).update(deleted=False, updated_at=timezone.now())
+            log_activity(actorUserId, f'Virtual server #{virtualServerID} deletion failed')
+            mark_stale()
+
+
+
+
+
+
+
+
+############################################################
+# read_host_states
+############################################################
+#
+# The host's containers right now, from the sidecar's live
+# listing: {name: state}. What settles an outcome the
+# sidecar's answer did not — a lost create, a lost bulk
+# job. Unreadable → RetryableJobError: the job waits for the
+# sidecar instead of guessing.
+############################################################
+
+def read_host_states():
+    try:
+        resp = docker_controller.get_status('host')
+        return {container['Names']: container['State'] for container in resp.json()['containers']}
+    except (requests.RequestException, ValueError, KeyError) as e:
+        raise RetryableJobError(f'Host state unknown: {e}')
+
+
+
+
+
+
+
+
+############################################################
+# vm_create / vm_delete handlers
+############################################################
+#
+# payload {"virtualServerID"}. A create the sidecar tried
+# and failed is final. One that never reached it is retried.
+# One whose answer was lost — a timeout while the image
+# starts, a monitor restart mid-call — is marked {"sent"} in
+# result and retried too, and every later step asks the host
+# first (read_host_states): a dind that is there means the
+# create went through. Creating it again would fail on the
+# name, soft-deleting the row would orphan the container.
+#
+# A delete is idempotent on the sidecar (tolerant steps,
+# judged by the outcome), so any failure is retried.
+############################################################
+
+def run_vm_create(thisJob):
+    virtualServerID = thisJob.payload['virtualServerID']
+    containerName = DIND_PREFIX + str(virtualServerID)
+    wasSent = (thisJob.result or {}).get('sent', False)
+    if wasSent and containerName in read_host_states():
+        finish_create(virtualServerID, thisJob.created_by_id, False)
+        return {}
+
+    save_job_result(thisJob, {'sent': True})
+    try:
+        resp = docker_controller.create_vm(containerName)
+    except requests.ConnectionError as e:
+        save_job_result(thisJob, {})
+        raise RetryableJobError(f'Sidecar unreachable: {e}')
+    except requests.RequestException as e:
+        raise RetryableJobError(f'Sidecar did not answer, the create may still finish: {e}')
+
+    if resp.status_code != 200:
+        # An earlier attempt still in flight wins the name
+        if wasSent and containerName in read_host_states():
+            finish_create(virtualServerID, thisJob.created_by_id, False)
+            return {}
+        save_job_result(thisJob, {})
+        raise RuntimeError(f'Sidecar answered {resp.status_code}')
+
+    finish_create(virtualServerID, thisJob.created_by_id, False)
+    return {}
+
+
+
+def fail_vm_create(thisJob):
+    virtualServerID = thisJob.payload['virtualServerID']
+    created = False
+    if (thisJob.result or {}).get('sent'):
+        try:
+            created = DIND_PREFIX + str(virtualServerID) in read_host_states()
+        except RetryableJobError:
+            pass
+    finish_create(virtualServerID, thisJob.created_by_id, not created)
+
+
+
+def run_vm_delete(thisJob):
+    virtualServerID = thisJob.payload['virtualServerID']
+    try:
+        resp = docker_controller.delete_vm(DIND_PREFIX + str(virtualServerID))
+    except requests.RequestException as e:
+        raise RetryableJobError(f'Sidecar request failed: {e}')
+    if resp.status_code != 200:
+        raise RetryableJobError(f'Sidecar answered {resp.status_code}')
+
+    finish_delete(virtualServerID, thisJob.created_by_id, False)
+    return {}
+
+
+
+def fail_vm_delete(thisJob):
+    finish_delete(thisJob.payload['virtualServerID'], thisJob.created_by_id, True)
+
+
+
+
+
+
+
+
+############################################################
+# vm_bulk handler
+############################################################
+#
+# payload {"action", "virtualServerIDs"}. Submits the list to
+# the sidecar as one bulk job — its id is saved into result
+# right away, so a runner restart resumes FOLLOWING that job
+# instead of submitting it twice — then polls it, writing the
+# per-VM progress into result as it changes:
+#   {"sidecarJobId", "counts": {queued, running, ok, failed},
+#    "vms": [{"id", "state", "error"}]}
+#
+# When the sidecar reports the job done, every VM not
+# reported ok is recorded as failed. When the job is lost —
+# 404 (bulk jobs live in the sidecar's memory, a restart
+# forgets them), or unreachable for BULK_LOST_AFTER_SECONDS
+# — a VM the sidecar had not finished may or may not have
+# been acted on: its outcome is read off the host
+# (resolve_lost_outcomes) instead, and only a VM the host
+# shows untouched counts as failed. Recording a half-done
+# create as failed would orphan a running dind, a half-done
+# delete would bring back a card whose data is archived.
+# When the host cannot be read either, the job is retried
+# and follows the same sidecar job again.
+#
+# The failure hook (the submit was refused, or the retries
+# ran out) fails every VM the saved progress does not show
+# ok.
+############################################################
+
+def run_vm_bulk(thisJob):
+    action = thisJob.payload['action']
+    virtualServerIDs = thisJob.payload['virtualServerIDs']
+    sidecarJobId = (thisJob.result or {}).get('sidecarJobId')
+
+    if not sidecarJobId:
+        try:
+            resp = docker_controller.start_bulk(action, [DIND_PREFIX + str(virtualServerID) for virtualServerID in virtualServerIDs])
+        except requests.ConnectionError as e:
+            raise RetryableJobError(f'Sidecar unreachable: {e}')
+        if resp.status_code != 202:
+            raise RuntimeError(f'Sidecar answered {resp.status_code}')
+        sidecarJobId = resp.json()['job_id']
+        save_job_result(thisJob, {'sidecarJobId': sidecarJobId})
+
+    progress = {'sidecarJobId': sidecarJobId}
+    jobDone = False
+    lastSeen = time.monotonic()
+    while True:
+        try:
+            resp = docker_controller.get_bulk_job(sidecarJobId)
+        except requests.RequestException:
+            resp = None
+
+        if resp is not None and resp.status_code == 200:
+            jobData = resp.json()
+            lastSeen = time.monotonic()
+            newProgress = {
+                'sidecarJobId': sidecarJobId,
+                'counts': jobData['counts'],
+                'vms': sorted(
+                    [
+                        {'id': int(name.replace(DIND_PREFIX, '')), 'state': entry['state'], 'error': entry.get('error')}
+                        for name, entry in jobData['vms'].items()
+                    ],
+                    key=lambda thisEntry: thisEntry['id'],
+                ),
+            }
+            if newProgress != progress:
+                progress = newProgress
+                save_job_result(thisJob, progress)
+            if jobData['state'] == 'done':
+                jobDone = True
+                break
+        elif resp is not None and resp.status_code == 404:
+            break
+        elif time.monotonic() - lastSeen > BULK_LOST_AFTER_SECONDS:
+            break
+
+        time.sleep(BULK_POLL_SECONDS)
+
+    states = {thisEntry['id']: thisEntry['state'] for thisEntry in progress.get('vms', [])}
+    failedIds = {virtualServerID for virtualServerID in virtualServerIDs if states.get(virtualServerID) != 'ok'}
+    if not jobDone:
+        unfinishedIds = {virtualServerID for virtualServerID in failedIds if states.get(virtualServerID) != 'failed'}
+        failedIds -= unfinishedIds - resolve_lost_outcomes(action, unfinishedIds)
+
+    record_bulk_outcomes(action, virtualServerIDs, failedIds, thisJob.created_by_id)
+    return {**progress, 'failed': sorted(failedIds)}
+
+
+
+def fail_vm_bulk(thisJob):
+    virtualServerIDs = thisJob.payload['virtualServerIDs']
+    okIds = {thisEntry['id'] for thisEntry in (thisJob.result or {}).get('vms', []) if thisEntry['state'] == 'ok'}
+    record_bulk_outcomes(thisJob.payload['action'], virtualServerIDs, set(virtualServerIDs) - okIds, thisJob.created_by_id)
+
+
+
+def resolve_lost_outcomes(action, virtualServerIDs):
+    if not virtualServerIDs:
+        return set()
+    hostStates = read_host_states()
+
+    failedIds = set()
+    for virtualServerID in virtualServerIDs:
+        hostState = hostStates.get(DIND_PREFIX + str(virtualServerID))
+        if action == 'create':
+            done = hostState is not None
+        elif action == 'delete':
+            done = hostState is None
+        elif action == 'start':
+            done = hostState == 'running'
+        else:
+            done = hostState is not None and hostState != 'running'
+        if not done:
+            failedIds.add(virtualServerID)
+    return failedIds
+
+
+
+def save_job_result(thisJob, result):
+    thisJob.result = result
+    BackgroundJob.objects.filter(id=thisJob.id).update(result=result, updated_at=timezone.now())
+
+
+
+def record_bulk_outcomes(action, virtualServerIDs, failedIds, actorUserId):
+    for virtualServerID in virtualServerIDs:
+        failed = virtualServerID in failedIds
+        if action == 'create':
+            finish_create(virtualServerID, actorUserId, failed)
+        elif action == 'delete':
+            finish_delete(virtualServerID, actorUserId, failed)
+        elif not failed:
+            with transaction.atomic():
+                VirtualServer.objects.filter(id=virtualServerID).update(enabled=(action == 'start'), updated_at=timezone.now())
+                log_activity(actorUserId, f'Virtual server #{virtualServerID} {"started" if action == "start" else "stopped"}')
+                mark_stale()
+
+
+
+
+
+
+
+
+############################################################
+# JOB_KINDS
+############################################################
+#
+# kind → (handler, failure hook, re-queued when interrupted)
+############################################################
+
+JOB_KINDS = {
+    'vm_create': (run_vm_create, fail_vm_create, True),
+    'vm_delete': (run_vm_delete, fail_vm_delete, True),
+    'vm_bulk': (run_vm_bulk, fail_vm_bulk, True),
+}
+
+
+
+
+
+
+
+
+############################################################
+# claim_next_job / run_job / recover_interrupted_jobs
+############################################################
+#
+# claim_next_job: the oldest due queued job, flipped to
+# running with a conditional UPDATE — it is claimed only if
+# it was still queued, so a claim can never run twice.
+#
+# run_job: runs one claimed job to its next state. Never
+# raises.
+#
+# recover_interrupted_jobs: at runner start, nothing can be
+# running yet — see the banner at the top for what happens
+# to each kind. Returns the number of jobs touched.
+############################################################
+
+def claim_next_job():
+    timeNow = timezone.now()
+    for jobId in BackgroundJob.objects.filter(state='queued', run_after__lte=timeNow).order_by('run_after', 'id').values_list('id', flat=True)[:5]:
+        claimed = BackgroundJob.objects.filter(id=jobId, state='queued').update(
+            state='running', attempts=F('attempts') + 1, started_at=timeNow, updated_at=timeNow,
+        )
+        if claimed:
+            return BackgroundJob.objects.get(id=jobId)
+    return None
+
+
+
+def run_job(thisJob):
+    handler, failureHook, _ = JOB_KINDS.get(thisJob.kind, (None, None, False))
+    try:
+        if handler is None:
+            raise RuntimeError(f'Unknown job kind: {thisJob.kind}')
+        result = handler(thisJob)
+
+    except RetryableJobError as e:
+        if thisJob.attempts < thisJob.max_attempts:
+            delay = min(JOB_RETRY_BASE_SECONDS * 2 ** (thisJob.attempts - 1), JOB_RETRY_MAX_SECONDS)
+            BackgroundJob.objects.filter(id=thisJob.id).update(
+                state='queued', last_error=str(e), run_after=timezone.now() + timedelta(seconds=delay), updated_at=timezone.now(),
+            )
+            return
+        finish_job(thisJob, 'failed', error=str(e), failureHook=failureHook)
+
+    except Exception as e:
+        finish_job(thisJob, 'failed', error=str(e), failureHook=failureHook)
+
+    else:
+        finish_job(thisJob, 'succeeded', result=result)
+
+
+
+def finish_job(thisJob, state, result=None, error='', failureHook=None):
+    if failureHook is not None:
+        try:
+            failureHook(thisJob)
+        except Exception as e:
+            error = f'{error}; failure handling: {e}'
+
+    updates = {'state': state, 'finished_at': timezone.now(), 'updated_at': timezone.now()}
+    if result is not None:
+        updates['result'] = result
+    if error:
+        updates['last_error'] = error
+    BackgroundJob.objects.filter(id=thisJob.id).update(**updates)
+
+
+
+def recover_interrupted_jobs():
+    touched = 0
+    for thisJob in BackgroundJob.objects.filter(state='running'):
+        _, failureHook, requeue = JOB_KINDS.get(thisJob.kind, (None, None, False))
+        if requeue:
+            BackgroundJob.objects.filter(id=thisJob.id).update(state='queued', run_after=timezone.now(), updated_at=timezone.now())
+        else:
+            finish_job(thisJob, 'failed', error='Interrupted by a monitor restart', failureHook=failureHook)
+        touched += 1
+    return touched
+
+
+
+
+
+
+
+
+############################################################
+# JobRunner
+############################################################
+#
+# The monitor's job loop, on its own thread: every
+# JOB_POLL_SECONDS it fills the free slots (at most
+# `concurrency` jobs running) with due jobs and hands them
+# to its executor. Each job's thread returns its DB
+# connection when the job is done.
+############################################################
+
+class JobRunner:
+
+    def __init__(self, concurrency=JOB_CONCURRENCY):
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='job')
+        self.slots = threading.BoundedSemaphore(concurrency)
+
+    def run_forever(self):
+        recover_interrupted_jobs()
+        while True:
+            try:
+                self.fill_slots()
+            except Exception as e:
+                print(f'Job Runner Error: {e}')
+            time.sleep(JOB_POLL_SECONDS)
+
+    def fill_slots(self):
+        while self.slots.acquire(blocking=False):
+            try:
+                thisJob = claim_next_job()
+            except Exception:
+                self.slots.release()
+                raise
+            if thisJob is None:
+                self.slots.release()
+                return
+            self.executor.submit(self.run, thisJob)
+
+    def run(self, thisJob):
+        try:
+            run_job(thisJob)
+        finally:
+            close_old_connections()
+            self.slots.release()
@@ -9,5 +9,8 @@
 #                         CMD starts exactly one instance
 #                         beside the web server (before
 #                         gunicorn forks) and respawns it if
-#                         it ever exits
+#                         it ever exits; --events (the
+#                         CMD's mode) applies the sidecar's
+#                         container delta stream instead
+#                         of re-listing everything
 ############################################################
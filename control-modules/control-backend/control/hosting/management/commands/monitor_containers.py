@@ -12,6 +12,9 @@
 #       (parent_server 0)
 #    2. every running hosting-users-dind-<N> → that VM's
 #       `docker ps` → cache rows under parent_server N
+#       (one /api/status/batch round trip; per-VM requests,
+#       MONITOR_CONCURRENCY at a time, only as the fallback;
+#       always written on the main thread)
 #    3. any discovered dind container without a VM row is
 #       adopted ownerless (owner NULL) — the safety net for
 #       containers created outside the panel
@@ -20,28 +23,90 @@
 #
 #  synced_at is the pass timestamp: one shared value per
 #  push, so "not seen this pass" is a plain inequality.
+#
+#  --events switches the container cache to deltas: the
+#  sidecar's /api/events stream (create/start/die/destroy/
+#  rename from every daemon) is applied as it arrives, and
+#  the full pass above only runs every RECONCILE_SECONDS as
+#  the safety net — and at once whenever the stream reports
+#  it may have missed events. cAdvisor and disk keep their
+#  own schedules in both modes.
+#
+#  The monitor is also the ONE process that runs background
+#  jobs (VM create/delete, bulk lifecycle — hosting/jobs):
+#  the JobRunner thread claims due jobs and runs at most
+#  JOB_CONCURRENCY of them at a time. Not with --once.
+#
+#  Every pass ends by refreshing the VM list snapshot
+#  (hosting/vm_snapshot) that GET /api/vm serves, and
+#  publishing it to the VM push streams (hosting/vm_push),
+#  which this process also serves on VM_PUSH_PORT.
+#
+#  cAdvisor is sampled once per pass (hosting/
+#  cadvisor_sampler): each VM's figures into VmUsage, the
+#  host's into the "cadvisor" feed the admin dashboard reads
+#  (hosting/monitor_feeds), and both into the usage history
+#  (hosting/usage_history), flushed to the database every
+#  USAGE_FLUSH_SECONDS. The Docker Hub pull budget is
+#  checked every RATE_LIMIT_REFRESH_SECONDS for the same
+#  dashboard (dashboard/registry_monitor).
+#
+#  Every WAL_CHECKPOINT_SECONDS it also checkpoints the
+#  database's write-ahead log (settings: SQLite runs in WAL
+#  mode).
 ############################################################
 
 import json
+import math
 import os
+import queue
+import re
+import statistics
 import threading
 import time
-from datetime import datetime, timedelta
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
 
 import requests
 from django.core.management.base import BaseCommand
-from django.db import close_old_connections, transaction
+from django.db import close_old_connections, connection, transaction
 from django.utils import timezone
 
+from control.common.http_pool import pool_stats
+from control.dashboard.registry_monitor import RATE_LIMIT_REFRESH_SECONDS, refresh_rate_limit
 from control.hosting import docker_controller
-from control.hosting.models import DIND_PREFIX, DockerContainer, VirtualServer, VmUsage
+from control.hosting.cadvisor_sampler import FEED_CADVISOR, CadvisorSampler, system_figures
+from control.hosting.jobs import JOB_CONCURRENCY, JobRunner
+from control.hosting.models import (
+    DIND_PREFIX,
+    DockerContainer,
+    DockerContainerNetwork,
+    DockerContainerPort,
+    VirtualServer,
+    VmUsage,
+)
+from control.hosting.monitor_feeds import publish_feed
+from control.hosting.usage_history import HOST_SERIES_ID, USAGE_FLUSH_SECONDS, USAGE_HISTORY
+from control.hosting.vm_push import VM_PUSH_HUB, VM_PUSH_PORT, serve_vm_push
+from control.hosting.vm_snapshot import refresh_snapshot
+
 
+# How often the sidecar's (incremental) disk sweep runs
+DISK_REFRESH_SECONDS = 30
 
-CADVISOR_HOST = os.getenv('CADVISOR_HOST', 'hosting-control-cadvisor')
-CADVISOR_PORT = os.getenv('CADVISOR_PORT', '8080')
+# How often the WAL is checkpointed into the database file
+WAL_CHECKPOINT_SECONDS = 60
 
-# How often the (slow) du-based disk sweep runs
-DISK_REFRESH_SECONDS = 300
+# --events mode: how often the full host + every-VM pass
+# still runs as the safety net (well under the 5-minute
+# sweep, which would otherwise drop quiet containers)
+RECONCILE_SECONDS = 60
+
+# Full pass: how many VMs' `docker ps` are fetched at once,
+# and how long one VM may take before it is skipped for the
+# pass (a hung inner daemon must not stall the others)
+MONITOR_CONCURRENCY = int(os.getenv('MONITOR_CONCURRENCY', '16'))
+VM_STATUS_DEADLINE_SECONDS = float(os.getenv('MONITOR_VM_DEADLINE', '5'))
 
 
 
@@ -54,55 +119,119 @@ DISK_REFRESH_SECONDS = 300
 # push_docker_info_to_db
 ############################################################
 #
-# One parent's `docker ps` snapshot → the cache, in one
-# transaction: upsert every container with one shared
-# synced_at, drop the parent's rows that were not in the
-# snapshot, and (host pass only) adopt unknown dind
-# containers as ownerless VM rows.
+# One parent's `docker ps` snapshot → the cache, as ONE
+# multi-row upsert on unique_dockerid_parent plus ONE delete
+# of the rows the snapshot no longer lists, in a single
+# transaction — and (host pass only) one batched adoption of
+# dind containers without a VM row as ownerless VM rows:
+# every running dind of the snapshot is checked, changed or
+# not, so a dind whose row went missing while it kept
+# running is adopted on the next pass (one SELECT; the
+# write only when one is missing). The changed
+# rows' ports and networks are replaced in the same
+# transaction (write_container_children).
+#
+# The previous snapshot of every parent is kept in memory
+# (_lastSnapshots): rows whose fields did not change since
+# the last successful push are not written at all, and a
+# pass where nothing changed (nothing to adopt either) opens
+# no transaction — SQLite's
+# write lock is never taken. synced_at is then refreshed in
+# one UPDATE at most every SYNCED_AT_REFRESH_SECONDS, which
+# keeps quiet rows clear of the 5-minute sweep.
+#
+# The memory is only an optimization: anything else that
+# changes cache rows (the event deltas, the sweep) calls
+# forget_snapshots, and the next push of that parent writes
+# in full again. A failed transaction forgets too.
+#
+# Returns {written, removed, lock_ms} — lock_ms is the time
+# spent inside the write transaction (0 when none opened).
 ############################################################
 
+CACHE_FIELDS = ['command', 'created_at', 'image', 'labels', 'stack_name', 'mounts', 'names',
+                'running_for', 'size', 'state', 'status']
+
+SYNCED_AT_REFRESH_SECONDS = 60
+
+_lastSnapshots = {}          # parentServerID → {docker_id: field tuple}
+_lastRefreshes = {}          # parentServerID → monotonic time of the last synced_at refresh
+
+
+
 def push_docker_info_to_db(json_obj, parentServerID=0):
     timeNow = timezone.now()
+    previous = _lastSnapshots.get(parentServerID)
+
+    snapshot = {}
+    changedRows = []
+    changedChildren = {}
+    for container in json_obj['containers']:
+        fields = container_fields(container)
+        ports = container_ports(container)
+        networks = container_networks(container)
+        fingerprint = container_fingerprint(fields, ports, networks)
+        snapshot[container['ID']] = fingerprint
+        if previous is None or previous.get(container['ID']) != fingerprint:
+            changedRows.append(DockerContainer(
+                docker_id=container['ID'], parent_server_id=parentServerID, synced_at=timeNow, **fields,
+            ))
+            changedChildren[container['ID']] = (ports, networks)
+
+    removedIds = set(previous or ()) - set(snapshot)
+    refreshDue = time.monotonic() - _lastRefreshes.get(parentServerID, 0.0) >= SYNCED_AT_REFRESH_SECONDS
+
+    orphanIDs = set()
+    if parentServerID == 0:
+        dindNames = {row.names for row in changedRows}
+        dindNames.update(container['Names'] for container in json_obj['containers'] if container['State'] == 'running')
+        orphanIDs = unknown_dind_ids(dindNames)
+
+    # Nothing changed, nothing vanished, nothing to adopt, no
+    # refresh due — the cache already says exactly this
+    if previous is not None and not changedRows and not removedIds and not orphanIDs and not refreshDue:
+        return {'written': 0, 'removed': 0, 'lock_ms': 0.0}
+
+    lockStart = time.monotonic()
+    try:
+        with transaction.atomic():
+            adopt_dind_ids(orphanIDs)
+
+            if changedRows:
+                DockerContainer.objects.bulk_create(
+                    changedRows,
+                    update_conflicts=True,
+                    unique_fields=['docker_id', 'parent_server'],
+                    update_fields=CACHE_FIELDS + ['synced_at'],
+                )
+                write_container_children(parentServerID, changedChildren)
 
-    with transaction.atomic():
-        for container in json_obj['containers']:
-
-            DockerContainer.objects.update_or_create(
-                docker_id=container['ID'],
-                parent_server_id=parentServerID,
-                defaults={
-                    'command': container['Command'],
-                    'created_at': container['CreatedAt'],
-                    'image': container['Image'],
-                    'labels': container['Labels'],
-                    'mounts': container['Mounts'],
-                    'names': container['Names'],
-                    'networks': container['Networks'],
-                    'ports': container['Ports'],
-                    'running_for': container['RunningFor'],
-                    'size': container['Size'],
-                    'state': container['State'],
-                    'status': container['Status'],
-                    'synced_at': timeNow,
-                },
-            )
+            # Drop this parent's rows that were not in the snapshot
+            _, removedByModel = DockerContainer.objects.filter(parent_server_id=parentServerID).exclude(docker_id__in=list(snapshot)).delete()
+            removed = removedByModel.get(DockerContainer._meta.label, 0)
+
+            if refreshDue:
+                DockerContainer.objects.filter(parent_server_id=parentServerID).update(synced_at=timeNow)
+
+    except Exception:
+        forget_snapshots(parentServerID)
+        raise
+
+    _lastSnapshots[parentServerID] = snapshot
+    if refreshDue:
+        _lastRefreshes[parentServerID] = time.monotonic()
+
+    return {'written': len(changedRows), 'removed': removed, 'lock_ms': (time.monotonic() - lockStart) * 1000}
 
-            # Adopt dind containers that have no VM row — e.g.
-            # created by hand on the host. Ownerless on purpose;
-            # non-numeric suffixes are skipped. get_or_create
-            # stamps the timestamps itself on the create path —
-            # existing rows are NOT touched, so updated_at keeps
-            # meaning "last state change".
-            if parentServerID == 0 and container['Names'].startswith(DIND_PREFIX):
-                virtualServerID = container['Names'].replace(DIND_PREFIX, '')
-                if virtualServerID.isdigit():
-                    VirtualServer.objects.get_or_create(
-                        id=int(virtualServerID),
-                        defaults={'owner': None, 'name': '', 'enabled': True, 'deleted': False},
-                    )
 
-        # Drop this parent's rows that were not in the snapshot
-        DockerContainer.objects.filter(parent_server_id=parentServerID).exclude(synced_at=timeNow).delete()
+
+def forget_snapshots(parentServerID=None):
+    if parentServerID is None:
+        _lastSnapshots.clear()
+        _lastRefreshes.clear()
+    else:
+        _lastSnapshots.pop(parentServerID, None)
+        _lastRefreshes.pop(parentServerID, None)
 
 
 
@@ -112,53 +241,466 @@ def push_docker_info_to_db(json_obj, parentServerID=0):
 
 
 ############################################################
-# parse_cadvisor_docker
+# container_fields / container_ports / container_networks
 ############################################################
 #
-# cAdvisor's /api/v1.3/docker payload → {vmId: {cpu_percent,
-# memory_mb}} for the dind containers. CPU% is a share of
-# the whole host: the delta of the cumulative nanosecond
-# counter between the two newest samples, over the wall time
-# between them, divided by the core count. Fewer than two
-# samples → cpu None (the container just started); memory is
-# the working set of the newest sample.
+# One `docker ps` dict → what the cache stores: the row's
+# columns (labels as an object, the compose project pulled
+# out as stack_name), its ports and its networks. The
+# sidecar sends the structured forms (LabelMap, PortList,
+# NetworkList) next to the CLI strings; a dict without them
+# (an older sidecar) has its strings parsed instead — label
+# values may contain commas, and port entries the pattern
+# does not know (docker's own ranges) are left out.
 #
-# Pure function — the contract tests feed it fake payloads.
+# container_fingerprint is what push_docker_info_to_db
+# compares between passes.
 #
 # Used by:
-#   - Command.handle (below) — every 3-second pass
+#   - push_docker_info_to_db (above) — every full pass
+#   - upsert_container (below) — every delta
 ############################################################
 
-def parse_cadvisor_docker(dockerPayload, numCores):
-    usageByVm = {}
+COMPOSE_PROJECT_LABEL = 'com.docker.compose.project'
+
+PORT_PATTERN = re.compile(
+    r'^(?:(?:\[(?P<bracketed>[^\]]*)\]|(?P<plain>::|[0-9.]+)):)?'
+    r'(?:(?P<public>\d+)->)?(?P<private>\d+)/(?P<protocol>\w+)$'
+)
+
+
+
+def container_fields(container):
+    labels = container.get('LabelMap')
+    if labels is None:
+        labels = parse_labels(container['Labels'])
+    return {
+        'command': container['Command'],
+        'created_at': container['CreatedAt'],
+        'image': container['Image'],
+        'labels': labels,
+        'stack_name': labels.get(COMPOSE_PROJECT_LABEL, '').strip()[:255],
+        'mounts': container['Mounts'],
+        'names': container['Names'],
+        'running_for': container['RunningFor'],
+        'size': container['Size'],
+        'state': container['State'],
+        'status': container['Status'],
+    }
 
-    for node in dockerPayload.values():
-        dindAlias = next((a for a in (node.get('aliases') or []) if a.startswith(DIND_PREFIX)), None)
-        if dindAlias is None or not dindAlias.replace(DIND_PREFIX, '').isdigit():
-            continue
-        vmId = int(dindAlias.replace(DIND_PREFIX, ''))
 
-        stats = node.get('stats') or []
-        if not stats:
+
+def container_ports(container):
+    portList = container.get('PortList')
+    if portList is None:
+        return parse_ports(container['Ports'])
+    return [
+        {'host_ip': thisPort.get('ip') or '', 'public_port': thisPort.get('public') or None,
+         'private_port': thisPort['private'], 'protocol': thisPort.get('type') or 'tcp'}
+        for thisPort in portList
+        if thisPort.get('private') is not None
+    ]
+
+
+
+def container_networks(container):
+    networkList = container.get('NetworkList')
+    if networkList is None:
+        networkList = [name for name in container['Networks'].split(',') if name]
+    return networkList
+
+
+
+def container_fingerprint(fields, ports, networks):
+    return (
+        tuple(fields[name] for name in CACHE_FIELDS if name != 'labels'),
+        tuple(sorted(fields['labels'].items())),
+        tuple(tuple(thisPort.values()) for thisPort in ports),
+        tuple(networks),
+    )
+
+
+
+def parse_labels(labelsText):
+    labels = {}
+    lastKey = None
+    for piece in labelsText.split(',') if labelsText else []:
+        key, separator, value = piece.partition('=')
+        if separator and key:
+            labels[key] = value
+            lastKey = key
+        elif lastKey is not None:
+            labels[lastKey] += f',{piece}'
+    return labels
+
+
+
+def parse_ports(portsText):
+    ports = []
+    for entry in portsText.split(','):
+        matched = PORT_PATTERN.match(entry.strip())
+        if matched is None:
             continue
+        ports.append({
+            'host_ip': matched['bracketed'] or matched['plain'] or '',
+            'public_port': int(matched['public']) if matched['public'] else None,
+            'private_port': int(matched['private']),
+            'protocol': matched['protocol'],
+        })
+    return ports
+
+
+
+
+
+
+
+
+############################################################
+# write_container_children / upsert_container / adopt_dind_containers
+############################################################
+#
+# write_container_children replaces the ports and networks
+# of the given containers of one parent — {docker_id:
+# (ports, networks)} — with one delete and one insert per
+# table. upsert_container writes one `docker ps` dict as the
+# row (docker_id, parent) with the given synced_at, children
+# included.
+#
+# adopt_dind_containers adopts dind containers that have no
+# VM row — e.g. created by hand on the host — in one query
+# (unknown_dind_ids) plus one INSERT (adopt_dind_ids).
+# Ownerless on purpose; non-numeric suffixes are skipped.
+# Existing rows are NOT touched, so updated_at keeps meaning
+# "last state change"; a row inserted meanwhile is left
+# alone (ignore_conflicts).
+#
+# Used by:
+#   - push_docker_info_to_db (above) — every host pass, the
+#     two halves apart: the SELECT decides whether the pass
+#     writes at all
+#   - apply_container_event (below) — every delta
+############################################################
+
+def write_container_children(parentServerID, childrenByDockerId):
+    containerIds = dict(
+        DockerContainer.objects.filter(parent_server_id=parentServerID, docker_id__in=list(childrenByDockerId))
+        .values_list('docker_id', 'id')
+    )
+    DockerContainerPort.objects.filter(container_id__in=containerIds.values()).delete()
+    DockerContainerNetwork.objects.filter(container_id__in=containerIds.values()).delete()
+
+    DockerContainerPort.objects.bulk_create([
+        DockerContainerPort(container_id=containerIds[dockerId], **thisPort)
+        for dockerId, (ports, _) in childrenByDockerId.items()
+        for thisPort in ports
+    ])
+    DockerContainerNetwork.objects.bulk_create([
+        DockerContainerNetwork(container_id=containerIds[dockerId], name=name)
+        for dockerId, (_, networks) in childrenByDockerId.items()
+        for name in networks
+    ])
+
+
+
+def upsert_container(container, parentServerID, timeNow):
+    DockerContainer.objects.update_or_create(
+        docker_id=container['ID'],
+        parent_server_id=parentServerID,
+        defaults={**container_fields(container), 'synced_at': timeNow},
+    )
+    write_container_children(parentServerID, {container['ID']: (container_ports(container), container_networks(container))})
+
+
+
+def adopt_dind_containers(namesList):
+    adopt_dind_ids(unknown_dind_ids(namesList))
+
+
+
+def unknown_dind_ids(namesList):
+    virtualServerIDs = {
+        int(names.replace(DIND_PREFIX, ''))
+        for names in namesList
+        if names.startswith(DIND_PREFIX) and names.replace(DIND_PREFIX, '').isdigit()
+    }
+    if not virtualServerIDs:
+        return set()
+
+    knownIDs = set(VirtualServer.objects.filter(id__in=virtualServerIDs).values_list('id', flat=True))
+    return virtualServerIDs - knownIDs
+
+
+
+def adopt_dind_ids(virtualServerIDs):
+    if not virtualServerIDs:
+        return
+    VirtualServer.objects.bulk_create(
+        [
+            VirtualServer(id=virtualServerID, owner=None, name='', enabled=True, deleted=False)
+            for virtualServerID in sorted(virtualServerIDs)
+        ],
+        ignore_conflicts=True,
+    )
+
+
+
+
+
+
+
+
+############################################################
+# apply_container_event
+############################################################
+#
+# One sidecar delta → the cache. A delta carrying a
+# container (create/start/die/rename) upserts that row; one
+# without (destroy, or already gone again) deletes it. Host
+# deltas adopt dind containers exactly like the full pass.
+# Deltas for a VM the registry does not know are dropped —
+# the row would violate the parent FK, and the next full
+# pass adopts the VM first anyway.
+#
+# Used by:
+#   - Command.apply_pending_events (below) — --events mode
+############################################################
+
+def apply_container_event(delta):
+    parent = delta.get('parent') or ''
+    if parent == 'host':
+        parentServerID = 0
+    elif parent.startswith(DIND_PREFIX) and parent.replace(DIND_PREFIX, '').isdigit():
+        parentServerID = int(parent.replace(DIND_PREFIX, ''))
+        if not VirtualServer.objects.filter(id=parentServerID).exists():
+            return
+    else:
+        return
+
+    # The row changes behind the full pass's back
+    forget_snapshots(parentServerID)
+
+    container = delta.get('container')
+    with transaction.atomic():
+        if container is None:
+            DockerContainer.objects.filter(docker_id=delta.get('id'), parent_server_id=parentServerID).delete()
+            return
+
+        upsert_container(container, parentServerID, timezone.now())
+        if parentServerID == 0:
+            adopt_dind_containers([container['Names']])
+
+
+
+
+
+
+
+
+############################################################
+# consume_events
+############################################################
+#
+# Thread target (--events mode): reads the sidecar's delta
+# stream into eventQueue, forever, reconnecting 3 s after any
+# break. Every (re)connect queues a "resync" first — events
+# may have been missed while no stream was open, so the main
+# loop answers with a full pass. Heartbeats are dropped here.
+# No database access on this thread: the main loop applies
+# everything, so writes stay serialized.
+#
+# Used by:
+#   - Command.handle (below) — started once in --events mode
+############################################################
+
+def consume_events(eventQueue):
+    while True:
+        try:
+            response = docker_controller.stream_events()
+            response.raise_for_status()
+            eventQueue.put({'action': 'resync'})
+
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                delta = json.loads(line)
+                if delta.get('action') != 'heartbeat':
+                    eventQueue.put(delta)
+
+        except Exception as e:
+            print(f'Docker Event Stream Error: {e}', flush=True)
+
+        time.sleep(3)
+
+
+
+
+
+
+
+
+############################################################
+# fetch_vm_statuses
+############################################################
+#
+# The per-VM half of the full pass: every running dind's
+# `docker ps` fetched on the bounded pool, yielded back to
+# the CALLING thread in completion order — so the DB writes
+# stay serialized on the main thread while the slower VMs are
+# still in flight.
+#
+# Each fetch carries the per-VM deadline as its HTTP timeout;
+# the pass as a whole waits at most one deadline per "wave"
+# of the pool (plus a second of slack). Only the time spent
+# WAITING counts against that budget — the caller's DB
+# writes between yields do not — and every fetch that
+# finished is yielded, however late it is read. Anything
+# still unfinished once the budget is spent is reported as
+# timed out and dropped — its rows simply keep their
+# previous state until the next pass.
+#
+# Yields (hostname, json_obj | None, elapsedMs, outcome),
+# outcome one of 'ok' | 'timeout' | 'error: <text>'.
+#
+# Used by:
+#   - Command.sync_all_containers (below)
+############################################################
+
+def fetch_vm_status(hostname, deadline):
+    started = time.monotonic()
+    try:
+        json_obj = json.loads(docker_controller.get_status(hostname, timeout=deadline).text)
+        return hostname, json_obj, (time.monotonic() - started) * 1000, 'ok'
+    except requests.Timeout:
+        return hostname, None, (time.monotonic() - started) * 1000, 'timeout'
+    except Exception as e:
+        return hostname, None, (time.monotonic() - started) * 1000, f'error: {e}'
+
+
 
-        memoryMb = round(stats[-1].get('memory', {}).get('working_set', 0) / 1048576)
+def fetch_vm_statuses(executor, hostnames, concurrency=MONITOR_CONCURRENCY, deadline=VM_STATUS_DEADLINE_SECONDS):
+    if not hostnames:
+        return
 
-        cpuPercent = None
-        if len(stats) >= 2:
-            # Timestamps carry nanoseconds — trim to microseconds
-            # for fromisoformat, and drop a surviving Z so both
-            # ends of the subtraction are always naive
-            t1 = datetime.fromisoformat(stats[-1]['timestamp'][:26].rstrip('Z'))
-            t0 = datetime.fromisoformat(stats[-2]['timestamp'][:26].rstrip('Z'))
-            wallNs = (t1 - t0).total_seconds() * 1e9
-            cpuNs = stats[-1]['cpu']['usage']['total'] - stats[-2]['cpu']['usage']['total']
-            if wallNs > 0 and cpuNs >= 0:
-                cpuPercent = round(cpuNs / wallNs / max(numCores, 1) * 100, 2)
+    passBudget = deadline * math.ceil(len(hostnames) / max(concurrency, 1)) + 1
+    pending = {executor.submit(fetch_vm_status, hostname, deadline): hostname for hostname in hostnames}
 
-        usageByVm[vmId] = {'cpu_percent': cpuPercent, 'memory_mb': memoryMb}
+    budgetLeft = passBudget
+    while pending and budgetLeft > 0:
+        waitStarted = time.monotonic()
+        done, _ = wait(pending, timeout=budgetLeft, return_when=FIRST_COMPLETED)
+        budgetLeft -= time.monotonic() - waitStarted
+        for future in done:
+            del pending[future]
+            yield future.result()
 
-    return usageByVm
+    # The budget is spent — what finished while the last
+    # results were being written still counts
+    for future, hostname in pending.items():
+        if future.done():
+            yield future.result()
+        else:
+            future.cancel()
+            yield hostname, None, passBudget * 1000, 'timeout'
+
+
+
+
+
+
+
+
+############################################################
+# fetch_vm_statuses_batch
+############################################################
+#
+# The same per-VM results as fetch_vm_statuses, in ONE round
+# trip: the sidecar's /api/status/batch queries the inner
+# daemons concurrently on its side and answers per VM. A
+# per-VM error is an entry, not an exception; only a failed
+# batch as a whole raises (the caller then falls back to
+# fetch_vm_statuses — e.g. against an older sidecar).
+#
+# Used by:
+#   - Command.sync_all_containers (below)
+############################################################
+
+def fetch_vm_statuses_batch(hostnames):
+    if not hostnames:
+        return []
+
+    response = docker_controller.get_status_batch(hostnames)
+    if response.status_code != 200:
+        raise RuntimeError(f'status batch answered {response.status_code}')
+
+    results = []
+    for hostname, entry in json.loads(response.text)['vms'].items():
+        if 'containers' in entry:
+            results.append((hostname, {'containers': entry['containers']}, entry.get('elapsed_ms', 0.0), 'ok'))
+        elif entry.get('timed_out'):
+            results.append((hostname, None, entry.get('elapsed_ms', 0.0), 'timeout'))
+        else:
+            results.append((hostname, None, entry.get('elapsed_ms', 0.0), f'error: {entry.get("error")}'))
+    return results
+
+
+
+
+
+
+
+
+############################################################
+# summarize_fetches
+############################################################
+#
+# Timing stats of one pass's per-VM fetches: nearest-rank
+# p50/p99 latency over every VM (timeouts included, at the
+# time they were given up on) plus the names that timed out
+# or failed. Pure function.
+#
+# Used by:
+#   - Command.sync_all_containers (below) — the pass log line
+############################################################
+
+def summarize_fetches(results):
+    latencies = sorted(elapsedMs for _, _, elapsedMs, _ in results)
+    if not latencies:
+        return {'vms': 0, 'p50_ms': 0.0, 'p99_ms': 0.0, 'timed_out': [], 'failed': []}
+
+    return {
+        'vms': len(latencies),
+        'p50_ms': round(statistics.median_low(latencies), 1),
+        'p99_ms': round(latencies[max(0, math.ceil(len(latencies) * 0.99) - 1)], 1),
+        'timed_out': sorted(hostname for hostname, _, _, outcome in results if outcome == 'timeout'),
+        'failed': sorted(hostname for hostname, _, _, outcome in results if outcome.startswith('error')),
+    }
+
+
+
+
+
+
+
+
+############################################################
+# cadvisor_error_kind
+############################################################
+#
+# A failed sample → what the dashboard feed says about it:
+# timeout, connect (cAdvisor unreachable or answering an
+# error) or parse (a payload without the expected fields).
+#
+# Used by:
+#   - Command.handle (below) — the cAdvisor feed
+############################################################
+
+def cadvisor_error_kind(error):
+    if isinstance(error, requests.exceptions.Timeout):
+        return 'timeout'
+    if isinstance(error, requests.exceptions.RequestException):
+        return 'connect'
+    return 'parse'
 
 
 
@@ -213,27 +755,37 @@ def update_vm_usage(usageByVm):
 # refresh_disk_usage
 ############################################################
 #
-# Thread target: one sidecar du sweep → disk_mb per VM. Runs
-# in its own thread because the du over the inner docker
-# trees can take tens of seconds and must never stall the
-# 3-second container sync.
+# Thread target: one sidecar disk sweep → disk_mb per VM,
+# upserted LINE BY LINE as the NDJSON stream delivers each
+# VM — a slow tree delays only its own number, and a stream
+# cut short keeps everything written before the cut. Runs in
+# its own thread because the first (full) walk of the inner
+# docker trees can take tens of seconds and must never stall
+# the 3-second container sync.
 #
 # Used by:
-#   - Command.handle (below) — started every ~5 minutes
+#   - Command.handle (below) — started every ~30 seconds
 ############################################################
 
 def refresh_disk_usage():
     try:
-        payload = json.loads(docker_controller.get_disk_usage().text)
-        timeNow = timezone.now()
-
-        for vmIdText, usedBytes in (payload.get('usage') or {}).items():
-            if not vmIdText.isdigit() or not VirtualServer.objects.filter(id=int(vmIdText)).exists():
-                continue
-            VmUsage.objects.update_or_create(
-                virtual_server_id=int(vmIdText),
-                defaults={'disk_mb': usedBytes // 1048576, 'disk_measured_at': timeNow},
-            )
+        response = docker_controller.get_disk_usage()
+        if response.status_code != 200:
+            raise RuntimeError(f'disk usage answered {response.status_code}')
+
+        with response:
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                measured = json.loads(line)
+                vmIdText = str(measured.get('id', ''))
+                if not vmIdText.isdigit() or not VirtualServer.objects.filter(id=int(vmIdText)).exists():
+                    continue
+                VmUsage.objects.update_or_create(
+                    virtual_server_id=int(vmIdText),
+                    defaults={'disk_mb': measured['bytes'] // 1048576, 'disk_measured_at': timezone.now()},
+                )
+                USAGE_HISTORY.record_disk(int(vmIdText), measured['bytes'] // 1048576)
 
     except Exception as e:
         print(f'Disk Usage Updater Error: {e}', flush=True)
@@ -248,6 +800,39 @@ def refresh_disk_usage():
 
 
 
+############################################################
+# checkpoint_wal
+############################################################
+#
+# Copies the write-ahead log back into the database file.
+# SQLite's own autocheckpoint runs on the committing
+# connection and gives up while readers still hold older
+# pages — with a web worker reading at all times the WAL
+# could only grow. PASSIVE never waits for anyone: what a
+# reader still pins is simply copied on a later run, and
+# once a run completes the next write starts the log over
+# (trimmed to journal_size_limit).
+#
+# Returns (busy, log pages, checkpointed pages) as SQLite
+# reports them — -1 pages when the database is not in WAL
+# mode.
+#
+# Used by:
+#   - Command.handle (below) — every WAL_CHECKPOINT_SECONDS
+############################################################
+
+def checkpoint_wal():
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA wal_checkpoint(PASSIVE)')
+        return tuple(cursor.fetchone())
+
+
+
+
+
+
+
+
 ############################################################
 # Command
 ############################################################
@@ -257,77 +842,243 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('--once', action='store_true', help='Run a single pass and exit (for testing)')
+        parser.add_argument('--events', action='store_true',
+                            help=f'Apply the sidecar event stream; full passes only every {RECONCILE_SECONDS} s')
 
 
     def handle(self, *args, **options):
-        self.stdout.write('Docker monitor started (3 s interval)')
-
-        numCores = None
+        eventsMode = options['events'] and not options['once']
+        self.verbosity = options['verbosity']
+        self.executor = ThreadPoolExecutor(max_workers=MONITOR_CONCURRENCY, thread_name_prefix='vm-status')
+        if eventsMode:
+            self.stdout.write(f'Docker monitor started (event stream, {RECONCILE_SECONDS} s reconciliation)')
+        else:
+            self.stdout.write('Docker monitor started (3 s interval)')
+
+        # Background jobs — their own thread and executor
+        if not options['once']:
+            threading.Thread(target=JobRunner(JOB_CONCURRENCY).run_forever, daemon=True).start()
+            self.stdout.write(f'Job runner started ({JOB_CONCURRENCY} at a time)')
+
+        # VM state push — the SSE streams, served from here
+        if not options['once']:
+            threading.Thread(target=serve_vm_push, daemon=True).start()
+            self.stdout.write(f'VM push started (port {VM_PUSH_PORT})')
+
+        sampler = CadvisorSampler()
         lastDiskRun = 0.0        # monotonic; 0 → first pass sweeps immediately
+        lastFullPass = 0.0       # monotonic; 0 → first pass is a full one
+        lastCheckpoint = time.monotonic()
+        lastUsageFlush = time.monotonic()
+        lastRateLimitRun = 0.0   # monotonic; 0 → first pass checks immediately
         diskThread = None
+        rateLimitThread = None
+
+        eventQueue = queue.Queue()
+        if eventsMode:
+            threading.Thread(target=consume_events, args=(eventQueue,), daemon=True).start()
 
         while True:
             if not options['once']:
                 time.sleep(3)
 
-            # Update host docker info
-            try:
-                json_obj = json.loads(docker_controller.get_status('host').text)
-                push_docker_info_to_db(json_obj, parentServerID=0)
-
-
-                # Update users docker info — every running dind
-                virtualServerHostnames = list(
-                    DockerContainer.objects
-                    .filter(parent_server_id=0, names__startswith=DIND_PREFIX, state='running')
-                    .values_list('names', flat=True)
-                )
-
-                for virtualServerHostname in virtualServerHostnames:
-                    try:
-                        json_obj = json.loads(docker_controller.get_status(virtualServerHostname).text)
-                        push_docker_info_to_db(json_obj, parentServerID=int(virtualServerHostname.replace(DIND_PREFIX, '')))
-                    except Exception as e:
-                        self.stdout.write(f'Docker Info Updater Error: {e}, container: {virtualServerHostname}')
-                        self.stdout.flush()
-
-
-            except Exception as e:
-                self.stdout.write(f'Docker Info Updater Error: {e}')
-                self.stdout.flush()
+            # Container cache — deltas first (events mode), then
+            # the full pass when it is due
+            resyncRequested = self.apply_pending_events(eventQueue) if eventsMode else False
+            if not eventsMode or resyncRequested or time.monotonic() - lastFullPass >= RECONCILE_SECONDS:
+                lastFullPass = time.monotonic()
+                self.sync_all_containers()
 
 
             # Clean up old docker containers — guarded on its
             # own: a transient "database is locked" here must
             # degrade to a skipped sweep, not kill the monitor
             try:
-                DockerContainer.objects.filter(synced_at__lt=timezone.now() - timedelta(minutes=5)).delete()
+                sweptCount, _ = DockerContainer.objects.filter(synced_at__lt=timezone.now() - timedelta(minutes=5)).delete()
+                if sweptCount:
+                    forget_snapshots()
             except Exception as e:
                 self.stdout.write(f'Docker Info Updater Error: {e}')
                 self.stdout.flush()
 
 
-            # Per-VM CPU/RAM from cAdvisor — one call per pass;
-            # stopped VMs get their numbers cleared inside
+            # cAdvisor, sampled once per pass for everyone: per-VM
+            # CPU/RAM into VmUsage (stopped VMs get their numbers
+            # cleared inside) and the usage history; the host into
+            # the history and the dashboard's feed. A failed
+            # sample is published too — the dashboard reports it
             try:
-                if numCores is None:
-                    machine = requests.get(f'http://{CADVISOR_HOST}:{CADVISOR_PORT}/api/v1.3/machine', timeout=5).json()
-                    numCores = machine.get('num_cores') or 1
-                dockerPayload = requests.get(f'http://{CADVISOR_HOST}:{CADVISOR_PORT}/api/v1.3/docker', timeout=5).json()
-                update_vm_usage(parse_cadvisor_docker(dockerPayload, numCores))
+                usageByVm, hostFigures = sampler.sample()
+                update_vm_usage(usageByVm)
+                for vmId, stats in usageByVm.items():
+                    USAGE_HISTORY.record(vmId, stats['cpu_percent'], stats['memory_mb'])
+                if hostFigures is not None:
+                    USAGE_HISTORY.record(
+                        HOST_SERIES_ID, hostFigures['cpu_percent'],
+                        hostFigures['memory_bytes'] // 1048576, hostFigures['disk_bytes'] // 1048576,
+                    )
+                    publish_feed(FEED_CADVISOR, {'system': system_figures(hostFigures)})
+                else:
+                    publish_feed(FEED_CADVISOR, {'error': 'nostats'})
             except Exception as e:
                 self.stdout.write(f'VM Usage Updater Error: {e}')
                 self.stdout.flush()
+                try:
+                    publish_feed(FEED_CADVISOR, {'error': cadvisor_error_kind(e)})
+                except Exception:
+                    pass
+
+
+            # Usage history — the buffered passes written, rolled
+            # up and pruned in one transaction; a failure keeps
+            # them buffered for the next try
+            if time.monotonic() - lastUsageFlush >= USAGE_FLUSH_SECONDS:
+                lastUsageFlush = time.monotonic()
+                try:
+                    flushed = USAGE_HISTORY.flush()
+                    if self.verbosity >= 2:
+                        self.stdout.write(f'Usage History: {flushed["written"]} samples, {flushed["rolled"]} rolled up, {flushed["pruned"]} pruned')
+                except Exception as e:
+                    self.stdout.write(f'Usage History Error: {e}')
+                self.stdout.flush()
 
 
-            # Disk sweep every ~5 minutes, in its own thread —
-            # the du must never stall the 3-second sync. The
+            # Disk sweep every ~30 seconds, in its own thread —
+            # a full walk must never stall the 3-second sync. The
             # is_alive guard prevents overlapping sweeps.
             if time.monotonic() - lastDiskRun >= DISK_REFRESH_SECONDS and (diskThread is None or not diskThread.is_alive()):
                 lastDiskRun = time.monotonic()
                 diskThread = threading.Thread(target=refresh_disk_usage, daemon=True)
                 diskThread.start()
 
+
+            # Docker Hub pull budget for the dashboard, on the same
+            # kind of guarded thread — the check goes out through
+            # the exit proxy and can take two 2 s timeouts
+            if time.monotonic() - lastRateLimitRun >= RATE_LIMIT_REFRESH_SECONDS and (rateLimitThread is None or not rateLimitThread.is_alive()):
+                lastRateLimitRun = time.monotonic()
+                rateLimitThread = threading.Thread(target=refresh_rate_limit, daemon=True)
+                rateLimitThread.start()
+
+
+            # The VM list snapshot — rebuilt from what this pass
+            # wrote; the version only moves when a card changed.
+            # The open streams get the per-VM differences
+            try:
+                _, snapshotEntries = refresh_snapshot()
+                VM_PUSH_HUB.publish(snapshotEntries)
+            except Exception as e:
+                self.stdout.write(f'VM Snapshot Error: {e}')
+                self.stdout.flush()
+
+            # WAL checkpoint — a pinned remainder is reported at
+            # --verbosity 2; it is picked up by the next run
+            if time.monotonic() - lastCheckpoint >= WAL_CHECKPOINT_SECONDS:
+                lastCheckpoint = time.monotonic()
+                try:
+                    _, logPages, checkpointedPages = checkpoint_wal()
+                    if checkpointedPages < logPages and self.verbosity >= 2:
+                        self.stdout.write(f'WAL Checkpoint: {checkpointedPages} of {logPages} pages (readers active)')
+                except Exception as e:
+                    self.stdout.write(f'WAL Checkpoint Error: {e}')
+                self.stdout.flush()
+
             if options['once']:
                 self.stdout.write(self.style.SUCCESS('Single pass done'))
                 break
+
+
+    ############################################################
+    # sync_all_containers
+    ############################################################
+    #
+    # The full pass: host `docker ps`, then every running
+    # dind's in one sidecar batch (fetch_vm_statuses_batch) —
+    # or, if the batch itself fails, fetched concurrently from
+    # here (fetch_vm_statuses) — written one by one. One VM
+    # failing or hanging never stops the others. The pass stats are
+    # logged whenever a VM timed out or failed, and on every
+    # pass at --verbosity 2.
+    ############################################################
+
+    def sync_all_containers(self):
+        try:
+            json_obj = json.loads(docker_controller.get_status('host').text)
+            push_docker_info_to_db(json_obj, parentServerID=0)
+
+
+            # Update users docker info — every running dind
+            virtualServerHostnames = list(
+                DockerContainer.objects
+                .filter(parent_server_id=0, names__startswith=DIND_PREFIX, state='running')
+                .values_list('names', flat=True)
+            )
+
+            passStarted = time.monotonic()
+            try:
+                fetched = fetch_vm_statuses_batch(virtualServerHostnames)
+            except Exception as e:
+                self.stdout.write(f'Docker Info Batch Error: {e}, falling back to per-VM requests')
+                self.stdout.flush()
+                fetched = fetch_vm_statuses(self.executor, virtualServerHostnames)
+
+            results = []
+            for result in fetched:
+                results.append(result)
+                virtualServerHostname, json_obj, _, outcome = result
+                if json_obj is None:
+                    continue
+                try:
+                    push_docker_info_to_db(json_obj, parentServerID=int(virtualServerHostname.replace(DIND_PREFIX, '')))
+                except Exception as e:
+                    self.stdout.write(f'Docker Info Updater Error: {e}, container: {virtualServerHostname}')
+                    self.stdout.flush()
+
+            stats = summarize_fetches(results)
+            if stats['timed_out'] or stats['failed'] or self.verbosity >= 2:
+                self.stdout.write(
+                    f'Docker Info Pass: {stats["vms"]} VMs in {(time.monotonic() - passStarted) * 1000:.0f} ms, '
+                    f'p50 {stats["p50_ms"]} ms, p99 {stats["p99_ms"]} ms, '
+                    f'timed out: {", ".join(stats["timed_out"]) or "-"}, failed: {", ".join(stats["failed"]) or "-"}, '
+                    f'connections opened {pool_stats()["opened"]} / reused {pool_stats()["reused"]} since start'
+                )
+                for virtualServerHostname, _, _, outcome in results:
+                    if outcome.startswith('error'):
+                        self.stdout.write(f'Docker Info Updater Error: {outcome[7:]}, container: {virtualServerHostname}')
+                self.stdout.flush()
+            self.lastPassStats = stats
+
+
+        except Exception as e:
+            self.stdout.write(f'Docker Info Updater Error: {e}')
+            self.stdout.flush()
+
+
+    ############################################################
+    # apply_pending_events
+    ############################################################
+    #
+    # Drain whatever the consumer thread queued since the last
+    # tick and apply it, in arrival order. Returns True when a
+    # resync marker was among them — the caller then runs a
+    # full pass right away.
+    ############################################################
+
+    def apply_pending_events(self, eventQueue):
+        resyncRequested = False
+
+        while True:
+            try:
+                delta = eventQueue.get_nowait()
+            except queue.Empty:
+                return resyncRequested
+
+            if delta.get('action') == 'resync':
+                resyncRequested = True
+                continue
+
+            try:
+                apply_container_event(delta)
+            except Exception as e:
+                self.stdout.write(f'Docker Event Updater Error: {e}')
+                self.stdout.flush()
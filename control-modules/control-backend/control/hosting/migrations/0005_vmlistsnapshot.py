@@ -0,0 +1,31 @@
+############################################################
+#  [*] VmListSnapshot — the materialized /api/vm payload
+#
+#  One row: the pre-encoded cards, a content version for
+#  ETags, and the dirty/built generations that let request-
+#  side mutations invalidate it.
+############################################################
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hosting', '0004_backgroundjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VmListSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.BigIntegerField(default=0)),
+                ('dirty_generation', models.BigIntegerField(default=0)),
+                ('built_generation', models.BigIntegerField(default=0)),
+                ('payload_hash', models.CharField(default='', max_length=64)),
+                ('payload', models.TextField(default='[]')),
+                ('built_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
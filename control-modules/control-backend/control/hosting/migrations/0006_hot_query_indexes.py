@@ -0,0 +1,43 @@
+############################################################
+#  [*] Hot-query indexes — the monitor's passes, owners' VMs
+#
+#  DockerContainer: (parent_server, names) replaces the FK's
+#  own parent_server index, (synced_at) serves the sweep.
+#  VirtualServer: (owner, deleted) replaces the owner index.
+############################################################
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hosting', '0005_vmlistsnapshot'),
+        ('users', '0002_systemuser_session_epoch'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='dockercontainer',
+            name='parent_server',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='containers', to='hosting.virtualserver'),
+        ),
+        migrations.AlterField(
+            model_name='virtualserver',
+            name='owner',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='virtual_servers', to='users.systemuser'),
+        ),
+        migrations.AddIndex(
+            model_name='dockercontainer',
+            index=models.Index(fields=['parent_server', 'names'], name='dockercontainer_parent_names'),
+        ),
+        migrations.AddIndex(
+            model_name='dockercontainer',
+            index=models.Index(fields=['synced_at'], name='dockercontainer_synced_at'),
+        ),
+        migrations.AddIndex(
+            model_name='virtualserver',
+            index=models.Index(fields=['owner', 'deleted'], name='virtualserver_owner_deleted'),
+        ),
+    ]
@@ -0,0 +1,84 @@
+############################################################
+#  [*] Structured container columns — labels, ports, networks
+#
+#  DockerContainer.labels becomes a JSON object plus the
+#  stack_name column; ports and networks move to child rows.
+#  The table is a cache the monitor refills within one pass,
+#  so it is emptied first instead of parsing the old strings.
+############################################################
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def clear_container_cache(apps, schema_editor):
+    apps.get_model('hosting', 'DockerContainer').objects.all().delete()
+
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hosting', '0006_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_container_cache, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='DockerContainerNetwork',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(db_index=True, max_length=255)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DockerContainerPort',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('host_ip', models.CharField(default='', max_length=64)),
+                ('public_port', models.PositiveIntegerField(blank=True, null=True)),
+                ('private_port', models.PositiveIntegerField()),
+                ('protocol', models.CharField(default='tcp', max_length=8)),
+            ],
+        ),
+        migrations.RemoveField(
+            model_name='dockercontainer',
+            name='networks',
+        ),
+        migrations.RemoveField(
+            model_name='dockercontainer',
+            name='ports',
+        ),
+        migrations.AddField(
+            model_name='dockercontainer',
+            name='stack_name',
+            field=models.CharField(default='', max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='dockercontainer',
+            name='labels',
+            field=models.JSONField(default=dict),
+        ),
+        migrations.AddIndex(
+            model_name='dockercontainer',
+            index=models.Index(fields=['parent_server', 'stack_name'], name='dockercontainer_parent_stack'),
+        ),
+        migrations.AddField(
+            model_name='dockercontainernetwork',
+            name='container',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='network_list', to='hosting.dockercontainer'),
+        ),
+        migrations.AddField(
+            model_name='dockercontainerport',
+            name='container',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='port_list', to='hosting.dockercontainer'),
+        ),
+        migrations.AddIndex(
+            model_name='dockercontainerport',
+            index=models.Index(fields=['public_port'], name='containerport_public'),
+        ),
+        migrations.AddIndex(
+            model_name='dockercontainerport',
+            index=models.Index(fields=['private_port'], name='containerport_private'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+############################################################
+#  [*] Usage history — UsageSample
+#
+#  One row per VM (0 = the host) per 3 s / 1 min / 1 h
+#  bucket, written by the monitor's usage history.
+############################################################
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hosting', '0007_structured_container_columns'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UsageSample',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.PositiveIntegerField()),
+                ('bucket_start', models.DateTimeField()),
+                ('cpu_percent', models.FloatField(blank=True, null=True)),
+                ('cpu_max_percent', models.FloatField(blank=True, null=True)),
+                ('memory_mb', models.IntegerField(blank=True, null=True)),
+                ('disk_mb', models.IntegerField(blank=True, null=True)),
+                ('virtual_server', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='usage_samples', to='hosting.virtualserver')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['resolution', 'bucket_start'], name='usagesample_retention')],
+                'constraints': [models.UniqueConstraint(fields=('virtual_server', 'resolution', 'bucket_start'), name='unique_usage_bucket')],
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+############################################################
+#  [*] Monitor feeds — MonitorFeed
+#
+#  One row per feed the monitor publishes for the workers
+#  (the first: the cAdvisor host figures).
+############################################################
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hosting', '0008_usagesample'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonitorFeed',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=32, unique=True)),
+                ('payload', models.JSONField(default=dict)),
+                ('refreshed_at', models.DateTimeField()),
+            ],
+        ),
+    ]
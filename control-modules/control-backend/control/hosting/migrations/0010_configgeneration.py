@@ -0,0 +1,26 @@
+############################################################
+#  [*] Config generations — ConfigGeneration
+#
+#  The sidecar generation each delta-updated config was last
+#  applied at (the first: the users Caddy's domain table).
+############################################################
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hosting', '0009_monitorfeed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConfigGeneration',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=32, unique=True)),
+                ('generation', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+    ]
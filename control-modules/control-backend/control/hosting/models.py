@@ -45,6 +45,11 @@ DIND_PREFIX = 'hosting-users-dind-'
 # .update() call sites set updated_at explicitly (auto_now
 # does not fire on .update()).
 #
+# (owner, deleted) serves "this owner's [live] VMs" — the
+# users grid's delete guard, the owner's SET_NULL on account
+# delete — and replaces the plain FK index on owner. Live
+# VMs of everyone are nearly the whole table: a scan.
+#
 # Used by:
 #   - vm_views — list/control; dns_views — ownership
 #   - monitor_containers — adopts discovered containers
@@ -53,13 +58,20 @@ DIND_PREFIX = 'hosting-users-dind-'
 class VirtualServer(models.Model):
 
     # Columns
-    owner = models.ForeignKey(SystemUser, null=True, blank=True, on_delete=models.SET_NULL, related_name='virtual_servers')
+    owner = models.ForeignKey(SystemUser, null=True, blank=True, on_delete=models.SET_NULL, related_name='virtual_servers',
+                              db_index=False)
     name = models.CharField(max_length=255, default='')
     enabled = models.BooleanField(default=True)
     deleted = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Indexes — an owner's (live) VMs
+    class Meta:
+        indexes = [
+            models.Index(fields=['owner', 'deleted'], name='virtualserver_owner_deleted'),
+        ]
+
     # String representation
     def __str__(self):
         return f'#{self.id} {self.name}'
@@ -79,10 +91,26 @@ class VirtualServer(models.Model):
 # under the reserved HOST row (parent_server 0), each VM's
 # containers under its row. Rewritten continuously by
 # monitor_containers; synced_at is the monitor's bookkeeping
-# timestamp (rows not seen for 5 minutes are swept). All
-# docker columns are CLI-style display strings rendered
-# verbatim by the UI — including created_at, which is
-# docker's own text, not a DateTimeField on purpose.
+# timestamp (rows not seen for 5 minutes are swept). The
+# display columns are CLI-style strings rendered verbatim by
+# the UI — including created_at, which is docker's own text,
+# not a DateTimeField on purpose.
+#
+# The three `docker ps` strings anything queries are stored
+# structured instead: labels as a JSON object, with the
+# compose project pulled out into stack_name at write time;
+# ports and networks as child rows (DockerContainerPort /
+# DockerContainerNetwork). labels_text / ports_text /
+# networks_text give the CLI strings back (prefetch
+# port_list / network_list when rendering many rows).
+#
+# Indexes, for the monitor's every-pass queries:
+#   (parent_server, names) — a parent's rows (the per-parent
+#       delete and synced_at refresh) and the host's dind
+#       rows; it replaces the plain FK index on parent_server
+#   (synced_at) — the global 5-minute sweep
+#   (parent_server, stack_name) — the VM list's stacks,
+#       already grouped
 #
 # Used by:
 #   - monitor_containers — the only writer
@@ -92,27 +120,44 @@ class VirtualServer(models.Model):
 class DockerContainer(models.Model):
 
     # Columns
-    parent_server = models.ForeignKey(VirtualServer, on_delete=models.CASCADE, related_name='containers')
+    parent_server = models.ForeignKey(VirtualServer, on_delete=models.CASCADE, related_name='containers', db_index=False)
     docker_id = models.CharField(max_length=255)
     command = models.TextField()
     created_at = models.TextField()
     image = models.TextField()
-    labels = models.TextField()
+    labels = models.JSONField(default=dict)
+    stack_name = models.CharField(max_length=255, default='')
     mounts = models.TextField()
     names = models.TextField()
-    networks = models.TextField()
-    ports = models.TextField()
     running_for = models.TextField()
     size = models.TextField()
     state = models.TextField()
     status = models.TextField()
     synced_at = models.DateTimeField()
 
-    # Constraints
+    # Constraints and indexes
     class Meta:
         constraints = [
             models.UniqueConstraint(fields=['docker_id', 'parent_server'], name='unique_dockerid_parent'),
         ]
+        indexes = [
+            models.Index(fields=['parent_server', 'names'], name='dockercontainer_parent_names'),
+            models.Index(fields=['synced_at'], name='dockercontainer_synced_at'),
+            models.Index(fields=['parent_server', 'stack_name'], name='dockercontainer_parent_stack'),
+        ]
+
+    # The `docker ps` strings
+    @property
+    def labels_text(self):
+        return ','.join(f'{key}={value}' for key, value in self.labels.items())
+
+    @property
+    def ports_text(self):
+        return ', '.join(thisPort.text for thisPort in sorted(self.port_list.all(), key=lambda thisPort: thisPort.id))
+
+    @property
+    def networks_text(self):
+        return ','.join(thisNetwork.name for thisNetwork in sorted(self.network_list.all(), key=lambda thisNetwork: thisNetwork.id))
 
     # String representation
     def __str__(self):
@@ -125,6 +170,71 @@ class DockerContainer(models.Model):
 
 
 
+############################################################
+# DockerContainerPort / DockerContainerNetwork
+############################################################
+#
+# One port / one network of a cached container, in the
+# order docker lists them (id order). A port is published
+# when public_port is set — host_ip is then "0.0.0.0", "::"
+# or a specific address ('' when docker did not say). Both
+# die with their container row.
+#
+# Used by:
+#   - monitor_containers — rewritten with their container
+#   - DockerContainer.ports_text / networks_text
+############################################################
+
+class DockerContainerPort(models.Model):
+
+    # Columns
+    container = models.ForeignKey(DockerContainer, on_delete=models.CASCADE, related_name='port_list')
+    host_ip = models.CharField(max_length=64, default='')
+    public_port = models.PositiveIntegerField(null=True, blank=True)
+    private_port = models.PositiveIntegerField()
+    protocol = models.CharField(max_length=8, default='tcp')
+
+    # Indexes — "who publishes / listens on port N"
+    class Meta:
+        indexes = [
+            models.Index(fields=['public_port'], name='containerport_public'),
+            models.Index(fields=['private_port'], name='containerport_private'),
+        ]
+
+    # The CLI notation (the sidecar's: [::] bracketed)
+    @property
+    def text(self):
+        if self.public_port is None:
+            return f'{self.private_port}/{self.protocol}'
+        if self.host_ip == '::':
+            return f'[::]:{self.public_port}->{self.private_port}/{self.protocol}'
+        if self.host_ip == '0.0.0.0':
+            return f'0.0.0.0:{self.public_port}->{self.private_port}/{self.protocol}'
+        return f'{self.public_port}->{self.private_port}/{self.protocol}'
+
+    # String representation
+    def __str__(self):
+        return self.text
+
+
+
+class DockerContainerNetwork(models.Model):
+
+    # Columns
+    container = models.ForeignKey(DockerContainer, on_delete=models.CASCADE, related_name='network_list')
+    name = models.CharField(max_length=255, db_index=True)
+
+    # String representation
+    def __str__(self):
+        return self.name
+
+
+
+
+
+
+
+
 ############################################################
 # DomainName
 ############################################################
@@ -203,8 +313,8 @@ class PortForward(models.Model):
 # One VM's live resource telemetry — a OneToOne beside the
 # registry row, written only by monitor_containers: CPU/RAM
 # from cAdvisor every 3-second pass (cleared to NULL while
-# the VM is not running), disk from the sidecar's du sweep
-# every ~5 minutes. All fields nullable — NULL means "not
+# the VM is not running), disk from the sidecar's disk sweep
+# every ~30 seconds. All fields nullable — NULL means "not
 # measured (yet)". memory_mb is the working set; disk_mb is
 # the SERVERS/<id> tree (apps + the inner docker data).
 #
@@ -226,3 +336,222 @@ class VmUsage(models.Model):
     # String representation
     def __str__(self):
         return f'usage of #{self.virtual_server_id}'
+
+
+
+
+
+
+
+
+
+############################################################
+# UsageSample
+############################################################
+#
+# The usage HISTORY: one row per VM per time bucket, at
+# three resolutions (seconds) — 3 (every monitor pass), 60
+# and 3600, the coarser ones rolled up from the finer.
+# Append-only: the monitor inserts closed buckets and prunes
+# whole buckets past their retention; nothing is ever
+# updated. virtual_server 0 (the HOST row) is the host
+# itself.
+#
+# cpu_percent / memory_mb are the bucket means, cpu_max_percent
+# the highest pass inside it, disk_mb the latest measurement.
+# All nullable like VmUsage — NULL is "not measured".
+#
+# The unique constraint is also the index of the API's
+# range reads; (resolution, bucket_start) serves the
+# retention delete.
+#
+# Used by:
+#   - usage_history — the only writer, and the readers
+############################################################
+
+class UsageSample(models.Model):
+
+    # Columns
+    virtual_server = models.ForeignKey(VirtualServer, on_delete=models.CASCADE, related_name='usage_samples', db_index=False)
+    resolution = models.PositiveIntegerField()
+    bucket_start = models.DateTimeField()
+    cpu_percent = models.FloatField(null=True, blank=True)
+    cpu_max_percent = models.FloatField(null=True, blank=True)
+    memory_mb = models.IntegerField(null=True, blank=True)
+    disk_mb = models.IntegerField(null=True, blank=True)
+
+    # Constraints and indexes
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['virtual_server', 'resolution', 'bucket_start'], name='unique_usage_bucket'),
+        ]
+        indexes = [
+            models.Index(fields=['resolution', 'bucket_start'], name='usagesample_retention'),
+        ]
+
+    # String representation
+    def __str__(self):
+        return f'usage of #{self.virtual_server_id} at {self.bucket_start} ({self.resolution} s)'
+
+
+
+
+
+
+
+
+############################################################
+# BackgroundJob
+############################################################
+#
+# One unit of slow physical work (a VM build, a teardown, a
+# bulk lifecycle run) — queued by the request that wants it,
+# executed by the monitor's job runner. The request only
+# inserts the row; no request worker ever waits on the
+# sidecar for these.
+#
+# state: queued → running → succeeded | failed. A transient
+# failure (sidecar unreachable) puts a running job back to
+# queued with run_after pushed out by an exponential backoff,
+# until attempts reaches max_attempts. payload is the kind's
+# input; result is its output — and, while a bulk job runs,
+# its live per-VM progress.
+#
+# Used by:
+#   - hosting/jobs — the only writer after the insert
+#   - vm_views / bulk_views — enqueue
+#   - job_views — the status API
+############################################################
+
+class BackgroundJob(models.Model):
+
+    # Columns
+    kind = models.CharField(max_length=32)
+    payload = models.JSONField(default=dict)
+    state = models.CharField(max_length=16, default='queued')
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=3)
+    run_after = models.DateTimeField()
+    last_error = models.TextField(default='')
+    result = models.JSONField(null=True, blank=True)
+    created_by = models.ForeignKey(SystemUser, null=True, blank=True, on_delete=models.SET_NULL, related_name='background_jobs')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    # Indexes — the runner's "next due job" lookup
+    class Meta:
+        indexes = [
+            models.Index(fields=['state', 'run_after'], name='backgroundjob_state_due'),
+        ]
+
+    # String representation
+    def __str__(self):
+        return f'{self.kind} #{self.id} ({self.state})'
+
+
+
+
+
+
+
+
+############################################################
+# VmListSnapshot
+############################################################
+#
+# The materialized GET /api/vm payload — ONE row (id 1)
+# holding every live VM's card, pre-encoded, plus owner ids
+# for the per-user filter. version increases by one every
+# time the content changes; it is the ETag's core.
+#
+# dirty_generation is bumped by every request-side mutation
+# (mark_stale, in the mutation's own transaction);
+# built_generation is the dirty_generation the payload was
+# built at. dirty > built means the payload may be stale and
+# the next reader rebuilds it first.
+#
+# Used by:
+#   - hosting/vm_snapshot — the only reader/writer
+############################################################
+
+class VmListSnapshot(models.Model):
+
+    # Columns
+    version = models.BigIntegerField(default=0)
+    dirty_generation = models.BigIntegerField(default=0)
+    built_generation = models.BigIntegerField(default=0)
+    payload_hash = models.CharField(max_length=64, default='')
+    payload = models.TextField(default='[]')
+    built_at = models.DateTimeField(null=True, blank=True)
+
+    # String representation
+    def __str__(self):
+        return f'vm list snapshot v{self.version}'
+
+
+
+
+
+
+
+
+############################################################
+# MonitorFeed
+############################################################
+#
+# What the monitor measures on its own schedule for the
+# request workers to read — one row per feed name, the
+# latest payload (a JSON object) and when it was refreshed.
+# The readers never call the measured service themselves,
+# so its load does not grow with the number of workers or
+# open dashboards.
+#
+# Used by:
+#   - hosting/monitor_feeds — the only reader/writer
+############################################################
+
+class MonitorFeed(models.Model):
+
+    # Columns
+    name = models.CharField(max_length=32, unique=True)
+    payload = models.JSONField(default=dict)
+    refreshed_at = models.DateTimeField()
+
+    # String representation
+    def __str__(self):
+        return f'{self.name} feed'
+
+
+
+
+
+
+
+
+############################################################
+# ConfigGeneration
+############################################################
+#
+# The revision of a generated table — one row per target
+# ('caddy', 'portforwarder'), bumped by every change in the
+# change's own transaction, so revisions follow the commit
+# order and a rollback takes the bump back. Every push
+# carries one; the sidecar's generation is the revision it
+# has applied. No row is revision 0.
+#
+# Used by:
+#   - docker_controller.next_config_revision /
+#     config_revision — the only reader/writer
+############################################################
+
+class ConfigGeneration(models.Model):
+
+    # Columns
+    name = models.CharField(max_length=32, unique=True)
+    generation = models.PositiveBigIntegerField(default=0)
+
+    # String representation
+    def __str__(self):
+        return f'{self.name} generation {self.generation}'
@@ -0,0 +1,56 @@
+############################################################
+#  [*] Monitor feeds — figures the monitor publishes
+#
+#  The monitor process measures external services on its own
+#  schedule and stores the latest result as a MonitorFeed
+#  row; the gunicorn workers only read that row. One writer,
+#  one single-row read per request, and the service is asked
+#  once per interval no matter how many workers or admins
+#  are polling.
+#
+#    publish_feed(name, payload) — one upsert statement
+#    read_feed(name, maxAgeSeconds)
+#                 — (payload, age in seconds); (None, None)
+#                   when the feed was never published, and
+#                   the payload is None when it is older than
+#                   maxAgeSeconds (the monitor is not running)
+#
+#  Used by:
+#    - monitor_containers — publishes every pass
+#    - dashboard_views — /api/dashboard/system reads
+############################################################
+
+from django.utils import timezone
+
+from control.hosting.models import MonitorFeed
+
+
+
+
+
+
+
+
+############################################################
+# publish_feed / read_feed
+############################################################
+
+def publish_feed(name, payload):
+    MonitorFeed.objects.bulk_create(
+        [MonitorFeed(name=name, payload=payload, refreshed_at=timezone.now())],
+        update_conflicts=True,
+        unique_fields=['name'],
+        update_fields=['payload', 'refreshed_at'],
+    )
+
+
+
+def read_feed(name, maxAgeSeconds):
+    row = MonitorFeed.objects.filter(name=name).values('payload', 'refreshed_at').first()
+    if row is None:
+        return None, None
+
+    age = (timezone.now() - row['refreshed_at']).total_seconds()
+    if age > maxAgeSeconds:
+        return None, age
+    return row['payload'], age
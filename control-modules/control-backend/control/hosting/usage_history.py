@@ -0,0 +1,364 @@
+############################################################
+#  [*] Usage history — CPU/RAM/disk over time, VMs and host
+#
+#  VmUsage only ever holds the LATEST numbers, so "which VM
+#  has been eating the CPU all afternoon" or "how full did
+#  the host get last week" had no answer short of running a
+#  Prometheus stack next to the platform. This keeps a
+#  compact history in the database itself:
+#
+#    record — the monitor hands over every pass's figures
+#      (per VM from cAdvisor's /docker, the host from its
+#      root container). They go into a fixed-size ring
+#      buffer per VM, in memory — bounded, so a database
+#      that cannot be written for a while costs at most
+#      USAGE_BUFFER_SAMPLES per VM, the oldest dropped first.
+#
+#    flush — every USAGE_FLUSH_SECONDS, in one transaction:
+#      the buffered passes become 3 s UsageSample rows (one
+#      multi-row INSERT), every 1-minute bucket that closed
+#      since is rolled up from them and every closed hour
+#      from the minutes — both from the DATABASE, so a
+#      monitor restart resumes where the last one stopped —
+#      and buckets past USAGE_RETENTION are deleted.
+#
+#    load_series / top_consumers — the readers: one VM's (or
+#      the host's) series over a USAGE_RANGES window, read at
+#      the finest resolution still retained for it and
+#      averaged down to at most USAGE_MAX_POINTS points; and
+#      the VMs with the highest mean CPU over the window.
+#
+#  The host is series 0 — the reserved HOST row, like the
+#  containers cache's parent 0.
+#
+#  Used by:
+#    - monitor_containers — USAGE_HISTORY.record every pass,
+#      record_disk from the disk sweep, flush
+#    - usage_views — /api/vm/usage/<id>
+#    - dashboard_views — /api/dashboard/usage
+############################################################
+
+import math
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+
+from django.db import transaction
+from django.db.models import Avg, Max, Min
+from django.utils import timezone
+
+from control.common.auth import format_datetime
+from control.hosting.models import UsageSample, VirtualServer
+
+
+HOST_SERIES_ID = 0
+
+# Bucket sizes in seconds, finest first — each one is rolled
+# up from the one before it
+USAGE_RESOLUTIONS = [3, 60, 3600]
+
+USAGE_RETENTION = {
+    3: timedelta(hours=2),
+    60: timedelta(days=2),
+    3600: timedelta(days=90),
+}
+
+USAGE_FLUSH_SECONDS = 30
+
+# Passes kept per VM between flushes — half an hour of 3 s
+# passes before the oldest are dropped
+USAGE_BUFFER_SAMPLES = 600
+
+# The windows the API serves, and its points per series
+USAGE_RANGES = {
+    '1h': timedelta(hours=1),
+    '6h': timedelta(hours=6),
+    '1d': timedelta(days=1),
+    '7d': timedelta(days=7),
+    '30d': timedelta(days=30),
+    '90d': timedelta(days=90),
+}
+USAGE_MAX_POINTS = 300
+
+
+
+
+
+
+
+
+############################################################
+# bucket_floor
+############################################################
+#
+# The start of the bucket of the given size holding moment
+# — buckets are aligned to the Unix epoch, so every process
+# and every resolution agrees on the boundaries.
+############################################################
+
+def bucket_floor(moment, seconds):
+    epochSeconds = int(moment.timestamp()) // seconds * seconds
+    return datetime.fromtimestamp(epochSeconds, tz=dt_timezone.utc)
+
+
+
+
+
+
+
+
+############################################################
+# UsageHistory
+############################################################
+#
+# The monitor's side: per-VM ring buffers of
+# (bucket start, cpu %, memory MB, disk MB), filled by
+# record on the main loop and record_disk on the disk
+# sweep's thread, emptied by flush. A failed flush puts its
+# passes back (still bounded) and re-raises.
+#
+#   record(vmId, cpuPercent, memoryMb, diskMb=None)
+#                      — one pass; disk is the latest one
+#                        seen for the VM unless given
+#   record_disk(vmId, diskMb)
+#   flush(now)         — returns {written, rolled, pruned}
+############################################################
+
+class UsageHistory:
+
+    def __init__(self, bufferSamples=USAGE_BUFFER_SAMPLES):
+        self.lock = threading.Lock()
+        self.bufferSamples = bufferSamples
+        self.buffers = {}
+        self.latestDisk = {}
+
+
+    def record(self, vmId, cpuPercent, memoryMb, diskMb=None, moment=None):
+        bucketStart = bucket_floor(moment or timezone.now(), USAGE_RESOLUTIONS[0])
+        with self.lock:
+            if diskMb is not None:
+                self.latestDisk[vmId] = diskMb
+            buffer = self.buffers.get(vmId)
+            if buffer is None:
+                buffer = self.buffers[vmId] = deque(maxlen=self.bufferSamples)
+            buffer.append((bucketStart, cpuPercent, memoryMb, self.latestDisk.get(vmId)))
+
+
+    def record_disk(self, vmId, diskMb):
+        with self.lock:
+            self.latestDisk[vmId] = diskMb
+
+
+    def flush(self, now=None):
+        now = now or timezone.now()
+        with self.lock:
+            pending, self.buffers = self.buffers, {}
+
+        try:
+            with transaction.atomic():
+                knownIds = set(VirtualServer.objects.filter(id__in=list(pending)).values_list('id', flat=True))
+                rawRows = [
+                    UsageSample(
+                        virtual_server_id=vmId, resolution=USAGE_RESOLUTIONS[0], bucket_start=bucketStart,
+                        cpu_percent=cpuPercent, cpu_max_percent=cpuPercent, memory_mb=memoryMb, disk_mb=diskMb,
+                    )
+                    for vmId, buffer in pending.items() if vmId in knownIds
+                    for bucketStart, cpuPercent, memoryMb, diskMb in buffer
+                ]
+                UsageSample.objects.bulk_create(rawRows, ignore_conflicts=True)
+                rolled = roll_up(now)
+                pruned = prune(now)
+
+        except Exception:
+            with self.lock:
+                for vmId, buffer in pending.items():
+                    restored = deque(buffer, maxlen=self.bufferSamples)
+                    restored.extend(self.buffers.get(vmId, ()))
+                    self.buffers[vmId] = restored
+            raise
+
+        # Disk figures of VMs that stopped reporting are not
+        # carried forward forever
+        with self.lock:
+            for vmId in set(self.latestDisk) - set(pending) - set(self.buffers):
+                del self.latestDisk[vmId]
+
+        return {'written': len(rawRows), 'rolled': rolled, 'pruned': pruned}
+
+
+
+# The monitor's one history
+USAGE_HISTORY = UsageHistory()
+
+
+
+
+
+
+
+
+############################################################
+# roll_up / prune
+############################################################
+#
+# roll_up writes every CLOSED bucket of each coarser
+# resolution that does not exist yet, one grouped query per
+# bucket, from the rows one level finer: mean CPU and
+# memory, the highest CPU, the latest (largest) disk. It
+# resumes after the newest bucket already written — never
+# further back than the finer level is retained — and
+# skips empty buckets (the monitor was down). Returns the
+# number of rows written.
+#
+# prune deletes, per resolution, the buckets older than its
+# retention. Returns the number of rows deleted.
+############################################################
+
+def roll_up(now):
+    written = 0
+
+    for fine, coarse in zip(USAGE_RESOLUTIONS, USAGE_RESOLUTIONS[1:]):
+        end = bucket_floor(now, coarse)
+        newest = UsageSample.objects.filter(resolution=coarse).aggregate(newest=Max('bucket_start'))['newest']
+        if newest is not None:
+            start = newest + timedelta(seconds=coarse)
+        else:
+            oldestFine = UsageSample.objects.filter(resolution=fine).aggregate(oldest=Min('bucket_start'))['oldest']
+            if oldestFine is None:
+                continue
+            start = bucket_floor(oldestFine, coarse)
+        start = max(start, bucket_floor(now - USAGE_RETENTION[fine], coarse))
+
+        while start < end:
+            bucketEnd = start + timedelta(seconds=coarse)
+            grouped = (
+                UsageSample.objects.filter(resolution=fine, bucket_start__gte=start, bucket_start__lt=bucketEnd)
+                .values('virtual_server_id')
+                .annotate(cpu=Avg('cpu_percent'), cpuMax=Max('cpu_max_percent'), memory=Avg('memory_mb'), disk=Max('disk_mb'))
+            )
+            rows = [
+                UsageSample(
+                    virtual_server_id=thisGroup['virtual_server_id'], resolution=coarse, bucket_start=start,
+                    cpu_percent=round(thisGroup['cpu'], 2) if thisGroup['cpu'] is not None else None,
+                    cpu_max_percent=thisGroup['cpuMax'],
+                    memory_mb=round(thisGroup['memory']) if thisGroup['memory'] is not None else None,
+                    disk_mb=thisGroup['disk'],
+                )
+                for thisGroup in grouped
+            ]
+            UsageSample.objects.bulk_create(rows, ignore_conflicts=True)
+            written += len(rows)
+            start = bucketEnd
+
+    return written
+
+
+
+def prune(now):
+    pruned = 0
+    for resolution, retention in USAGE_RETENTION.items():
+        deleted, _ = UsageSample.objects.filter(resolution=resolution, bucket_start__lt=now - retention).delete()
+        pruned += deleted
+    return pruned
+
+
+
+
+
+
+
+
+############################################################
+# load_series / top_consumers
+############################################################
+#
+# load_series returns (seconds per point, points) for one
+# series over rangeName — points oldest first as
+# {time, cpu_percent, cpu_max_percent, memory_mb, disk_mb},
+# each the mean (max for cpu_max_percent, latest for disk)
+# of the stored buckets it covers; empty buckets are left
+# out rather than reported as zero.
+#
+# top_consumers returns the `limit` VMs with the highest
+# mean CPU over rangeName, with their peak and mean memory —
+# the noisy neighbours.
+############################################################
+
+def range_resolution(rangeName):
+    window = USAGE_RANGES[rangeName]
+    resolution = next(
+        (thisResolution for thisResolution in USAGE_RESOLUTIONS if USAGE_RETENTION[thisResolution] >= window),
+        USAGE_RESOLUTIONS[-1],
+    )
+    return window, resolution
+
+
+
+def load_series(virtualServerID, rangeName, now=None):
+    window, resolution = range_resolution(rangeName)
+    since = (now or timezone.now()) - window
+    step = max(1, math.ceil(window.total_seconds() / USAGE_MAX_POINTS / resolution)) * resolution
+
+    rows = (
+        UsageSample.objects.filter(virtual_server_id=virtualServerID, resolution=resolution, bucket_start__gte=since)
+        .order_by('bucket_start')
+        .values_list('bucket_start', 'cpu_percent', 'cpu_max_percent', 'memory_mb', 'disk_mb')
+    )
+
+    points = []
+    groupStart = None
+    for bucketStart, cpuPercent, cpuMaxPercent, memoryMb, diskMb in rows:
+        thisGroupStart = bucket_floor(bucketStart, step)
+        if thisGroupStart != groupStart:
+            groupStart = thisGroupStart
+            group = {'time': groupStart, 'cpu': [], 'cpuMax': [], 'memory': [], 'disk': None}
+            points.append(group)
+        if cpuPercent is not None:
+            group['cpu'].append(cpuPercent)
+        if cpuMaxPercent is not None:
+            group['cpuMax'].append(cpuMaxPercent)
+        if memoryMb is not None:
+            group['memory'].append(memoryMb)
+        if diskMb is not None:
+            group['disk'] = diskMb
+
+    return step, [
+        {
+            'time': format_datetime(group['time']),
+            'cpu_percent': round(sum(group['cpu']) / len(group['cpu']), 1) if group['cpu'] else None,
+            'cpu_max_percent': round(max(group['cpuMax']), 1) if group['cpuMax'] else None,
+            'memory_mb': round(sum(group['memory']) / len(group['memory'])) if group['memory'] else None,
+            'disk_mb': group['disk'],
+        }
+        for group in points
+    ]
+
+
+
+def top_consumers(rangeName, limit=5, now=None):
+    window, resolution = range_resolution(rangeName)
+    since = (now or timezone.now()) - window
+
+    ranked = list(
+        UsageSample.objects.filter(resolution=resolution, bucket_start__gte=since, cpu_percent__isnull=False)
+        .exclude(virtual_server_id=HOST_SERIES_ID)
+        .values('virtual_server_id')
+        .annotate(cpu=Avg('cpu_percent'), cpuMax=Max('cpu_max_percent'), memory=Avg('memory_mb'))
+        .order_by('-cpu', 'virtual_server_id')[:limit]
+    )
+    names = dict(
+        VirtualServer.objects.filter(id__in=[thisRow['virtual_server_id'] for thisRow in ranked])
+        .values_list('id', 'name')
+    )
+
+    return [
+        {
+            'id': thisRow['virtual_server_id'],
+            'name': names.get(thisRow['virtual_server_id']),
+            'cpu_percent': round(thisRow['cpu'], 1),
+            'cpu_max_percent': round(thisRow['cpuMax'], 1) if thisRow['cpuMax'] is not None else None,
+            'memory_mb': round(thisRow['memory']) if thisRow['memory'] is not None else None,
+        }
+        for thisRow in ranked
+    ]
@@ -0,0 +1,404 @@
+############################################################
+#  [*] VM push — Server-Sent Events instead of the 3 s poll
+#
+#    GET /api/vm/events                     — own VMs
+#    GET /api/vm/events?showOtherUsers=true — every VM (admin)
+#    GET /api/vm/events?virtualServerID=N   — one VM
+#
+#  Every open /vm tab used to GET /api/vm every 3 seconds —
+#  with a lab full of students that is over a hundred
+#  identical requests a second through gunicorn's 20 threads,
+#  whether anything changed or not. The stream turns that
+#  around: the load follows the CHANGE rate, not the number
+#  of open tabs.
+#
+#  Served by the MONITOR process, not by gunicorn: a stream
+#  holds its connection for as long as the tab is open, and
+#  twenty gthread slots cannot hold two hundred of them. The
+#  monitor already produces the changes — it rebuilds the VM
+#  list snapshot (hosting/vm_snapshot) every pass and hands
+#  the cards to the hub here, which diffs them per VM. Its
+#  own small threaded HTTP server (VM_PUSH_PORT, routed by
+#  control-caddy) parks each stream on the hub's condition
+#  until a change or a heartbeat is due. Request-side
+#  changes (create, rename, domains, ...) mark the snapshot
+#  stale and reach the streams with the monitor's next pass.
+#
+#  The protocol, one compact JSON document per event:
+#    event: snapshot    data: [card, ...]  — on connect, and
+#                       whenever the client fell too far
+#                       behind to resume
+#    event: vm          data: card         — added/changed
+#    event: vm-removed  data: {"id": N}    — gone, or no
+#                       longer visible to this client
+#  Event ids are "<boot>-<n>"; a reconnect's Last-Event-ID
+#  resumes with only the missed changes when they are still
+#  in the hub's history (VM_PUSH_HISTORY events).
+#
+#  Access is the /api/vm rules exactly, and it is checked
+#  again at every heartbeat: a logout, a disabled account or
+#  a lost admin flag ends the stream within
+#  VM_PUSH_HEARTBEAT_SECONDS.
+#
+#  Used by:
+#    - monitor_containers — VM_PUSH_HUB.publish every pass,
+#      serve_vm_push on a daemon thread
+#    - VirtualServersTable.jsx / VirtualServer.jsx — via
+#      useVmEvents; the 3 s poll is the fallback only
+############################################################
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from importlib import import_module
+from urllib.parse import parse_qs, urlsplit
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+from control.common.auth import check_user_is_allowed_to_access_vm, user_for_session
+
+
+VM_PUSH_PORT = int(os.environ.get('VM_PUSH_PORT', '8001'))
+
+# Streams open at once — beyond it a client gets 503 and
+# stays on the poll
+VM_PUSH_MAX_CLIENTS = int(os.environ.get('VM_PUSH_MAX_CLIENTS', '500'))
+
+# A comment line this often keeps proxies from idling the
+# connection out, and is when access is checked again
+VM_PUSH_HEARTBEAT_SECONDS = 15
+
+# Per-VM changes kept for Last-Event-ID resumption
+VM_PUSH_HISTORY = 1000
+
+
+
+
+
+
+
+
+############################################################
+# VmPushHub
+############################################################
+#
+# The current cards and the recent per-VM changes, shared by
+# the publishing monitor loop and every stream thread.
+#
+#   publish(entries)   — entries as vm_snapshot builds them,
+#                        [(vmId, ownerId, encoded card)]; one
+#                        change per card added, changed or
+#                        gone
+#   current()          — (last change id, entries)
+#   changes_after(id, timeout)
+#                      — waits until there is a change after
+#                        id (or the timeout), then returns the
+#                        list of (id, vmId, ownerId, card or
+#                        None); [] on timeout, None when the
+#                        history no longer reaches back to id
+#
+# Nothing is published until the first publish — streams
+# wait for it (ready) instead of sending an empty snapshot.
+############################################################
+
+class VmPushHub:
+
+    def __init__(self, history=VM_PUSH_HISTORY):
+        self.boot = str(int(time.time()))
+        self.condition = threading.Condition()
+        self.cards = {}
+        self.changes = deque(maxlen=history)
+        self.lastChangeId = 0
+        self.ready = False
+        self.clients = 0
+
+
+    def publish(self, entries):
+        newCards = {vmId: (ownerId, card) for vmId, ownerId, card in entries}
+        with self.condition:
+            for vmId, (ownerId, card) in newCards.items():
+                if self.cards.get(vmId) != (ownerId, card):
+                    self.lastChangeId += 1
+                    self.changes.append((self.lastChangeId, vmId, ownerId, card))
+            for vmId, (ownerId, _) in self.cards.items():
+                if vmId not in newCards:
+                    self.lastChangeId += 1
+                    self.changes.append((self.lastChangeId, vmId, ownerId, None))
+            self.cards = newCards
+            self.ready = True
+            self.condition.notify_all()
+
+
+    def current(self):
+        with self.condition:
+            entries = [(vmId, ownerId, card) for vmId, (ownerId, card) in sorted(self.cards.items())]
+            return self.lastChangeId, entries
+
+
+    def changes_after(self, changeId, timeout):
+        with self.condition:
+            self.condition.wait_for(lambda: self.lastChangeId > changeId, timeout)
+            if self.lastChangeId <= changeId:
+                return []
+            if not self.changes or self.changes[0][0] > changeId + 1:
+                return None
+            return [thisChange for thisChange in self.changes if thisChange[0] > changeId]
+
+
+    def wait_ready(self, timeout):
+        with self.condition:
+            return self.condition.wait_for(lambda: self.ready, timeout)
+
+
+
+# The monitor's one hub
+VM_PUSH_HUB = VmPushHub()
+
+
+
+
+
+
+
+
+############################################################
+# format_event / parse_event_id
+############################################################
+#
+# One SSE frame. The card JSON is compact and json escapes
+# newlines, so data is always a single line.
+############################################################
+
+def format_event(eventName, eventId, data):
+    return f'id: {eventId}\nevent: {eventName}\ndata: {data}\n\n'.encode()
+
+
+
+def parse_event_id(hub, lastEventId):
+    boot, _, changeId = (lastEventId or '').partition('-')
+    if boot != hub.boot or not changeId.isdigit():
+        return None
+    changeId = int(changeId)
+    return changeId if changeId <= hub.lastChangeId else None
+
+
+
+
+
+
+
+
+############################################################
+# stream_events
+############################################################
+#
+# The body of one stream, written through write(bytes) until
+# the client goes away (write raises OSError) or
+# still_allowed() turns False — asked at least every
+# heartbeatSeconds, busy or idle. visible(vmId, ownerId) is
+# the client's scope. sentIds is what the client holds, so a
+# VM leaving the scope is a vm-removed even though it still
+# exists; a resumed client is taken to hold everything it
+# may see now plus everything it could see among the missed
+# changes.
+############################################################
+
+def stream_events(hub, visible, write, still_allowed, lastEventId=None, heartbeatSeconds=VM_PUSH_HEARTBEAT_SECONDS):
+    write(b'retry: 3000\n\n')
+
+    changeId = parse_event_id(hub, lastEventId)
+    if changeId is not None:
+        missed = hub.changes_after(changeId, 0)
+        if missed is None:
+            changeId = None
+        else:
+            sentIds = {vmId for vmId, ownerId, _ in hub.current()[1] if visible(vmId, ownerId)}
+            sentIds.update(vmId for _, vmId, ownerId, _ in missed if visible(vmId, ownerId))
+
+    lastCheck = time.monotonic()
+    while True:
+
+        # (Re)start from the whole visible list
+        if changeId is None:
+            changeId, entries = hub.current()
+            visibleEntries = [(vmId, card) for vmId, ownerId, card in entries if visible(vmId, ownerId)]
+            sentIds = {vmId for vmId, _ in visibleEntries}
+            write(format_event('snapshot', f'{hub.boot}-{changeId}', '[' + ','.join(card for _, card in visibleEntries) + ']'))
+
+        changes = hub.changes_after(changeId, heartbeatSeconds)
+
+        if time.monotonic() - lastCheck >= heartbeatSeconds:
+            if not still_allowed():
+                return
+            lastCheck = time.monotonic()
+
+        if changes is None:
+            changeId = None
+            continue
+
+        if not changes:
+            write(b': keepalive\n\n')
+            continue
+
+        for thisChangeId, vmId, ownerId, card in changes:
+            eventId = f'{hub.boot}-{thisChangeId}'
+            if card is not None and visible(vmId, ownerId):
+                sentIds.add(vmId)
+                write(format_event('vm', eventId, card))
+            elif vmId in sentIds:
+                sentIds.discard(vmId)
+                write(format_event('vm-removed', eventId, json.dumps({'id': vmId})))
+            changeId = thisChangeId
+
+
+
+
+
+
+
+
+############################################################
+# resolve_session_user
+############################################################
+#
+# The session cookie → SessionUser, the way login_required
+# resolves it (same engine, user_for_session's rules); None
+# when there is no valid session.
+############################################################
+
+def resolve_session_user(cookieHeader):
+    cookie = SimpleCookie()
+    try:
+        cookie.load(cookieHeader or '')
+    except Exception:
+        return None
+    morsel = cookie.get(settings.SESSION_COOKIE_NAME)
+    if morsel is None:
+        return None
+
+    sessionStore = import_module(settings.SESSION_ENGINE).SessionStore(session_key=morsel.value)
+    return user_for_session(sessionStore)
+
+
+
+
+
+
+
+
+############################################################
+# VmEventsHandler / serve_vm_push
+############################################################
+#
+# One thread per stream (ThreadingHTTPServer) — each spends
+# its life parked on the hub's condition. The scope and the
+# re-check follow vm_list: showOtherUsers is admin-only, a
+# single VM needs check_user_is_allowed_to_access_vm. Every
+# database touch closes its connection again, so an idle
+# stream never holds one.
+############################################################
+
+class VmEventsHandler(BaseHTTPRequestHandler):
+
+    hub = VM_PUSH_HUB
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+
+    def send_plain(self, status, message):
+        body = json.dumps({'message': message}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def check_access(self, showOtherUsers, virtualServerID):
+        close_old_connections()
+        try:
+            user = resolve_session_user(self.headers.get('Cookie'))
+            if user is None:
+                return None
+            if showOtherUsers and user.admin == 0:
+                return None
+            if virtualServerID is not None and check_user_is_allowed_to_access_vm(user, virtualServerID) == False:
+                return None
+            return user
+        finally:
+            connection.close()
+
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path.rstrip('/') != '/api/vm/events':
+            return self.send_plain(404, 'Not found')
+
+        query = parse_qs(url.query)
+        showOtherUsers = query.get('showOtherUsers', ['false'])[0].lower() == 'true'
+        virtualServerID = query.get('virtualServerID', [None])[0]
+        if virtualServerID is not None:
+            if not virtualServerID.isdigit():
+                return self.send_plain(400, 'Invalid virtualServerID')
+            virtualServerID = int(virtualServerID)
+
+        user = self.check_access(showOtherUsers, virtualServerID)
+        if user is None:
+            return self.send_plain(401, 'Unauthorized')
+
+        if virtualServerID is not None:
+            visible = lambda vmId, ownerId: vmId == virtualServerID
+        elif showOtherUsers:
+            visible = lambda vmId, ownerId: True
+        else:
+            visible = lambda vmId, ownerId: ownerId == user.id
+
+        with self.hub.condition:
+            if self.hub.clients >= VM_PUSH_MAX_CLIENTS:
+                return self.send_plain(503, 'Too many streams')
+            self.hub.clients += 1
+
+        try:
+            if not self.hub.wait_ready(VM_PUSH_HEARTBEAT_SECONDS):
+                return self.send_plain(503, 'Not ready')
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('X-Accel-Buffering', 'no')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+
+            def write(data):
+                self.wfile.write(data)
+                self.wfile.flush()
+
+            stream_events(
+                self.hub, visible, write,
+                still_allowed=lambda: self.check_access(showOtherUsers, virtualServerID) is not None,
+                lastEventId=self.headers.get('Last-Event-ID'),
+            )
+        except OSError:
+            pass        # the tab went away
+        finally:
+            self.close_connection = True
+            with self.hub.condition:
+                self.hub.clients -= 1
+
+
+
+class VmPushServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+
+def serve_vm_push(port=VM_PUSH_PORT):
+    VmPushServer(('0.0.0.0', port), VmEventsHandler).serve_forever()
@@ -0,0 +1,300 @@
+############################################################
+#  [*] VM list snapshot — GET /api/vm, materialized
+#
+#  Every open tab polls /api/vm every 3 seconds, and building
+#  the payload means the whole containers cache, every
+#  domain, forward, usage row and owner email — for an
+#  answer that is byte-identical on most polls. So the cards
+#  are built ONCE per change instead of once per poll:
+#
+#    refresh_snapshot — builds every live VM's card, encodes
+#      each one compactly, and stores them in the one
+#      VmListSnapshot row. When the content differs from
+#      what is stored, version goes up by one; otherwise only
+#      the bookkeeping moves. The monitor calls it after
+#      every tick (containers, usage and the creating →
+#      unknown timeout all land within 3 s).
+#
+#    mark_stale — called by every request-side mutation of
+#      what the cards show (create/rename/start/stop/delete,
+#      domains, forwards, owner emails, job outcomes), inside
+#      the mutation's transaction. The next reader rebuilds
+#      before serving, so a user never sees their own change
+#      missing.
+#
+#    load_snapshot — the reader's side: a single-row lookup
+#      of the version and generations; rebuilds inline when
+#      the row is missing, stale, or older than
+#      SNAPSHOT_MAX_AGE_SECONDS (the monitor is not running).
+#      The decoded cards are kept per process keyed by the
+#      payload hash, so only NEW content is ever parsed.
+#
+#  Card states depend on the clock ("creating" for 5 minutes
+#  after the row is made, then "unknown") — the snapshot
+#  records them as of its build, which the 3-second refresh
+#  keeps current.
+#
+#  Used by:
+#    - vm_views — vm_list serves it; the mutations mark it
+#    - dns_views, portforward_views, users_views, hosting/jobs
+#      — mark_stale
+#    - monitor_containers — refresh_snapshot every tick, the
+#      entries then published to the VM push streams
+############################################################
+
+import hashlib
+import json
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from control.common.auth import format_datetime
+from control.hosting.models import DIND_PREFIX, DockerContainer, DomainName, PortForward, VirtualServer, VmListSnapshot, VmUsage
+from control.users.models import SystemUser
+
+
+SNAPSHOT_ID = 1
+
+# A snapshot older than this is rebuilt by the reader — the
+# monitor normally refreshes it every 3 seconds
+SNAPSHOT_MAX_AGE_SECONDS = 15
+
+# payload hash → [(vmId, ownerId, encoded card)], this process
+_loaded = (None, None)
+
+
+
+
+
+
+
+
+############################################################
+# build_cards
+############################################################
+#
+# Every non-deleted VM's card, in numeric id order, as
+# (vmId, ownerId, card dict) — the REGISTRY drives the list;
+# the containers cache only decorates it with live state. A
+# row whose container the monitor has not seen yet still
+# shows, as "creating" (fresh row) or "unknown" (old row —
+# manually removed container, or the sidecar is
+# unreachable). Ids are integers; stacks/domains/
+# portforwards are null when empty. Stacks come from the
+# cache's stack_name column — containers started outside
+# compose group under '' on purpose.
+############################################################
+
+def build_cards():
+    from control.hosting.api.portforward_views import PORTFORWARD_PUBLIC_HOST
+
+    # The dind containers on the host — one per live VM
+    dindRows = {}
+    for thisRow in DockerContainer.objects.filter(parent_server_id=0, names__startswith=DIND_PREFIX).order_by('id'):
+        vmIdText = thisRow.names.replace(DIND_PREFIX, '')
+        if vmIdText.isdigit() and vmIdText not in dindRows:
+            dindRows[vmIdText] = thisRow
+
+    virtualServers = {
+        thisVm.id: thisVm
+        for thisVm in VirtualServer.objects.filter(deleted=False).exclude(id=0)
+    }
+    ownerEmails = dict(
+        SystemUser.objects.filter(id__in=[thisVm.owner_id for thisVm in virtualServers.values() if thisVm.owner_id is not None])
+        .values_list('id', 'email')
+    )
+
+
+    # Every VM's containers grouped by stack, in one query
+    stacksByVm = {}
+    containerRows = (
+        DockerContainer.objects.exclude(parent_server_id=0)
+        .only('parent_server_id', 'stack_name', 'image', 'names', 'running_for', 'state', 'status')
+        .order_by('id')
+    )
+    for thisRow in containerRows:
+        stacksByVm.setdefault(thisRow.parent_server_id, {}).setdefault(thisRow.stack_name, []).append({
+            'image': thisRow.image,
+            'names': thisRow.names,
+            'runningfor': thisRow.running_for,
+            'state': thisRow.state,
+            'status': thisRow.status,
+        })
+
+
+    # Every VM's domains, in one query
+    domainsByVm = {}
+    for thisDomain in DomainName.objects.order_by('id'):
+        domainsByVm.setdefault(thisDomain.virtual_server_id, []).append({
+            'id': thisDomain.id,
+            'domainname': thisDomain.domain_name,
+            'iscloudflare': int(thisDomain.is_cloudflare),
+            'ssl': int(thisDomain.ssl),
+        })
+
+
+    # Every VM's port forwards, in one query — publichost rides
+    # along so the card can render the exact connect string
+    portForwardsByVm = {}
+    for thisForward in PortForward.objects.order_by('id'):
+        portForwardsByVm.setdefault(thisForward.virtual_server_id, []).append({
+            'id': thisForward.id,
+            'publichost': PORTFORWARD_PUBLIC_HOST,
+            'publicport': thisForward.public_port,
+            'internalport': thisForward.internal_port,
+            'description': thisForward.description,
+        })
+
+
+    # Every VM's live usage (the monitor's telemetry), in one
+    # query — null while nothing has been measured
+    usageByVm = {
+        thisUsage.virtual_server_id: {
+            'cpu_percent': round(thisUsage.cpu_percent, 1) if thisUsage.cpu_percent is not None else None,
+            'memory_mb': thisUsage.memory_mb,
+            'disk_mb': thisUsage.disk_mb,
+            'cpu_measured_at': format_datetime(thisUsage.cpu_measured_at),
+            'disk_measured_at': format_datetime(thisUsage.disk_measured_at),
+        }
+        for thisUsage in VmUsage.objects.all()
+    }
+
+
+    # Assemble, in numeric id order
+    cards = []
+    for vmId in sorted(virtualServers):
+        thisVm = virtualServers[vmId]
+
+        # Live state from the cache; without a cache row the
+        # registry row speaks for itself — a fresh one is a
+        # create in flight, an old one is honestly unknown
+        dindRow = dindRows.get(str(vmId))
+        if dindRow is not None:
+            state, status = dindRow.state, dindRow.status
+        elif timezone.now() - thisVm.created_at < timedelta(minutes=5):
+            state, status = 'creating', None
+        else:
+            state, status = 'unknown', None
+
+        stacks = [
+            {'stackname': stackName, 'containers': containers}
+            for stackName, containers in sorted(stacksByVm.get(thisVm.id, {}).items())
+        ]
+
+        cards.append((vmId, thisVm.owner_id, {
+            'id': thisVm.id,
+            'name': thisVm.name,
+            'status': status,
+            'state': state,
+            'enabled': int(thisVm.enabled),
+            'owneremail': ownerEmails.get(thisVm.owner_id),
+            'stacks': stacks or None,
+            'domains': domainsByVm.get(thisVm.id) or None,
+            'portforwards': portForwardsByVm.get(thisVm.id) or None,
+            'usage': usageByVm.get(thisVm.id),
+        }))
+
+    return cards
+
+
+
+
+
+
+
+
+############################################################
+# refresh_snapshot / mark_stale
+############################################################
+#
+# refresh_snapshot returns (version, entries), entries being
+# [(vmId, ownerId, encoded card)]. The generation is read
+# BEFORE building, so a mutation committing mid-build leaves
+# the result stale on purpose. A build that finds a NEWER
+# generation already stored does not overwrite it. The store
+# is best-effort — a failed write (a locked database) still
+# serves the freshly built entries.
+############################################################
+
+def refresh_snapshot():
+    global _loaded
+
+    snapshotRow, _ = VmListSnapshot.objects.get_or_create(id=SNAPSHOT_ID)
+    generation = snapshotRow.dirty_generation
+
+    entries = [
+        (vmId, ownerId, json.dumps(card, separators=(',', ':'), ensure_ascii=False))
+        for vmId, ownerId, card in build_cards()
+    ]
+    payload = json.dumps(entries, separators=(',', ':'), ensure_ascii=False)
+    payloadHash = hashlib.sha256(payload.encode()).hexdigest()
+
+    try:
+        with transaction.atomic():
+            snapshotRow = VmListSnapshot.objects.get(id=SNAPSHOT_ID)
+            if snapshotRow.built_generation > generation:
+                return snapshotRow.version, entries
+            if payloadHash != snapshotRow.payload_hash:
+                snapshotRow.version += 1
+                snapshotRow.payload = payload
+                snapshotRow.payload_hash = payloadHash
+            snapshotRow.built_generation = generation
+            snapshotRow.built_at = timezone.now()
+            snapshotRow.save()
+    except Exception as e:
+        print(f'VM snapshot store failed: {e}')
+        return snapshotRow.version, entries
+
+    _loaded = (snapshotRow.payload_hash, entries)
+    return snapshotRow.version, entries
+
+
+
+def mark_stale():
+    VmListSnapshot.objects.filter(id=SNAPSHOT_ID).update(dirty_generation=F('dirty_generation') + 1)
+
+
+
+
+
+
+
+
+############################################################
+# load_snapshot
+############################################################
+#
+# Returns (version, entries loader) — the loader is only
+# called once the caller knows it needs the cards (not for a
+# 304), and parses the stored payload at most once per
+# content per process.
+############################################################
+
+def load_snapshot():
+    snapshotMeta = (
+        VmListSnapshot.objects.filter(id=SNAPSHOT_ID)
+        .values('version', 'payload_hash', 'dirty_generation', 'built_generation', 'built_at')
+        .first()
+    )
+
+    if (snapshotMeta is None
+            or snapshotMeta['dirty_generation'] > snapshotMeta['built_generation']
+            or snapshotMeta['built_at'] is None
+            or timezone.now() - snapshotMeta['built_at'] > timedelta(seconds=SNAPSHOT_MAX_AGE_SECONDS)):
+        version, entries = refresh_snapshot()
+        return version, lambda: entries
+
+    payloadHash = snapshotMeta['payload_hash']
+
+    def entries_loader():
+        global _loaded
+        loadedHash, loadedEntries = _loaded
+        if loadedHash != payloadHash:
+            payload = VmListSnapshot.objects.filter(id=SNAPSHOT_ID).values_list('payload', flat=True).first()
+            loadedEntries = [tuple(entry) for entry in json.loads(payload or '[]')]
+            _loaded = (payloadHash, loadedEntries)
+        return loadedEntries
+
+    return snapshotMeta['version'], entries_loader
@@ -13,6 +13,8 @@
 #    DB_PATH            — SQLite file, default /data/control.db
 #                         (a FRESH file — the legacy
 #                         database.db is not touched)
+#    SESSION_BACKEND    — "db" (default) or "signed"; see
+#                         Sessions below
 #    DOCKER_CONTROLLER_HOST / _PORT — the docker sidecar
 #    CADVISOR_HOST / _PORT          — container metrics
 #    BACKEND_SSH_API_KEY            — /api/sshrouter secret
@@ -27,6 +29,8 @@
 import environ
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 env = environ.Env()
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -96,16 +100,47 @@ SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
 # same /data mount as the legacy database.db, which stays
 # untouched until the transfer command imports it.
 #
-# WAL is deliberately NOT enabled: DBGate bind-mounts bare
-# .db files, and a WAL database needs its -wal/-shm sidecar
-# files next to it. Instead: a 20 s busy timeout and
-# IMMEDIATE transactions, which cover the web workers and
-# the monitor container sharing the file.
+# Tuned on every connect (init_command, SQLITE_PRAGMAS):
+#
+#   journal_mode=WAL    — readers no longer block the writer
+#                         nor it them: gunicorn's request
+#                         threads keep reading while the
+#                         monitor writes its pass. DBGate
+#                         mounts the whole /data directory, so
+#                         it sees the -wal/-shm files next to
+#                         the database (a bare-file mount
+#                         would NOT — keep it a directory).
+#   synchronous=NORMAL  — WAL's safe setting: no fsync per
+#                         commit, only per checkpoint; a power
+#                         loss can cost the last commits, never
+#                         consistency.
+#   cache_size / mmap_size — 32 MiB page cache per connection,
+#                         reads served from a 256 MiB mapping.
+#   temp_store=MEMORY   — sorts and temp b-trees off the disk.
+#   journal_size_limit  — the WAL file is cut back to 64 MiB
+#                         after a checkpoint.
+#
+# The monitor checkpoints every WAL_CHECKPOINT_SECONDS, so
+# the WAL cannot grow unbounded behind busy readers.
+#
+# Writers still queue for the single write lock: a 20 s busy
+# timeout and IMMEDIATE transactions (no deadlocking lock
+# upgrades), which cover the web workers and the monitor
+# sharing the file.
 #
 # ATOMIC_REQUESTS wraps every request in one transaction —
 # rollback-on-exception everywhere by default.
 ############################################################
 
+SQLITE_PRAGMAS = [
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA cache_size=-32768',
+    'PRAGMA mmap_size=268435456',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA journal_size_limit=67108864',
+]
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
@@ -114,6 +149,7 @@ DATABASES = {
         'OPTIONS': {
             'timeout': 20,
             'transaction_mode': 'IMMEDIATE',
+            'init_command': ';'.join(SQLITE_PRAGMAS),
         },
     }
 }
@@ -189,15 +225,36 @@ MIDDLEWARE = [
 # Sessions
 ############################################################
 #
-# DB-backed sessions in the SQLite file — they survive
-# restarts and deploys. The cookie: named "session", HttpOnly
-# (JavaScript never touches it — logout is POST /api/logout)
-# and browser-session lifetime. Secure is on outside DEBUG:
-# Caddy terminates TLS in front, and a Secure cookie over
-# plain-http dev access would be refused by the browser.
+# Two backends, picked by SESSION_BACKEND:
+#
+#   db     — sessions are rows in the SQLite file (default).
+#            They survive restarts and deploys; every cold
+#            session resolution reads django_session, and a
+#            login writes it.
+#   signed — the cookie IS the session: the user's ID and
+#            session epoch, signed with SECRET_KEY. Resolving
+#            it never touches django_session, a login writes
+#            nothing. Revocation is server-side all the same:
+#            a logout bumps SystemUser.session_epoch, which
+#            ends every session of that user (all devices).
+#            Rotating DJANGO_SECRET_KEY ends everyone's.
+#
+# The cookie: named "session", HttpOnly (JavaScript never
+# touches it — logout is POST /api/logout) and browser-
+# session lifetime. Secure is on outside DEBUG: Caddy
+# terminates TLS in front, and a Secure cookie over plain-
+# http dev access would be refused by the browser.
 ############################################################
 
-SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+SESSION_ENGINES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'signed': 'django.contrib.sessions.backends.signed_cookies',
+}
+SESSION_BACKEND = env('SESSION_BACKEND', default='db')
+if SESSION_BACKEND not in SESSION_ENGINES:
+    raise ImproperlyConfigured(f'SESSION_BACKEND must be one of {", ".join(SESSION_ENGINES)}, not {SESSION_BACKEND!r}')
+
+SESSION_ENGINE = SESSION_ENGINES[SESSION_BACKEND]
 SESSION_COOKIE_NAME = 'session'
 SESSION_COOKIE_HTTPONLY = True
 SESSION_COOKIE_SECURE = not DEBUG
@@ -13,7 +13,15 @@
 #                         account/admin grid
 #    test_hosting.py    — vm list/control, dns, sshrouter
 #                         (docker sidecar fully mocked)
+#    test_jobs.py       — background job queue, retries,
+#                         runner bound, status API
+#    test_push.py       — VM push hub, SSE protocol and
+#                         endpoint
+#    test_usage.py      — usage history buffers, rollups,
+#                         series and endpoints
 #    test_dashboard.py  — admin widgets + no-leak guarantees
+#    test_benchmarks.py — opt-in hot-path timings
+#                         (CONTROL_BENCHMARKS=1)
 #
 #  Run inside the container:
 #    python3 manage.py test control
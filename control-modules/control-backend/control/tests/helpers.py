@@ -98,21 +98,22 @@ def create_dind_row(vm, state='running', status='Up 2 hours'):
         parent_server_id=0,
         docker_id=f'dind-{vm.id}',
         command='', created_at='', image='hosting-dind-ubuntu',
-        labels='', mounts='', names=f'{DIND_PREFIX}{vm.id}',
-        networks='', ports='', running_for='',
+        labels={}, mounts='', names=f'{DIND_PREFIX}{vm.id}',
+        running_for='',
         size='', state=state, status=status,
         synced_at=timezone.now(),
     )
 
 
 
-def create_inner_container(vm, names='web-1', labels='com.docker.compose.project=web', state='running'):
+def create_inner_container(vm, names='web-1', stack_name='web', state='running'):
     return DockerContainer.objects.create(
         parent_server=vm,
         docker_id=f'inner-{vm.id}-{names}',
         command='', created_at='', image='nginx:alpine',
-        labels=labels, mounts='', names=names,
-        networks='', ports='', running_for='2 hours',
+        labels={'com.docker.compose.project': stack_name} if stack_name else {},
+        stack_name=stack_name, mounts='', names=names,
+        running_for='2 hours',
         size='', state=state, status='Up 2 hours',
         synced_at=timezone.now(),
     )
@@ -124,6 +125,36 @@ def create_inner_container(vm, names='web-1', labels='com.docker.compose.project
 
 
 
+############################################################
+# run_queued_jobs
+############################################################
+#
+# What the monitor's JobRunner would do, inline: claim and
+# run every due job until none is left. Returns how many ran.
+#
+# Used by:
+#   - test_hosting.py, test_jobs.py — the async create/
+#     delete/bulk outcomes
+############################################################
+
+def run_queued_jobs():
+    from control.hosting.jobs import claim_next_job, run_job
+
+    ranCount = 0
+    while True:
+        thisJob = claim_next_job()
+        if thisJob is None:
+            return ranCount
+        run_job(thisJob)
+        ranCount += 1
+
+
+
+
+
+
+
+
 ############################################################
 # post_json / put_json / login
 ############################################################
@@ -0,0 +1,328 @@
+############################################################
+#  [*] Benchmarks — hot-path timings, opt-in
+#
+#  Not contract tests: these print timings for the paths
+#  the monitor and the busiest endpoints hammer, at a
+#  realistic data volume. Skipped unless CONTROL_BENCHMARKS
+#  is set, so the contract suite stays fast:
+#
+#    CONTROL_BENCHMARKS=1 python3 manage.py test control.tests.test_benchmarks
+#
+#  Numbers go to stdout; the assertions only guard that the
+#  measured path did the work it claims to.
+#
+#  Convention: one banner per test class; test methods carry
+#  descriptive names instead of banners.
+############################################################
+
+import os
+import statistics
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from control.common.auth import SIGNED_SESSION_ENGINE, auth_cache_get
+from control.tests.helpers import create_host_row, create_system_user, create_vm, login
+from control.hosting.management.commands.monitor_containers import (
+    checkpoint_wal,
+    container_fields,
+    forget_snapshots,
+    push_docker_info_to_db,
+)
+from control.hosting.models import DockerContainer
+from control.hosting.vm_snapshot import refresh_snapshot
+
+
+RUN_BENCHMARKS = bool(os.getenv('CONTROL_BENCHMARKS'))
+
+
+
+def fake_snapshot(vmId, perVm, state='running'):
+    return {'containers': [
+        {'ID': f'{vmId}-{n}', 'Command': '"docker-entrypoint.sh"', 'CreatedAt': '2026-01-01 00:00:00 +0000 UTC',
+         'Image': 'nginx:alpine', 'Labels': f'com.docker.compose.project=stack{n % 5},x=y', 'Mounts': '/apps/data',
+         'Names': f'app-{n}', 'Networks': 'default', 'Ports': '80/tcp', 'RunningFor': '2 hours ago',
+         'Size': 'N/A', 'State': state if n == 0 else 'running', 'Status': 'Up 2 hours'}
+        for n in range(perVm)
+    ]}
+
+
+
+def report(title, samplesMs):
+    samplesMs = sorted(samplesMs)
+    p99 = samplesMs[min(len(samplesMs) - 1, int(len(samplesMs) * 0.99))]
+    print(f'\n  {title:<48} total {sum(samplesMs):8.1f} ms   '
+          f'p50 {statistics.median(samplesMs):7.2f} ms   p99 {p99:7.2f} ms', flush=True)
+
+
+
+def start_worker(func):
+    """Runs func on a new thread with its own connection, closed when func returns."""
+    def body():
+        try:
+            func()
+        finally:
+            connection.close()
+
+    worker = threading.Thread(target=body)
+    worker.start()
+    return worker
+
+
+
+def run_on_worker(func):
+    """start_worker, waited for; returns func's result."""
+    outcome = {}
+    start_worker(lambda: outcome.update(value=func())).join()
+    return outcome['value']
+
+
+
+class ScratchDatabaseBenchmark(SimpleTestCase):
+    """
+    Real lock contention needs a real file: the class runs on a migrated
+    scratch SQLite file with the production OPTIONS, and every database touch
+    goes through start_worker / run_on_worker — the test runner's in-memory
+    database (held by the main thread) stays out of it. prepare() seeds it.
+    """
+
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.scratch = tempfile.TemporaryDirectory()
+        cls.settingsDict = connections.settings['default']
+        cls.originalName = cls.settingsDict['NAME']
+        cls.originalOptions = dict(cls.settingsDict['OPTIONS'])
+        cls.settingsDict['NAME'] = os.path.join(cls.scratch.name, 'control.db')
+        run_on_worker(lambda: call_command('migrate', verbosity=0))
+        run_on_worker(cls.prepare)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settingsDict['NAME'] = cls.originalName
+        cls.settingsDict['OPTIONS'] = cls.originalOptions
+        cls.scratch.cleanup()
+        super().tearDownClass()
+
+
+
+
+
+
+
+
+############################################################
+# ContainerPushBenchmark
+############################################################
+#
+# 5,000 cached containers (100 VMs × 50): the per-pass write
+# lock time of the batched writer — cold, steady (nothing
+# changed) and with one state flip per VM — next to the old
+# one-update_or_create-per-row writer as the reference.
+############################################################
+
+@unittest.skipUnless(RUN_BENCHMARKS, 'set CONTROL_BENCHMARKS=1 to run benchmarks')
+class ContainerPushBenchmark(TestCase):
+
+    VMS = 100
+    PER_VM = 50
+
+    def setUp(self):
+        forget_snapshots()
+        create_host_row()
+        owner = create_system_user()
+        self.vmIds = [create_vm(owner).id for _ in range(self.VMS)]
+
+    def tearDown(self):
+        forget_snapshots()
+
+    def one_pass(self, state='running'):
+        return [push_docker_info_to_db(fake_snapshot(vmId, self.PER_VM, state), vmId)['lock_ms'] for vmId in self.vmIds]
+
+    def test_batched_writer_lock_time(self):
+        report('batched — cold pass (5,000 inserts)', self.one_pass())
+        self.assertEqual(DockerContainer.objects.count(), self.VMS * self.PER_VM)
+
+        report('batched — steady pass (nothing changed)', self.one_pass())
+        report('batched — one state flip per VM', self.one_pass(state='exited'))
+        self.assertEqual(DockerContainer.objects.filter(state='exited').count(), self.VMS)
+
+    def test_legacy_per_row_writer_lock_time(self):
+        def legacy_push(json_obj, parentServerID):
+            started = time.monotonic()
+            with transaction.atomic():
+                for container in json_obj['containers']:
+                    DockerContainer.objects.update_or_create(
+                        docker_id=container['ID'], parent_server_id=parentServerID,
+                        defaults={**container_fields(container), 'synced_at': timeNow},
+                    )
+            return (time.monotonic() - started) * 1000
+
+        timeNow = timezone.now()
+        report('legacy — cold pass (5,000 inserts)', [legacy_push(fake_snapshot(v, self.PER_VM), v) for v in self.vmIds])
+        report('legacy — steady pass (nothing changed)', [legacy_push(fake_snapshot(v, self.PER_VM), v) for v in self.vmIds])
+        self.assertEqual(DockerContainer.objects.count(), self.VMS * self.PER_VM)
+
+
+
+
+
+
+
+
+############################################################
+# CheckauthLoadBenchmark
+############################################################
+#
+# p50/p99 of GET /api/checkauth from CLIENTS concurrent
+# clients while a monitor-like writer keeps rewriting the
+# containers cache — for db and signed sessions, with the
+# auth cache cold (every request resolves its session) and
+# warm — on a scratch file (ScratchDatabaseBenchmark).
+############################################################
+
+@unittest.skipUnless(RUN_BENCHMARKS, 'set CONTROL_BENCHMARKS=1 to run benchmarks')
+class CheckauthLoadBenchmark(ScratchDatabaseBenchmark):
+
+    CLIENTS = 8
+    REQUESTS = 150
+    VMS = 20
+    PER_VM = 50
+
+    @classmethod
+    def prepare(cls):
+        create_host_row()
+        owner = create_system_user()
+        cls.vmIds = [create_vm(owner).id for _ in range(cls.VMS)]
+
+    def monitor_writer(self, stop):
+        forget_snapshots()
+        state = 'running'
+        while not stop.is_set():
+            state = 'exited' if state == 'running' else 'running'
+            for vmId in self.vmIds:
+                push_docker_info_to_db(fake_snapshot(vmId, self.PER_VM, state), vmId)
+                time.sleep(0.005)
+
+    def measure(self, title, engine, warm):
+        samplesMs = []
+        statuses = set()
+
+        def hammer(thisClient):
+            for _ in range(self.REQUESTS):
+                started = time.monotonic()
+                statuses.add(thisClient.get('/api/checkauth').status_code)
+                samplesMs.append((time.monotonic() - started) * 1000)
+
+        cacheGet = auth_cache_get if warm else (lambda cacheKey: None)
+        with override_settings(SESSION_ENGINE=engine), patch('control.common.auth.auth_cache_get', new=cacheGet):
+            clients = [self.client_class() for _ in range(self.CLIENTS)]
+            for thisClient in clients:
+                run_on_worker(lambda: login(thisClient, 'user@test.local', 'test-pass-8'))
+
+            stop = threading.Event()
+            writer = start_worker(lambda: self.monitor_writer(stop))
+            for thisWorker in [start_worker(lambda c=c: hammer(c)) for c in clients]:
+                thisWorker.join()
+            stop.set()
+            writer.join()
+
+        report(title, samplesMs)
+        self.assertEqual((statuses, len(samplesMs)), ({200}, self.CLIENTS * self.REQUESTS))
+
+    def test_checkauth_latency_under_monitor_writes(self):
+        self.measure('db sessions — auth cache cold', 'django.contrib.sessions.backends.db', warm=False)
+        self.measure('signed sessions — auth cache cold', SIGNED_SESSION_ENGINE, warm=False)
+        self.measure('db sessions — auth cache warm', 'django.contrib.sessions.backends.db', warm=True)
+        self.measure('signed sessions — auth cache warm', SIGNED_SESSION_ENGINE, warm=True)
+
+
+
+
+
+
+
+
+############################################################
+# VmListLoadBenchmark
+############################################################
+#
+# p50/p99 of GET /api/vm (the whole 100-VM, 5,000-container
+# list) from CLIENTS concurrent readers while the monitor
+# runs back-to-back passes — a state flip in every VM, the
+# snapshot refresh, a WAL checkpoint — once with the plain
+# rollback journal and once with settings.SQLITE_PRAGMAS.
+# Readers skip If-None-Match: every request reads the
+# payload. Readers and writer share one interpreter, so the
+# absolute numbers include GIL waits — compare the lines.
+############################################################
+
+@unittest.skipUnless(RUN_BENCHMARKS, 'set CONTROL_BENCHMARKS=1 to run benchmarks')
+class VmListLoadBenchmark(ScratchDatabaseBenchmark):
+
+    CLIENTS = 8
+    REQUESTS = 100
+    VMS = 100
+    PER_VM = 50
+
+    @classmethod
+    def prepare(cls):
+        create_host_row()
+        create_system_user()
+        owner = create_system_user(email='owner@test.local')
+        cls.vmIds = [create_vm(owner).id for _ in range(cls.VMS)]
+
+    def monitor_passes(self, stop):
+        forget_snapshots()
+        state = 'running'
+        passes = 0
+        while not stop.is_set():
+            state = 'exited' if state == 'running' else 'running'
+            for vmId in self.vmIds:
+                push_docker_info_to_db(fake_snapshot(vmId, self.PER_VM, state), vmId)
+            refresh_snapshot()
+            checkpoint_wal()
+            passes += 1
+        return passes
+
+    def measure(self, title, initCommand):
+        self.settingsDict['OPTIONS'] = dict(self.originalOptions, init_command=initCommand)
+        samplesMs = []
+        statuses = set()
+
+        def read(thisClient):
+            for _ in range(self.REQUESTS):
+                started = time.monotonic()
+                statuses.add(thisClient.get('/api/vm').status_code)
+                samplesMs.append((time.monotonic() - started) * 1000)
+
+        clients = [self.client_class() for _ in range(self.CLIENTS)]
+        for thisClient in clients:
+            run_on_worker(lambda: login(thisClient, 'owner@test.local', 'test-pass-8'))
+        run_on_worker(lambda: push_docker_info_to_db(fake_snapshot(self.vmIds[0], self.PER_VM), self.vmIds[0]))
+
+        stop = threading.Event()
+        passes = []
+        writer = start_worker(lambda: passes.append(self.monitor_passes(stop)))
+        for thisWorker in [start_worker(lambda c=c: read(c)) for c in clients]:
+            thisWorker.join()
+        stop.set()
+        writer.join()
+
+        report(f'{title} ({passes[0]} monitor passes)', samplesMs)
+        self.assertEqual((statuses, len(samplesMs)), ({200}, self.CLIENTS * self.REQUESTS))
+
+    def test_vm_list_latency_under_monitor_passes(self):
+        self.measure('rollback journal', 'PRAGMA journal_mode=DELETE')
+        self.measure('WAL + tuning', ';'.join(settings.SQLITE_PRAGMAS))
+
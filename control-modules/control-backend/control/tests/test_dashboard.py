@@ -1,21 +1,29 @@
 ############################################################
 #  [*] Dashboard contract tests — the admin widgets' data
 #
-#  The admin gate on all three endpoints, the totals' counting
-#  rules, the activity feed shape, and the no-leak guarantee
-#  when cAdvisor is unreachable.
+#  The admin gate on every endpoint, the totals' counting
+#  rules, the activity feed shape, and the system gauges
+#  served from the monitor's cAdvisor feed (no leak when
+#  cAdvisor is unreachable).
 #
 #  Convention: one banner per test class; test methods carry
 #  descriptive names instead of banners.
 ############################################################
 
+from datetime import timedelta
 from unittest.mock import patch
 
 import requests
 from django.test import TestCase
+from django.utils import timezone
 
 from control.tests.helpers import create_host_row, create_system_user, create_vm, login
-from control.hosting.models import DomainName
+from control.dashboard import registry_monitor
+from control.dashboard.registry_monitor import FEED_DOCKERHUB, get_rate_limit, refresh_rate_limit
+from control.hosting.cadvisor_sampler import FEED_CADVISOR
+from control.hosting.management.commands.monitor_containers import cadvisor_error_kind
+from control.hosting.models import DomainName, MonitorFeed
+from control.hosting.monitor_feeds import publish_feed
 from control.users.models import RecentActivity
 
 
@@ -31,7 +39,7 @@ from control.users.models import RecentActivity
 
 class DashboardAuthTests(TestCase):
 
-    ENDPOINTS = ['/api/dashboard/system', '/api/dashboard/recentactivity', '/api/dashboard/hostingsystem']
+    ENDPOINTS = ['/api/dashboard/system', '/api/dashboard/recentactivity', '/api/dashboard/hostingsystem', '/api/dashboard/usage']
 
     def test_anonymous_and_non_admin_are_401(self):
         create_system_user()
@@ -112,18 +120,83 @@ class DashboardActivityTests(TestCase):
 ############################################################
 # SystemEndpointTests
 ############################################################
+#
+# /api/dashboard/system serves the monitor's cAdvisor feed
+# and never calls cAdvisor itself; the old error answers
+# survive, without leaking internals.
+############################################################
 
 class SystemEndpointTests(TestCase):
 
-    @patch('control.dashboard.api.dashboard_views.requests.get',
-           side_effect=requests.ConnectionError('secret internal detail'))
-    def test_cadvisor_down_is_a_generic_500(self, getMock):
+    SYSTEM = {'cpu_percent': 12.5, 'memory_percent': 40.0, 'disk_percent': 70.1, 'cpu_cores': 8,
+              'memory_total_gb': 16.0, 'memory_used_gb': 6.4, 'disk_total_gb': 500.0, 'disk_used_gb': 350.5}
+
+    def setUp(self):
         create_system_user(email='admin@test.local', admin=True)
         login(self.client, 'admin@test.local', 'test-pass-8')
 
+    @patch('control.dashboard.api.dashboard_views.get_rate_limit', return_value=None)
+    @patch('requests.Session.request', side_effect=AssertionError('cAdvisor must not be called'))
+    def test_serves_the_published_figures(self, requestMock, rateLimitMock):
+        publish_feed(FEED_CADVISOR, {'system': self.SYSTEM})
         response = self.client.get('/api/dashboard/system')
-        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {**self.SYSTEM, 'dockerhub_pull_limits': None})
+
+    def test_failed_samples_keep_their_answers(self):
+        for error, status, message in [('connect', 500, 'Failed to connect to cAdvisor'),
+                                       ('timeout', 504, 'cAdvisor request timeout'),
+                                       ('nostats', 503, 'No stats data available yet')]:
+            publish_feed(FEED_CADVISOR, {'error': error})
+            response = self.client.get('/api/dashboard/system')
+            self.assertEqual((response.status_code, response.json()['message']), (status, message), error)
+
+    def test_missing_or_stale_feed_is_503(self):
+        self.assertEqual(self.client.get('/api/dashboard/system').status_code, 503)
+
+        publish_feed(FEED_CADVISOR, {'system': self.SYSTEM})
+        MonitorFeed.objects.update(refreshed_at=timezone.now() - timedelta(minutes=1))     # the monitor stopped
+        self.assertEqual(self.client.get('/api/dashboard/system').status_code, 503)
+
+    def test_monitor_publishes_a_generic_error_kind(self):
+        self.assertEqual(cadvisor_error_kind(requests.ConnectionError('secret internal detail')), 'connect')
+        self.assertEqual(cadvisor_error_kind(requests.Timeout()), 'timeout')
+        self.assertEqual(cadvisor_error_kind(KeyError('memory_capacity')), 'parse')
+
+
+
+
+
+
+
+
+############################################################
+# RateLimitFeedTests
+############################################################
+#
+# The Docker Hub check runs in the monitor, one at a time; a
+# failed check leaves the last good figures in place until
+# they are too old to show.
+############################################################
+
+class RateLimitFeedTests(TestCase):
+
+    FIGURES = {'limit': 100, 'remaining': 73, 'used': 27, 'percent': 73, 'ip': '203.0.113.7'}
+
+    def test_readers_get_the_last_good_check(self):
+        self.assertIsNone(get_rate_limit())
+
+        with patch('control.dashboard.registry_monitor.check_rate_limit', return_value=self.FIGURES):
+            self.assertEqual(refresh_rate_limit(), self.FIGURES)
+        with patch('control.dashboard.registry_monitor.check_rate_limit', return_value=None):
+            self.assertIsNone(refresh_rate_limit())            # Docker Hub unreachable
+        self.assertEqual(get_rate_limit(), self.FIGURES)
+
+        MonitorFeed.objects.filter(name=FEED_DOCKERHUB).update(refreshed_at=timezone.now() - timedelta(minutes=11))
+        self.assertIsNone(get_rate_limit())
 
-        # Generic message only — internals never reach the client
-        self.assertEqual(response.json()['message'], 'Failed to connect to cAdvisor')
-        self.assertNotIn('secret internal detail', response.content.decode())
+    def test_one_check_at_a_time(self):
+        with patch('control.dashboard.registry_monitor.check_rate_limit', return_value=self.FIGURES) as checkMock:
+            with registry_monitor._checkLock:
+                self.assertIsNone(refresh_rate_limit())
+            checkMock.assert_not_called()
@@ -1,8 +1,8 @@
 ############################################################
 #  [*] Hosting contract tests — vm list/control, dns, ssh
 #
-#  Pins the /api/vm, /api/vm/control, /api/vm/dns/* and
-#  /api/sshrouter contracts. The docker sidecar is mocked
+#  Pins the /api/vm (and its snapshot), /api/vm/control, /api/vm/bulk,
+#  /api/vm/dns/* and /api/sshrouter contracts. The docker sidecar is mocked
 #  everywhere — no test touches a real container — and the
 #  Caddy regeneration is asserted as calls, never executed.
 #
@@ -10,19 +10,21 @@
 #  descriptive names instead of banners.
 ############################################################
 
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from datetime import timedelta
 from types import SimpleNamespace
 from unittest.mock import patch
 
 import requests
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
 from django.utils import timezone
 
 
-# Runs the would-be background thread inline, so the async
-# create/delete tests observe the completed outcome
-RUN_INLINE = lambda target: target()
-
 from control.tests.helpers import (
     create_dind_row,
     create_host_row,
@@ -31,11 +33,39 @@ from control.tests.helpers import (
     create_vm,
     login,
     post_json,
+    run_queued_jobs,
     put_json,
 )
+from control.common.http_pool import build_session, pool_stats
+from control.hosting import docker_controller
 from control.hosting.api.portforward_views import PORTFORWARD_PUBLIC_HOST
-from control.hosting.management.commands.monitor_containers import parse_cadvisor_docker, update_vm_usage
-from control.hosting.models import DIND_PREFIX, DockerContainer, DomainName, PortForward, VirtualServer, VmUsage
+from control.hosting.cadvisor_sampler import CadvisorSampler, parse_cadvisor_docker, parse_cadvisor_host, system_figures
+from control.hosting.management.commands.monitor_containers import (
+    apply_container_event,
+    checkpoint_wal,
+    fetch_vm_statuses,
+    fetch_vm_statuses_batch,
+    forget_snapshots,
+    push_docker_info_to_db,
+    refresh_disk_usage,
+    summarize_fetches,
+    update_vm_usage,
+)
+from control.hosting.models import (
+    DIND_PREFIX,
+    BackgroundJob,
+    ConfigGeneration,
+    DockerContainer,
+    DockerContainerNetwork,
+    DockerContainerPort,
+    DomainName,
+    PortForward,
+    UsageSample,
+    VirtualServer,
+    VmListSnapshot,
+    VmUsage,
+)
+from control.hosting.vm_snapshot import mark_stale, refresh_snapshot
 from control.users.models import RecentActivity
 
 
@@ -120,6 +150,7 @@ class VmListTests(TestCase):
         # An OLD row without a container is honestly unknown
         from control.hosting.models import VirtualServer
         VirtualServer.objects.filter(id=pendingVm.id).update(created_at=timezone.now() - timedelta(minutes=10))
+        refresh_snapshot()      # the monitor's next pass
         vms = {vm['id']: vm for vm in self.client.get('/api/vm').json()}
         self.assertEqual(vms[pendingVm.id]['state'], 'unknown')
 
@@ -130,9 +161,9 @@ class VmListTests(TestCase):
         self.assertNotIn(deadVm.id, [vm['id'] for vm in self.client.get('/api/vm').json()])
 
     def test_stacks_grouped_by_compose_label(self):
-        create_inner_container(self.ownVm, names='web-1', labels='com.docker.compose.project=web,x=y')
-        create_inner_container(self.ownVm, names='web-2', labels='com.docker.compose.project=web')
-        create_inner_container(self.ownVm, names='loose', labels='')   # compose-less → stack ''
+        create_inner_container(self.ownVm, names='web-1', stack_name='web')
+        create_inner_container(self.ownVm, names='web-2', stack_name='web')
+        create_inner_container(self.ownVm, names='loose', stack_name='')   # compose-less → stack ''
 
         login(self.client, 'user@test.local', 'test-pass-8')
         stacks = {stack['stackname']: stack for stack in self.client.get('/api/vm').json()[0]['stacks']}
@@ -156,6 +187,7 @@ class VmListTests(TestCase):
         self.assertIsNone(self.client.get(f'/api/vm/{self.ownVm.id}').json()['portforwards'])
 
         PortForward.objects.create(virtual_server=self.ownVm, public_port=30005, internal_port=3000, description='Minecraft')
+        refresh_snapshot()      # the monitor's next pass
         forwards = self.client.get('/api/vm').json()[0]['portforwards']
         self.assertEqual(forwards, [{'id': forwards[0]['id'], 'publichost': PORTFORWARD_PUBLIC_HOST,
                                      'publicport': 30005, 'internalport': 3000, 'description': 'Minecraft'}])
@@ -183,6 +215,91 @@ class VmListTests(TestCase):
 
 
 
+############################################################
+# VmListSnapshotTests
+############################################################
+#
+# The materialized list: versions move only on content
+# changes, ETag/If-None-Match answers 304, the ETag differs
+# per caller and scope, and request-side mutations are
+# visible on the very next poll.
+############################################################
+
+class VmListSnapshotTests(TestCase):
+
+    def setUp(self):
+        create_host_row()
+        self.user = create_system_user()
+        self.admin = create_system_user(email='admin@test.local', admin=True)
+        self.vm = create_vm(self.user, name='mine')
+        create_dind_row(self.vm)
+        login(self.client, 'user@test.local', 'test-pass-8')
+
+    def test_version_only_moves_when_a_card_changes(self):
+        firstVersion, _ = refresh_snapshot()
+        self.assertEqual(refresh_snapshot()[0], firstVersion)
+
+        DockerContainer.objects.filter(names=f'{DIND_PREFIX}{self.vm.id}').update(state='exited')
+        self.assertEqual(refresh_snapshot()[0], firstVersion + 1)
+
+    def test_unchanged_list_is_a_304(self):
+        response = self.client.get('/api/vm')
+        etag = response['ETag']
+        self.assertEqual(response.status_code, 200)
+
+        notModified = self.client.get('/api/vm', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(notModified.status_code, 304)
+        self.assertEqual(notModified.content, b'')
+        self.assertEqual(notModified['ETag'], etag)
+
+        # A changed card → a new version, a full body
+        DockerContainer.objects.filter(names=f'{DIND_PREFIX}{self.vm.id}').update(state='exited')
+        refresh_snapshot()
+        changed = self.client.get('/api/vm', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(changed.json()[0]['state'], 'exited')
+
+    def test_etag_differs_per_caller_and_scope(self):
+        ownTag = self.client.get('/api/vm')['ETag']
+        singleTag = self.client.get(f'/api/vm/{self.vm.id}')['ETag']
+
+        adminClient = self.client_class()
+        login(adminClient, 'admin@test.local', 'test-pass-8')
+        adminTag = adminClient.get('/api/vm')['ETag']
+        allTag = adminClient.get('/api/vm?showOtherUsers=true')['ETag']
+
+        self.assertEqual(len({ownTag, singleTag, adminTag, allTag}), 4)
+        self.assertEqual(adminClient.get('/api/vm', HTTP_IF_NONE_MATCH=ownTag).status_code, 200)
+
+    def test_own_mutation_is_visible_on_the_next_poll(self):
+        etag = self.client.get('/api/vm')['ETag']
+        post_json(self.client, '/api/vm/control', {'action': 'rename', 'virtualServerID': self.vm.id, 'newName': 'renamed'})
+
+        response = self.client.get('/api/vm', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['name'], 'renamed')
+
+    def test_stale_or_old_snapshot_is_rebuilt_by_the_reader(self):
+        refresh_snapshot()
+        VirtualServer.objects.filter(id=self.vm.id).update(name='behind its back')
+
+        # Not marked → served as stored, until it ages out
+        self.assertEqual(self.client.get('/api/vm').json()[0]['name'], 'mine')
+        VmListSnapshot.objects.update(built_at=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(self.client.get('/api/vm').json()[0]['name'], 'behind its back')
+
+        # Marked → rebuilt at once
+        VirtualServer.objects.filter(id=self.vm.id).update(name='marked')
+        mark_stale()
+        self.assertEqual(self.client.get('/api/vm').json()[0]['name'], 'marked')
+
+
+
+
+
+
+
+
 ############################################################
 # VmControlTests
 ############################################################
@@ -222,11 +339,12 @@ class VmControlTests(TestCase):
             self.assertEqual(response.status_code, 400, message)
             self.assertEqual(response.json()['message'], message)
 
-    @patch('control.hosting.api.vm_views.run_in_background', new=RUN_INLINE)
     @patch('control.hosting.docker_controller.create_vm', return_value=OK_RESPONSE)
     def test_create_accepts_and_builds_in_background(self, createMock):
         response = self.control({'action': 'create', 'name': '  Mano serveris (1)  '})
         self.assertEqual(response.status_code, 202)
+        createMock.assert_not_called()          # queued, not run in the request
+        self.assertEqual(run_queued_jobs(), 1)
 
         newVm = VirtualServer.objects.latest('id')
         self.assertEqual(newVm.name, 'Mano serveris (1)')   # stripped
@@ -236,14 +354,14 @@ class VmControlTests(TestCase):
         createMock.assert_called_once_with(f'{DIND_PREFIX}{newVm.id}')
         self.assertTrue(RecentActivity.objects.filter(message=f'Virtual server #{newVm.id} created').exists())
 
-    @patch('control.hosting.api.vm_views.run_in_background', new=RUN_INLINE)
-    @patch('control.hosting.docker_controller.create_vm', side_effect=requests.ConnectionError)
+    @patch('control.hosting.docker_controller.create_vm', return_value=FAIL_RESPONSE)
     def test_create_failure_soft_deletes_the_row_again(self, createMock):
         # The request still answers 202 — the failure happens in
-        # the background and shows as the card vanishing + the
+        # the job and shows as the card vanishing + the
         # activity entry
         response = self.control({'action': 'create', 'name': 'doomed'})
         self.assertEqual(response.status_code, 202)
+        run_queued_jobs()
 
         doomedVm = VirtualServer.objects.get(name='doomed')
         self.assertTrue(doomedVm.deleted)
@@ -271,7 +389,6 @@ class VmControlTests(TestCase):
         foreignVm = create_vm(self.admin)
         self.assertEqual(self.control({'virtualServerID': foreignVm.id, 'action': 'stop'}).status_code, 401)
 
-    @patch('control.hosting.api.vm_views.run_in_background', new=RUN_INLINE)
     @patch('control.hosting.docker_controller.update_portforwarder_config')
     @patch('control.hosting.docker_controller.update_caddy_config')
     @patch('control.hosting.docker_controller.delete_vm', return_value=OK_RESPONSE)
@@ -282,6 +399,7 @@ class VmControlTests(TestCase):
 
         response = self.control({'virtualServerID': self.vm.id, 'action': 'delete'})
         self.assertEqual(response.status_code, 202)
+        run_queued_jobs()
 
         self.assertTrue(VirtualServer.objects.get(id=self.vm.id).deleted)
         self.assertFalse(DomainName.objects.filter(virtual_server=self.vm).exists())
@@ -292,13 +410,17 @@ class VmControlTests(TestCase):
         # The cache rows are deliberately NOT touched here — the
         # monitor prunes them once the container is gone
 
-    @patch('control.hosting.api.vm_views.run_in_background', new=RUN_INLINE)
     @patch('control.hosting.docker_controller.update_portforwarder_config')
     @patch('control.hosting.docker_controller.update_caddy_config')
+    @patch('control.hosting.jobs.JOB_RETRY_BASE_SECONDS', 0)
     @patch('control.hosting.docker_controller.delete_vm', side_effect=requests.ConnectionError)
     def test_delete_failure_reverts_the_flag(self, deleteMock, caddyMock, portforwarderMock):
         response = self.control({'virtualServerID': self.vm.id, 'action': 'delete'})
         self.assertEqual(response.status_code, 202)
+        self.assertTrue(VirtualServer.objects.get(id=self.vm.id).deleted)   # intent committed
+        caddyMock.assert_not_called()           # no domains, nothing to remove
+        self.assertEqual(run_queued_jobs(), 5)  # every attempt retried, then failed
+        self.assertEqual(deleteMock.call_count, 5)
 
         # The card comes back and the activity says why
         self.assertFalse(VirtualServer.objects.get(id=self.vm.id).deleted)
@@ -320,6 +442,171 @@ class VmControlTests(TestCase):
 
 
 
+############################################################
+# VmBulkTests
+############################################################
+#
+# /api/vm/bulk: admin gate, all-or-nothing validation, the
+# up-front database changes, and the vm_bulk job recording
+# each VM's outcome from the sidecar's job report.
+############################################################
+
+class VmBulkTests(TestCase):
+
+    SIDECAR_JOB_ID = 'ab' * 16
+
+    def setUp(self):
+        create_host_row()
+        self.user = create_system_user()
+        self.admin = create_system_user(email='admin@test.local', admin=True)
+        self.vms = [create_vm(self.user, name=f'vm {i}') for i in range(3)]
+        self.vmIds = [thisVm.id for thisVm in self.vms]
+        login(self.client, 'admin@test.local', 'test-pass-8')
+
+    def job_report(self, states, done=True):
+        return SimpleNamespace(status_code=200, json=lambda: {
+            'job_id': self.SIDECAR_JOB_ID, 'action': 'stop', 'state': 'done' if done else 'running',
+            'total': len(states), 'counts': {'ok': list(states.values()).count('ok')},
+            'vms': {f'{DIND_PREFIX}{vmId}': {'state': state} for vmId, state in states.items()},
+        })
+
+    def accepted(self):
+        return SimpleNamespace(status_code=202, json=lambda: {'job_id': self.SIDECAR_JOB_ID, 'total': 3})
+
+    def host_listing(self, states):
+        return SimpleNamespace(status_code=200, json=lambda: {'containers': [
+            {'Names': f'{DIND_PREFIX}{vmId}', 'State': state} for vmId, state in states.items()
+        ]})
+
+    def test_admin_only(self):
+        login(self.client, 'user@test.local', 'test-pass-8')
+        response = post_json(self.client, '/api/vm/bulk', {'action': 'stop', 'virtualServerIDs': self.vmIds})
+        self.assertEqual(response.status_code, 401)
+
+    def test_validation_is_all_or_nothing(self):
+        self.assertEqual(post_json(self.client, '/api/vm/bulk', {'action': 'explode'}).status_code, 400)
+        self.assertEqual(post_json(self.client, '/api/vm/bulk', {'action': 'stop', 'virtualServerIDs': []}).status_code, 400)
+        self.assertEqual(post_json(self.client, '/api/vm/bulk', {'action': 'create', 'ownerIDs': [self.user.id], 'name': 'x'}).status_code, 400)
+
+        deadVm = create_vm(self.user, deleted=True)
+        response = post_json(self.client, '/api/vm/bulk', {'action': 'delete', 'virtualServerIDs': self.vmIds + [deadVm.id]})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json()['missing'], [deadVm.id])
+        self.assertFalse(VirtualServer.objects.filter(id__in=self.vmIds, deleted=True).exists())
+
+    @patch('control.hosting.docker_controller.get_bulk_job')
+    @patch('control.hosting.docker_controller.start_bulk')
+    def test_stop_records_each_outcome(self, startBulkMock, getJobMock):
+        startBulkMock.return_value = self.accepted()
+        getJobMock.return_value = self.job_report({self.vmIds[0]: 'ok', self.vmIds[1]: 'failed', self.vmIds[2]: 'ok'})
+
+        response = post_json(self.client, '/api/vm/bulk', {'action': 'stop', 'virtualServerIDs': self.vmIds + [self.vmIds[0]]})
+        self.assertEqual(response.status_code, 202)
+        startBulkMock.assert_not_called()       # queued, not run in the request
+        run_queued_jobs()
+        startBulkMock.assert_called_once_with('stop', [f'{DIND_PREFIX}{vmId}' for vmId in self.vmIds])
+
+        enabled = dict(VirtualServer.objects.filter(id__in=self.vmIds).values_list('id', 'enabled'))
+        self.assertEqual(enabled, {self.vmIds[0]: False, self.vmIds[1]: True, self.vmIds[2]: False})
+
+        # The job status API carries the per-VM progress
+        job = self.client.get(f'/api/jobs/{response.json()["jobId"]}').json()
+        self.assertEqual(job['state'], 'succeeded')
+        self.assertEqual([(entry['id'], entry['state']) for entry in job['result']['vms']],
+                         [(self.vmIds[0], 'ok'), (self.vmIds[1], 'failed'), (self.vmIds[2], 'ok')])
+        self.assertEqual(job['result']['failed'], [self.vmIds[1]])
+
+    @patch('control.hosting.jobs.BULK_POLL_SECONDS', 0)
+    @patch('control.hosting.docker_controller.update_portforwarder_config')
+    @patch('control.hosting.docker_controller.update_caddy_config')
+    @patch('control.hosting.docker_controller.get_bulk_job')
+    @patch('control.hosting.docker_controller.start_bulk')
+    def test_delete_commits_intent_then_reverts_failures(self, startBulkMock, getJobMock, caddyMock, portforwarderMock):
+        DomainName.objects.create(virtual_server=self.vms[0], domain_name='dies.test.lt')
+        startBulkMock.return_value = self.accepted()
+        getJobMock.side_effect = [
+            self.job_report({vmId: 'running' for vmId in self.vmIds}, done=False),
+            self.job_report({self.vmIds[0]: 'ok', self.vmIds[1]: 'ok', self.vmIds[2]: 'failed'}),
+        ]
+
+        response = post_json(self.client, '/api/vm/bulk', {'action': 'delete', 'virtualServerIDs': self.vmIds})
+        self.assertEqual(response.status_code, 202)
+        caddyMock.assert_called_once()          # once for the whole list
+        portforwarderMock.assert_called_once()
+        self.assertFalse(DomainName.objects.exists())
+        self.assertEqual(VirtualServer.objects.filter(id__in=self.vmIds, deleted=True).count(), 3)
+
+        run_queued_jobs()
+        deleted = dict(VirtualServer.objects.filter(id__in=self.vmIds).values_list('id', 'deleted'))
+        self.assertEqual(deleted, {self.vmIds[0]: True, self.vmIds[1]: True, self.vmIds[2]: False})
+
+    @patch('control.hosting.docker_controller.get_status')
+    @patch('control.hosting.docker_controller.get_bulk_job', return_value=SimpleNamespace(status_code=404))
+    @patch('control.hosting.docker_controller.start_bulk')
+    def test_create_makes_one_vm_per_owner_and_a_lost_job_reads_the_host(self, startBulkMock, getJobMock, getStatusMock):
+        startBulkMock.return_value = self.accepted()
+        response = post_json(self.client, '/api/vm/bulk', {'action': 'create', 'ownerIDs': [self.user.id, self.admin.id], 'name': ' Semestras '})
+        self.assertEqual(response.status_code, 202)
+
+        newIds = response.json()['virtualServerIDs']
+        newVms = VirtualServer.objects.filter(id__in=newIds).order_by('id')
+        self.assertEqual([thisVm.owner_id for thisVm in newVms], [self.user.id, self.admin.id])
+        self.assertEqual({thisVm.name for thisVm in newVms}, {'Semestras'})
+        self.assertFalse(any(thisVm.deleted for thisVm in newVms))
+
+        # The sidecar forgot the job → the host shows which
+        # dind was built before it did
+        getStatusMock.return_value = self.host_listing({newIds[0]: 'running'})
+        run_queued_jobs()
+        deleted = dict(VirtualServer.objects.filter(id__in=newIds).values_list('id', 'deleted'))
+        self.assertEqual(deleted, {newIds[0]: False, newIds[1]: True})
+        getStatusMock.assert_called_once_with('host')
+
+    @patch('control.hosting.docker_controller.update_portforwarder_config')
+    @patch('control.hosting.docker_controller.update_caddy_config')
+    @patch('control.hosting.docker_controller.get_status')
+    @patch('control.hosting.docker_controller.get_bulk_job')
+    @patch('control.hosting.docker_controller.start_bulk')
+    def test_a_forgotten_delete_fails_only_what_the_host_still_runs(self, startBulkMock, getJobMock, getStatusMock, caddyMock, portforwarderMock):
+        startBulkMock.return_value = self.accepted()
+        getJobMock.return_value = SimpleNamespace(status_code=404)
+        getStatusMock.side_effect = requests.ConnectionError('down')
+
+        response = post_json(self.client, '/api/vm/bulk', {'action': 'delete', 'virtualServerIDs': self.vmIds})
+        self.assertEqual(response.status_code, 202)
+
+        # The host cannot be read either → retried later, nothing reverted
+        run_queued_jobs()
+        job = BackgroundJob.objects.get(id=response.json()['jobId'])
+        self.assertEqual(job.state, 'queued')
+        self.assertEqual(VirtualServer.objects.filter(id__in=self.vmIds, deleted=True).count(), 3)
+
+        # The retry follows the same sidecar job; only the dind
+        # still on the host failed
+        getStatusMock.side_effect = None
+        getStatusMock.return_value = self.host_listing({self.vmIds[2]: 'exited'})
+        BackgroundJob.objects.filter(id=job.id).update(run_after=timezone.now())
+        run_queued_jobs()
+        startBulkMock.assert_called_once()
+        deleted = dict(VirtualServer.objects.filter(id__in=self.vmIds).values_list('id', 'deleted'))
+        self.assertEqual(deleted, {self.vmIds[0]: True, self.vmIds[1]: True, self.vmIds[2]: False})
+        self.assertEqual(self.client.get(f'/api/jobs/{job.id}').json()['result']['failed'], [self.vmIds[2]])
+
+    @patch('control.hosting.docker_controller.start_bulk', return_value=SimpleNamespace(status_code=400))
+    def test_refused_job_undoes_the_create(self, startBulkMock):
+        response = post_json(self.client, '/api/vm/bulk', {'action': 'create', 'ownerIDs': [self.user.id], 'name': 'doomed'})
+        self.assertEqual(response.status_code, 202)
+        run_queued_jobs()
+        self.assertTrue(VirtualServer.objects.get(name='doomed').deleted)
+        self.assertEqual(self.client.get(f'/api/jobs/{response.json()["jobId"]}').json()['state'], 'failed')
+
+
+
+
+
+
+
+
 ############################################################
 # DnsTests
 ############################################################
@@ -390,8 +677,11 @@ class DnsTests(TestCase):
         self.assertEqual(response.json(), {'message': 'ok'})
         self.assertFalse(DomainName.objects.filter(id=domainId).exists())
 
-        # Every mutation pushed a fresh users Caddyfile
-        self.assertEqual(caddyMock.call_count, 3)
+        # Every mutation pushed its change to the users Caddy
+        self.assertEqual([call.args[0][0]['op'] for call in caddyMock.call_args_list], ['add', 'update', 'remove'])
+        self.assertEqual(caddyMock.call_args_list[1].args[0][0]['domain'],
+                         {'id': domainId, 'virtualserverid': self.vm.id, 'domainname': 'kitas.test.lt', 'iscloudflare': 1, 'ssl': 0})
+        self.assertEqual(caddyMock.call_args_list[2].args[0], [{'op': 'remove', 'id': domainId}])
 
     @patch('control.hosting.docker_controller.update_caddy_config')
     def test_put_and_delete_are_scoped_to_the_vm(self, caddyMock):
@@ -415,9 +705,9 @@ class DnsTests(TestCase):
         self.assertEqual(response.json()['reason'], 'Domain name is already taken')
 
     @patch('control.hosting.docker_controller.update_caddy_config', side_effect=Exception('caddy down'))
-    def test_failed_caddy_push_rolls_the_change_back(self, caddyMock):
-        # ATOMIC_REQUESTS: the domain INSERT and the Caddy push
-        # succeed or fail together — no divergence
+    def test_failed_caddy_push_undoes_the_change(self, caddyMock):
+        # The INSERT committed before the push; the failed push
+        # undoes it and resends the table — no divergence
         failClient = self.client_class(raise_request_exception=False)
         login(failClient, 'user@test.local', 'test-pass-8')
 
@@ -425,6 +715,165 @@ class DnsTests(TestCase):
                              {'domainname': 'ghost.test.lt', 'iscloudflare': 0, 'ssl': 0})
         self.assertEqual(response.status_code, 500)
         self.assertFalse(DomainName.objects.filter(domain_name='ghost.test.lt').exists())
+        self.assertEqual([call.args for call in caddyMock.call_args_list][1], ())    # the full-table resend
+        self.assertEqual(ConfigGeneration.objects.get(name='caddy').generation, 2)   # the change, then its undo
+
+
+
+
+
+
+
+
+############################################################
+# CaddyDeltaTests
+############################################################
+#
+# update_caddy_config against a mocked sidecar session: a
+# delta labeled with its revision, the full table (labeled
+# with the revision read before it) when no delta is given
+# or the sidecar answers 409, and a failure that raises.
+############################################################
+
+def sidecar_response(statusCode, payload):
+    response = requests.Response()
+    response.status_code = statusCode
+    response._content = json.dumps(payload).encode()
+    return response
+
+
+
+class CaddyDeltaTests(TestCase):
+
+    def setUp(self):
+        self.domain = DomainName.objects.create(virtual_server=create_vm(create_system_user()), domain_name='mano.test.lt')
+        self.operations = [{'op': 'remove', 'id': 99}]
+        ConfigGeneration.objects.create(name='caddy', generation=4)
+
+    def test_a_change_sends_only_its_delta(self):
+        with patch('control.hosting.docker_controller.SESSION') as sessionMock:
+            sessionMock.post.return_value = sidecar_response(200, {'message': 'Caddy config updated', 'generation': 5})
+            docker_controller.update_caddy_config(self.operations, 5)
+
+        self.assertEqual(sessionMock.post.call_args.kwargs['json'], {'revision': 5, 'operations': self.operations})
+
+    def test_without_a_delta_the_full_table_is_sent(self):
+        with patch('control.hosting.docker_controller.SESSION') as sessionMock:
+            sessionMock.post.return_value = sidecar_response(200, {'message': 'Caddy config updated', 'generation': 4})
+            docker_controller.update_caddy_config()
+
+        self.assertEqual(sessionMock.post.call_args.kwargs['json'],
+                         {'revision': 4, 'domains': [docker_controller.domain_payload(self.domain)]})
+
+    def test_a_mismatch_resends_the_full_table(self):
+        with patch('control.hosting.docker_controller.SESSION') as sessionMock:
+            sessionMock.post.side_effect = [
+                sidecar_response(409, {'error': 'Generation mismatch', 'generation': 2}),
+                sidecar_response(200, {'message': 'Caddy config updated', 'generation': 4}),
+            ]
+            docker_controller.update_caddy_config(self.operations, 5)
+
+        self.assertEqual([call.kwargs['json'].keys() for call in sessionMock.post.call_args_list],
+                         [{'revision', 'operations'}, {'revision', 'domains'}])
+
+    def test_a_failure_raises_and_stores_nothing(self):
+        with patch('control.hosting.docker_controller.SESSION') as sessionMock:
+            sessionMock.post.return_value = sidecar_response(500, {'error': 'Caddy reload failed', 'generation': 4})
+            with self.assertRaises(requests.HTTPError):
+                docker_controller.update_caddy_config(self.operations, 5)
+
+        self.assertEqual(ConfigGeneration.objects.get(name='caddy').generation, 4)
+
+
+
+
+
+
+
+
+############################################################
+# ConfigPushTests
+############################################################
+#
+# The push runs after the commit, outside the SQLite write
+# lock: the sidecar call sees no open transaction and the
+# change already visible, and a second change commits while
+# the first one's push is still in flight — the overlap the
+# sidecar's coordinator folds into one reload. No test
+# transaction around it: the views commit for real.
+############################################################
+
+class ConfigPushTests(TransactionTestCase):
+
+    def setUp(self):
+        self.user = create_system_user()
+        self.vm = create_vm(self.user)
+        login(self.client, 'user@test.local', 'test-pass-8')
+
+    def test_the_push_sees_the_committed_change(self):
+        seen = []
+
+        def fake_push(operations=None, revision=None):
+            seen.append((connection.in_atomic_block, DomainName.objects.filter(domain_name='mano.test.lt').exists(), revision))
+
+        with patch('control.hosting.docker_controller.update_caddy_config', side_effect=fake_push):
+            response = post_json(self.client, f'/api/vm/dns/{self.vm.id}',
+                                 {'domainname': 'mano.test.lt', 'iscloudflare': 0, 'ssl': 0})
+
+        self.assertEqual(response.json(), {'message': 'ok'})
+        self.assertEqual(seen, [(False, True, 1)])
+
+    def test_a_change_commits_while_another_push_is_in_flight(self):
+        otherClient = self.client_class()
+        login(otherClient, 'user@test.local', 'test-pass-8')
+        pushes = []
+
+        def other_change():
+            try:
+                return post_json(otherClient, f'/api/vm/dns/{self.vm.id}',
+                                 {'domainname': 'kitas.test.lt', 'iscloudflare': 0, 'ssl': 0}).status_code
+            finally:
+                connection.close()
+
+        def fake_push(operations=None, revision=None):
+            pushes.append(revision)
+            if len(pushes) == 1:
+                # The first push is still "reloading" — the second
+                # request must get the write lock and finish
+                with ThreadPoolExecutor(max_workers=1) as executor:
+                    self.assertEqual(executor.submit(other_change).result(timeout=10), 200)
+
+        with patch('control.hosting.docker_controller.update_caddy_config', side_effect=fake_push):
+            response = post_json(self.client, f'/api/vm/dns/{self.vm.id}',
+                                 {'domainname': 'mano.test.lt', 'iscloudflare': 0, 'ssl': 0})
+
+        self.assertEqual(response.json(), {'message': 'ok'})
+        self.assertEqual(pushes, [1, 2])        # arrival order; the sidecar sorts by revision
+        self.assertEqual(DomainName.objects.filter(virtual_server=self.vm).count(), 2)
+
+    def test_a_failed_push_commits_its_undo_and_the_next_change_resyncs(self):
+        failClient = self.client_class(raise_request_exception=False)
+        login(failClient, 'user@test.local', 'test-pass-8')
+        calls = []
+
+        def fake_push(operations=None, revision=None):
+            calls.append((operations is not None, revision))
+            if len(calls) <= 2:
+                raise requests.ConnectionError('caddy down')   # the delta and the resend
+
+        with patch('control.hosting.docker_controller.update_caddy_config', side_effect=fake_push):
+            response = post_json(failClient, f'/api/vm/dns/{self.vm.id}',
+                                 {'domainname': 'ghost.test.lt', 'iscloudflare': 0, 'ssl': 0})
+            self.assertEqual(response.status_code, 500)
+            # The undo is committed, not rolled back with a request
+            self.assertFalse(DomainName.objects.filter(domain_name='ghost.test.lt').exists())
+            self.assertEqual(ConfigGeneration.objects.get(name='caddy').generation, 2)
+
+            # The next change carries revision 3 — past the gap the
+            # failure left, which the sidecar answers with a 409
+            post_json(self.client, f'/api/vm/dns/{self.vm.id}', {'domainname': 'mano.test.lt', 'iscloudflare': 0, 'ssl': 0})
+
+        self.assertEqual(calls, [(True, 1), (False, None), (True, 3)])
 
 
 
@@ -437,8 +886,9 @@ class DnsTests(TestCase):
 # CadvisorParsingTests
 ############################################################
 #
-# The pure cAdvisor-payload parser the monitor feeds — CPU%
-# math, memory extraction, and the skip rules.
+# The monitor's cAdvisor sampler and its pure payload
+# parsers — CPU% math, memory/disk extraction, the skip
+# rules, and /machine fetched only once.
 ############################################################
 
 class CadvisorParsingTests(TestCase):
@@ -475,6 +925,51 @@ class CadvisorParsingTests(TestCase):
         }
         self.assertEqual(parse_cadvisor_docker(payload, numCores=1), {})
 
+    def test_host_figures_from_the_root_container(self):
+        machine = {'num_cores': 4, 'memory_capacity': 8 << 30,
+                   'filesystems': [{'device': '/dev/sda1', 'capacity': 100 << 30}, {'device': '/dev/sdb1', 'capacity': 10 << 30}]}
+        latest = self.sample('2026-08-10T12:00:01.000000000Z', 2_000_000_000, 2 << 30)
+        latest['filesystem'] = [{'device': '/dev/sdb1', 'usage': 1 << 30}, {'device': '/dev/sda1', 'usage': 40 << 30}]
+        payload = {'stats': [self.sample('2026-08-10T12:00:00.000000000Z', 0, 0), latest]}
+
+        host = parse_cadvisor_host(payload, machine)
+        self.assertEqual((host['cpu_percent'], host['disk_bytes'], host['disk_total_bytes']), (50.0, 40 << 30, 100 << 30))
+        self.assertEqual(system_figures(host), {
+            'cpu_percent': 50.0, 'memory_percent': 25.0, 'disk_percent': 40.0, 'cpu_cores': 4,
+            'memory_total_gb': 8.0, 'memory_used_gb': 2.0, 'disk_total_gb': 100.0, 'disk_used_gb': 40.0,
+        })
+        self.assertIsNone(parse_cadvisor_host({'stats': []}, machine))
+
+    def test_host_disk_falls_back_to_the_largest_real_filesystem(self):
+        latest = self.sample('2026-08-10T12:00:00.000000000Z', 0, 0)
+        latest['filesystem'] = [
+            {'device': '/dev/loop3', 'capacity': 500 << 30, 'usage': 1},
+            {'device': 'overlay', 'capacity': 400 << 30, 'usage': 1},
+            {'device': '/dev/nvme0n1p2', 'capacity': 200 << 30, 'usage': 50 << 30},
+        ]
+        host = parse_cadvisor_host({'stats': [latest]}, {'num_cores': 2, 'memory_capacity': 1 << 30})
+        self.assertEqual((host['cpu_percent'], host['disk_bytes'], host['disk_total_bytes']), (None, 50 << 30, 200 << 30))
+        self.assertEqual(system_figures(host)['cpu_percent'], 0)
+
+    def test_sampler_fetches_machine_info_once(self):
+        payloads = {
+            '/api/v1.3/machine': {'num_cores': 2, 'memory_capacity': 1 << 30},
+            '/api/v1.3/docker': {},
+            '/api/v1.3/containers': {'stats': []},
+        }
+        fetched = []
+
+        def fake_get(url, timeout):
+            path = url[len('http://cadvisor'):]
+            fetched.append(path)
+            return SimpleNamespace(raise_for_status=lambda: None, json=lambda: payloads[path])
+
+        sampler = CadvisorSampler(baseUrl='http://cadvisor', session=SimpleNamespace(get=fake_get))
+        self.assertEqual(sampler.sample(), ({}, None))
+        sampler.sample()
+        self.assertEqual(fetched.count('/api/v1.3/machine'), 1)
+        self.assertEqual(fetched.count('/api/v1.3/containers'), 2)
+
     def test_update_clears_stopped_vms_and_skips_unknown_ids(self):
         owner = create_system_user(email='mon@test.local')
         runningVm = create_vm(owner)
@@ -501,6 +996,547 @@ class CadvisorParsingTests(TestCase):
 
 
 
+############################################################
+# DiskRefreshTests
+############################################################
+#
+# The NDJSON disk stream consumed line by line: every VM
+# line is upserted as it arrives, unknown ids are skipped,
+# and a stream cut mid-way keeps what was already written.
+############################################################
+
+class FakeStream:
+
+    def __init__(self, lines, failAfter=None):
+        self.status_code = 200
+        self.lines = lines
+        self.failAfter = failAfter
+
+    def iter_lines(self):
+        for n, line in enumerate(self.lines):
+            if n == self.failAfter:
+                raise requests.ConnectionError('stream cut')
+            yield line.encode()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+
+class DiskRefreshTests(TestCase):
+
+    def setUp(self):
+        owner = create_system_user()
+        self.vms = [create_vm(owner), create_vm(owner)]
+
+    @staticmethod
+    def line(vmId, megabytes):
+        return f'{{"id": "{vmId}", "bytes": {megabytes * 1048576}, "elapsed_ms": 1.0}}'
+
+    def test_lines_are_upserted_and_unknown_ids_skipped(self):
+        lines = [self.line(self.vms[1].id, 20), '', self.line(999999, 5), self.line(self.vms[0].id, 10)]
+        with patch('control.hosting.docker_controller.get_disk_usage', return_value=FakeStream(lines)):
+            refresh_disk_usage()
+
+        self.assertEqual(VmUsage.objects.get(virtual_server=self.vms[0]).disk_mb, 10)
+        self.assertEqual(VmUsage.objects.get(virtual_server=self.vms[1]).disk_mb, 20)
+        self.assertFalse(VmUsage.objects.filter(virtual_server_id=999999).exists())
+
+    def test_cut_stream_keeps_the_lines_already_read(self):
+        lines = [self.line(self.vms[0].id, 10), self.line(self.vms[1].id, 20)]
+        with patch('control.hosting.docker_controller.get_disk_usage', return_value=FakeStream(lines, failAfter=1)):
+            refresh_disk_usage()
+
+        self.assertEqual(VmUsage.objects.get(virtual_server=self.vms[0]).disk_mb, 10)
+        self.assertFalse(VmUsage.objects.filter(virtual_server=self.vms[1]).exists())
+
+
+
+
+
+
+
+
+############################################################
+# ContainerPushTests
+############################################################
+#
+# The batched full-pass writer: one upsert + one delete per
+# parent, unchanged snapshots skipped entirely, and the
+# batched dind adoption on the host pass.
+############################################################
+
+class ContainerPushTests(TestCase):
+
+    @staticmethod
+    def snapshot(*containers):
+        return {'containers': [
+            {'ID': dockerId, 'Command': '"sh"', 'CreatedAt': '', 'Image': 'nginx', 'Labels': '',
+             'Mounts': '', 'Names': names, 'Networks': '', 'Ports': '', 'RunningFor': '',
+             'Size': 'N/A', 'State': state, 'Status': 'Up'}
+            for dockerId, names, state in containers
+        ]}
+
+    def setUp(self):
+        forget_snapshots()
+        create_host_row()
+        self.vm = create_vm(create_system_user())
+
+    def tearDown(self):
+        forget_snapshots()
+
+    def test_unchanged_snapshot_writes_nothing(self):
+        first = push_docker_info_to_db(self.snapshot(('a', 'web-1', 'running'), ('b', 'db-1', 'running')), self.vm.id)
+        self.assertEqual(first['written'], 2)
+
+        with self.assertNumQueries(0):
+            second = push_docker_info_to_db(self.snapshot(('a', 'web-1', 'running'), ('b', 'db-1', 'running')), self.vm.id)
+        self.assertEqual(second, {'written': 0, 'removed': 0, 'lock_ms': 0.0})
+
+    def test_only_changed_rows_are_written_and_unseen_rows_dropped(self):
+        push_docker_info_to_db(self.snapshot(('a', 'web-1', 'running'), ('b', 'db-1', 'running')), self.vm.id)
+        result = push_docker_info_to_db(self.snapshot(('a', 'web-1', 'exited')), self.vm.id)
+
+        self.assertEqual((result['written'], result['removed']), (1, 1))
+        rows = {row.docker_id: row.state for row in DockerContainer.objects.filter(parent_server=self.vm)}
+        self.assertEqual(rows, {'a': 'exited'})
+
+    def test_forgotten_snapshot_rewrites_in_full(self):
+        push_docker_info_to_db(self.snapshot(('a', 'web-1', 'running')), self.vm.id)
+        DockerContainer.objects.filter(parent_server=self.vm).delete()      # changed behind its back
+        forget_snapshots(self.vm.id)
+
+        push_docker_info_to_db(self.snapshot(('a', 'web-1', 'running')), self.vm.id)
+        self.assertTrue(DockerContainer.objects.filter(parent_server=self.vm, docker_id='a').exists())
+
+    def test_host_pass_adopts_unknown_dinds_once(self):
+        push_docker_info_to_db(self.snapshot(
+            ('own', f'{DIND_PREFIX}{self.vm.id}', 'running'),
+            ('orphan', f'{DIND_PREFIX}515151', 'running'),
+            ('junk', f'{DIND_PREFIX}abc', 'running'),    # non-numeric — never adopted
+        ), parentServerID=0)
+
+        self.assertIsNone(VirtualServer.objects.get(id=515151).owner_id)
+        self.assertEqual(VirtualServer.objects.get(id=self.vm.id).owner_id, self.vm.owner_id)   # untouched
+        self.assertEqual(DockerContainer.objects.filter(parent_server_id=0).count(), 3)
+
+    def test_an_unchanged_running_dind_without_a_row_is_adopted(self):
+        snapshot = self.snapshot(('orphan', f'{DIND_PREFIX}515151', 'running'), ('gone', f'{DIND_PREFIX}616161', 'exited'))
+        push_docker_info_to_db(snapshot, parentServerID=0)
+        VirtualServer.objects.filter(id__in=[515151, 616161]).delete()      # the rows went missing, the dinds did not
+
+        result = push_docker_info_to_db(snapshot, parentServerID=0)
+        self.assertEqual(result['written'], 0)                                  # nothing in the snapshot changed...
+        self.assertTrue(VirtualServer.objects.filter(id=515151).exists())       # ...the running one is adopted anyway
+        self.assertFalse(VirtualServer.objects.filter(id=616161).exists())
+
+        with self.assertNumQueries(1):                                          # and then it is one SELECT again
+            push_docker_info_to_db(snapshot, parentServerID=0)
+
+
+
+
+
+
+
+
+
+############################################################
+# ContainerStructureTests
+############################################################
+#
+# Labels, ports and networks stored structured: the
+# sidecar's structured forms are taken as they are, an older
+# sidecar's strings are parsed, the CLI strings come back
+# out, and the children follow their container.
+############################################################
+
+class ContainerStructureTests(TestCase):
+
+    LEGACY = {
+        'ID': 'a', 'Command': '"sh"', 'CreatedAt': '', 'Image': 'nginx', 'Mounts': '', 'Names': 'web-1',
+        'Labels': 'com.docker.compose.project=shop,tags=a,b,empty=',
+        'Ports': '0.0.0.0:8080->80/tcp, [::]:8080->80/tcp, 443/tcp, 7000-7001/udp',
+        'Networks': 'shop_default,bridge',
+        'RunningFor': '', 'Size': 'N/A', 'State': 'running', 'Status': 'Up',
+    }
+
+    def setUp(self):
+        forget_snapshots()
+        create_host_row()
+        self.vm = create_vm(create_system_user())
+
+    def tearDown(self):
+        forget_snapshots()
+
+    def test_legacy_strings_are_parsed(self):
+        push_docker_info_to_db({'containers': [self.LEGACY]}, self.vm.id)
+        row = DockerContainer.objects.get(parent_server=self.vm)
+
+        self.assertEqual(row.labels, {'com.docker.compose.project': 'shop', 'tags': 'a,b', 'empty': ''})
+        self.assertEqual(row.stack_name, 'shop')
+        self.assertEqual(row.ports_text, '0.0.0.0:8080->80/tcp, [::]:8080->80/tcp, 443/tcp')     # ranges are dropped
+        self.assertEqual(row.networks_text, 'shop_default,bridge')
+
+    def test_structured_forms_win_and_children_are_replaced(self):
+        push_docker_info_to_db({'containers': [self.LEGACY]}, self.vm.id)
+        structured = {
+            **self.LEGACY,
+            'LabelMap': {'com.docker.compose.project': 'shop, too'},
+            'PortList': [{'ip': '', 'public': None, 'private': 9000, 'type': 'tcp'}],
+            'NetworkList': ['shop_default'],
+        }
+        self.assertEqual(push_docker_info_to_db({'containers': [structured]}, self.vm.id)['written'], 1)
+
+        row = DockerContainer.objects.get(parent_server=self.vm)
+        self.assertEqual((row.stack_name, row.ports_text, row.networks_text), ('shop, too', '9000/tcp', 'shop_default'))
+        self.assertEqual(DockerContainerPort.objects.count(), 1)
+
+    def test_children_are_queryable_and_die_with_the_row(self):
+        push_docker_info_to_db({'containers': [self.LEGACY]}, self.vm.id)
+        self.assertEqual(
+            list(DockerContainer.objects.filter(port_list__public_port=8080).distinct().values_list('names', flat=True)),
+            ['web-1'],
+        )
+        self.assertTrue(DockerContainer.objects.filter(network_list__name='bridge').exists())
+
+        push_docker_info_to_db({'containers': []}, self.vm.id)
+        self.assertEqual((DockerContainerPort.objects.count(), DockerContainerNetwork.objects.count()), (0, 0))
+
+
+
+
+
+
+
+
+############################################################
+# ContainerEventTests
+############################################################
+#
+# The --events mode's delta application: upsert on a delta
+# with a container, delete without one, dind adoption from
+# host deltas, and unknown parents dropped.
+############################################################
+
+class ContainerEventTests(TestCase):
+
+    @staticmethod
+    def legacy(names, dockerId='abc', state='running'):
+        return {
+            'ID': dockerId, 'Command': '"sh"', 'CreatedAt': '', 'Image': 'nginx', 'Labels': '',
+            'Mounts': '', 'Names': names, 'Networks': '', 'Ports': '', 'RunningFor': '',
+            'Size': 'N/A', 'State': state, 'Status': 'Up 1 second',
+        }
+
+    def setUp(self):
+        create_host_row()
+        self.vm = create_vm(create_system_user())
+
+    def test_start_upserts_and_die_updates_the_row(self):
+        parent = f'{DIND_PREFIX}{self.vm.id}'
+        apply_container_event({'parent': parent, 'action': 'start', 'id': 'abc', 'container': self.legacy('web-1')})
+        apply_container_event({'parent': parent, 'action': 'die', 'id': 'abc',
+                               'container': self.legacy('web-1', state='exited')})
+
+        row = DockerContainer.objects.get(parent_server=self.vm, docker_id='abc')
+        self.assertEqual(row.state, 'exited')
+
+    def test_destroy_deletes_only_that_parents_row(self):
+        create_inner_container(self.vm, names='web-1')
+        rowId = DockerContainer.objects.get(parent_server=self.vm).docker_id
+
+        apply_container_event({'parent': 'host', 'action': 'destroy', 'id': rowId, 'container': None})
+        self.assertTrue(DockerContainer.objects.filter(docker_id=rowId).exists())   # wrong parent
+
+        apply_container_event({'parent': f'{DIND_PREFIX}{self.vm.id}', 'action': 'destroy', 'id': rowId, 'container': None})
+        self.assertFalse(DockerContainer.objects.filter(docker_id=rowId).exists())
+
+    def test_host_create_adopts_an_unknown_dind(self):
+        apply_container_event({'parent': 'host', 'action': 'create', 'id': 'dind',
+                               'container': self.legacy(f'{DIND_PREFIX}424242', dockerId='dind', state='created')})
+
+        adopted = VirtualServer.objects.get(id=424242)
+        self.assertIsNone(adopted.owner_id)
+        self.assertTrue(DockerContainer.objects.filter(parent_server_id=0, docker_id='dind').exists())
+
+    def test_unknown_vm_parent_is_dropped(self):
+        apply_container_event({'parent': f'{DIND_PREFIX}999999', 'action': 'start', 'id': 'x',
+                               'container': self.legacy('web-1', dockerId='x')})
+        apply_container_event({'parent': 'not-a-parent', 'action': 'start', 'id': 'y',
+                               'container': self.legacy('web-1', dockerId='y')})
+        self.assertFalse(DockerContainer.objects.filter(docker_id__in=['x', 'y']).exists())
+
+
+
+
+
+
+
+
+############################################################
+# SqliteTuningTests
+############################################################
+#
+# settings.SQLITE_PRAGMAS reach every connection, and the
+# monitor's checkpoint answers SQLite's triple (the in-memory
+# test database has no WAL: -1 pages). No test transaction
+# around it: the monitor checkpoints in autocommit.
+############################################################
+
+class SqliteTuningTests(TransactionTestCase):
+
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_connections_are_tuned_on_connect(self):
+        self.assertEqual(self.pragma('synchronous'), 1)         # NORMAL
+        self.assertEqual(self.pragma('temp_store'), 2)          # MEMORY
+        self.assertEqual(self.pragma('cache_size'), -32768)
+        self.assertEqual(self.pragma('journal_size_limit'), 67108864)
+
+    def test_checkpoint_reports_pages(self):
+        self.assertEqual(checkpoint_wal(), (0, -1, -1))
+
+
+
+
+
+
+
+
+############################################################
+# QueryPlanTests
+############################################################
+#
+# EXPLAIN QUERY PLAN of the hot queries names the index
+# meant for them (models.py) — a model or query change that
+# silently falls back to a table scan fails here. Plans are
+# SQLite's, on the empty test database: no ANALYZE stats, so
+# these are the plans a fresh deployment gets.
+############################################################
+
+class QueryPlanTests(TestCase):
+
+    def query_plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return ' | '.join(row[-1] for row in cursor.fetchall())
+
+    def assertPlanUses(self, queryset, indexName):
+        plan = self.query_plan(queryset)
+        self.assertIn(f'INDEX {indexName} ', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_monitor_pass_queries(self):
+        self.assertPlanUses(
+            DockerContainer.objects.filter(parent_server_id=0, names__startswith=DIND_PREFIX, state='running').values_list('names'),
+            'dockercontainer_parent_names',
+        )
+        self.assertPlanUses(DockerContainer.objects.filter(parent_server_id=7).exclude(docker_id__in=['a', 'b']), 'dockercontainer_parent_names')
+        self.assertPlanUses(DockerContainer.objects.filter(synced_at__lt=timezone.now()), 'dockercontainer_synced_at')
+
+    def test_structured_container_queries(self):
+        self.assertPlanUses(DockerContainer.objects.filter(parent_server_id=7, stack_name='web'), 'dockercontainer_parent_stack')
+        self.assertPlanUses(DockerContainerPort.objects.filter(public_port=8080), 'containerport_public')
+
+    def test_usage_history_queries(self):
+        since = timezone.now()
+        # The unique constraint's own (auto) index serves the range read
+        plan = self.query_plan(
+            UsageSample.objects.filter(virtual_server_id=7, resolution=60, bucket_start__gte=since).order_by('bucket_start')
+        )
+        self.assertIn('(virtual_server_id=? AND resolution=? AND bucket_start>?)', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+        self.assertPlanUses(UsageSample.objects.filter(resolution=3, bucket_start__lt=since), 'usagesample_retention')
+
+    def test_owner_queries(self):
+        self.assertPlanUses(VirtualServer.objects.filter(owner_id=7, deleted=False).values('id')[:1], 'virtualserver_owner_deleted')
+        self.assertIn('COVERING INDEX', self.query_plan(VirtualServer.objects.filter(owner_id=7, deleted=False).values('id')[:1]))
+
+    def test_activity_feed_needs_no_sort(self):
+        # SQLite indexes end in the rowid, so the user_id FK index
+        # already yields a user's rows in id order
+        plan = self.query_plan(RecentActivity.objects.filter(user_id=7).order_by('-id')[:500])
+        self.assertIn('(user_id=?)', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+
+
+
+
+
+
+
+############################################################
+# VmStatusFanOutTests
+############################################################
+#
+# The per-VM fetch of the full pass: the sidecar batch maps
+# onto the same outcomes; in the fallback the fetches
+# overlap, a timeout or error stays confined to its VM, a
+# fetch hung past the pass budget is given up on, and the
+# nearest-rank stats name the stragglers.
+############################################################
+
+class VmStatusFanOutTests(TestCase):
+
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(max_workers=4)
+
+    def tearDown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def test_fetches_run_concurrently_up_to_the_pool_size(self):
+        barrier = threading.Barrier(4, timeout=2)
+
+        def fake_status(hostname, timeout):
+            barrier.wait()      # only passes if all four are in flight at once
+            return SimpleNamespace(text='{"containers": []}')
+
+        hostnames = [f'{DIND_PREFIX}{n}' for n in range(4)]
+        with patch('control.hosting.docker_controller.get_status', side_effect=fake_status):
+            results = list(fetch_vm_statuses(self.executor, hostnames, concurrency=4, deadline=1))
+
+        self.assertEqual(sorted(r[0] for r in results), hostnames)
+        self.assertTrue(all(r[3] == 'ok' and r[1] == {'containers': []} for r in results))
+
+    def test_timeout_and_error_stay_confined_to_their_vm(self):
+        def fake_status(hostname, timeout):
+            if hostname.endswith('1'):
+                raise requests.Timeout('read timed out')
+            if hostname.endswith('2'):
+                raise requests.ConnectionError('refused')
+            return SimpleNamespace(text='{"containers": []}')
+
+        hostnames = [f'{DIND_PREFIX}{n}' for n in range(1, 4)]
+        with patch('control.hosting.docker_controller.get_status', side_effect=fake_status):
+            stats = summarize_fetches(list(fetch_vm_statuses(self.executor, hostnames, concurrency=4, deadline=1)))
+
+        self.assertEqual(stats['vms'], 3)
+        self.assertEqual(stats['timed_out'], [f'{DIND_PREFIX}1'])
+        self.assertEqual(stats['failed'], [f'{DIND_PREFIX}2'])
+
+    def test_fetch_hung_past_the_pass_budget_is_given_up(self):
+        release = threading.Event()
+
+        def fake_status(hostname, timeout):
+            release.wait(5)     # ignores its deadline, like a wedged socket
+            return SimpleNamespace(text='{"containers": []}')
+
+        with patch('control.hosting.docker_controller.get_status', side_effect=fake_status):
+            results = list(fetch_vm_statuses(self.executor, [f'{DIND_PREFIX}7'], concurrency=4, deadline=0.01))
+        release.set()
+
+        self.assertEqual([(r[0], r[3]) for r in results], [(f'{DIND_PREFIX}7', 'timeout')])
+
+    def test_a_slow_consumer_loses_no_finished_fetch(self):
+        hostnames = [f'{DIND_PREFIX}{n}' for n in range(8)]
+        with patch('control.hosting.docker_controller.get_status', return_value=SimpleNamespace(text='{"containers": []}')):
+            results = []
+            for result in fetch_vm_statuses(self.executor, hostnames, concurrency=4, deadline=0.05):
+                time.sleep(0.2)         # the DB writes outlast the 1.1 s budget
+                results.append(result)
+
+        self.assertEqual(sorted(r[0] for r in results), hostnames)
+        self.assertTrue(all(r[3] == 'ok' for r in results))
+
+    def test_batch_entries_map_to_the_same_outcomes(self):
+        body = ('{"vms": {"a": {"containers": [], "elapsed_ms": 3.0}, "b": {"error": "Timed out", "timed_out": true, '
+                '"elapsed_ms": 2000.0}, "c": {"error": "Error from c: 502", "elapsed_ms": 1.0}}, "elapsed_ms": 2001.0}')
+        with patch('control.hosting.docker_controller.get_status_batch',
+                   return_value=SimpleNamespace(status_code=200, text=body)) as batchMock:
+            results = fetch_vm_statuses_batch(['a', 'b', 'c'])
+
+        batchMock.assert_called_once_with(['a', 'b', 'c'])
+        self.assertEqual([(r[0], r[1], r[3]) for r in results],
+                         [('a', {'containers': []}, 'ok'), ('b', None, 'timeout'), ('c', None, 'error: Error from c: 502')])
+
+    def test_failed_batch_raises_for_the_fallback(self):
+        with patch('control.hosting.docker_controller.get_status_batch', return_value=FAIL_RESPONSE):
+            with self.assertRaises(RuntimeError):
+                fetch_vm_statuses_batch(['a'])
+
+    def test_stats_are_nearest_rank(self):
+        results = [(f'h{n}', None, float(n), 'ok') for n in range(1, 101)]
+        stats = summarize_fetches(results)
+        self.assertEqual((stats['p50_ms'], stats['p99_ms']), (50.0, 99.0))
+        self.assertEqual(summarize_fetches([])['vms'], 0)
+
+
+
+
+
+
+
+
+############################################################
+# HttpPoolTests
+############################################################
+#
+# The shared keep-alive session against a real loopback
+# server: sequential calls reuse one connection (and the
+# counters say so), and a Set-Cookie never sticks to the
+# shared session.
+############################################################
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.send_header('Set-Cookie', 'virtual-server-id=7')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, *args):
+        pass
+
+
+
+class HttpPoolTests(TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.baseUrl = f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_sequential_calls_reuse_one_connection(self):
+        session = build_session(poolSize=4)
+        before = pool_stats()
+        for n in range(5):
+            self.assertEqual(session.get(f'{self.baseUrl}/call/{n}', timeout=2).text, 'ok')
+        after = pool_stats()
+        session.close()
+
+        self.assertEqual(after['requests'] - before['requests'], 5)
+        self.assertEqual(after['opened'] - before['opened'], 1)
+
+    def test_response_cookies_are_not_kept(self):
+        session = build_session(poolSize=4)
+        session.get(f'{self.baseUrl}/', timeout=2)
+        session.close()
+        self.assertEqual(len(session.cookies), 0)
+
+
+
+
+
+
+
+
 ############################################################
 # SshRouterTests
 ############################################################
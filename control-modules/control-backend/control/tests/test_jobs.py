@@ -0,0 +1,277 @@
+############################################################
+#  [*] Background job tests — queue, retries, runner, API
+#
+#  Pins the hosting/jobs contract: requests only insert rows,
+#  claims are exclusive, transient failures back off
+#  exponentially until max_attempts, final failures run the
+#  kind's hook, interrupted jobs are recovered per kind, the
+#  runner never exceeds its concurrency, and /api/jobs shows
+#  each caller their own jobs (admins all). The docker
+#  sidecar is mocked everywhere.
+#
+#  Convention: one banner per test class; test methods carry
+#  descriptive names instead of banners.
+############################################################
+
+import threading
+import time
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import requests
+from django.test import TestCase
+from django.utils import timezone
+
+from control.tests.helpers import create_host_row, create_system_user, create_vm, login, post_json, run_queued_jobs
+from control.hosting.jobs import (
+    JobRunner,
+    claim_next_job,
+    enqueue_job,
+    recover_interrupted_jobs,
+    run_job,
+)
+from control.hosting.models import BackgroundJob, VirtualServer
+from control.users.models import RecentActivity
+
+
+OK_RESPONSE = SimpleNamespace(status_code=200)
+FAIL_RESPONSE = SimpleNamespace(status_code=500)
+
+
+
+
+
+
+
+
+############################################################
+# JobQueueTests
+############################################################
+#
+# Admission, claiming, retry/backoff and failure handling.
+############################################################
+
+class JobQueueTests(TestCase):
+
+    def setUp(self):
+        create_host_row()
+        self.user = create_system_user()
+        self.vm = create_vm(self.user)
+        login(self.client, 'user@test.local', 'test-pass-8')
+
+    def host_listing(self, names):
+        return SimpleNamespace(status_code=200, json=lambda: {'containers': [{'Names': name, 'State': 'running'} for name in names]})
+
+    @patch('control.hosting.docker_controller.create_vm')
+    def test_a_burst_of_creates_is_admitted_without_threads(self, createMock):
+        threadsBefore = threading.active_count()
+        for i in range(50):
+            response = post_json(self.client, '/api/vm/control', {'action': 'create', 'name': f'burst {i}'})
+            self.assertEqual(response.status_code, 202)
+
+        self.assertEqual(threading.active_count(), threadsBefore)
+        self.assertEqual(BackgroundJob.objects.filter(kind='vm_create', state='queued').count(), 50)
+        createMock.assert_not_called()
+
+        jobId = response.json()['jobId']
+        self.assertEqual(BackgroundJob.objects.get(id=jobId).payload, {'virtualServerID': VirtualServer.objects.latest('id').id})
+
+    def test_claims_are_exclusive_and_respect_run_after(self):
+        dueJob = enqueue_job('vm_create', {'virtualServerID': self.vm.id}, self.user.id)
+        laterJob = enqueue_job('vm_create', {'virtualServerID': self.vm.id}, self.user.id)
+        BackgroundJob.objects.filter(id=laterJob.id).update(run_after=timezone.now() + timedelta(minutes=1))
+
+        claimed = claim_next_job()
+        self.assertEqual((claimed.id, claimed.state, claimed.attempts), (dueJob.id, 'running', 1))
+        self.assertIsNone(claim_next_job())     # running is not claimable; the other is not due
+
+    @patch('control.hosting.docker_controller.create_vm', side_effect=requests.ConnectionError('refused'))
+    def test_transient_failures_back_off_exponentially(self, createMock):
+        thisJob = enqueue_job('vm_create', {'virtualServerID': self.vm.id}, self.user.id)
+
+        for attempt, expectedDelay in [(1, 5), (2, 10)]:
+            BackgroundJob.objects.filter(id=thisJob.id).update(run_after=timezone.now())
+            before = timezone.now()
+            run_job(claim_next_job())
+            thisJob.refresh_from_db()
+            self.assertEqual((thisJob.state, thisJob.attempts), ('queued', attempt))
+            self.assertIn('Sidecar unreachable', thisJob.last_error)
+            delay = (thisJob.run_after - before).total_seconds()
+            self.assertTrue(expectedDelay <= delay < expectedDelay + 1, delay)
+
+        # The last attempt fails the job for good — and the
+        # create's failure hook soft-deletes the row
+        BackgroundJob.objects.filter(id=thisJob.id).update(run_after=timezone.now())
+        run_job(claim_next_job())
+        thisJob.refresh_from_db()
+        self.assertEqual((thisJob.state, thisJob.attempts), ('failed', 3))
+        self.assertIsNotNone(thisJob.finished_at)
+        self.assertTrue(VirtualServer.objects.get(id=self.vm.id).deleted)
+
+    @patch('control.hosting.docker_controller.create_vm', return_value=FAIL_RESPONSE)
+    def test_a_final_failure_is_not_retried(self, createMock):
+        enqueue_job('vm_create', {'virtualServerID': self.vm.id}, self.user.id)
+        self.assertEqual(run_queued_jobs(), 1)
+
+        thisJob = BackgroundJob.objects.get()
+        self.assertEqual((thisJob.state, thisJob.attempts, thisJob.last_error), ('failed', 1, 'Sidecar answered 500'))
+        self.assertTrue(RecentActivity.objects.filter(message=f'Virtual server #{self.vm.id} creation failed').exists())
+
+    @patch('control.hosting.docker_controller.delete_vm', return_value=OK_RESPONSE)
+    def test_success_and_unknown_kinds(self, deleteMock):
+        deleteJob = enqueue_job('vm_delete', {'virtualServerID': self.vm.id}, self.user.id)
+        strangeJob = enqueue_job('vm_explode', {}, self.user.id)
+        self.assertEqual(run_queued_jobs(), 2)
+
+        deleteJob.refresh_from_db()
+        strangeJob.refresh_from_db()
+        self.assertEqual((deleteJob.state, deleteJob.result), ('succeeded', {}))
+        self.assertEqual((strangeJob.state, strangeJob.last_error), ('failed', 'Unknown job kind: vm_explode'))
+
+    @patch('control.hosting.docker_controller.create_vm', return_value=OK_RESPONSE)
+    @patch('control.hosting.docker_controller.get_status')
+    def test_interrupted_jobs_are_recovered_per_kind(self, getStatusMock, createMock):
+        createJob = enqueue_job('vm_create', {'virtualServerID': self.vm.id}, self.user.id)
+        deleteJob = enqueue_job('vm_delete', {'virtualServerID': self.vm.id}, self.user.id)
+        BackgroundJob.objects.update(state='running')
+        BackgroundJob.objects.filter(id=createJob.id).update(result={'sent': True})    # cut off mid-call
+
+        self.assertEqual(recover_interrupted_jobs(), 2)
+        createJob.refresh_from_db()
+        deleteJob.refresh_from_db()
+        self.assertEqual((createJob.state, deleteJob.state), ('queued', 'queued'))
+
+        # The dind was never built → the create runs again
+        getStatusMock.return_value = self.host_listing([])
+        BackgroundJob.objects.filter(id=deleteJob.id).delete()
+        run_queued_jobs()
+        createMock.assert_called_once_with(f'hosting-users-dind-{self.vm.id}')
+        self.assertEqual(BackgroundJob.objects.get(id=createJob.id).state, 'succeeded')
+        self.assertFalse(VirtualServer.objects.get(id=self.vm.id).deleted)
+
+    @patch('control.hosting.docker_controller.create_vm', side_effect=requests.ReadTimeout('image still starting'))
+    @patch('control.hosting.docker_controller.get_status')
+    def test_a_timed_out_create_asks_the_host_instead_of_failing(self, getStatusMock, createMock):
+        thisJob = enqueue_job('vm_create', {'virtualServerID': self.vm.id}, self.user.id)
+        run_job(claim_next_job())
+        thisJob.refresh_from_db()
+        self.assertEqual((thisJob.state, thisJob.result), ('queued', {'sent': True}))
+        self.assertFalse(VirtualServer.objects.get(id=self.vm.id).deleted)
+
+        # The sidecar finished it after all → a success, no second create
+        getStatusMock.return_value = self.host_listing([f'hosting-users-dind-{self.vm.id}'])
+        BackgroundJob.objects.filter(id=thisJob.id).update(run_after=timezone.now())
+        run_job(claim_next_job())
+        thisJob.refresh_from_db()
+        self.assertEqual(thisJob.state, 'succeeded')
+        self.assertEqual(createMock.call_count, 1)
+        self.assertFalse(VirtualServer.objects.get(id=self.vm.id).deleted)
+
+    @patch('control.hosting.docker_controller.create_vm', side_effect=requests.ReadTimeout('image still starting'))
+    @patch('control.hosting.docker_controller.get_status')
+    def test_timeouts_that_run_out_keep_a_dind_the_host_has(self, getStatusMock, createMock):
+        thisJob = enqueue_job('vm_create', {'virtualServerID': self.vm.id}, self.user.id, maxAttempts=1)
+        getStatusMock.return_value = self.host_listing([f'hosting-users-dind-{self.vm.id}'])
+        run_job(claim_next_job())
+        thisJob.refresh_from_db()
+        self.assertEqual(thisJob.state, 'failed')
+        self.assertFalse(VirtualServer.objects.get(id=self.vm.id).deleted)    # no orphan: the row owns it
+
+        getStatusMock.return_value = self.host_listing([])
+        otherVm = create_vm(self.user)
+        enqueue_job('vm_create', {'virtualServerID': otherVm.id}, self.user.id, maxAttempts=1)
+        run_queued_jobs()
+        self.assertTrue(VirtualServer.objects.get(id=otherVm.id).deleted)
+
+
+
+
+
+
+
+
+############################################################
+# JobRunnerTests
+############################################################
+#
+# The concurrency bound, with the database taken out: claims
+# come from a list, each job just sleeps and counts.
+############################################################
+
+class JobRunnerTests(TestCase):
+
+    def test_runner_never_exceeds_its_concurrency(self):
+        pending = [SimpleNamespace(id=i) for i in range(10)]
+        lock = threading.Lock()
+        active = {'now': 0, 'max': 0, 'done': 0}
+
+        def fake_claim():
+            with lock:
+                return pending.pop() if pending else None
+
+        def fake_run(thisJob):
+            with lock:
+                active['now'] += 1
+                active['max'] = max(active['max'], active['now'])
+            time.sleep(0.02)
+            with lock:
+                active['now'] -= 1
+                active['done'] += 1
+
+        runner = JobRunner(concurrency=3)
+        with patch('control.hosting.jobs.claim_next_job', new=fake_claim), \
+             patch('control.hosting.jobs.run_job', new=fake_run):
+            deadline = time.monotonic() + 5
+            while active['done'] < 10 and time.monotonic() < deadline:
+                runner.fill_slots()
+                time.sleep(0.005)
+        runner.executor.shutdown(wait=True)
+
+        self.assertEqual(active['done'], 10)
+        self.assertEqual(active['max'], 3)
+
+
+
+
+
+
+
+
+############################################################
+# JobApiTests
+############################################################
+#
+# /api/jobs and /api/jobs/<id>: own jobs for everyone, all
+# jobs for admins.
+############################################################
+
+class JobApiTests(TestCase):
+
+    def setUp(self):
+        self.user = create_system_user()
+        self.other = create_system_user(email='other@test.local')
+        self.admin = create_system_user(email='admin@test.local', admin=True)
+        self.ownJob = enqueue_job('vm_create', {'virtualServerID': 1}, self.user.id)
+        self.otherJob = enqueue_job('vm_create', {'virtualServerID': 2}, self.other.id)
+        BackgroundJob.objects.filter(id=self.otherJob.id).update(state='failed', last_error='boom')
+
+    def test_users_see_their_own_jobs(self):
+        login(self.client, 'user@test.local', 'test-pass-8')
+        self.assertEqual([thisJob['id'] for thisJob in self.client.get('/api/jobs').json()], [self.ownJob.id])
+
+        job = self.client.get(f'/api/jobs/{self.ownJob.id}').json()
+        self.assertEqual((job['kind'], job['state'], job['attempts'], job['lasterror']), ('vm_create', 'queued', 0, None))
+        self.assertIsNotNone(job['runafter'])
+
+        self.assertEqual(self.client.get(f'/api/jobs/{self.otherJob.id}').status_code, 401)
+        self.assertEqual(self.client.get('/api/jobs/999999').status_code, 404)
+
+    def test_admins_see_all_and_can_filter(self):
+        login(self.client, 'admin@test.local', 'test-pass-8')
+        self.assertEqual([thisJob['id'] for thisJob in self.client.get('/api/jobs').json()], [self.otherJob.id, self.ownJob.id])
+        failed = self.client.get('/api/jobs?state=failed').json()
+        self.assertEqual([(thisJob['id'], thisJob['lasterror']) for thisJob in failed], [(self.otherJob.id, 'boom')])
+
+    def test_login_required(self):
+        self.assertEqual(self.client.get('/api/jobs').status_code, 401)
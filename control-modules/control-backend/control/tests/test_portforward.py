@@ -236,10 +236,9 @@ class PortForwardCrudTests(TestCase):
         self.assertEqual(response.json()['reason'], 'Description is too long')
 
     @patch('control.hosting.docker_controller.update_portforwarder_config', side_effect=Exception('portforwarder down'))
-    def test_failed_portforwarder_push_rolls_the_change_back(self, portforwarderMock):
-        # ATOMIC_REQUESTS: the forward INSERT and the
-        # portforwarder push succeed or fail together — no
-        # divergence
+    def test_failed_portforwarder_push_undoes_the_change(self, portforwarderMock):
+        # The INSERT committed before the push; the failed push
+        # undoes it and resends the table — no divergence
         failClient = self.client_class(raise_request_exception=False)
         login(failClient, 'user@test.local', 'test-pass-8')
 
@@ -247,3 +246,4 @@ class PortForwardCrudTests(TestCase):
                              {'publicport': PORT_A, 'internalport': 3000, 'description': ''})
         self.assertEqual(response.status_code, 500)
         self.assertFalse(PortForward.objects.filter(public_port=PORT_A).exists())
+        self.assertEqual(portforwarderMock.call_count, 2)     # the push, then the resend
@@ -0,0 +1,223 @@
+############################################################
+#  [*] VM push tests — hub, stream protocol, HTTP endpoint
+#
+#  Pins hosting/vm_push: the hub turns snapshots into per-VM
+#  changes, a stream sends a snapshot then only what its
+#  scope may see (vm-removed when a VM leaves it), resumes
+#  from Last-Event-ID, falls back to a snapshot when the
+#  history is gone, and ends when access is lost. The HTTP
+#  test runs the real threaded server on a free port.
+#
+#  Convention: one banner per test class; test methods carry
+#  descriptive names instead of banners.
+############################################################
+
+import http.client
+import json
+import threading
+from unittest.mock import patch
+
+from django.test import TestCase
+
+from control.common.auth import SessionUser
+from control.tests.helpers import create_system_user, login
+from control.hosting.vm_push import (
+    VmEventsHandler,
+    VmPushHub,
+    VmPushServer,
+    resolve_session_user,
+    stream_events,
+)
+
+
+def card(vmId, name='vm', state='running'):
+    return json.dumps({'id': vmId, 'name': name, 'state': state}, separators=(',', ':'))
+
+
+
+class ClientGone(OSError):
+    pass
+
+
+
+def run_stream(hub, visible, frameLimit, allowed=lambda: True, lastEventId=None, heartbeatSeconds=0.05):
+    """Runs stream_events until frameLimit frames were written; returns the parsed frames."""
+    frames = []
+
+    def write(data):
+        frames.append(data.decode())
+        if len(frames) >= frameLimit:
+            raise ClientGone()
+
+    try:
+        stream_events(hub, visible, write, allowed, lastEventId=lastEventId, heartbeatSeconds=heartbeatSeconds)
+    except ClientGone:
+        pass
+    return [parse_frame(thisFrame) for thisFrame in frames[1:]]     # [0] is the retry hint
+
+
+
+def parse_frame(frame):
+    if frame.startswith(':'):
+        return ('keepalive', None, None)
+    fields = dict(line.split(': ', 1) for line in frame.strip().split('\n'))
+    return (fields['event'], fields['id'], json.loads(fields['data']))
+
+
+
+
+
+
+
+
+############################################################
+# VmPushHubTests
+############################################################
+#
+# Snapshots in, per-VM changes out.
+############################################################
+
+class VmPushHubTests(TestCase):
+
+    def test_only_differences_become_changes(self):
+        hub = VmPushHub()
+        hub.publish([(1, 10, card(1)), (2, 20, card(2))])
+        self.assertEqual(hub.lastChangeId, 2)
+
+        hub.publish([(1, 10, card(1)), (2, 20, card(2))])
+        self.assertEqual(hub.lastChangeId, 2)       # nothing changed
+
+        hub.publish([(1, 10, card(1, state='exited'))])
+        self.assertEqual(hub.changes_after(2, 0), [(3, 1, 10, card(1, state='exited')), (4, 2, 20, None)])
+
+    def test_history_gap_and_timeout(self):
+        hub = VmPushHub(history=2)
+        for i in range(1, 5):
+            hub.publish([(1, 10, card(1, name=f'v{i}'))])
+        self.assertIsNone(hub.changes_after(1, 0))      # changes 2.. are gone
+        self.assertEqual([thisChange[0] for thisChange in hub.changes_after(2, 0)], [3, 4])
+        self.assertEqual(hub.changes_after(4, 0.01), [])
+
+
+
+
+
+
+
+
+############################################################
+# StreamEventsTests
+############################################################
+#
+# The protocol, driven directly — no sockets.
+############################################################
+
+class StreamEventsTests(TestCase):
+
+    def setUp(self):
+        self.hub = VmPushHub()
+        self.hub.publish([(1, 10, card(1)), (2, 20, card(2))])
+        self.ownOnly = lambda vmId, ownerId: ownerId == 10
+
+    def test_snapshot_is_scoped(self):
+        frames = run_stream(self.hub, self.ownOnly, frameLimit=2)
+        self.assertEqual(frames[0], ('snapshot', f'{self.hub.boot}-2', [json.loads(card(1))]))
+
+    def test_changes_follow_the_scope(self):
+        def publisher():
+            self.hub.publish([(1, 10, card(1, state='exited')), (2, 20, card(2, state='exited'))])
+            self.hub.publish([(1, 20, card(1, state='exited')), (2, 20, card(2, state='exited'))])   # re-owned
+
+        threading.Timer(0.02, publisher).start()
+        frames = run_stream(self.hub, self.ownOnly, frameLimit=4, heartbeatSeconds=1)
+
+        self.assertEqual([(event, data) for event, _, data in frames[1:]], [
+            ('vm', json.loads(card(1, state='exited'))),      # VM 2 is not ours — never sent
+            ('vm-removed', {'id': 1}),                        # left our scope
+        ])
+
+    def test_resume_sends_only_what_was_missed(self):
+        self.hub.publish([(1, 10, card(1, state='exited'))])
+        self.hub.publish([(2, 20, card(2))])     # VM 1 gone
+        frames = run_stream(self.hub, self.ownOnly, frameLimit=3, lastEventId=f'{self.hub.boot}-2')
+        self.assertEqual([event for event, _, _ in frames], ['vm', 'vm-removed'])
+
+    def test_unknown_or_stale_event_id_gets_a_snapshot(self):
+        for lastEventId in ['0-1', f'{self.hub.boot}-99', 'garbage']:
+            frames = run_stream(self.hub, self.ownOnly, frameLimit=2, lastEventId=lastEventId)
+            self.assertEqual(frames[0][0], 'snapshot', lastEventId)
+
+    def test_idle_stream_keeps_alive_and_ends_without_access(self):
+        frames = run_stream(self.hub, self.ownOnly, frameLimit=4)
+        self.assertEqual([event for event, _, _ in frames], ['snapshot', 'keepalive', 'keepalive'])
+
+        allowed = iter([True, False])
+        frames = run_stream(self.hub, self.ownOnly, frameLimit=10, allowed=lambda: next(allowed))
+        self.assertEqual([event for event, _, _ in frames], ['snapshot', 'keepalive'])
+
+
+
+
+
+
+
+
+############################################################
+# VmPushHttpTests
+############################################################
+#
+# Session resolution and the real endpoint: headers, access
+# rules, framing.
+############################################################
+
+class VmPushHttpTests(TestCase):
+
+    def setUp(self):
+        self.hub = VmPushHub()
+        self.hub.publish([(1, 10, card(1)), (2, 20, card(2))])
+
+        handler = type('TestHandler', (VmEventsHandler,), {'hub': self.hub})
+        self.server = VmPushServer(('127.0.0.1', 0), handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get(self, path):
+        connection = http.client.HTTPConnection('127.0.0.1', self.server.server_address[1], timeout=5)
+        connection.request('GET', path)
+        return connection.getresponse()
+
+    def test_session_cookie_resolves_to_the_user(self):
+        thisUser = create_system_user()
+        login(self.client, 'user@test.local', 'test-pass-8')
+        sessionKey = self.client.cookies['session'].value
+
+        self.assertEqual(resolve_session_user(f'session={sessionKey}').id, thisUser.id)
+        self.assertIsNone(resolve_session_user('session=nope'))
+        self.assertIsNone(resolve_session_user(None))
+
+    def test_no_session_is_401(self):
+        with patch('control.hosting.vm_push.resolve_session_user', return_value=None):
+            self.assertEqual(self.get('/api/vm/events').status, 401)
+
+    def test_other_users_is_admin_only(self):
+        student = SessionUser(10, 'user@test.local', '', 0, 1)
+        with patch('control.hosting.vm_push.resolve_session_user', return_value=student):
+            self.assertEqual(self.get('/api/vm/events?showOtherUsers=true').status, 401)
+            self.assertEqual(self.get('/api/vm/other').status, 404)
+
+    def test_stream_opens_with_the_scoped_snapshot(self):
+        student = SessionUser(10, 'user@test.local', '', 0, 1)
+        with patch('control.hosting.vm_push.resolve_session_user', return_value=student):
+            response = self.get('/api/vm/events')
+            self.assertEqual(response.status, 200)
+            self.assertEqual(response.getheader('Content-Type'), 'text/event-stream')
+
+            self.assertEqual(response.fp.readline(), b'retry: 3000\n')
+            response.fp.readline()
+            self.assertEqual(response.fp.readline(), f'id: {self.hub.boot}-2\n'.encode())
+            self.assertEqual(response.fp.readline(), b'event: snapshot\n')
+            self.assertEqual(json.loads(response.fp.readline().decode()[len('data: '):]), [json.loads(card(1))])
+            response.close()
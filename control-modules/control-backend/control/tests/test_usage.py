@@ -0,0 +1,185 @@
+############################################################
+#  [*] Usage history tests — buffers, rollups, series, API
+#
+#  Pins hosting/usage_history: passes are buffered (bounded)
+#  and written on flush, closed minutes and hours are rolled
+#  up from the finer rows, retention prunes, a failed flush
+#  keeps its passes, the series are downsampled, and the two
+#  endpoints follow the VM / admin access rules.
+#
+#  Convention: one banner per test class; test methods carry
+#  descriptive names instead of banners.
+############################################################
+
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+from unittest.mock import patch
+
+from django.test import TestCase
+
+from control.tests.helpers import create_host_row, create_system_user, create_vm, login
+from control.hosting.models import UsageSample
+from control.hosting.usage_history import HOST_SERIES_ID, UsageHistory, load_series, top_consumers
+
+
+T0 = datetime(2026, 8, 10, 12, 0, 0, tzinfo=dt_timezone.utc)
+
+
+
+
+
+
+
+
+############################################################
+# UsageHistoryTests
+############################################################
+#
+# The monitor's side: record, flush, roll up, prune.
+############################################################
+
+class UsageHistoryTests(TestCase):
+
+    def setUp(self):
+        create_host_row()
+        self.vm = create_vm(create_system_user())
+        self.history = UsageHistory(bufferSamples=100)
+
+    def test_flush_writes_buffered_passes_and_skips_unknown_vms(self):
+        self.history.record_disk(self.vm.id, 700)
+        self.history.record(self.vm.id, 10.0, 256, moment=T0)
+        self.history.record(999999, 1.0, 1, moment=T0)                     # no such VM
+        self.history.record(HOST_SERIES_ID, 40.0, 4096, diskMb=9000, moment=T0)
+
+        self.assertEqual(self.history.flush(T0 + timedelta(seconds=3))['written'], 2)
+        rows = {row.virtual_server_id: (row.cpu_percent, row.memory_mb, row.disk_mb) for row in UsageSample.objects.filter(resolution=3)}
+        self.assertEqual(rows, {self.vm.id: (10.0, 256, 700), HOST_SERIES_ID: (40.0, 4096, 9000)})
+        self.assertEqual(self.history.flush(T0 + timedelta(seconds=6))['written'], 0)
+
+    def test_buffers_are_bounded(self):
+        history = UsageHistory(bufferSamples=5)
+        for i in range(20):
+            history.record(self.vm.id, float(i), 1, moment=T0 + timedelta(seconds=3 * i))
+        history.flush(T0 + timedelta(seconds=60))
+
+        kept = list(UsageSample.objects.filter(resolution=3).order_by('bucket_start').values_list('cpu_percent', flat=True))
+        self.assertEqual(kept, [15.0, 16.0, 17.0, 18.0, 19.0])         # the oldest dropped first
+
+    def test_closed_minutes_and_hours_are_rolled_up_once(self):
+        for i in range(20):     # the first minute, 3 s apart
+            self.history.record(self.vm.id, 10.0 if i % 2 else 30.0, 100 + i, moment=T0 + timedelta(seconds=3 * i))
+        self.history.record(self.vm.id, 99.0, 1, moment=T0 + timedelta(seconds=61))     # the open minute
+
+        self.assertEqual(self.history.flush(T0 + timedelta(seconds=62))['rolled'], 1)
+        minute = UsageSample.objects.get(resolution=60)
+        self.assertEqual((minute.bucket_start, minute.cpu_percent, minute.cpu_max_percent, minute.memory_mb),
+                         (T0, 20.0, 30.0, 110))
+
+        self.assertEqual(self.history.flush(T0 + timedelta(seconds=90))['rolled'], 0)
+        self.assertEqual(self.history.flush(T0 + timedelta(hours=1, seconds=5))['rolled'], 2)    # 12:01 and the hour
+        self.assertEqual(UsageSample.objects.get(resolution=3600).cpu_max_percent, 99.0)
+
+    def test_retention_prunes_old_buckets(self):
+        self.history.record(self.vm.id, 1.0, 1, moment=T0)
+        self.history.flush(T0 + timedelta(seconds=61))      # rolls the minute up
+        result = self.history.flush(T0 + timedelta(hours=3))
+
+        self.assertEqual(result['pruned'], 1)
+        self.assertFalse(UsageSample.objects.filter(resolution=3).exists())
+        self.assertTrue(UsageSample.objects.filter(resolution=60).exists())
+
+    def test_a_failed_flush_keeps_its_passes(self):
+        self.history.record(self.vm.id, 5.0, 1, moment=T0)
+        with patch('control.hosting.usage_history.roll_up', side_effect=RuntimeError('database is locked')):
+            with self.assertRaises(RuntimeError):
+                self.history.flush(T0 + timedelta(seconds=3))
+        self.assertFalse(UsageSample.objects.exists())
+
+        self.assertEqual(self.history.flush(T0 + timedelta(seconds=6))['written'], 1)
+
+
+
+
+
+
+
+
+############################################################
+# UsageSeriesTests
+############################################################
+#
+# The readers: resolution choice, downsampling, ranking.
+############################################################
+
+class UsageSeriesTests(TestCase):
+
+    def setUp(self):
+        owner = create_system_user()
+        self.quiet = create_vm(owner, name='quiet')
+        self.noisy = create_vm(owner, name='noisy')
+
+    def minutes(self, vm, cpuPercents, start):
+        UsageSample.objects.bulk_create([
+            UsageSample(virtual_server=vm, resolution=60, bucket_start=start + timedelta(minutes=i),
+                        cpu_percent=cpu, cpu_max_percent=cpu, memory_mb=100, disk_mb=i)
+            for i, cpu in enumerate(cpuPercents)
+        ])
+
+    def test_series_is_downsampled_from_the_retained_resolution(self):
+        now = T0 + timedelta(days=1)
+        self.minutes(self.quiet, [10.0, 20.0, 30.0, 40.0, 50.0, 60.0], start=now - timedelta(minutes=10))
+
+        step, points = load_series(self.quiet.id, '1d', now=now)
+        self.assertEqual(step, 300)             # 1,440 minutes → 5-minute points
+        self.assertEqual([(thisPoint['cpu_percent'], thisPoint['cpu_max_percent'], thisPoint['disk_mb']) for thisPoint in points],
+                         [(30.0, 50.0, 4), (60.0, 60.0, 5)])
+        self.assertEqual(load_series(self.quiet.id, '1h', now=now), (12, []))     # raw rows only
+
+    def test_top_consumers_rank_by_mean_cpu(self):
+        now = T0 + timedelta(hours=1)
+        self.minutes(self.quiet, [1.0, 3.0], start=now - timedelta(minutes=30))
+        self.minutes(self.noisy, [80.0, 60.0], start=now - timedelta(minutes=30))
+
+        ranked = top_consumers('6h', now=now)
+        self.assertEqual([(thisVm['name'], thisVm['cpu_percent'], thisVm['cpu_max_percent']) for thisVm in ranked],
+                         [('noisy', 70.0, 80.0), ('quiet', 2.0, 3.0)])
+
+
+
+
+
+
+
+
+############################################################
+# UsageApiTests
+############################################################
+#
+# /api/vm/usage/<id> and /api/dashboard/usage.
+############################################################
+
+class UsageApiTests(TestCase):
+
+    def setUp(self):
+        create_host_row()
+        self.user = create_system_user()
+        self.other = create_system_user(email='other@test.local')
+        create_system_user(email='admin@test.local', admin=True)
+        self.vm = create_vm(self.user)
+        self.otherVm = create_vm(self.other)
+
+    def test_owners_read_their_own_vms(self):
+        login(self.client, 'user@test.local', 'test-pass-8')
+        response = self.client.get(f'/api/vm/usage/{self.vm.id}?range=7d')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'range': '7d', 'step_seconds': 3600, 'points': []})
+
+        self.assertEqual(self.client.get(f'/api/vm/usage/{self.otherVm.id}').status_code, 401)
+        self.assertEqual(self.client.get('/api/vm/usage/0').status_code, 401)          # the host is dashboard-only
+        self.assertEqual(self.client.get(f'/api/vm/usage/{self.vm.id}?range=2y').status_code, 400)
+
+    def test_admins_read_the_host(self):
+        login(self.client, 'admin@test.local', 'test-pass-8')
+        payload = self.client.get('/api/dashboard/usage?range=1h').json()
+        self.assertEqual(set(payload), {'range', 'step_seconds', 'points', 'top_cpu'})
+        self.assertEqual(self.client.get(f'/api/vm/usage/{self.otherVm.id}').status_code, 200)
@@ -15,11 +15,15 @@
 ############################################################
 
 from datetime import timedelta
+from unittest.mock import patch
 
 import bcrypt
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
+from control.common.auth import SIGNED_SESSION_ENGINE, bump_auth_generation, revoke_sessions
 from control.tests.helpers import create_system_user, create_vm, login, post_json
 from control.users.models import RecentActivity, RegistrationCode, SystemUser
 
@@ -193,6 +197,141 @@ class CheckauthTests(TestCase):
 
 
 
+############################################################
+# AuthCacheTests
+############################################################
+#
+# The per-process auth cache: a warm forward_auth gate costs
+# no query, and every change that takes access away —
+# through the API here, or committed by another process —
+# cuts it off on the very next request.
+############################################################
+
+class AuthCacheTests(TestCase):
+
+    def setUp(self):
+        self.user = create_system_user()
+        self.admin = create_system_user(email='admin@test.local', admin=True)
+        self.vm = create_vm(self.user)
+        login(self.client, 'user@test.local', 'test-pass-8')
+        self.adminClient = self.client_class()
+        login(self.adminClient, 'admin@test.local', 'test-pass-8')
+
+    def edit_user(self, thisUser, admin, enabled):
+        return post_json(self.adminClient, '/api/admin/users', {
+            'action': 'insertupdate', 'id': thisUser.id, 'email': thisUser.email,
+            'admin': admin, 'enabled': enabled, 'password': '',
+        })
+
+    def test_a_warm_gate_runs_no_query(self):
+        gatePath = f'/api/checkauth/vm/{self.vm.id}'
+        self.assertEqual(self.client.get(gatePath).status_code, 200)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(gatePath).status_code, 200)
+        self.assertEqual([query['sql'] for query in queries.captured_queries if 'SAVEPOINT' not in query['sql']], [])
+
+    def test_a_login_keeps_everyone_elses_warm_gate(self):
+        gatePath = f'/api/checkauth/vm/{self.vm.id}'
+        self.assertEqual(self.client.get(gatePath).status_code, 200)
+
+        login(self.client_class(), 'admin@test.local', 'test-pass-8')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(gatePath).status_code, 200)
+        self.assertEqual([query['sql'] for query in queries.captured_queries if 'SAVEPOINT' not in query['sql']], [])
+
+    def test_disabling_through_the_api_cuts_a_warm_session(self):
+        self.assertEqual(self.client.get('/api/checkauth').status_code, 200)
+        self.assertEqual(self.edit_user(self.user, admin=0, enabled=0).json(), {'type': 'ok'})
+        self.assertEqual(self.client.get('/api/checkauth').status_code, 401)
+
+    def test_demoting_closes_the_admin_gate(self):
+        create_system_user(email='second@test.local', admin=True)
+        secondClient = self.client_class()
+        login(secondClient, 'second@test.local', 'test-pass-8')
+        self.assertEqual(secondClient.get('/api/checkauth/admin').status_code, 200)
+
+        self.edit_user(SystemUser.objects.get(email='second@test.local'), admin=0, enabled=1)
+        self.assertEqual(secondClient.get('/api/checkauth/admin').status_code, 401)
+
+    @patch('control.hosting.docker_controller.update_portforwarder_config')
+    @patch('control.hosting.docker_controller.update_caddy_config')
+    def test_deleting_a_vm_closes_its_gate(self, caddyMock, forwarderMock):
+        gatePath = f'/api/checkauth/vm/{self.vm.id}'
+        self.assertEqual(self.client.get(gatePath).status_code, 200)
+
+        post_json(self.client, '/api/vm/control', {'action': 'delete', 'virtualServerID': self.vm.id})
+        self.assertEqual(self.client.get(gatePath).status_code, 401)
+
+    def test_another_process_invalidates_through_the_generation(self):
+        self.assertEqual(self.client.get('/api/checkauth').status_code, 200)
+
+        # A change this process was not told about is served from
+        # the cache (for at most AUTH_CACHE_SECONDS)...
+        SystemUser.objects.filter(id=self.user.id).update(enabled=False)
+        self.assertEqual(self.client.get('/api/checkauth').status_code, 200)
+
+        # ...until the committing process moves the generation
+        bump_auth_generation()
+        self.assertEqual(self.client.get('/api/checkauth').status_code, 401)
+
+
+
+
+
+
+
+
+############################################################
+# SignedSessionTests
+############################################################
+#
+# SESSION_BACKEND=signed: the cookie carries the session, so
+# nothing touches django_session, and a logout still ends it
+# server-side through the user's session epoch.
+############################################################
+
+@override_settings(SESSION_ENGINE=SIGNED_SESSION_ENGINE)
+class SignedSessionTests(TestCase):
+
+    def setUp(self):
+        self.user = create_system_user()
+
+    def test_sessions_never_touch_the_session_table(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(login(self.client, 'user@test.local', 'test-pass-8').status_code, 200)
+            bump_auth_generation()      # a cold resolution
+            self.assertEqual(self.client.get('/api/checkauth').json()['id'], self.user.id)
+        self.assertFalse([query for query in queries.captured_queries if 'django_session' in query['sql']])
+
+    def test_logout_revokes_every_copy_of_the_cookie(self):
+        login(self.client, 'user@test.local', 'test-pass-8')
+        otherDevice = self.client_class()
+        login(otherDevice, 'user@test.local', 'test-pass-8')
+        replayed = self.client_class()
+        replayed.cookies['session'] = self.client.cookies['session'].value
+
+        post_json(self.client, '/api/logout', {})
+        self.assertEqual(SystemUser.objects.get(id=self.user.id).session_epoch, 1)
+        self.assertEqual(replayed.get('/api/checkauth').status_code, 401)
+        self.assertEqual(otherDevice.get('/api/checkauth').status_code, 401)
+
+        login(self.client, 'user@test.local', 'test-pass-8')
+        self.assertEqual(self.client.get('/api/checkauth').status_code, 200)
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.db')
+    def test_db_sessions_obey_the_epoch_too(self):
+        login(self.client, 'user@test.local', 'test-pass-8')
+        revoke_sessions(self.user.id)
+        self.assertEqual(self.client.get('/api/checkauth').status_code, 401)
+
+
+
+
+
+
+
+
 ############################################################
 # RegisterTests
 ############################################################
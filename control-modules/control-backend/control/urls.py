@@ -68,21 +68,31 @@ urlpatterns += [
 # The VM list/detail, the control actions proxied to the
 # docker sidecar, the domain CRUD that regenerates the users
 # Caddyfile, the port forward CRUD that regenerates the
-# portforwarder Caddyfile, and the shared-secret endpoint the
-# external SSH router calls to route server<N> logins.
+# portforwarder Caddyfile, the background jobs the slow
+# create/delete/bulk work runs as, each VM's usage history,
+# and the shared-secret endpoint the external SSH router
+# calls to route server<N> logins.
 #
 # Views live in control/hosting/api/.
 ############################################################
 
 from control.hosting.api.vm_views import vm_list, vm_control
+from control.hosting.api.bulk_views import vm_bulk
+from control.hosting.api.job_views import job_list, job_detail
 from control.hosting.api.dns_views import dns_isvalid, vm_dns
 from control.hosting.api.portforward_views import portforward_isvalid, vm_portforward
 from control.hosting.api.sshrouter_views import sshrouter
+from control.hosting.api.usage_views import vm_usage_history
 
 urlpatterns += [
     path('api/vm', vm_list),                                                # GET  — all visible VMs (?showOtherUsers= for admins)
     path('api/vm/control', vm_control),                                     # POST — create/start/stop/delete/rename
     path('api/vm/<int:virtualServerID>', vm_list),                          # GET  — one VM as an object, 404 while not visible
+    path('api/vm/bulk', vm_bulk),                                           # POST — admin; one action over many VMs → job id
+    path('api/vm/usage/<int:virtualServerID>', vm_usage_history),           # GET  — CPU/RAM/disk history (?range=1h…90d)
+
+    path('api/jobs', job_list),                                             # GET  — recent background jobs (own; admins all)
+    path('api/jobs/<int:jobId>', job_detail),                               # GET  — one job: state, attempts, error, progress
 
     path('api/vm/dns/isvalid', dns_isvalid),                                # GET  — live domain-name validation
     path('api/vm/dns/<int:virtualServerID>', vm_dns),                       # GET list / POST add / PUT edit
@@ -109,15 +119,17 @@ urlpatterns += [
 # The three admin-only endpoints the dashboard polls every
 # 2 seconds: host metrics from cAdvisor (+ Docker Hub pull
 # limits through the exit proxy), the global activity feed
-# and the platform totals.
+# and the platform totals — plus the host's usage history
+# on demand.
 #
 # Views live in control/dashboard/api/.
 ############################################################
 
-from control.dashboard.api.dashboard_views import dashboard_system, dashboard_recentactivity, dashboard_hostingsystem
+from control.dashboard.api.dashboard_views import dashboard_system, dashboard_recentactivity, dashboard_hostingsystem, dashboard_usage
 
 urlpatterns += [
     path('api/dashboard/system', dashboard_system),                         # GET — CPU/RAM/disk + Docker Hub pull limits
     path('api/dashboard/recentactivity', dashboard_recentactivity),         # GET — newest 5 activity rows, all users
     path('api/dashboard/hostingsystem', dashboard_hostingsystem),           # GET — user/VM/domain totals
+    path('api/dashboard/usage', dashboard_usage),                           # GET — host usage history + top CPU VMs (?range=)
 ]
@@ -13,7 +13,7 @@
 #    - /api/checkauth/admin is the forward_auth gate for
 #      /dbgate/* and /swagger
 #
-#  POST /api/logout flushes the session server-side — the
+#  POST /api/logout ends the session server-side — the
 #  cookie is HttpOnly, so JavaScript cannot delete it; the
 #  login page calls the endpoint on mount instead.
 #
@@ -28,18 +28,26 @@ import re
 from datetime import timedelta
 
 import bcrypt
+from django.db import transaction
 from django.http import JsonResponse
 from django.utils import timezone
 
 from control.common.auth import (
     DUMMY_BCRYPT_HASH,
     admin_required,
+    auth_cache_get,
+    auth_cache_put,
     check_user_is_allowed_to_access_vm,
     get_json,
     get_user_by_email,
+    invalidate_auth_cache,
     log_activity,
     login,
     login_required,
+    read_auth_generation,
+    revoke_sessions,
+    sessions_are_signed,
+    user_for_session,
 )
 from control.users.models import RegistrationCode, SystemUser
 
@@ -125,9 +133,12 @@ def login_view(request):
 ############################################################
 #
 # POST /api/logout — flush the session: the server-side row
-# dies and the response expires the HttpOnly cookie. Needs no
-# login and always answers OK — logging out an already-dead
-# session is a success, not an error.
+# dies and the response expires the HttpOnly cookie. A
+# signed-cookie session has no row, so its user's session
+# epoch moves instead (revoke_sessions — every device of the
+# user is logged out). Needs no login and always answers OK —
+# logging out an already-dead session is a success, not an
+# error.
 #
 # Used by:
 #   - Login.jsx — on mount, so opening /login IS the logout
@@ -137,7 +148,13 @@ def logout_view(request):
     if request.method != 'POST':
         return JsonResponse({'message': 'Method not allowed'}, status=405)
 
+    if sessions_are_signed():
+        thisUser = user_for_session(request.session)
+        if thisUser is not None:
+            revoke_sessions(thisUser.id)
+
     request.session.flush()
+    invalidate_auth_cache()
     return JsonResponse({'message': 'OK'})
 
 
@@ -223,6 +240,38 @@ def register_view(request):
 
 
 
+############################################################
+# bump_last_seen
+############################################################
+#
+# LastLogin is really "last seen" — bumped at most once a
+# minute: every SPA page load AND every :8443 forward_auth
+# subrequest lands in checkauth, and a write per GET is a
+# lot of writes. Even the conditional UPDATE is a write
+# statement (SQLite takes its write lock for it), so the
+# auth cache also remembers, per process, that a user was
+# bumped within the minute and the statement is skipped.
+############################################################
+
+LAST_SEEN_INTERVAL = timedelta(minutes=1)
+
+
+
+def bump_last_seen(userId):
+    if auth_cache_get(('seen', userId)):
+        return
+    generation = read_auth_generation()
+    timeNow = timezone.now()
+    SystemUser.objects.filter(id=userId).exclude(last_login__gte=timeNow - LAST_SEEN_INTERVAL).update(last_login=timeNow)
+    auth_cache_put(('seen', userId), True, generation, LAST_SEEN_INTERVAL.total_seconds())
+
+
+
+
+
+
+
+
 ############################################################
 # checkauth
 ############################################################
@@ -234,14 +283,22 @@ def register_view(request):
 # Browser, WebSSH2), including their WebSocket upgrades, so
 # it must stay cheap and cookie-only.
 #
-# Every call bumps LastLogin — it is really "last seen" and
-# feeds the users grid and the dashboard.
+# Every call bumps LastLogin (bump_last_seen) — it is really
+# "last seen" and feeds the users grid and the dashboard. The
+# session and the VM grant come out of the auth cache when
+# it has them, so a warm gate costs no query at all. Both
+# checkauth views run outside ATOMIC_REQUESTS: its IMMEDIATE
+# BEGIN takes SQLite's write lock before the view even
+# starts, queueing every gate behind the monitor's writes —
+# and nothing here needs a transaction (the one write is a
+# single UPDATE).
 #
 # Used by:
 #   - AuthGuard.jsx — the session context around the app
 #   - control-caddy Caddyfile — the :8443 forward_auth
 ############################################################
 
+@transaction.non_atomic_requests
 @login_required
 def checkauth(request, virtualServerID=None):
 
@@ -265,11 +322,7 @@ def checkauth(request, virtualServerID=None):
     }
 
 
-    # Bump "last seen" — but at most once a minute: every SPA
-    # page load AND every :8443 forward_auth subrequest lands
-    # here, and a write per GET is a lot of writes
-    staleBefore = timezone.now() - timedelta(minutes=1)
-    SystemUser.objects.filter(id=request.current_user.id).exclude(last_login__gte=staleBefore).update(last_login=timezone.now())
+    bump_last_seen(request.current_user.id)
     return JsonResponse(user_info, json_dumps_params={'indent': 4})
 
 
@@ -285,12 +338,13 @@ def checkauth(request, virtualServerID=None):
 #
 # GET /api/checkauth/admin — same body, admins only. Caddy
 # calls it as the forward_auth gate of /dbgate/* (and the
-# swagger UI).
+# swagger UI). Outside ATOMIC_REQUESTS, like checkauth.
 #
 # Used by:
 #   - control-caddy Caddyfile — the /dbgate/* forward_auth
 ############################################################
 
+@transaction.non_atomic_requests
 @admin_required
 def checkauth_admin(request):
 
@@ -301,9 +355,5 @@ def checkauth_admin(request):
         'admin': request.current_user.admin,
     }
 
-    # Bump "last seen" — but at most once a minute: every SPA
-    # page load AND every :8443 forward_auth subrequest lands
-    # here, and a write per GET is a lot of writes
-    staleBefore = timezone.now() - timedelta(minutes=1)
-    SystemUser.objects.filter(id=request.current_user.id).exclude(last_login__gte=staleBefore).update(last_login=timezone.now())
+    bump_last_seen(request.current_user.id)
     return JsonResponse(user_info, json_dumps_params={'indent': 4})
@@ -24,8 +24,9 @@ from django.http import JsonResponse
 
 import bcrypt
 
-from control.common.auth import admin_required, format_datetime, get_json
+from control.common.auth import admin_required, format_datetime, get_json, invalidate_auth_cache
 from control.hosting.models import VirtualServer
+from control.hosting.vm_snapshot import mark_stale
 from control.users.models import SystemUser
 
 
@@ -115,6 +116,8 @@ def admin_users(request):
                 try:
                     with transaction.atomic():
                         thisUser.save()
+                        mark_stale()    # owner emails ride on the VM cards
+                        invalidate_auth_cache()
                 except IntegrityError:
                     return JsonResponse({'type': 'error', 'reason': 'User with this email already exists'}, status=409)
 
@@ -134,6 +137,7 @@ def admin_users(request):
 
             # Delete user
             SystemUser.objects.filter(id=postData['id']).delete()
+            invalidate_auth_cache()
             return JsonResponse({'type': 'ok'})
 
 
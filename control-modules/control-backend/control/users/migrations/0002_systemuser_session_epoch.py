@@ -0,0 +1,23 @@
+############################################################
+#  [*] SystemUser.session_epoch — server-side revocation
+#
+#  Stamped into each session at login; bumping it ends every
+#  session of the user, signed-cookie ones included.
+############################################################
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='systemuser',
+            name='session_epoch',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
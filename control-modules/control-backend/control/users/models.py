@@ -30,6 +30,9 @@ from django.db import models
 # transfer script carries the old hashes over unchanged, so
 # passwords keep working. last_login is really "last seen":
 # every checkauth bumps it; NULL means never seen.
+# session_epoch is stamped into every session at login; a
+# session carrying an older epoch is dead (how a logout
+# revokes signed-cookie sessions, see settings Sessions).
 #
 # Deleting a user cascades their registration code, detaches
 # their activity rows (kept, shown as "Deleted User") and
@@ -49,6 +52,7 @@ class SystemUser(models.Model):
     admin = models.BooleanField(default=False)
     enabled = models.BooleanField(default=False)
     last_login = models.DateTimeField(null=True, blank=True)
+    session_epoch = models.PositiveIntegerField(default=0)
 
     # String representation
     def __str__(self):
@@ -9,11 +9,19 @@
 #  Package layout (one blueprint per domain, like the old
 #  backend's app/ package):
 #
-#    status/routes.py           — /api/test, /api/status/<name>
+#    status/routes.py           — /api/test, /api/status/<name>,
+#                                 /api/status/batch, /api/poolstats
+#    common/http_pool.py        — keep-alive daemon sessions
+#    common/docker_engine.py    — the Engine API client
+#    common/regeneration.py     — coalesced render + reload
+#    events/routes.py           — /api/events (delta stream)
+#    events/docker_events.py    — the per-daemon event watchers
 #    virtual_servers/routes.py  — create/start/stop/delete/cleanup
 #    usage/routes.py            — /api/usage/disk
+#    usage/disk_index.py        — the incremental disk index
 #    caddy/routes.py            — /api/updatecaddyconfig
 #    caddy/caddyfile_updater.py — the users-Caddyfile renderer
+#    caddy/caddy_admin.py       — per-domain admin API updates
 #    portforwarder/routes.py    — /api/updateportforwarderconfig
 #    portforwarder/portforwarder_updater.py — the layer4 renderer
 #
@@ -40,7 +48,7 @@ from flask import Flask
 # create_app
 ############################################################
 #
-# Build the Flask app and register the five blueprints. No
+# Build the Flask app and register the six blueprints. No
 # secret key and no CORS layer on purpose: the service has
 # no sessions, no cookies and no browser callers — the only
 # clients are backend containers on the internal network.
@@ -58,9 +66,15 @@ def create_app():
     from .status.routes import status_bp
     app.register_blueprint(status_bp, url_prefix='')
 
+    from .events.routes import events_bp
+    app.register_blueprint(events_bp, url_prefix='')
+
     from .virtual_servers.routes import virtual_servers_bp
     app.register_blueprint(virtual_servers_bp, url_prefix='')
 
+    from .bulk.routes import bulk_bp
+    app.register_blueprint(bulk_bp, url_prefix='')
+
     from .usage.routes import usage_bp
     app.register_blueprint(usage_bp, url_prefix='')
 
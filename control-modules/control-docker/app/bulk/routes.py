@@ -0,0 +1,212 @@
+############################################################
+#  [*] Bulk routes — one lifecycle action over many VMs
+#
+#    POST /api/bulk           — queue {action, vms}, answer a job id
+#    GET  /api/bulk/<job_id>  — the job's per-VM progress
+#
+#  Semester start/end means hundreds of creates, stops or
+#  deletes at once. One request per VM (each a sysbox
+#  `docker run` with no limit between them) either overloads
+#  sysbox or has to be scripted one by one; here the whole
+#  list is ONE job, run through a bounded executor shared by
+#  every bulk job: at most BULK_CONCURRENCY lifecycle
+#  operations touch the host daemon at a time, the rest wait
+#  in its queue. Size it to what the host's sysbox can start
+#  side by side.
+#
+#  Each VM runs exactly the single-VM operation
+#  (virtual_servers/routes — create_vm, start_vm, stop_vm,
+#  delete_vm), so a bulk delete archives data the same way a
+#  single one does.
+#
+#  Jobs live in memory only: a sidecar restart forgets them
+#  (the poller sees 404). Finished jobs are dropped
+#  BULK_JOB_TTL_SECONDS after they end.
+#
+#  Used by:
+#    - control-backend bulk_views — /api/vm/bulk
+############################################################
+
+
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Blueprint, Response, request
+
+from ..virtual_servers.routes import NAME_PATTERN, create_vm, delete_vm, parse_vm_id, start_vm, stop_vm
+
+
+bulk_bp = Blueprint('bulk', __name__)
+
+BULK_CONCURRENCY = int(os.getenv('BULK_CONCURRENCY', '4'))
+BULK_JOB_TTL_SECONDS = int(os.getenv('BULK_JOB_TTL_SECONDS', '3600'))
+
+ACTIONS = {
+    'create': create_vm,
+    'start': lambda container_name, vm_id: start_vm(container_name),
+    'stop': lambda container_name, vm_id: stop_vm(container_name),
+    'delete': delete_vm,
+}
+
+bulk_executor = ThreadPoolExecutor(max_workers=BULK_CONCURRENCY, thread_name_prefix='bulk')
+
+jobs_lock = threading.Lock()
+jobs = {}
+
+
+
+
+
+
+
+
+############################################################
+# run_vm / job_snapshot / prune_jobs
+############################################################
+#
+# run_vm: one VM of a job, on an executor thread — marks it
+# running, runs the operation, records ok/failed with the
+# error and how long it took. The job's finished_at is set
+# by whichever VM completes it.
+#
+# job_snapshot: a copy of the job safe to serialize outside
+# the lock. VM state is queued → running → ok | failed.
+############################################################
+
+def run_vm(job, container_name, vm_id):
+    entry = job['vms'][container_name]
+    with jobs_lock:
+        entry['state'] = 'running'
+    started = time.monotonic()
+
+    try:
+        error = ACTIONS[job['action']](container_name, vm_id)
+    except Exception as e:
+        error = f'{job["action"]} of {container_name} failed: {e}'
+
+    with jobs_lock:
+        entry['state'] = 'failed' if error else 'ok'
+        entry['elapsed_ms'] = round((time.monotonic() - started) * 1000, 1)
+        if error:
+            entry['error'] = error
+        job['pending'] -= 1
+        if job['pending'] == 0:
+            job['finished_at'] = time.time()
+
+
+
+def job_snapshot(job):
+    with jobs_lock:
+        vms = {name: dict(entry) for name, entry in job['vms'].items()}
+        finished_at = job['finished_at']
+
+    counts = {'queued': 0, 'running': 0, 'ok': 0, 'failed': 0}
+    for entry in vms.values():
+        counts[entry['state']] += 1
+
+    return {
+        'job_id': job['job_id'],
+        'action': job['action'],
+        'state': 'done' if finished_at else 'running',
+        'total': len(vms),
+        'counts': counts,
+        'created_at': job['created_at'],
+        'finished_at': finished_at,
+        'vms': vms,
+    }
+
+
+
+def prune_jobs():
+    cutoff = time.time() - BULK_JOB_TTL_SECONDS
+    with jobs_lock:
+        for job_id in [job_id for job_id, job in jobs.items() if job['finished_at'] and job['finished_at'] < cutoff]:
+            del jobs[job_id]
+
+
+
+
+
+
+
+
+############################################################
+# bulk_HTTPPOST
+############################################################
+#
+# POST /api/bulk — {"action": "create"|"start"|"stop"|
+# "delete", "vms": ["hosting-users-dind-<id>", ...]}
+#
+# The whole list is validated first (dind names only — this
+# is a VM-only endpoint); one bad name rejects the job with
+# 400 and nothing runs. Duplicates run once. Answers 202
+# {"job_id", "total"} as soon as everything is queued.
+############################################################
+
+@bulk_bp.route('/api/bulk', methods=['POST'])
+def bulk_HTTPPOST():
+    body = request.get_json(silent=True) or {}
+    action = body.get('action')
+    names = body.get('vms')
+
+    if action not in ACTIONS:
+        return Response(json.dumps({'error': f'Invalid action: {action}'}), mimetype='application/json', status=400)
+    if not isinstance(names, list) or not names:
+        return Response(json.dumps({'error': 'vms must be a non-empty list'}), mimetype='application/json', status=400)
+
+    vm_ids = {}
+    for name in names:
+        if not isinstance(name, str) or not re.match(NAME_PATTERN, name) or parse_vm_id(name) is None:
+            return Response(json.dumps({'error': f'{name} is not a VM container name'}), mimetype='application/json', status=400)
+        vm_ids[name] = parse_vm_id(name)
+
+    prune_jobs()
+
+    job = {
+        'job_id': uuid.uuid4().hex,
+        'action': action,
+        'created_at': time.time(),
+        'finished_at': None,
+        'pending': len(vm_ids),
+        'vms': {name: {'state': 'queued'} for name in vm_ids},
+    }
+    with jobs_lock:
+        jobs[job['job_id']] = job
+
+    for name, vm_id in vm_ids.items():
+        bulk_executor.submit(run_vm, job, name, vm_id)
+
+    return Response(json.dumps({'job_id': job['job_id'], 'total': len(vm_ids)}), mimetype='application/json', status=202)
+
+
+
+
+
+
+
+
+############################################################
+# bulk_job_HTTPGET
+############################################################
+#
+# GET /api/bulk/<job_id> — {"job_id", "action", "state":
+# "running"|"done", "total", "counts": {queued, running, ok,
+# failed}, "created_at", "finished_at", "vms": {"<name>":
+# {"state", "error"?, "elapsed_ms"?}}}; 404 for a job this
+# process does not know (never existed, pruned, or lost to a
+# restart).
+############################################################
+
+@bulk_bp.route('/api/bulk/<job_id>', methods=['GET'])
+def bulk_job_HTTPGET(job_id):
+    with jobs_lock:
+        job = jobs.get(job_id)
+    if job is None:
+        return Response(json.dumps({'error': f'Unknown job {job_id}'}), mimetype='application/json', status=404)
+
+    return Response(json.dumps(job_snapshot(job)), mimetype='application/json')
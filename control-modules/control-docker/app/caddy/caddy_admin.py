@@ -0,0 +1,333 @@
+############################################################
+#  [*] CaddyAdmin — per-domain updates through Caddy's API
+#
+#  The Caddyfile path re-renders the text, writes it and has
+#  Caddy adapt the whole file again on `caddy reload` — work
+#  that grows with the domain count. With
+#  USERS_CADDY_ADMIN_SOCKET set, the sidecar instead talks to
+#  the users Caddy's admin API over a unix socket in the
+#  shared _DATA/users-caddy/admin directory, with the same
+#  sites rendered as Caddy JSON, and touches only the
+#  domains that changed:
+#
+#    every domain owns objects tagged with an @id —
+#      domain-<id>         its route (host match → subroute:
+#                          Cloudflare allowlist, reverse
+#                          proxy), on the "https" server
+#                          when ssl=1, else on "http"
+#      domain-<id>-errors  its 502 answer, on the same
+#                          server's errors routes
+#      domain-<id>-tls     its certificate policy (ssl=1 only:
+#                          internal behind Cloudflare, ACME
+#                          otherwise)
+#    an added domain is inserted (routes/0 — host matches
+#    never overlap, and the catch-all stays last), an edited
+#    one PATCHed in place by @id, a removed one DELETEd by
+#    @id; objects a change does not affect are not sent.
+#
+#  A full POST /load of the rendered config is the fallback:
+#  on the first update after a sidecar start, when the
+#  marker object (CONFIG_MARKER_ID) is missing — Caddy was
+#  restarted from its Caddyfile, or its config was replaced
+#  by hand — and when any single operation is refused.
+#
+#  Caddy still applies each admin change as a config reload
+#  of its own; what goes away is the Caddyfile adaptation,
+#  the docker exec and the file round trip, and the request
+#  stays the size of one domain. The Caddyfile itself is
+#  still written on every change, so a restarted Caddy
+#  serves the same sites.
+#
+#  Used by:
+#    - caddy/routes.updatecaddyconfig_HTTPPOST — when
+#      USERS_CADDY_ADMIN_SOCKET is set
+############################################################
+
+import os
+import threading
+from urllib.parse import quote
+
+import requests
+
+from ..common.http_pool import host_session
+from .caddyfile_updater import USERS_CADDY_ADMIN_LISTEN, CaddyfileUpdater, domain_row_key
+
+
+# The marker every full load carries, on the (small)
+# catch-all route — present means Caddy runs a config this
+# module loaded
+CONFIG_MARKER_ID = 'hosting-users-catchall'
+
+ADMIN_TIMEOUT = 30
+
+
+
+
+
+
+
+
+############################################################
+# admin_socket
+############################################################
+#
+# The admin socket as the sidecar sees it, or '' when the
+# admin API path is off. Read per call, like
+# CADDYFILE_LOCATION.
+############################################################
+
+def admin_socket():
+    return os.environ.get('USERS_CADDY_ADMIN_SOCKET', '')
+
+
+
+
+
+
+
+
+############################################################
+# render_domain / render_config
+############################################################
+#
+# render_domain: one domain row → (server name, route,
+# errors route, TLS policy or None), each tagged with its
+# @id. The same site the Caddyfile renderer writes for the
+# row, in JSON.
+#
+# render_config: every row → the whole config for /load —
+# the admin endpoint itself (a load without it would move
+# the API back to localhost:2019, out of the sidecar's
+# reach), the log, both servers with the catch-all last on
+# "http", and the certificate policies.
+############################################################
+
+def render_domain(dns_entry):
+    domain_id = f'domain-{int(dns_entry["id"])}'
+    domain_name = dns_entry['domainname']
+    is_cloudflare = dns_entry['iscloudflare'] == 1
+    is_ssl = dns_entry['ssl'] == 1
+
+    handlers = []
+    if is_cloudflare:
+        handlers.append({
+            'match': [{'not': [{'remote_ip': {'ranges': CaddyfileUpdater.cloudflare_ranges}}]}],
+            'handle': [{'handler': 'static_response', 'body': CaddyfileUpdater.cloudflare_only_message, 'status_code': 403}],
+        })
+    handlers.append({
+        'handle': [{
+            'handler': 'reverse_proxy',
+            'upstreams': [{'dial': f'hosting-users-dind-{int(dns_entry["virtualserverid"])}:80'}],
+            'headers': {'request': {'set': {
+                'X-Forwarded-For': ['{http.request.header.X-Forwarded-For}' if is_cloudflare else '{http.request.remote.host}'],
+            }}},
+        }],
+    })
+
+    route = {
+        '@id': domain_id,
+        'match': [{'host': [domain_name]}],
+        'handle': [{'handler': 'subroute', 'routes': handlers}],
+        'terminal': True,
+    }
+    errors_route = {
+        '@id': f'{domain_id}-errors',
+        'match': [{'host': [domain_name]}],
+        'handle': [{'handler': 'subroute', 'routes': [{
+            'match': [{'expression': '{http.error.status_code} == 502'}],
+            'handle': [{'handler': 'static_response', 'body': CaddyfileUpdater.no_app_message, 'status_code': 502}],
+        }]}],
+        'terminal': True,
+    }
+
+    tls_policy = None
+    if is_ssl:
+        issuer = {'module': 'internal'} if is_cloudflare else {'module': 'acme', 'email': CaddyfileUpdater.acme_email}
+        tls_policy = {'@id': f'{domain_id}-tls', 'subjects': [domain_name], 'issuers': [issuer]}
+
+    return ('https' if is_ssl else 'http'), route, errors_route, tls_policy
+
+
+
+def render_config(dns_entries):
+    servers = {
+        'https': {'listen': [':443'], 'routes': [], 'errors': {'routes': []}},
+        'http': {'listen': [':80'], 'routes': [], 'errors': {'routes': []}},
+    }
+    policies = []
+
+    for dns_entry in dns_entries:
+        server, route, errors_route, tls_policy = render_domain(dns_entry)
+        servers[server]['routes'].append(route)
+        servers[server]['errors']['routes'].append(errors_route)
+        if tls_policy is not None:
+            policies.append(tls_policy)
+
+    servers['http']['routes'].append({
+        '@id': CONFIG_MARKER_ID,
+        'handle': [{'handler': 'static_response', 'body': CaddyfileUpdater.unknown_domain_message, 'status_code': 200}],
+    })
+
+    return {
+        'admin': {'listen': USERS_CADDY_ADMIN_LISTEN},
+        'logging': {'logs': {'default': {
+            'writer': {'output': 'file', 'filename': '/var/log/caddy/access.log',
+                       'roll_size_mb': 100, 'roll_keep': 5, 'roll_keep_days': 30},
+            'encoder': {'format': 'json'},
+        }}},
+        'apps': {
+            'http': {'servers': servers},
+            'tls': {'automation': {'policies': policies}},
+        },
+    }
+
+
+
+
+
+
+
+
+############################################################
+# domain_operations
+############################################################
+#
+# The admin API calls that turn the applied rows into the
+# new ones, as [(method, path, body or None)]. Both sides
+# are {domain id: row}. A row whose server changes (ssl
+# toggled) is removed and added again; otherwise only the
+# objects whose JSON changed are PATCHed. Removals go first,
+# so a domain name moving between rows is never served
+# twice.
+############################################################
+
+def domain_operations(applied_rows, new_rows):
+    removals, changes = [], []
+
+    for domain_id, old_row in applied_rows.items():
+        new_row = new_rows.get(domain_id)
+        if new_row is not None and domain_row_key(new_row) == domain_row_key(old_row):
+            continue
+
+        old_server, old_route, old_errors, old_tls = render_domain(old_row)
+        if new_row is None or render_domain(new_row)[0] != old_server:
+            removals += [('DELETE', f'/id/{old_route["@id"]}', None), ('DELETE', f'/id/{old_errors["@id"]}', None)]
+            if old_tls is not None:
+                removals.append(('DELETE', f'/id/{old_tls["@id"]}', None))
+            continue
+
+        _, route, errors_route, tls_policy = render_domain(new_row)
+        for old_object, new_object in [(old_route, route), (old_errors, errors_route)]:
+            if new_object != old_object:
+                changes.append(('PATCH', f'/id/{new_object["@id"]}', new_object))
+        if tls_policy != old_tls:
+            if old_tls is None:
+                changes.append(('POST', '/config/apps/tls/automation/policies', tls_policy))
+            elif tls_policy is None:
+                changes.append(('DELETE', f'/id/{old_tls["@id"]}', None))
+            else:
+                changes.append(('PATCH', f'/id/{tls_policy["@id"]}', tls_policy))
+
+    for domain_id, new_row in new_rows.items():
+        old_row = applied_rows.get(domain_id)
+        if old_row is not None and render_domain(old_row)[0] == render_domain(new_row)[0]:
+            continue
+        server, route, errors_route, tls_policy = render_domain(new_row)
+        changes += [
+            ('PUT', f'/config/apps/http/servers/{server}/routes/0', route),
+            ('PUT', f'/config/apps/http/servers/{server}/errors/routes/0', errors_route),
+        ]
+        if tls_policy is not None:
+            changes.append(('POST', '/config/apps/tls/automation/policies', tls_policy))
+
+    return removals + changes
+
+
+
+
+
+
+
+
+############################################################
+# CaddyAdmin
+############################################################
+#
+# applied_rows is class-level, like CaddyfileUpdater's
+# hashes: {domain id: row} as Caddy is known to run them, or
+# None when that is not known (a sidecar start, a failed
+# update) — the next update is then a full load.
+#
+#   apply_domains(dns_entries) → 'unchanged' | 'patched' |
+#                                'loaded' | 'failed'
+#   load(dns_entries)          — POST /load, True/False
+#   call(method, path, body)   — one admin request; raises
+#                                AdminError on a refusal
+############################################################
+
+class AdminError(Exception):
+    pass
+
+
+
+class CaddyAdmin:
+
+
+    applied_rows = None
+
+    # One update at a time — applied_rows must describe the
+    # config Caddy really runs
+    apply_lock = threading.Lock()
+
+
+
+    def apply_domains(self, dns_entries):
+        new_rows = {dns_entry['id']: dns_entry for dns_entry in dns_entries}
+
+        with self.apply_lock:
+            try:
+                if CaddyAdmin.applied_rows is not None:
+                    operations = domain_operations(CaddyAdmin.applied_rows, new_rows)
+                    if not operations:
+                        return 'unchanged'
+
+                    # Drift: Caddy no longer runs what this
+                    # process loaded
+                    self.call('GET', f'/id/{CONFIG_MARKER_ID}')
+
+                    for method, path, body in operations:
+                        self.call(method, path, body)
+                    CaddyAdmin.applied_rows = new_rows
+                    return 'patched'
+
+            except (AdminError, requests.RequestException) as e:
+                print(f'Caddy admin: {e} — loading the full config')
+
+            CaddyAdmin.applied_rows = None
+            if not self.load(dns_entries):
+                return 'failed'
+            CaddyAdmin.applied_rows = new_rows
+            return 'loaded'
+
+
+
+    def load(self, dns_entries):
+        try:
+            self.call('POST', '/load', render_config(dns_entries))
+        except (AdminError, requests.RequestException) as e:
+            print(f'Caddy admin: full load failed: {e}')
+            return False
+        return True
+
+
+
+    # Caddy accepts an empty Host or 127.0.0.1 on a unix
+    # socket listener; requests would send the socket path
+    def call(self, method, path, body=None):
+        response = host_session.request(
+            method, f'http+unix://{quote(admin_socket(), safe="")}{path}',
+            json=body, headers={'Host': '127.0.0.1'}, timeout=ADMIN_TIMEOUT,
+        )
+        if response.status_code != 200:
+            raise AdminError(f'{method} {path}: {response.status_code} {response.text.strip()}')
+        return response
@@ -12,13 +12,57 @@
 #  catch-all :80 block answers for every unknown domain.
 #
 #  The rendered file is the throwaway artifact — the domain
-#  table is the source of truth, and every mutation rewrites
-#  the file wholesale.
+#  table is the source of truth, and every mutation renders
+#  the file wholesale. Rendering is cheap to repeat: each
+#  domain's server block is cached by the row's content, so
+#  a regeneration only formats the rows that changed and
+#  joins the rest. The file is put in place through the
+#  staged pipeline (common/staged_config: candidate file,
+#  validation, rename, reload, the last good file back on a
+#  refused reload), only when its content differs from what
+#  is on disk, and Caddy is reloaded only when it differs
+#  from what Caddy last loaded — a VM delete without
+#  domains, or a DNS edit that renders the same file, never
+#  pays for a reload.
+#
+#  The rename is why the users Caddy mounts the DIRECTORY
+#  holding the file (_DATA/users-caddy/etc → /etc/caddy): a
+#  single-file bind mount keeps the old inode and would
+#  never see a renamed-in file.
 ############################################################
 
+import hashlib
 import os
 import re
-from subprocess import Popen, PIPE
+import threading
+
+from ..common import docker_engine
+from ..common.staged_config import StagedConfig
+
+
+# Where the users Caddy serves its admin API, inside its own
+# container — written into the global options when the
+# sidecar updates Caddy through that API (caddy_admin)
+USERS_CADDY_ADMIN_LISTEN = 'unix//run/caddy-admin/admin.sock'
+
+
+
+
+
+
+
+
+############################################################
+# caddyfile_location
+############################################################
+#
+# Where the users Caddyfile lives on the shared volume
+# (CADDYFILE_LOCATION) — read per call, so tests can point
+# it elsewhere. caddy/domain_state keeps its file beside it.
+############################################################
+
+def caddyfile_location():
+    return os.environ.get("CADDYFILE_LOCATION", '/users-caddy/etc/Caddyfile')
 
 
 
@@ -37,15 +81,47 @@ from subprocess import Popen, PIPE
 # WITHOUT a dedent on purpose: it is spliced INSIDE server
 # blocks, so it keeps its extra indentation.
 #
+# The per-process state is class-level, shared by every
+# instance (the route builds one per request):
+#   fragment_cache — domain row key → its server block, the
+#                    rows of the last render only
+#   written_hash   — sha256 of the file last written
+#   loaded_hash    — sha256 of the file Caddy last loaded;
+#                    None after a restart, so the first
+#                    update always reloads
+#   staged_config  — the file's validation cache and
+#                    last-known-good content
+#
 # Methods:
 #   generate_caddyfile — domain rows → the whole file text
-#   save_caddyfile     — write to CADDYFILE_LOCATION
-#   reload_caddy       — docker exec caddy reload
+#   render_server_block — one domain row → its server block
+#   apply_caddyfile    — write + reload, each only if needed
+#   write_caddyfile    — the write alone, only if needed
+#   reload_caddy       — caddy reload via an Engine API exec
 ############################################################
 
 class CaddyfileUpdater:
 
 
+    # The certificate contact and the answers Caddy gives by
+    # itself — caddy_admin renders the same sites from them
+    acme_email = "admin@knf.vu.lt"
+    cloudflare_only_message = "Sorry for disapointing you, but this service is only accessible through Cloudflare"
+    no_app_message = "Virtual server does not host any app on port 80 or the app cannot be accessed externally."
+    unknown_domain_message = "Hosting platform does not host any applications at this domain name."
+
+
+    fragment_cache = {}
+    written_hash = None
+    loaded_hash = None
+    staged_config = StagedConfig('hosting-users-caddy', caddyfile_location)
+
+    # One write + reload at a time — the hashes must describe
+    # the file and the config that are really in place.
+    # Reentrant: apply_caddyfile writes through write_caddyfile
+    apply_lock = threading.RLock()
+
+
     # Global options block
     global_options = '''
     ########################################################################################################################
@@ -90,6 +166,7 @@ class CaddyfileUpdater:
     }
     '''
     cloudflare_snippet = re.sub(r'^ {4}', '', cloudflare_snippet, flags=re.MULTILINE)
+    cloudflare_ranges = re.findall(r'remote_ip (\S+)', cloudflare_snippet)
 
 
     # Blocks every request that did not arrive through a
@@ -102,14 +179,14 @@ class CaddyfileUpdater:
                 import cloudflare
             }
         }
-        respond @block_non_cloudflare "Sorry for disapointing you, but this service is only accessible through Cloudflare" 403
+        respond @block_non_cloudflare "''' + cloudflare_only_message + '''" 403
     '''
 
 
     # The catch-all for every domain the table does not know
     resolve_any_other_domain_names = '''
     :80 {
-        respond "Hosting platform does not host any applications at this domain name." 200
+        respond "''' + unknown_domain_message + '''" 200
     }
     '''
     resolve_any_other_domain_names = re.sub(r'^ {4}', '', resolve_any_other_domain_names, flags=re.MULTILINE)
@@ -127,83 +204,111 @@ class CaddyfileUpdater:
     # a dict with lowercase keys (the backend's wire shape):
     # id, virtualserverid, domainname, iscloudflare (0/1),
     # ssl (0/1). The old docstring documented CSV-era
-    # capitalized keys that the code never reads — the "CSV"
-    # wording in the comments below is the same fossil.
+    # capitalized keys that the code never reads.
+    #
+    # Server blocks come from fragment_cache when the row is
+    # unchanged; the cache is replaced by this render's rows,
+    # so deleted domains do not linger in it. With the admin
+    # API path on (USERS_CADDY_ADMIN_SOCKET set) the global
+    # options also move Caddy's admin endpoint onto the shared
+    # socket, so a restarted Caddy is reachable there too.
     #
     # Used by:
     #   - main.updatecaddyconfig_HTTPPOST — every regeneration
     ############################################################
 
     def generate_caddyfile(self, dns_entries):
+        fragments = {}
+        server_blocks = []
+        for dns_entry in dns_entries:
+            key = domain_row_key(dns_entry)
+            server_block = self.fragment_cache.get(key)
+            if server_block is None:
+                server_block = self.render_server_block(dns_entry)
+            fragments[key] = server_block
+            server_blocks.append(server_block)
+        CaddyfileUpdater.fragment_cache = fragments
+
+        global_options = self.global_options
+        if os.environ.get("USERS_CADDY_ADMIN_SOCKET"):
+            global_options = global_options.replace("{\n", f"{{\n    admin {USERS_CADDY_ADMIN_LISTEN}\n\n", 1)
+
+        return "".join([
+            global_options, "\n\n",
+            self.cloudflare_snippet, "\n\n",
+            "\n",
+            *server_blocks,
+            self.resolve_any_other_domain_names, "\n\n",
+        ])
 
-        # Start building the Caddyfile content.
-        caddyfile_content = ""
-        caddyfile_content += self.global_options + "\n\n"
-        caddyfile_content += self.cloudflare_snippet + "\n\n"
-        caddyfile_content += "\n"
 
-        # Iterate over all DNS entries.
-        for dns_entry in dns_entries:
-            dns_id = dns_entry["id"]
-            virtual_server_id = dns_entry["virtualserverid"]
-            domain_name = dns_entry["domainname"]
-            is_cloudflare = dns_entry["iscloudflare"]
-            is_ssl = dns_entry["ssl"]
 
 
-            # Begin the server block — https only when ssl=1
-            server_block = f"# DNS ID: {dns_id}\n"
-            if is_ssl == 1:
-                server_block += f"{domain_name} {{\n"
-            else:
-                server_block += f"http://{domain_name} {{\n"
-
-
-            # TLS: Cloudflare terminates public TLS itself, so
-            # its domains get an internal cert; plain ssl=1
-            # domains get a real ACME cert
-            if is_cloudflare == 1:
-                server_block += "    tls internal"
-            else:
-                if is_ssl == 1:
-                    server_block += "    tls admin@knf.vu.lt"
-            server_block += "\n\n"
 
 
-            # If the server should only be accessible through Cloudflare, add the block.
-            if is_cloudflare == 1:
-                server_block += self.cloudflare_block
-                server_block += "\n\n"
+    ############################################################
+    # render_server_block
+    ############################################################
+    #
+    # One domain row → its server block, ending in the blank
+    # lines that separate it from the next one.
+    ############################################################
+
+    def render_server_block(self, dns_entry):
+        dns_id = dns_entry["id"]
+        virtual_server_id = dns_entry["virtualserverid"]
+        domain_name = dns_entry["domainname"]
+        is_cloudflare = dns_entry["iscloudflare"]
+        is_ssl = dns_entry["ssl"]
+
 
+        # Begin the server block — https only when ssl=1
+        server_block = f"# DNS ID: {dns_id}\n"
+        if is_ssl == 1:
+            server_block += f"{domain_name} {{\n"
+        else:
+            server_block += f"http://{domain_name} {{\n"
 
-            # Reverse proxy into the VM's inner Caddy; behind
-            # Cloudflare the real client IP arrives in the
-            # forwarded header, otherwise it IS the peer
-            if is_cloudflare == 1:
-                server_block += f"    reverse_proxy http://hosting-users-dind-{virtual_server_id}:80 {{\n"
-                server_block += "        header_up X-Forwarded-For {http.request.header.X-Forwarded-For}\n"
-                server_block += "    }\n"
-            else:
-                server_block += f"    reverse_proxy http://hosting-users-dind-{virtual_server_id}:80 {{\n"
-                server_block += "        header_up X-Forwarded-For {remote_host}\n"
-                server_block += "    }\n"
 
-            # Add default response if upstream server could not be connected
-            server_block += f"    handle_errors 502 {{\n"
-            server_block += "        respond \"Virtual server does not host any app on port 80 or the app cannot be accessed externally.\" 502\n"
-            server_block += "    }\n"
-            server_block += "}"
+        # TLS: Cloudflare terminates public TLS itself, so
+        # its domains get an internal cert; plain ssl=1
+        # domains get a real ACME cert
+        if is_cloudflare == 1:
+            server_block += "    tls internal"
+        else:
+            if is_ssl == 1:
+                server_block += f"    tls {self.acme_email}"
+        server_block += "\n\n"
+
+
+        # If the server should only be accessible through Cloudflare, add the block.
+        if is_cloudflare == 1:
+            server_block += self.cloudflare_block
+            server_block += "\n\n"
 
-            # Add a newline to separate the server blocks.
-            server_block += "\n\n\n\n"
 
-            # Add the server block to the caddyfile content.
-            caddyfile_content += server_block
+        # Reverse proxy into the VM's inner Caddy; behind
+        # Cloudflare the real client IP arrives in the
+        # forwarded header, otherwise it IS the peer
+        if is_cloudflare == 1:
+            server_block += f"    reverse_proxy http://hosting-users-dind-{virtual_server_id}:80 {{\n"
+            server_block += "        header_up X-Forwarded-For {http.request.header.X-Forwarded-For}\n"
+            server_block += "    }\n"
+        else:
+            server_block += f"    reverse_proxy http://hosting-users-dind-{virtual_server_id}:80 {{\n"
+            server_block += "        header_up X-Forwarded-For {remote_host}\n"
+            server_block += "    }\n"
 
-        # Add the resolve any other domain names block.
-        caddyfile_content += self.resolve_any_other_domain_names + "\n\n"
+        # Add default response if upstream server could not be connected
+        server_block += f"    handle_errors 502 {{\n"
+        server_block += f"        respond \"{self.no_app_message}\" 502\n"
+        server_block += "    }\n"
+        server_block += "}"
 
-        return caddyfile_content
+        # Add a newline to separate the server blocks.
+        server_block += "\n\n\n\n"
+
+        return server_block
 
 
 
@@ -211,20 +316,52 @@ class CaddyfileUpdater:
 
 
     ############################################################
-    # save_caddyfile
+    # apply_caddyfile
     ############################################################
     #
-    # Write the rendered file to the shared users-caddy volume
-    # (CADDYFILE_LOCATION, default /users-caddy/Caddyfile).
+    # Put the rendered file in place: 'unchanged' when Caddy
+    # already runs exactly this content (no reload),
+    # 'reloaded' after a successful reload, 'failed' when the
+    # render did not validate (the live file untouched) or
+    # the reload was refused (the last good file restored) —
+    # either way Caddy keeps serving the old config, which
+    # stays the loaded one.
     #
     # Used by:
-    #   - main.updatecaddyconfig_HTTPPOST
+    #   - caddy/routes.updatecaddyconfig_HTTPPOST
     ############################################################
 
-    def save_caddyfile(self, caddyfile_content):
-        caddy_location = os.environ.get("CADDYFILE_LOCATION", '/users-caddy/Caddyfile')
-        with open(caddy_location, "w") as file:
-            file.write(caddyfile_content)
+    def apply_caddyfile(self, caddyfile_content):
+        content_hash = hashlib.sha256(caddyfile_content.encode()).hexdigest()
+
+        with self.apply_lock:
+            if content_hash == CaddyfileUpdater.loaded_hash:
+                # The admin API path may have written another
+                # render since — a Caddy restart must start
+                # from the loaded one
+                self.write_caddyfile(caddyfile_content)
+                return 'unchanged'
+
+            outcome = self.staged_config.apply(caddyfile_content, self.reload_caddy)
+            if outcome == 'failed':
+                CaddyfileUpdater.written_hash = CaddyfileUpdater.loaded_hash
+            if outcome != 'reloaded':
+                return 'failed'
+            CaddyfileUpdater.loaded_hash = CaddyfileUpdater.written_hash = content_hash
+            return 'reloaded'
+
+
+
+    # The write half alone — validated and swapped in, unless
+    # the file already holds this content. Also the admin API
+    # path's way of keeping the file in step for a Caddy
+    # restart; a render that does not validate is not
+    # written, the file keeps the last good one.
+    def write_caddyfile(self, caddyfile_content):
+        content_hash = hashlib.sha256(caddyfile_content.encode()).hexdigest()
+        with self.apply_lock:
+            if content_hash != CaddyfileUpdater.written_hash and self.staged_config.write(caddyfile_content):
+                CaddyfileUpdater.written_hash = content_hash
 
 
 
@@ -235,20 +372,39 @@ class CaddyfileUpdater:
     # reload_caddy
     ############################################################
     #
-    # `caddy reload` inside the users Caddy container, through
-    # the docker socket. Returns True/False — a failed reload
+    # `caddy reload` inside the users Caddy container, as an
+    # Engine API exec (docker_engine.exec_run). Returns True/False — a failed reload
     # leaves the OLD config serving (Caddy keeps running), and
     # the route answers 500 so the backend rolls the domain
     # change back.
     #
     # Used by:
-    #   - caddy/routes.updatecaddyconfig_HTTPPOST
+    #   - apply_caddyfile, through staged_config
     ############################################################
 
     def reload_caddy(self):
-        process = Popen([
-            'docker', 'exec', 'hosting-users-caddy', 'caddy', 'reload', '--config', '/etc/caddy/Caddyfile'
-        ])
-        output, error = process.communicate()
+        try:
+            exit_code, output = docker_engine.exec_run(
+                'hosting-users-caddy', ['caddy', 'reload', '--config', '/etc/caddy/Caddyfile'])
+        except Exception:
+            return False
+
+        return exit_code == 0
+
+
+
+
+
+
+
+
+############################################################
+# domain_row_key
+############################################################
+#
+# What a domain row renders from — the fragment cache key
+# here, and what caddy_admin diffs to find changed domains.
+############################################################
 
-        return process.returncode == 0
+def domain_row_key(dns_entry):
+    return (dns_entry["id"], dns_entry["virtualserverid"], dns_entry["domainname"], dns_entry["iscloudflare"], dns_entry["ssl"])
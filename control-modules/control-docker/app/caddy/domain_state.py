@@ -0,0 +1,170 @@
+############################################################
+#  [*] Domain state — the users Caddy's table, versioned
+#
+#  The backend used to POST the whole domain table on every
+#  edit. It now sends what changed, numbered: every domain
+#  change bumps the backend's revision in the transaction
+#  that makes it, so revision N is exactly the change from
+#  table N-1 to table N, in commit order. The push happens
+#  after the commit, so pushes arrive in any order:
+#
+#    {"revision": N, "domains": [...]}          — full resync,
+#                                                 at least
+#                                                 table N
+#    {"revision": N, "operations": [
+#        {"op": "add",    "domain": {...}},
+#        {"op": "update", "domain": {...}},
+#        {"op": "remove", "id": 5}]}            — change N
+#
+#  The sidecar keeps the table it last applied, with its
+#  generation — the revision it is at — in
+#  DOMAIN_STATE_FILENAME beside the Caddyfile; a restarted
+#  sidecar resumes from it. A round folds its payloads in
+#  revision order: a delta applies when it is the next
+#  revision, and is already covered when it is not newer
+#  than the generation (a full table got there first); a
+#  full table replaces the table unless it is not newer
+#  either. A delta that skips ahead of a missing one, or
+#  whose operations do not fit (adding an id that exists,
+#  updating or removing one that does not), is a mismatch:
+#  the route answers 409 and the backend resends the whole
+#  table. With no state file every delta is a mismatch.
+#
+#  A full table without a revision (a manual resync) always
+#  applies, one generation up.
+#
+#  Used by:
+#    - caddy/routes.regenerate_caddy
+############################################################
+
+import json
+import os
+import tempfile
+
+from .caddyfile_updater import caddyfile_location
+
+
+DOMAIN_STATE_FILENAME = 'Caddyfile.state.json'
+
+# (generation, {domain id: row} or None) as last applied —
+# read from the state file on first use
+applied_state = None
+
+
+
+
+
+
+
+
+############################################################
+# GenerationMismatch
+############################################################
+
+class GenerationMismatch(Exception):
+    pass
+
+
+
+
+
+
+
+
+############################################################
+# fold_payload
+############################################################
+#
+# One payload onto (generation, domains) → the next
+# (generation, domains), the same ones when the payload is
+# covered; raises GenerationMismatch. Never changes its
+# inputs — a round that fails to apply leaves the applied
+# state as it was.
+#
+# payload_revision is the round's sort key: revisionless
+# tables last, in arrival order.
+############################################################
+
+def fold_payload(generation, domains, payload):
+    revision = payload.get('revision')
+
+    if 'domains' in payload:
+        if revision is None:
+            return generation + 1, {row['id']: row for row in payload['domains']}
+        if revision <= generation and domains is not None:
+            return generation, domains
+        return revision, {row['id']: row for row in payload['domains']}
+
+    if domains is not None and revision is not None and revision <= generation:
+        return generation, domains
+    if domains is None or revision != generation + 1:
+        raise GenerationMismatch(f'revision {revision}, applied {generation}')
+
+    domains = dict(domains)
+    for operation in payload['operations']:
+        if operation['op'] == 'add' and operation['domain']['id'] not in domains:
+            domains[operation['domain']['id']] = operation['domain']
+        elif operation['op'] == 'update' and operation['domain']['id'] in domains:
+            domains[operation['domain']['id']] = operation['domain']
+        elif operation['op'] == 'remove' and operation['id'] in domains:
+            del domains[operation['id']]
+        else:
+            raise GenerationMismatch(f'{operation["op"]} does not fit the applied table')
+
+    return revision, domains
+
+
+
+def payload_revision(payload):
+    revision = payload.get('revision')
+    return float('inf') if revision is None else revision
+
+
+
+
+
+
+
+
+############################################################
+# current_state / commit_state
+############################################################
+#
+# current_state: the applied (generation, domains) — from
+# memory, or the state file once per process. An unreadable
+# file counts as no state: (0, None).
+#
+# commit_state: remember a successfully applied round and
+# persist it (temp file + rename, like the Caddyfile).
+############################################################
+
+def state_location():
+    return os.path.join(os.path.dirname(caddyfile_location()), DOMAIN_STATE_FILENAME)
+
+
+
+def current_state():
+    global applied_state
+    if applied_state is None:
+        try:
+            with open(state_location()) as file:
+                saved = json.load(file)
+            applied_state = (saved['generation'], {row['id']: row for row in saved['domains']})
+        except (OSError, ValueError, KeyError, TypeError):
+            applied_state = (0, None)
+    return applied_state
+
+
+
+def commit_state(generation, domains):
+    global applied_state
+    location = state_location()
+    fd, temp_location = tempfile.mkstemp(dir=os.path.dirname(location), prefix='.state-')
+    try:
+        with os.fdopen(fd, 'w') as file:
+            json.dump({'generation': generation, 'domains': [domains[domain_id] for domain_id in sorted(domains)]}, file)
+        os.replace(temp_location, location)
+    except BaseException:
+        os.unlink(temp_location)
+        raise
+    applied_state = (generation, domains)
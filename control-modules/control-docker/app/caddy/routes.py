@@ -9,7 +9,10 @@ import json
 
 from flask import Blueprint, Response, request
 
+from ..common.regeneration import RegenerationCoordinator, RegenerationError
+from .caddy_admin import CaddyAdmin, admin_socket
 from .caddyfile_updater import CaddyfileUpdater
+from .domain_state import GenerationMismatch, commit_state, current_state, fold_payload, payload_revision
 
 
 caddy_bp = Blueprint('caddy', __name__)
@@ -21,22 +24,102 @@ caddy_bp = Blueprint('caddy', __name__)
 
 
 
+############################################################
+# regenerate_caddy
+############################################################
+#
+# One round of the users Caddy's coordinator. The round's
+# payloads — full tables or deltas (caddy/domain_state) —
+# are folded in revision order onto the applied table, so
+# pushes that overtook each other on the way still fit; a
+# payload that does not fit is skipped and answered
+# 'mismatch' with the applied generation. If the table
+# changed, it is applied once: the admin API path
+# (USERS_CADDY_ADMIN_SOCKET set — caddy_admin; the file is
+# only written, for a Caddy restart) or the file path
+# (write + `caddy reload`, each skipped when unchanged), and
+# only a table that applied is committed as the new state.
+# Answers (generation, outcome) per payload — outcome
+# 'unchanged', 'failed', 'mismatch', or how it was applied.
+############################################################
+
+def regenerate_caddy(submissions):
+    applied = current_state()
+    generation, domains = applied
+    folded = {}                 # submission number → its generation, or None on a mismatch
+
+    for number, payload in sorted(submissions, key=lambda submission: payload_revision(submission[1])):
+        try:
+            generation, domains = fold_payload(generation, domains, payload)
+            folded[number] = generation
+        except GenerationMismatch as e:
+            print(f'Caddy config: {e} — asking for the full table')
+            folded[number] = None
+
+    outcome = 'mismatch'
+    if (generation, domains) != applied:
+        outcome = apply_domains([domains[domain_id] for domain_id in sorted(domains)])
+        if outcome != 'failed':
+            commit_state(generation, domains)
+    elif any(thisGeneration is not None for thisGeneration in folded.values()):
+        outcome = 'unchanged'
+
+    applied_generation = current_state()[0]
+    return [(folded[number], outcome) if folded[number] is not None else (applied_generation, 'mismatch') for number, _ in submissions]
+
+
+
+def apply_domains(domains):
+    caddyUpdater = CaddyfileUpdater()
+    caddy_config = caddyUpdater.generate_caddyfile(domains)
+
+    if admin_socket():
+        outcome = CaddyAdmin().apply_domains(domains)
+        if outcome != 'failed':
+            caddyUpdater.write_caddyfile(caddy_config)
+        return outcome
+
+    return caddyUpdater.apply_caddyfile(caddy_config)
+
+
+
+caddy_coordinator = RegenerationCoordinator('caddy', regenerate_caddy)
+
+
+
+
+
+
+
+
 ############################################################
 # updatecaddyconfig_HTTPPOST
 ############################################################
 #
 # POST /api/updatecaddyconfig
 #
-# The whole domain table in → a fresh users Caddyfile out,
-# then `caddy reload` in the users Caddy container. The
-# backend calls this INSIDE its request transaction, and a
-# failed reload answers 500 here — that is what actually
-# rolls the domain change back on the backend side (a 200
-# would have let the table and the Caddyfile diverge).
+# A full domain table or one numbered change
+# (caddy/domain_state) → the users Caddy running the result
+# (regenerate_caddy). Every answer carries a generation —
+# the revision the applied table was at with this call's
+# change in it. A render identical to the running config (or
+# a change a newer table already carried) answers "Caddy
+# config unchanged", still a 200; a delta that does not fit
+# answers 409 with the applied generation — the backend then
+# sends the full table. Concurrent calls are coalesced
+# (common/regeneration): their changes are applied in
+# revision order, with one reload for all of them. The
+# backend calls this AFTER committing the change, outside
+# its write lock, so edits from many requests can pile up
+# into one round. A failed reload (or a render that does not
+# validate — common/staged_config — or a round that raised)
+# answers 500 here — the backend then undoes its change and
+# resends the table (a 200 would have let the table and the
+# Caddyfile diverge).
 #
-# The body is a plain JSON object: {"domains": [...]} (the
-# old double-encoded string-of-JSON contract is gone — the
-# backend sends the object directly).
+# The body is a plain JSON object (the old double-encoded
+# string-of-JSON contract is gone — the backend sends the
+# object directly).
 #
 # Used by:
 #   - control-backend dns_views — every domain mutation
@@ -48,14 +131,22 @@ def updatecaddyconfig_HTTPPOST():
     # Get the data from the request
     data = request.get_json()
 
-    # Update the Caddyfile configuration
-    caddyUpdater = CaddyfileUpdater()
-    caddy_config = caddyUpdater.generate_caddyfile(data['domains'])
-    caddyUpdater.save_caddyfile(caddy_config)
+    # Update the Caddy configuration
+    try:
+        generation, outcome = caddy_coordinator.submit(data)
+    except RegenerationError as e:
+        print(f'{e}: {e.__cause__}')
+        return Response(json.dumps({'error': 'Caddy regeneration failed', 'generation': current_state()[0]}), mimetype='application/json', status=500)
+
+    if outcome == 'mismatch':
+        return Response(json.dumps({'error': 'Generation mismatch', 'generation': generation}), mimetype='application/json', status=409)
 
     # A failed reload means the new file is NOT serving — the
     # caller must treat the whole operation as failed
-    if not caddyUpdater.reload_caddy():
-        return Response(json.dumps({'error': 'Caddy reload failed'}), mimetype='application/json', status=500)
+    if outcome == 'failed':
+        return Response(json.dumps({'error': 'Caddy reload failed', 'generation': generation}), mimetype='application/json', status=500)
+
+    if outcome == 'unchanged':
+        return Response(json.dumps({'message': 'Caddy config unchanged', 'generation': generation}), mimetype='application/json')
 
-    return Response(json.dumps({'message': f'Caddy config updated'}), mimetype='application/json')
+    return Response(json.dumps({'message': f'Caddy config updated', 'generation': generation}), mimetype='application/json')
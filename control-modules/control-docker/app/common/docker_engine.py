@@ -0,0 +1,173 @@
+############################################################
+#  [*] Docker Engine — the host daemon's HTTP API, natively
+#
+#  Every lifecycle route and both caddy reloads used to fork
+#  the docker CLI (a Go binary start + a fresh socket
+#  handshake per call). They now speak the Engine API
+#  directly over /var/run/docker.sock, on the keep-alive
+#  host_session of common/http_pool — the same socket the
+#  status routes always read.
+#
+#  Each call raises EngineError (status_code + the daemon's
+#  message) on an answer the operation did not expect, and
+#  lets requests.RequestException through on socket errors.
+#  Answers that mean "already there" (304 on start/stop, 404
+#  on remove) count as success — the routes judge outcomes.
+#
+#  HTTP timeouts cover what the DAEMON does before answering:
+#  stop waits up to the container's grace period, an exec is
+#  read to its end.
+#
+#  Used by:
+#    - virtual_servers/routes — create/start/stop/delete/cleanup
+#    - caddy/caddyfile_updater — reload_caddy
+#    - portforwarder/portforwarder_updater — reload_portforwarder
+#    - common/staged_config — caddy validate
+############################################################
+
+
+import time
+from urllib.parse import quote
+
+from .http_pool import host_session
+
+
+HOST_API_URL = 'http+unix://%2Fvar%2Frun%2Fdocker.sock'
+
+# Engine API answers are small; the slow parts are bounded
+# per call below
+DEFAULT_TIMEOUT = 30
+
+
+
+
+
+
+
+
+############################################################
+# EngineError / call
+############################################################
+#
+# call: one Engine API request. ok_statuses are the answers
+# the caller treats as success; anything else → EngineError.
+############################################################
+
+class EngineError(Exception):
+
+    def __init__(self, status_code, message):
+        super().__init__(f'{status_code}: {message}')
+        self.status_code = status_code
+        self.message = message
+
+
+
+def call(method, path, ok_statuses=(200, 201, 204), timeout=DEFAULT_TIMEOUT, **kwargs):
+    response = host_session.request(method, f'{HOST_API_URL}{path}', timeout=timeout, **kwargs)
+    if response.status_code not in ok_statuses:
+        try:
+            message = response.json().get('message', response.text)
+        except ValueError:
+            message = response.text
+        raise EngineError(response.status_code, message)
+    return response
+
+
+
+def container_path(name):
+    return f'/containers/{quote(name, safe="")}'
+
+
+
+
+
+
+
+
+############################################################
+# Containers
+############################################################
+#
+# create_container — POST /containers/create; the config is
+#                    the Engine API body (Image, Hostname,
+#                    HostConfig...). Returns the new id.
+# start_container  — 304 (already running) is success
+# stop_container   — 304 (already stopped) is success; the
+#                    daemon kills after grace_seconds
+# remove_container — 404 (already gone) is success
+# inspect_container — the inspect document, None when the
+#                    container does not exist
+# wait_for_state   — poll until State.Status is one of the
+#                    wanted statuses (or the container is
+#                    gone, when None is among them); returns
+#                    the last status seen
+############################################################
+
+def create_container(name, config):
+    response = call('POST', '/containers/create', params={'name': name}, json=config)
+    return response.json()['Id']
+
+
+
+def start_container(name):
+    call('POST', f'{container_path(name)}/start', ok_statuses=(204, 304))
+
+
+
+def stop_container(name, grace_seconds=10):
+    call('POST', f'{container_path(name)}/stop', ok_statuses=(204, 304),
+         params={'t': grace_seconds}, timeout=grace_seconds + DEFAULT_TIMEOUT)
+
+
+
+def remove_container(name, force=False):
+    call('DELETE', container_path(name), ok_statuses=(204, 404), params={'force': int(force)})
+
+
+
+def inspect_container(name):
+    response = call('GET', f'{container_path(name)}/json', ok_statuses=(200, 404))
+    return response.json() if response.status_code == 200 else None
+
+
+
+def wait_for_state(name, statuses, timeout=30, interval=0.25):
+    deadline = time.monotonic() + timeout
+    while True:
+        inspected = inspect_container(name)
+        status = inspected['State']['Status'] if inspected else None
+        if status in statuses or time.monotonic() >= deadline:
+            return status
+        time.sleep(interval)
+
+
+
+
+
+
+
+
+############################################################
+# exec_run
+############################################################
+#
+# `docker exec` without the CLI: create the exec, start it
+# attached and read its output stream to the end (the exec
+# is finished when the stream closes), then read its exit
+# code. Returns (exit_code, raw output bytes) — the output
+# is the daemon's multiplexed stdout/stderr stream, kept
+# only for error messages.
+############################################################
+
+def exec_run(name, cmd, timeout=DEFAULT_TIMEOUT):
+    created = call('POST', f'{container_path(name)}/exec', json={
+        'Cmd': cmd,
+        'AttachStdout': True,
+        'AttachStderr': True,
+    })
+    exec_id = created.json()['Id']
+
+    output = call('POST', f'/exec/{exec_id}/start', json={'Detach': False, 'Tty': False}, timeout=timeout).content
+
+    inspected = call('GET', f'/exec/{exec_id}/json').json()
+    return inspected.get('ExitCode'), output
@@ -0,0 +1,158 @@
+############################################################
+#  [*] Pooled HTTP — keep-alive sessions for the daemons
+#
+#  The status proxy used to open a fresh unix-socket session
+#  (host daemon) or a fresh TCP connection (an inner daemon
+#  through the dockersocket Caddy) for every call. Both now
+#  go through one process-wide session each, whose urllib3
+#  pools keep the connections alive between calls and hand
+#  them to whichever thread asks next:
+#
+#    host_session — http+unix:// to /var/run/docker.sock,
+#                   ONE pool per socket (requests_unixsocket
+#                   keeps one per full URL, so nothing was
+#                   ever reused across paths)
+#    proxy_session — http:// to hosting-control-dockersocket
+#
+#  Neither session keeps cookies: the VM id cookie goes out
+#  per call, and a Set-Cookie from one VM's daemon must never
+#  ride along on the next VM's request.
+#
+#  HTTP_POOL_SIZE bounds the idle connections kept per
+#  socket/host — not concurrency: a burst beyond it still
+#  gets connections, they are just closed instead of pooled.
+#  Timeouts stay per call, exactly as before.
+#
+#  pool_stats(): requests sent vs. connections opened; the
+#  difference is the requests that reused a connection.
+#
+#  Used by:
+#    - status/routes — the status proxy, /api/poolstats
+#    - events/docker_events — event streams + lookups
+############################################################
+
+
+import os
+import threading
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests_unixsocket.adapters import UnixAdapter, UnixHTTPConnectionPool
+from urllib3.connectionpool import HTTPConnectionPool
+
+
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '32'))
+
+stats_lock = threading.Lock()
+stats = {'requests': 0, 'opened': 0}
+
+
+
+
+
+
+
+
+############################################################
+# Counting pools + adapters
+############################################################
+#
+# urllib3 calls _new_conn exactly when a pool has no idle
+# connection to hand out — the one place a connection is
+# really opened. The adapters count every request sent.
+############################################################
+
+def count(key):
+    with stats_lock:
+        stats[key] += 1
+
+
+
+class CountingHTTPConnectionPool(HTTPConnectionPool):
+
+    def _new_conn(self):
+        count('opened')
+        return super()._new_conn()
+
+
+
+class CountingUnixConnectionPool(UnixHTTPConnectionPool):
+
+    def __init__(self, socket_url, timeout, maxsize):
+        HTTPConnectionPool.__init__(self, 'localhost', timeout=timeout, maxsize=maxsize)
+        self.socket_path = socket_url
+        self.timeout = timeout
+
+    def _new_conn(self):
+        count('opened')
+        return super()._new_conn()
+
+
+
+class CountingAdapter(HTTPAdapter):
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': CountingHTTPConnectionPool}
+
+    def send(self, request, **kwargs):
+        count('requests')
+        return super().send(request, **kwargs)
+
+
+
+class CountingUnixAdapter(UnixAdapter):
+
+    def __init__(self, pool_maxsize):
+        super().__init__()
+        self.pool_maxsize = pool_maxsize
+
+    def get_connection(self, url, proxies=None):
+        # Key the pool by the socket, not by the full URL
+        socket_url = f'http+unix://{urlparse(url).netloc}'
+
+        with self.pools.lock:
+            pool = self.pools.get(socket_url)
+            if pool is None:
+                pool = CountingUnixConnectionPool(socket_url, self.timeout, self.pool_maxsize)
+                self.pools[socket_url] = pool
+
+        return pool
+
+    def send(self, request, **kwargs):
+        count('requests')
+        return super().send(request, **kwargs)
+
+
+
+
+
+
+
+
+############################################################
+# host_session / proxy_session / pool_stats
+############################################################
+
+def build_session(scheme, adapter):
+    session = requests.Session()
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    session.mount(scheme, adapter)
+    return session
+
+
+
+host_session = build_session('http+unix://', CountingUnixAdapter(pool_maxsize=HTTP_POOL_SIZE))
+proxy_session = build_session('http://', CountingAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE))
+
+
+
+def pool_stats():
+    with stats_lock:
+        return {
+            'requests': stats['requests'],
+            'opened': stats['opened'],
+            'reused': max(0, stats['requests'] - stats['opened']),
+        }
@@ -0,0 +1,147 @@
+############################################################
+#  [*] Regeneration coordinator — one reload per burst
+#
+#  Every /api/updatecaddyconfig and
+#  /api/updateportforwarderconfig call used to render, write
+#  and reload on its own — a burst of edits became a
+#  queue of back-to-back reloads, every caller waiting (and,
+#  on the backend, holding its transaction) for all the
+#  reloads ahead of it.
+#
+#  A coordinator runs one target's regenerations on a single
+#  worker thread. Every call gets the next submission number
+#  and parks; the worker hands the whole round — the parked
+#  submissions, in order — to the target's apply, which
+#  renders and reloads ONCE and returns one answer per
+#  submission. Calls arriving while a round runs go into the
+#  next one, so however many pile up behind a slow reload,
+#  they cost one more.
+#
+#  Only a burst waits REGENERATION_DEBOUNCE_SECONDS for the
+#  rest of itself: a round that starts with several calls
+#  parked, or with calls that arrived while the last round
+#  ran. A lone call on an idle coordinator goes straight
+#  through.
+#
+#  The backend commits each change first and calls here
+#  after, outside its SQLite write lock — holding the lock
+#  through the call would let only one edit reach the
+#  sidecar at a time, with nothing left to coalesce. Its
+#  calls therefore carry the revision their change committed
+#  at, and can arrive out of order.
+#
+#  What a round folds is the target's business: whole tables
+#  go to the newest revision (the portforwarder), the users
+#  Caddy's deltas are applied in revision order onto its
+#  state. Either way a caller's answer is about the config
+#  that was applied (or failed) with its change in it; a
+#  failed round fails every caller in it, and each one
+#  undoes its change on the backend.
+#
+#  Used by:
+#    - caddy/routes — the users Caddy
+#    - portforwarder/routes — the portforwarder
+############################################################
+
+import os
+import threading
+import time
+
+
+REGENERATION_DEBOUNCE_SECONDS = float(os.getenv('REGENERATION_DEBOUNCE_SECONDS', '0.05'))
+
+
+
+
+
+
+
+
+############################################################
+# RegenerationError
+############################################################
+#
+# Raised in every caller of a round whose apply raised —
+# the original exception is its __cause__.
+############################################################
+
+class RegenerationError(Exception):
+    pass
+
+
+
+
+
+
+
+
+############################################################
+# RegenerationCoordinator
+############################################################
+#
+# apply([(submission number, payload), ...]) → one answer
+# per submission, in order; called on the worker only,
+# never twice at once.
+#
+#   submit(payload) → this call's answer — blocks until the
+#                     round covering it ran
+#   stats           — {'submitted', 'rounds'}
+############################################################
+
+class RegenerationCoordinator:
+
+    def __init__(self, name, apply, debounce_seconds=REGENERATION_DEBOUNCE_SECONDS):
+        self.name = name
+        self.apply = apply
+        self.debounce_seconds = debounce_seconds
+        self.condition = threading.Condition()
+        self.waiting = []           # (ticket, submission) the next round answers
+        self.worker = None
+        self.stats = {'submitted': 0, 'rounds': 0}
+
+
+
+    def submit(self, payload):
+        ticket = {'done': threading.Event()}
+
+        with self.condition:
+            self.stats['submitted'] += 1
+            self.waiting.append((ticket, (self.stats['submitted'], payload)))
+            if self.worker is None:
+                self.worker = threading.Thread(target=self.run, name=f'regenerate-{self.name}', daemon=True)
+                self.worker.start()
+            self.condition.notify()
+
+        ticket['done'].wait()
+        if ticket['error'] is not None:
+            raise RegenerationError(f'{self.name} regeneration failed') from ticket['error']
+        return ticket['answer']
+
+
+
+    def run(self):
+        contended = False           # calls arrived while the last round ran
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.waiting)
+                burst = contended or len(self.waiting) > 1
+
+            # Let the rest of a burst arrive
+            if burst:
+                time.sleep(self.debounce_seconds)
+
+            with self.condition:
+                waiting, self.waiting = self.waiting, []
+                self.stats['rounds'] += 1
+
+            try:
+                answers, error = self.apply([submission for _, submission in waiting]), None
+            except Exception as e:
+                answers, error = [None] * len(waiting), e
+
+            with self.condition:
+                contended = bool(self.waiting)
+
+            for (ticket, _), answer in zip(waiting, answers):
+                ticket.update(answer=answer, error=error)
+                ticket['done'].set()
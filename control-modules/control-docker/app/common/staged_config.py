@@ -0,0 +1,257 @@
+############################################################
+#  [*] Staged config — validate before the swap, roll back
+#      after a refused reload
+#
+#  The generated Caddyfiles (the users Caddy's and the
+#  portforwarder's) used to be written over the live file
+#  and then reloaded: a config Caddy refused stayed on disk
+#  for the next container restart to fail on, and a syntax
+#  error cost a full reload to find. Both now go through one
+#  pipeline:
+#
+#    1. the render is written to a candidate file beside the
+#       live one (a temp name in the same directory, 0644)
+#    2. the candidate is validated — check_caddyfile_syntax
+#       in-process, and with CADDY_VALIDATE=caddy also
+#       `caddy validate` on it inside the target container.
+#       A rejected candidate is deleted; the live file is
+#       never touched and no reload is paid for
+#    3. the candidate is renamed over the live file (atomic)
+#    4. Caddy reloads it; when the reload is refused, the
+#       last-known-good content goes back on disk — what the
+#       last successful reload loaded, or before the first
+#       one in this process, the live file as it was
+#
+#  Verdicts are cached by content hash (the
+#  VALIDATION_CACHE_SIZE most recent), so a render already
+#  checked — a retry, a config toggled back — skips the
+#  check, and one already rejected fails at once. A
+#  validation that could not run (the exec failed) is not
+#  cached.
+#
+#  The containers mount the DIRECTORY holding their file as
+#  /etc/caddy — the rename needs it, and `caddy validate`
+#  finds the candidate there.
+#
+#  Used by:
+#    - caddy/caddyfile_updater — the users Caddy
+#    - portforwarder/portforwarder_updater — the
+#      portforwarder
+############################################################
+
+import hashlib
+import os
+import tempfile
+from collections import OrderedDict
+
+from . import docker_engine
+
+
+VALIDATION_CACHE_SIZE = 64
+
+# Where the containers see the directory the files live in
+CONTAINER_CONFIG_DIRECTORY = '/etc/caddy'
+
+
+
+
+
+
+
+
+############################################################
+# check_caddyfile_syntax
+############################################################
+#
+# The in-process check: the Caddyfile's lexical structure —
+# every quoted string closed, every block opened by a
+# standalone `{` token closed by a standalone `}`. Braces
+# inside a token (placeholders like {remote_host}) are not
+# blocks, and `#` starts a comment only at a token's start,
+# as in Caddy's own lexer. Returns None, or what is wrong
+# and on which line.
+#
+# It does not know directives — a misspelled one passes
+# here and is caught by `caddy validate` or the reload.
+############################################################
+
+def check_caddyfile_syntax(content):
+    open_blocks = []            # line numbers of the open `{`
+    line = 1
+    position = 0
+
+    while position < len(content):
+        character = content[position]
+
+        if character == '\n':
+            line += 1
+            position += 1
+        elif character.isspace():
+            position += 1
+        elif character == '#':
+            end = content.find('\n', position)
+            position = len(content) if end == -1 else end
+        elif character in '"`':
+            start_line = line
+            position += 1
+            while position < len(content) and content[position] != character:
+                if character == '"' and content[position] == '\\':
+                    position += 1
+                elif content[position] == '\n':
+                    line += 1
+                position += 1
+            if position >= len(content):
+                return f'line {start_line}: unterminated {character} string'
+            position += 1
+        else:
+            start = position
+            while position < len(content) and not content[position].isspace():
+                position += 1
+            token = content[start:position]
+            if token == '{':
+                open_blocks.append(line)
+            elif token == '}':
+                if not open_blocks:
+                    return f'line {line}: unexpected }}'
+                open_blocks.pop()
+
+    if open_blocks:
+        return f'line {open_blocks[-1]}: unclosed {{'
+    return None
+
+
+
+
+
+
+
+
+############################################################
+# write_candidate / replace_file
+############################################################
+#
+# write_candidate: content → a temp file beside location
+# (same directory, so the rename is atomic), 0644 — the
+# Caddy containers do not run as root. Returns its path.
+#
+# replace_file: write_candidate + the rename — a reader
+# never sees a half-written file.
+############################################################
+
+def write_candidate(location, content):
+    fd, candidate = tempfile.mkstemp(dir=os.path.dirname(location), prefix=f'.{os.path.basename(location)}-')
+    try:
+        with os.fdopen(fd, 'w') as file:
+            file.write(content)
+        os.chmod(candidate, 0o644)
+    except BaseException:
+        os.unlink(candidate)
+        raise
+    return candidate
+
+
+
+def replace_file(location, content):
+    candidate = write_candidate(location, content)
+    try:
+        os.replace(candidate, location)
+    except BaseException:
+        os.unlink(candidate)
+        raise
+
+
+
+
+
+
+
+
+############################################################
+# StagedConfig
+############################################################
+#
+# One per generated file: container is where `caddy
+# validate` runs, location a callable giving the live
+# file's path (read per call, like the *_LOCATION variables
+# it reads). The callers serialize their calls.
+#
+#   write(content)         → True, or False when the
+#                            candidate was rejected (the live
+#                            file untouched)
+#   apply(content, reload) → 'reloaded' | 'invalid' |
+#                            'failed' (reload refused, the
+#                            last-known-good file restored)
+#   validate(content, candidate) → None or the reason,
+#                            cached by content hash
+############################################################
+
+class StagedConfig:
+
+    def __init__(self, container, location):
+        self.container = container
+        self.location = location
+        self.verdicts = OrderedDict()       # (mode, content hash) → None or the reason
+        self.last_good = None               # the content the last successful reload loaded
+
+
+
+    def write(self, content):
+        location = self.location()
+        candidate = write_candidate(location, content)
+        try:
+            problem = self.validate(content, candidate)
+            if problem is not None:
+                print(f'{self.container}: candidate config rejected: {problem}')
+                return False
+            os.replace(candidate, location)
+            candidate = None
+        finally:
+            if candidate is not None:
+                os.unlink(candidate)
+        return True
+
+
+
+    def apply(self, content, reload):
+        location = self.location()
+        last_good = self.last_good
+        if last_good is None and os.path.exists(location):
+            with open(location) as file:
+                last_good = file.read()
+
+        if not self.write(content):
+            return 'invalid'
+
+        if reload():
+            self.last_good = content
+            return 'reloaded'
+
+        if last_good is not None:
+            replace_file(location, last_good)
+        return 'failed'
+
+
+
+    def validate(self, content, candidate):
+        mode = os.environ.get('CADDY_VALIDATE', 'syntax')
+        key = (mode, hashlib.sha256(content.encode()).hexdigest())
+        if key in self.verdicts:
+            self.verdicts.move_to_end(key)
+            return self.verdicts[key]
+
+        problem = check_caddyfile_syntax(content)
+        if problem is None and mode == 'caddy':
+            try:
+                exit_code, output = docker_engine.exec_run(self.container, [
+                    'caddy', 'validate', '--adapter', 'caddyfile',
+                    '--config', f'{CONTAINER_CONFIG_DIRECTORY}/{os.path.basename(candidate)}',
+                ])
+            except Exception as e:
+                return f'caddy validate could not run: {e}'
+            if exit_code != 0:
+                problem = f'caddy validate: {output.decode(errors="replace").strip()[-300:]}'
+
+        self.verdicts[key] = problem
+        if len(self.verdicts) > VALIDATION_CACHE_SIZE:
+            self.verdicts.popitem(last=False)
+        return problem
@@ -0,0 +1,256 @@
+############################################################
+#  [*] DockerEventStream — container deltas from every daemon
+#
+#  Subscribes to the Engine API /events endpoint of the host
+#  daemon (unix socket) and of every running VM's INNER
+#  daemon (through the dockersocket Caddy, routed by the
+#  virtual-server-id cookie), and merges them into one queue
+#  of container deltas:
+#
+#    {"parent": "host" | "hosting-users-dind-<id>",
+#     "action": "create" | "start" | "die" | "destroy" |
+#               "rename" | "resync",
+#     "id": <docker id>, "container": <legacy dict> | null}
+#
+#  "container" is the legacy `docker ps` shape (the same
+#  reshape_container the status route uses), looked up right
+#  after the event — null on destroy, or when the container
+#  is already gone again. "resync" means events of that
+#  daemon may have been missed — its stream broke, or a VM's
+#  stream only just opened (the inner containers start with
+#  the dind, before its watcher is up): the consumer must
+#  re-list that parent in full.
+#
+#  VM watchers follow the host stream: a dind start opens the
+#  VM's inner stream, a dind die/destroy closes it.
+############################################################
+
+import json
+import queue
+import threading
+import urllib.parse
+
+from ..common.http_pool import host_session, proxy_session
+from ..status.routes import reshape_container
+
+
+HOST_API_URL = 'http+unix://%2Fvar%2Frun%2Fdocker.sock'
+VM_API_URL = 'http://hosting-control-dockersocket:80/dockersocket'
+DIND_PREFIX = 'hosting-users-dind-'
+
+# Only the events that change what `docker ps` shows
+WATCHED_ACTIONS = ['create', 'start', 'die', 'destroy', 'rename']
+
+# A keep-alive line this often, so the consumer's read
+# timeout can tell an idle stream from a dead one
+HEARTBEAT_SECONDS = 15
+
+# Back-off before a broken daemon stream is reopened
+RETRY_SECONDS = 3
+
+
+
+
+
+
+
+
+############################################################
+# api_get
+############################################################
+#
+# One Engine API GET against a parent's daemon: "host" goes
+# through the unix socket, a dind name through the
+# dockersocket proxy with the VM id cookie, both over the
+# keep-alive pools of common/http_pool. Raises
+# requests.RequestException on network errors.
+#
+# Used by:
+#   - DockerEventStream (below) — event streams + lookups
+############################################################
+
+def api_get(parent, path, **kwargs):
+    if parent == 'host':
+        return host_session.get(f'{HOST_API_URL}{path}', **kwargs)
+
+    vm_id = parent.replace(DIND_PREFIX, '')
+    return proxy_session.get(f'{VM_API_URL}{path}', cookies={'virtual-server-id': vm_id}, **kwargs)
+
+
+
+def filters_query(filters):
+    return urllib.parse.quote(json.dumps(filters))
+
+
+
+
+
+
+
+
+############################################################
+# DockerEventStream
+############################################################
+#
+# One instance per /api/events subscriber. Threads: one
+# watcher per daemon, all feeding self.deltas; lines() is
+# the consumer side. close() stops every watcher — the
+# blocking stream reads are unblocked by closing their
+# responses.
+#
+# Methods:
+#   start  — open the host watcher + one per running VM
+#   lines  — NDJSON lines (deltas + heartbeats), forever
+#   close  — stop all watchers
+############################################################
+
+class DockerEventStream:
+
+    def __init__(self):
+        self.deltas = queue.Queue()
+        self.lock = threading.Lock()
+        self.watchers = {}          # parent → stop Event
+        self.responses = {}         # parent → open stream response
+        self.closed = False
+
+
+
+    def start(self):
+        self.watch('host')
+
+        running = api_get('host', '/containers/json?filters=' + filters_query({'status': ['running']}), timeout=5)
+        for container in running.json():
+            name = (container.get('Names') or [''])[0].lstrip('/')
+            if self.is_vm_name(name):
+                self.watch(name)
+
+
+
+    def lines(self):
+        while True:
+            try:
+                delta = self.deltas.get(timeout=HEARTBEAT_SECONDS)
+            except queue.Empty:
+                delta = {'action': 'heartbeat'}
+            yield json.dumps(delta) + '\n'
+
+
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            for parent in list(self.watchers):
+                self.unwatch_locked(parent)
+
+
+
+    ############################################################
+    # Watchers
+    ############################################################
+
+    @staticmethod
+    def is_vm_name(name):
+        return name.startswith(DIND_PREFIX) and name.replace(DIND_PREFIX, '').isdigit()
+
+
+
+    def watch(self, parent):
+        with self.lock:
+            if self.closed or parent in self.watchers:
+                return
+            stop = threading.Event()
+            self.watchers[parent] = stop
+        threading.Thread(target=self.run_watcher, args=(parent, stop), daemon=True).start()
+
+
+
+    def unwatch_locked(self, parent):
+        stop = self.watchers.pop(parent, None)
+        if stop is not None:
+            stop.set()
+        response = self.responses.pop(parent, None)
+        if response is not None:
+            try:
+                response.close()
+            except Exception:
+                pass
+
+
+
+    def run_watcher(self, parent, stop):
+        path = '/events?filters=' + filters_query({'type': ['container'], 'event': WATCHED_ACTIONS})
+        firstRound = True
+
+        while not stop.is_set():
+            try:
+                response = api_get(parent, path, stream=True, timeout=(5, None))
+                with self.lock:
+                    if stop.is_set():
+                        response.close()
+                        return
+                    self.responses[parent] = response
+
+                # A REopened stream may have missed events, and so
+                # may a VM's first one
+                if not firstRound or parent != 'host':
+                    self.deltas.put({'parent': parent, 'action': 'resync', 'id': None, 'container': None})
+                firstRound = False
+
+                for line in response.iter_lines():
+                    if stop.is_set():
+                        return
+                    if line:
+                        self.handle_event(parent, json.loads(line))
+
+            except Exception as e:
+                if stop.is_set():
+                    return
+                print(f'Event stream error ({parent}): {e}', flush=True)
+
+            firstRound = False
+            stop.wait(RETRY_SECONDS)
+
+
+
+    ############################################################
+    # handle_event
+    ############################################################
+    #
+    # One raw Engine API event → one delta on the queue. Host
+    # events for dind containers also open/close that VM's
+    # inner watcher.
+    ############################################################
+
+    def handle_event(self, parent, event):
+        action = event.get('Action') or event.get('status') or ''
+        if action not in WATCHED_ACTIONS:
+            return
+        actor = event.get('Actor') or {}
+        docker_id = actor.get('ID') or event.get('id')
+        name = (actor.get('Attributes') or {}).get('name', '')
+
+        container = None
+        if action != 'destroy':
+            container = self.lookup(parent, docker_id)
+
+        self.deltas.put({'parent': parent, 'action': action, 'id': docker_id, 'container': container})
+
+        if parent == 'host' and self.is_vm_name(name):
+            if action == 'start':
+                self.watch(name)
+            elif action in ('die', 'destroy'):
+                with self.lock:
+                    self.unwatch_locked(name)
+
+
+
+    def lookup(self, parent, docker_id):
+        try:
+            path = '/containers/json?all=1&filters=' + filters_query({'id': [docker_id]})
+            response = api_get(parent, path, timeout=5)
+            if response.status_code != 200:
+                return None
+            matches = response.json()
+            return reshape_container(matches[0]) if matches else None
+        except Exception:
+            return None
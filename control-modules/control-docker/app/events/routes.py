@@ -0,0 +1,56 @@
+############################################################
+#  [*] Events routes — the live container delta stream
+#
+#    GET  /api/events  — NDJSON, one delta per line, forever
+############################################################
+
+
+import json
+
+from flask import Blueprint, Response
+
+from .docker_events import DockerEventStream
+
+
+events_bp = Blueprint('events', __name__)
+
+
+
+
+
+
+
+
+############################################################
+# events_HTTPGET
+############################################################
+#
+# GET /api/events
+#
+# Opens a DockerEventStream for this subscriber and streams
+# its deltas as NDJSON (see docker_events.py for the line
+# shape), plus a {"action": "heartbeat"} line whenever the
+# daemons are quiet for HEARTBEAT_SECONDS. The stream never
+# ends on its own; the watchers die with the connection.
+#
+# Used by:
+#   - control-backend monitor_containers --events — the
+#     event-driven cache mode
+############################################################
+
+@events_bp.route('/api/events', methods=['GET'])
+def events_HTTPGET():
+    stream = DockerEventStream()
+    try:
+        stream.start()
+    except Exception as e:
+        stream.close()
+        return Response(json.dumps({'error': f'Failed to subscribe to docker events: {e}'}), mimetype='application/json', status=500)
+
+    def generate():
+        try:
+            yield from stream.lines()
+        finally:
+            stream.close()
+
+    return Response(generate(), mimetype='application/x-ndjson')
@@ -16,13 +16,39 @@
 #  what keeps the table inside the pool.
 #
 #  The rendered file is the throwaway artifact — the forward
-#  table is the source of truth, and every mutation rewrites
-#  the file wholesale.
+#  table is the source of truth, and every mutation renders
+#  the file wholesale. It is put in place through the staged
+#  pipeline (common/staged_config: candidate file,
+#  validation, rename, reload, the last good file back on a
+#  refused reload) — which is why the portforwarder mounts
+#  the DIRECTORY holding it (_DATA/users-portforwarder/etc →
+#  /etc/caddy).
 ############################################################
 
 import os
 import re
-from subprocess import Popen, PIPE
+
+from ..common import docker_engine
+from ..common.staged_config import StagedConfig
+
+
+
+
+
+
+
+
+############################################################
+# portforwarder_caddyfile_location
+############################################################
+#
+# Where the portforwarder Caddyfile lives on the shared
+# volume (PORTFORWARDER_CADDYFILE_LOCATION) — read per call,
+# so tests can point it elsewhere.
+############################################################
+
+def portforwarder_caddyfile_location():
+    return os.environ.get("PORTFORWARDER_CADDYFILE_LOCATION", '/users-portforwarder/etc/Caddyfile')
 
 
 
@@ -40,15 +66,21 @@ from subprocess import Popen, PIPE
 # time (the re.sub below each) — the same shape as the
 # users-Caddy CaddyfileUpdater.
 #
+# staged_config is class-level, shared by every instance:
+# the file's validation cache and last-known-good content.
+#
 # Methods:
 #   generate_caddyfile — forward rows → the whole file text
-#   save_caddyfile     — write to PORTFORWARDER_CADDYFILE_LOCATION
-#   reload_portforwarder — docker exec caddy reload
+#   apply_caddyfile    — validate, swap in, reload
+#   reload_portforwarder — caddy reload via an Engine API exec
 ############################################################
 
 class PortforwarderUpdater:
 
 
+    staged_config = StagedConfig('hosting-users-portforwarder', portforwarder_caddyfile_location)
+
+
     # Banner block — also the whole file when no forwards exist
     generated_file_banner = '''
     ########################################################################################################################
@@ -127,21 +159,21 @@ class PortforwarderUpdater:
 
 
     ############################################################
-    # save_caddyfile
+    # apply_caddyfile
     ############################################################
     #
-    # Write the rendered file to the shared portforwarder
-    # volume (PORTFORWARDER_CADDYFILE_LOCATION, default
-    # /users-portforwarder/Caddyfile).
+    # The rendered file → the running config: 'reloaded', or
+    # 'failed' when it did not validate (the live file
+    # untouched) or the reload was refused (the last good
+    # file restored) — the OLD listeners keep serving.
     #
     # Used by:
-    #   - portforwarder/routes.updateportforwarderconfig_HTTPPOST
+    #   - portforwarder/routes.regenerate_portforwarder
     ############################################################
 
-    def save_caddyfile(self, caddyfile_content):
-        caddy_location = os.environ.get("PORTFORWARDER_CADDYFILE_LOCATION", '/users-portforwarder/Caddyfile')
-        with open(caddy_location, "w") as file:
-            file.write(caddyfile_content)
+    def apply_caddyfile(self, caddyfile_content):
+        outcome = self.staged_config.apply(caddyfile_content, self.reload_portforwarder)
+        return 'reloaded' if outcome == 'reloaded' else 'failed'
 
 
 
@@ -152,20 +184,21 @@ class PortforwarderUpdater:
     # reload_portforwarder
     ############################################################
     #
-    # `caddy reload` inside the portforwarder container,
-    # through the docker socket. Returns True/False — a failed
-    # reload leaves the OLD listeners serving (Caddy keeps
-    # running), and the route answers 500 so the backend rolls
-    # the forward change back.
+    # `caddy reload` inside the portforwarder container, as an
+    # Engine API exec (docker_engine.exec_run). Returns
+    # True/False — a failed reload leaves the OLD listeners
+    # serving (Caddy keeps running), and the route answers 500
+    # so the backend undoes the forward change.
     #
     # Used by:
-    #   - portforwarder/routes.updateportforwarderconfig_HTTPPOST
+    #   - apply_caddyfile, through staged_config
     ############################################################
 
     def reload_portforwarder(self):
-        process = Popen([
-            'docker', 'exec', 'hosting-users-portforwarder', 'caddy', 'reload', '--config', '/etc/caddy/Caddyfile'
-        ])
-        output, error = process.communicate()
+        try:
+            exit_code, output = docker_engine.exec_run(
+                'hosting-users-portforwarder', ['caddy', 'reload', '--config', '/etc/caddy/Caddyfile'])
+        except Exception:
+            return False
 
-        return process.returncode == 0
+        return exit_code == 0
@@ -9,6 +9,7 @@ import json
 
 from flask import Blueprint, Response, request
 
+from ..common.regeneration import RegenerationCoordinator, RegenerationError
 from .portforwarder_updater import PortforwarderUpdater
 
 
@@ -21,6 +22,55 @@ portforwarder_bp = Blueprint('portforwarder', __name__)
 
 
 
+############################################################
+# regenerate_portforwarder
+############################################################
+#
+# One round of the portforwarder's coordinator: every call
+# carries the whole forward table with the backend revision
+# it was read at (at least), so the newest one wins —
+# rendered, validated, swapped in, `caddy reload`. The backend
+# pushes after its commit, so an older table can arrive
+# after a newer one: a round whose newest table is not newer
+# than the one applied (applied_revision) reloads nothing
+# and answers 'unchanged'. A table without a revision always
+# applies. Every call in the round gets (the applied
+# revision, 'reloaded' | 'unchanged' | 'failed').
+############################################################
+
+# The revision of the table last reloaded — in memory: after
+# a restart the first table is taken as it comes
+applied_revision = 0
+
+
+
+def regenerate_portforwarder(submissions):
+    global applied_revision
+    revision, port_forwards = max(
+        ((payload.get('revision'), payload['portforwards']) for _, payload in submissions),
+        key=lambda candidate: float('inf') if candidate[0] is None else candidate[0],
+    )
+    if revision is not None and revision <= applied_revision:
+        return [(applied_revision, 'unchanged')] * len(submissions)
+
+    portforwarderUpdater = PortforwarderUpdater()
+    caddy_config = portforwarderUpdater.generate_caddyfile(port_forwards)
+    outcome = portforwarderUpdater.apply_caddyfile(caddy_config)
+    if outcome != 'failed':
+        applied_revision = revision if revision is not None else applied_revision + 1
+    return [(applied_revision if outcome != 'failed' else revision, outcome)] * len(submissions)
+
+
+
+portforwarder_coordinator = RegenerationCoordinator('portforwarder', regenerate_portforwarder)
+
+
+
+
+
+
+
+
 ############################################################
 # updateportforwarderconfig_HTTPPOST
 ############################################################
@@ -29,14 +79,20 @@ portforwarder_bp = Blueprint('portforwarder', __name__)
 #
 # The whole port forward table in → a fresh portforwarder
 # Caddyfile out, then `caddy reload` in the portforwarder
-# container. The backend calls this INSIDE its request
-# transaction, and a failed reload answers 500 here — that is
-# what actually rolls the forward change back on the backend
-# side (a 200 would have let the table and the listeners
+# container (regenerate_portforwarder). Concurrent calls are
+# coalesced (common/regeneration): the newest table is
+# applied once for all of them, and each answer carries the
+# revision that was applied. The backend calls this AFTER
+# committing the change, outside its write lock, and a
+# failed reload (or a render that does not validate —
+# common/staged_config — or a round that raised) answers 500
+# here — the backend then undoes its change and resends the
+# table (a 200 would have let the table and the listeners
 # diverge).
 #
-# The body is a plain JSON object: {"portforwards": [...]} —
-# the same contract shape as /api/updatecaddyconfig.
+# The body is a plain JSON object: {"revision": N,
+# "portforwards": [...]} — the same contract shape as
+# /api/updatecaddyconfig.
 #
 # Used by:
 #   - control-backend portforward_views — every forward
@@ -50,13 +106,18 @@ def updateportforwarderconfig_HTTPPOST():
     data = request.get_json()
 
     # Update the portforwarder Caddyfile configuration
-    portforwarderUpdater = PortforwarderUpdater()
-    caddy_config = portforwarderUpdater.generate_caddyfile(data['portforwards'])
-    portforwarderUpdater.save_caddyfile(caddy_config)
+    try:
+        generation, outcome = portforwarder_coordinator.submit(data)
+    except RegenerationError as e:
+        print(f'{e}: {e.__cause__}')
+        return Response(json.dumps({'error': 'Portforwarder regeneration failed'}), mimetype='application/json', status=500)
 
     # A failed reload means the new file is NOT serving — the
     # caller must treat the whole operation as failed
-    if not portforwarderUpdater.reload_portforwarder():
-        return Response(json.dumps({'error': 'Portforwarder reload failed'}), mimetype='application/json', status=500)
+    if outcome == 'failed':
+        return Response(json.dumps({'error': 'Portforwarder reload failed', 'generation': generation}), mimetype='application/json', status=500)
+
+    if outcome == 'unchanged':
+        return Response(json.dumps({'message': 'Portforwarder config unchanged', 'generation': generation}), mimetype='application/json')
 
-    return Response(json.dumps({'message': f'Portforwarder config updated'}), mimetype='application/json')
+    return Response(json.dumps({'message': f'Portforwarder config updated', 'generation': generation}), mimetype='application/json')
@@ -3,6 +3,8 @@
 #
 #    GET  /api/test                     — hello (nothing calls it)
 #    GET  /api/status/<container_name>  — docker ps, host or inside one VM
+#    POST /api/status/batch             — docker ps inside many VMs at once
+#    GET  /api/poolstats                — keep-alive pool counters
 #
 #  The status answer is reshaped into the legacy `docker ps
 #  --format json` field names the whole platform renders
@@ -13,15 +15,27 @@
 import json
 import os
 import re
+import time
 import requests
-import requests_unixsocket
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime, timezone
 
-from flask import Blueprint, Response
+from flask import Blueprint, Response, request
+
+from ..common.http_pool import host_session, pool_stats, proxy_session
 
 
 status_bp = Blueprint('status', __name__)
 
+DIND_PREFIX = 'hosting-users-dind-'
+
+# /api/status/batch: inner daemons queried at once, and the
+# per-VM deadline (the same 2 s the single-VM route uses)
+BATCH_CONCURRENCY = int(os.getenv('STATUS_BATCH_CONCURRENCY', '16'))
+BATCH_VM_TIMEOUT = float(os.getenv('STATUS_BATCH_VM_TIMEOUT', '2'))
+
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY, thread_name_prefix='status-batch')
+
 
 
 
@@ -58,6 +72,197 @@ def test_HTTPGET():
 
 
 
+############################################################
+# poolstats_HTTPGET
+############################################################
+#
+# GET /api/poolstats
+#
+# {"requests": N, "opened": N, "reused": N} — the daemon
+# calls this process made since start, and how many of them
+# had to open a connection (common/http_pool).
+#
+# Used by:
+#   - operators (curl from the backend container)
+############################################################
+
+@status_bp.route('/api/poolstats', methods=['GET'])
+def poolstats_HTTPGET():
+    return Response(json.dumps(pool_stats(), indent=4), mimetype='application/json')
+
+
+
+
+
+
+
+
+############################################################
+# reshape_container
+############################################################
+#
+# One Docker API container object (the /containers/json list
+# shape) → the legacy `docker ps --format json` dict the
+# whole platform stores and renders verbatim — plus the
+# structured forms of three of its strings, so the backend
+# stores them without parsing the strings back:
+#
+#   LabelMap    — {key: value}
+#   PortList    — [{"ip", "public", "private", "type"}]
+#                 (ip "" and public null when unpublished)
+#   NetworkList — [name]
+#
+# Reshaping quirks worth knowing: RunningFor is derived from
+# the Created timestamp (so it reads "since created", not
+# "since started" — the list API carries no started-at), Size
+# is always "N/A", and volume mounts are counted but their
+# sources hidden (LocalVolumes).
+#
+# Used by:
+#   - newstatus_HTTPGET (below) — every listed container
+#   - events/docker_events — the container behind each event
+############################################################
+
+def reshape_container(container):
+    status = container.get('Status', '')
+    state = container.get('State', '')
+
+    # Networks: comma-joined names
+    network_list = list(container.get('NetworkSettings', {}).get('Networks', {}).keys())
+    networks = ",".join(network_list)
+
+    # Ports: rebuild the CLI notation, including the
+    # bracketed [::] IPv6 form
+    ports = []
+    port_list = []
+    for p in container.get('Ports', []):
+        private_port = p.get('PrivatePort')
+        public_port = p.get('PublicPort')
+        type_ = p.get('Type')
+        ip = p.get('IP')
+        port_list.append({"ip": ip or "", "public": public_port or None, "private": private_port, "type": type_})
+
+        if public_port:
+            if ip == '0.0.0.0':
+                ports.append(f"{ip}:{public_port}->{private_port}/{type_}")
+            elif ip == '::':
+                ports.append(f"[{ip}]:{public_port}->{private_port}/{type_}") # Match [::] format
+            else:
+                ports.append(f"{public_port}->{private_port}/{type_}")
+        else:
+            ports.append(f"{private_port}/{type_}")
+    ports_str = ", ".join(ports)
+
+    # Mounts: bind sources comma-joined; named volumes are
+    # only COUNTED (LocalVolumes) like the CLI does, their
+    # sources stay hidden
+    mounts = []
+    local_volumes = 0
+    for m in container.get('Mounts', []):
+        src = m.get('Source', '')
+        mount_type = m.get('Type', '')
+
+        if mount_type == 'volume':
+            local_volumes += 1
+        else:
+            mounts.append(src)
+    mounts_str = ",".join(mounts)
+
+    # Labels: comma-joined k=v (the backend later slices
+    # com.docker.compose.project out of this)
+    labels = []
+    for k, v in container.get('Labels', {}).items():
+        labels.append(f"{k}={v}")
+    labels_str = ",".join(labels)
+
+    # Command: the CLI wraps it in quotes
+    cmd = container.get('Command', '')
+    if not cmd.startswith('"'):
+        cmd = f'"{cmd}"'
+
+    # CreatedAt: real UTC now, so the legacy "+0000 UTC"
+    # suffix finally tells the truth
+    created_ts = container.get('Created')
+    created_str = datetime.fromtimestamp(created_ts, tz=timezone.utc).strftime('%Y-%m-%d %H:%M:%S +0000 UTC')
+
+    # RunningFor: approximated from Created (the API has no
+    # "started" timestamp here), so it reads "since created"
+    now = datetime.now()
+    created_dt = datetime.fromtimestamp(created_ts)
+    diff = now - created_dt
+
+    if diff.days > 0:
+        running_for = f"{diff.days} days ago"
+    elif diff.seconds >= 3600:
+        running_for = f"{diff.seconds // 3600} hours ago"
+    elif diff.seconds >= 60:
+        running_for = f"{diff.seconds // 60} minutes ago"
+    else:
+        running_for = "Less than a minute ago"
+
+    return {
+        "Command": cmd,
+        "CreatedAt": created_str,
+        "ID": container.get('Id'),
+        "Image": container.get('Image'),
+        "Labels": labels_str,
+        "LocalVolumes": str(local_volumes),
+        "Mounts": mounts_str,
+        "Names": (container.get('Names', [''])[0]).lstrip('/'),
+        "Networks": networks,
+        "Ports": ports_str,
+        "RunningFor": running_for,
+        "Size": "N/A",
+        "State": state,
+        "Status": status,
+        "LabelMap": dict(container.get('Labels') or {}),
+        "PortList": port_list,
+        "NetworkList": network_list,
+    }
+
+
+
+
+
+
+
+
+############################################################
+# is_vm_name / fetch_container_list
+############################################################
+#
+# The raw Docker API container list of one daemon: "host"
+# through the unix socket, a full dind name through the
+# dockersocket Caddy (which routes by the virtual-server-id
+# cookie), both over the keep-alive pools of
+# common/http_pool. Returns the requests.Response; network
+# errors raise.
+#
+# Used by:
+#   - newstatus_HTTPGET (below) — one daemon per request
+#   - fetch_vm_entry (below) — every VM of a batch
+############################################################
+
+def is_vm_name(container_name):
+    return container_name.startswith(DIND_PREFIX) and container_name[len(DIND_PREFIX):].isdigit()
+
+
+
+def fetch_container_list(container_name, timeout):
+    if container_name == 'host':
+        return host_session.get('http+unix://%2Fvar%2Frun%2Fdocker.sock/containers/json?all=1', timeout=timeout)
+
+    vm_id = container_name.replace(DIND_PREFIX, '')
+    api_url = f'http://hosting-control-dockersocket:80/dockersocket/containers/json?all=1'
+    return proxy_session.get(api_url, cookies={'virtual-server-id': vm_id}, timeout=timeout)
+
+
+
+
+
+
+
+
 ############################################################
 # newstatus_HTTPGET
 ############################################################
@@ -69,13 +274,7 @@ def test_HTTPGET():
 # its INNER daemon is queried through the dockersocket Caddy
 # (which routes by the virtual-server-id cookie). The Docker
 # API answer is reshaped into the legacy `docker ps --format
-# json` field names.
-#
-# Reshaping quirks worth knowing: RunningFor is derived from
-# the Created timestamp (so it reads "since created", not
-# "since started" — the list API carries no started-at), Size
-# is always "N/A", and volume mounts are counted but their
-# sources hidden (LocalVolumes).
+# json` field names (reshape_container above).
 #
 # Used by:
 #   - control-backend monitor_containers — every 3 s for the
@@ -96,19 +295,12 @@ def newstatus_HTTPGET(container_name):
     # STEP 2: Fetch the container list — host socket directly,
     # or the VM's inner daemon through the dockersocket proxy
     # ========================================================
-    response = None
-    if(container_name == 'host'):
-        session = requests_unixsocket.Session()
-        response = session.get('http+unix://%2Fvar%2Frun%2Fdocker.sock/containers/json?all=1', timeout=2)
-    else:
+    if container_name != 'host' and not is_vm_name(container_name):
         # Anything that is not "host" must be a full dind name —
         # checked BEFORE the id is sliced out of it
-        if not container_name.startswith('hosting-users-dind-') or not container_name.replace('hosting-users-dind-', '').isdigit():
-            return Response(json.dumps({'error': f'{container_name} is not a VM container name'}, indent=4), mimetype='application/json', status=400)
+        return Response(json.dumps({'error': f'{container_name} is not a VM container name'}, indent=4), mimetype='application/json', status=400)
 
-        vm_id = container_name.replace('hosting-users-dind-', '')
-        api_url = f'http://hosting-control-dockersocket:80/dockersocket/containers/json?all=1'
-        response = requests.get(api_url, cookies={'virtual-server-id': vm_id}, timeout=2)
+    response = fetch_container_list(container_name, timeout=2)
 
 
     # STEP 3: Validate the response and parse it
@@ -122,102 +314,152 @@ def newstatus_HTTPGET(container_name):
     # STEP 4: Reshape every container into the legacy Docker
     # CLI json format
     # ======================================================
-    containers = []
-    for container in response_json:
-        status = container.get('Status', '')
-        state = container.get('State', '')
-
-        # Networks: comma-joined names
-        networks = ",".join(container.get('NetworkSettings', {}).get('Networks', {}).keys())
-
-        # Ports: rebuild the CLI notation, including the
-        # bracketed [::] IPv6 form
-        ports = []
-        for p in container.get('Ports', []):
-            private_port = p.get('PrivatePort')
-            public_port = p.get('PublicPort')
-            type_ = p.get('Type')
-            ip = p.get('IP')
-
-            if public_port:
-                if ip == '0.0.0.0':
-                    ports.append(f"{ip}:{public_port}->{private_port}/{type_}")
-                elif ip == '::':
-                    ports.append(f"[{ip}]:{public_port}->{private_port}/{type_}") # Match [::] format
-                else:
-                    ports.append(f"{public_port}->{private_port}/{type_}")
-            else:
-                ports.append(f"{private_port}/{type_}")
-        ports_str = ", ".join(ports)
-
-        # Mounts: bind sources comma-joined; named volumes are
-        # only COUNTED (LocalVolumes) like the CLI does, their
-        # sources stay hidden
-        mounts = []
-        local_volumes = 0
-        for m in container.get('Mounts', []):
-            src = m.get('Source', '')
-            mount_type = m.get('Type', '')
-
-            if mount_type == 'volume':
-                local_volumes += 1
-                pass
-            else:
-                mounts.append(src)
-        mounts_str = ",".join(mounts)
-
-        # Labels: comma-joined k=v (the backend later slices
-        # com.docker.compose.project out of this)
-        labels = []
-        for k, v in container.get('Labels', {}).items():
-            labels.append(f"{k}={v}")
-        labels_str = ",".join(labels)
-
-        # Command: the CLI wraps it in quotes
-        cmd = container.get('Command', '')
-        if not cmd.startswith('"'):
-            cmd = f'"{cmd}"'
-
-        # CreatedAt: real UTC now, so the legacy "+0000 UTC"
-        # suffix finally tells the truth
-        created_ts = container.get('Created')
-        created_str = datetime.fromtimestamp(created_ts, tz=timezone.utc).strftime('%Y-%m-%d %H:%M:%S +0000 UTC')
-
-        # RunningFor: approximated from Created (the API has no
-        # "started" timestamp here), so it reads "since created"
-        now = datetime.now()
-        created_dt = datetime.fromtimestamp(created_ts)
-        diff = now - created_dt
-
-        if diff.days > 0:
-            running_for = f"{diff.days} days ago"
-        elif diff.seconds >= 3600:
-            running_for = f"{diff.seconds // 3600} hours ago"
-        elif diff.seconds >= 60:
-            running_for = f"{diff.seconds // 60} minutes ago"
-        else:
-            running_for = "Less than a minute ago"
-
-        legacy_container = {
-            "Command": cmd,
-            "CreatedAt": created_str,
-            "ID": container.get('Id'),
-            "Image": container.get('Image'),
-            "Labels": labels_str,
-            "LocalVolumes": str(local_volumes),
-            "Mounts": mounts_str,
-            "Names": (container.get('Names', [''])[0]).lstrip('/'),
-            "Networks": networks,
-            "Ports": ports_str,
-            "RunningFor": running_for,
-            "Size": "N/A",
-            "State": state,
-            "Status": status
-        }
-        containers.append(legacy_container)
+    containers = [reshape_container(container) for container in response_json]
 
 
     # STEP 5: Return the reshaped list
     # ================================
     json_obj['containers'] = containers
     return Response(json.dumps(json_obj, indent=4), mimetype='application/json')
+
+
+
+
+
+
+
+
+
+############################################################
+# batchstatus_HTTPPOST
+############################################################
+#
+# POST /api/status/batch   {"vms": ["hosting-users-dind-7", ...]}
+#                          {"vms": "running"}
+#
+# `docker ps` of many VMs in one round trip: the inner
+# daemons are queried concurrently (BATCH_CONCURRENCY at a
+# time, BATCH_VM_TIMEOUT each) and the answer is ONE JSON
+# document keyed by VM name, streamed out entry by entry as
+# the daemons answer:
+#
+#   {"vms": {"<name>": {"containers": [...], "elapsed_ms": 12.3},
+#            "<name>": {"error": "...", "timed_out": true, "elapsed_ms": 2001.0},
+#            ...},
+#    "elapsed_ms": 41.0}
+#
+# The batch waits at most BATCH_VM_TIMEOUT per "wave" of the
+# pool (plus a second); only the time spent waiting counts,
+# not a slow reader's, and every entry that finished is
+# emitted, however late. Only the fetches still unfinished
+# once the budget is spent are entered as timed out.
+#
+# One VM failing — bad name, daemon down, timeout — is an
+# error ENTRY, never a failed batch. "running" lists every
+# running dind on the host daemon first; only a malformed
+# body or an unreachable host daemon fails the request.
+#
+# Used by:
+#   - control-backend monitor_containers — the full pass
+############################################################
+
+@status_bp.route('/api/status/batch', methods=['POST'])
+def batchstatus_HTTPPOST():
+    data = request.get_json(silent=True) or {}
+    vms = data.get('vms')
+
+    # STEP 1: Resolve the VM list
+    # ===========================
+    if vms == 'running':
+        try:
+            vms = list_running_vms()
+        except Exception as e:
+            return Response(json.dumps({'error': f'Failed to list running VMs: {e}'}), mimetype='application/json', status=500)
+    elif not isinstance(vms, list) or not all(isinstance(name, str) for name in vms):
+        return Response(json.dumps({'error': 'vms must be a list of VM container names or "running"'}), mimetype='application/json', status=400)
+
+
+    # STEP 2: Fan out, stream entries in completion order
+    # ===================================================
+    started = time.monotonic()
+    names = list(dict.fromkeys(vms))
+    budget = BATCH_VM_TIMEOUT * -(-len(names) // BATCH_CONCURRENCY) + 1
+
+    def generate():
+        yield '{"vms": {'
+        pending = {batch_executor.submit(fetch_vm_entry, name): name for name in names}
+        separator = ''
+        budget_left = budget
+        while pending and budget_left > 0:
+            wait_started = time.monotonic()
+            done, _ = wait(pending, timeout=budget_left, return_when=FIRST_COMPLETED)
+            budget_left -= time.monotonic() - wait_started
+            for future in done:
+                yield f'{separator}{json.dumps(pending.pop(future))}: {json.dumps(future.result())}'
+                separator = ', '
+
+        for future, name in pending.items():
+            if future.done():
+                entry = future.result()
+            else:
+                future.cancel()
+                entry = {'error': 'Timed out', 'timed_out': True, 'elapsed_ms': round(budget * 1000, 1)}
+            yield f'{separator}{json.dumps(name)}: {json.dumps(entry)}'
+            separator = ', '
+        yield f'}}, "elapsed_ms": {round((time.monotonic() - started) * 1000, 1)}}}'
+
+    return Response(generate(), mimetype='application/json')
+
+
+
+
+
+
+
+
+############################################################
+# list_running_vms / fetch_vm_entry
+############################################################
+#
+# list_running_vms: names of the running dind containers on
+# the host daemon. fetch_vm_entry: one VM's batch entry —
+# the reshaped list, or the error that VM hit; never raises.
+#
+# Used by:
+#   - batchstatus_HTTPPOST (above)
+############################################################
+
+def list_running_vms():
+    filters = json.dumps({'name': [DIND_PREFIX], 'status': ['running']})
+    response = host_session.get('http+unix://%2Fvar%2Frun%2Fdocker.sock/containers/json', params={'filters': filters}, timeout=2)
+    if response.status_code != 200:
+        raise RuntimeError(f'host daemon answered {response.status_code}')
+
+    names = [(container.get('Names') or [''])[0].lstrip('/') for container in response.json()]
+    return sorted(name for name in names if is_vm_name(name))
+
+
+
+def fetch_vm_entry(container_name):
+    started = time.monotonic()
+    elapsed_ms = lambda: round((time.monotonic() - started) * 1000, 1)
+
+    if not re.match(r'^[a-z0-9-]{1,25}$', container_name) or not is_vm_name(container_name):
+        return {'error': f'{container_name} is not a VM container name', 'elapsed_ms': elapsed_ms()}
+
+    try:
+        response = fetch_container_list(container_name, timeout=BATCH_VM_TIMEOUT)
+    except requests.Timeout:
+        return {'error': 'Timed out', 'timed_out': True, 'elapsed_ms': elapsed_ms()}
+    except Exception as e:
+        return {'error': f'{e}', 'elapsed_ms': elapsed_ms()}
+
+    if response.status_code != 200:
+        return {'error': f'Error from {container_name}: {response.status_code}', 'elapsed_ms': elapsed_ms()}
+
+    try:
+        containers = [reshape_container(container) for container in json.loads(response.text)]
+    except Exception as e:
+        return {'error': f'Unreadable answer from {container_name}: {e}', 'elapsed_ms': elapsed_ms()}
+
+    return {'containers': containers, 'elapsed_ms': elapsed_ms()}
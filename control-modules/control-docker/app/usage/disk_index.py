@@ -0,0 +1,291 @@
+############################################################
+#  [*] Disk index — incremental per-VM disk accounting
+#
+#  Replaces one `du -sb` per VM over the whole SERVERS/<id>
+#  tree (apps + the huge inner docker data) on every sweep.
+#
+#  Each VM tree is walked with os.scandir in a worker process
+#  (one VM per task, DISK_WORKERS processes, each result
+#  handed back as soon as its VM is done), and the walk
+#  leaves behind a per-directory index, persisted as
+#  DISK_INDEX_DIR/<id>.json:
+#
+#    "<dir relative to the VM root>": [inode, mtime_ns,
+#                                      bytes of its small files,
+#                                      [its subdirectories],
+#                                      {large file: bytes}]
+#
+#  A directory's mtime changes whenever an entry is created,
+#  removed or renamed IN it. So on the next sweep a directory
+#  whose inode and mtime still match is NOT listed again: its
+#  small-file bytes and subdirectory names come from the
+#  index, and only those subdirectories are stat'ed (one
+#  lstat each) to see whether THEY changed. Only changed
+#  directories are scandir'ed and their files stat'ed —
+#  after the first walk a sweep costs one lstat per
+#  directory instead of one per file, cheap enough for the
+#  backend's 30-second refresh.
+#
+#  What the mtime cannot see: a file rewritten or grown IN
+#  PLACE (its directory's mtime stays put). The files that
+#  can move the total — DISK_TRACKED_FILE_BYTES and up (logs,
+#  databases, disk images) — are therefore kept by name and
+#  lstat'ed on every sweep, reused directory or not. Only
+#  small files can drift, and that drift is bounded by a
+#  full rescan of every tree at least every
+#  DISK_FULL_RESCAN_SECONDS. Sizes are apparent sizes, like
+#  `du -sb`, except that a hard-linked file is counted once
+#  per link.
+#
+#  Totals come split by the VM root's top-level entry:
+#  apps (SERVERS/<id>/apps), docker (SERVERS/<id>/docker)
+#  and other (everything else, including the root itself).
+#
+#  Without a writable DISK_INDEX_DIR nothing is persisted and
+#  every sweep is a full walk — correct, just not cheaper.
+#
+#  Used by:
+#    - usage/routes — /api/usage/disk
+############################################################
+
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+
+
+DISK_INDEX_DIR = os.getenv('DISK_INDEX_DIR', '/disk-index')
+DISK_WORKERS = int(os.getenv('DISK_WORKERS', '4'))
+DISK_FULL_RESCAN_SECONDS = int(os.getenv('DISK_FULL_RESCAN_SECONDS', '900'))
+DISK_TRACKED_FILE_BYTES = int(os.getenv('DISK_TRACKED_FILE_BYTES', str(1024 * 1024)))
+
+# One sweep at a time: two overlapping sweeps would race on
+# the same index files
+sweep_lock = threading.Lock()
+worker_pool = None
+
+
+
+
+
+
+
+
+############################################################
+# load_index / save_index
+############################################################
+#
+# An index file is {"full_at": <epoch of its last full
+# walk>, "dirs": {...}}. A missing or unreadable file is an
+# empty index (→ full walk); saving is write-then-rename, so
+# a crash mid-save never leaves a torn index behind.
+############################################################
+
+def index_path(index_dir, vm_id):
+    return os.path.join(index_dir, f'{vm_id}.json') if index_dir else None
+
+
+
+def load_index(path):
+    if not path:
+        return {'full_at': 0, 'dirs': {}}
+    try:
+        with open(path) as f:
+            index = json.load(f)
+        return {'full_at': index.get('full_at', 0), 'dirs': index.get('dirs', {})}
+    except (OSError, ValueError):
+        return {'full_at': 0, 'dirs': {}}
+
+
+
+def save_index(path, index):
+    if not path:
+        return
+    try:
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump(index, f, separators=(',', ':'))
+        os.replace(f'{path}.tmp', path)
+    except OSError:
+        pass
+
+
+
+
+
+
+
+
+############################################################
+# measure_tree
+############################################################
+#
+# Worker-process entry: one VM tree → its split totals, its
+# index updated on disk. Never raises for unreadable parts —
+# they simply count as zero, like du's partial totals. Files
+# of tracked_file_bytes and up are kept by name (see the
+# module banner); an index entry from before that (four
+# fields) is simply rescanned.
+#
+# Returns {apps, docker, other, bytes, dirs_scanned,
+# dirs_reused, full, elapsed_ms}.
+############################################################
+
+def measure_tree(root, path, full_rescan_seconds=DISK_FULL_RESCAN_SECONDS, tracked_file_bytes=DISK_TRACKED_FILE_BYTES):
+    started = time.monotonic()
+    old = load_index(path)
+    full = time.time() - old['full_at'] >= full_rescan_seconds
+    old_dirs = {} if full else old['dirs']
+
+    new_dirs = {}
+    totals = {'apps': 0, 'docker': 0, 'other': 0}
+    scanned = reused = 0
+
+    stack = ['']
+    while stack:
+        rel = stack.pop()
+        try:
+            st = os.lstat(os.path.join(root, rel) if rel else root)
+        except OSError:
+            continue
+
+        dir_path = os.path.join(root, rel) if rel else root
+        entry = old_dirs.get(rel)
+        if entry and len(entry) == 5 and entry[0] == st.st_ino and entry[1] == st.st_mtime_ns:
+            files_bytes, subdirs = entry[2], entry[3]
+            large_files = restat_files(dir_path, entry[4])
+            reused += 1
+        else:
+            files_bytes, subdirs, large_files = scan_directory(dir_path, tracked_file_bytes)
+            scanned += 1
+
+        new_dirs[rel] = [st.st_ino, st.st_mtime_ns, files_bytes, subdirs, large_files]
+
+        # Bytes of the directory itself + its direct files go to
+        # the bucket of the top-level entry they live under
+        top = rel.split(os.sep, 1)[0]
+        totals[top if top in ('apps', 'docker') else 'other'] += st.st_size + files_bytes + sum(large_files.values())
+        stack.extend(os.path.join(rel, name) if rel else name for name in subdirs)
+
+    save_index(path, {'full_at': time.time() if full else old['full_at'], 'dirs': new_dirs})
+
+    return {
+        **totals,
+        'bytes': sum(totals.values()),
+        'dirs_scanned': scanned,
+        'dirs_reused': reused,
+        'full': full,
+        'elapsed_ms': round((time.monotonic() - started) * 1000, 1),
+    }
+
+
+
+def scan_directory(path, tracked_file_bytes):
+    files_bytes = 0
+    subdirs = []
+    large_files = {}
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.name)
+                        continue
+                    size = entry.stat(follow_symlinks=False).st_size
+                    if size >= tracked_file_bytes:
+                        large_files[entry.name] = size
+                    else:
+                        files_bytes += size
+                except OSError:
+                    pass
+    except OSError:
+        pass
+    return files_bytes, subdirs, large_files
+
+
+
+def restat_files(path, large_files):
+    sizes = {}
+    for name in large_files:
+        try:
+            sizes[name] = os.lstat(os.path.join(path, name)).st_size
+        except OSError:
+            pass
+    return sizes
+
+
+
+
+
+
+
+
+############################################################
+# iter_sweep / sweep
+############################################################
+#
+# Measure every live VM directory (pure numeric names — the
+# "<id>-deleted-<timestamp>" archives are skipped) across
+# the worker pool, yielding (id, measure_tree result) as
+# EACH VM finishes — one huge tree no longer holds back the
+# others' numbers. After the last VM, the index files of VMs
+# that no longer exist are dropped. A VM whose measurement
+# failed is left out. workers=0 measures in-process (tests).
+#
+# The sweep lock is held for the generator's whole life; a
+# caller that stops early (a dropped stream) closes the
+# generator, which releases it.
+#
+# sweep: the same, collected into {"<id>": result}.
+############################################################
+
+def iter_sweep(servers_dir, index_dir=DISK_INDEX_DIR, workers=DISK_WORKERS):
+    global worker_pool
+
+    with sweep_lock:
+        vm_ids = sorted(entry for entry in os.listdir(servers_dir) if entry.isdigit())
+        if index_dir and not os.path.isdir(index_dir):
+            index_dir = None
+
+        jobs = {vm_id: (os.path.join(servers_dir, vm_id), index_path(index_dir, vm_id)) for vm_id in vm_ids}
+
+        if workers <= 0:
+            for vm_id, args in jobs.items():
+                yield vm_id, measure_tree(*args)
+        else:
+            # forkserver, not fork: this process runs Flask's
+            # threads, and forking a threaded process is unsafe
+            if worker_pool is None:
+                worker_pool = ProcessPoolExecutor(max_workers=workers, mp_context=get_context('forkserver'))
+            futures = {worker_pool.submit(measure_tree, *args): vm_id for vm_id, args in jobs.items()}
+            try:
+                for future in as_completed(futures):
+                    try:
+                        result = future.result()
+                    except BrokenProcessPool:
+                        # A killed worker takes the pool down with it —
+                        # rebuilt on the next sweep
+                        worker_pool = None
+                        continue
+                    except Exception:
+                        continue
+                    yield futures[future], result
+            finally:
+                for future in futures:
+                    future.cancel()
+
+        if index_dir:
+            for name in os.listdir(index_dir):
+                if name.endswith('.json') and name[:-5] not in jobs:
+                    try:
+                        os.remove(os.path.join(index_dir, name))
+                    except OSError:
+                        pass
+
+
+
+def sweep(servers_dir, index_dir=DISK_INDEX_DIR, workers=DISK_WORKERS):
+    return dict(iter_sweep(servers_dir, index_dir, workers))
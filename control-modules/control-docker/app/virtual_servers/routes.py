@@ -7,6 +7,10 @@
 #    GET  /api/create/<container_name>   — docker run of a new VM
 #    GET  /api/cleanup/<container_name>  — inner docker prune (nothing calls it)
 #
+#  The docker side of each goes through the Engine API
+#  client (common/docker_engine) — no docker CLI. Only the
+#  data-directory rm/mv of a delete are still processes.
+#
 #  Validation failures answer HTTP 400 with the message — the
 #  backend treats any non-200 as a failed operation, so a 200
 #  with an error key would read as success upstream.
@@ -14,6 +18,10 @@
 #  delete and create additionally require a real dind name
 #  (hosting-users-dind-<digits>) BEFORE slicing the id out of
 #  it — any other name answers 400 instead of crashing.
+#
+#  The operations themselves (start_vm, stop_vm, delete_vm,
+#  create_vm) are plain functions the routes wrap, so the
+#  bulk routes run exactly the same steps per VM.
 ############################################################
 
 
@@ -21,10 +29,12 @@ import json
 import os
 import re
 from datetime import datetime
-from subprocess import Popen, PIPE
+from subprocess import Popen
 
 from flask import Blueprint, Response
 
+from ..common import docker_engine
+
 
 virtual_servers_bp = Blueprint('virtual_servers', __name__)
 
@@ -37,6 +47,9 @@ USERS_VM_DIR = os.getenv('USERS_VM_DIR', 'SERVERS').lstrip('/').rstrip('/')
 NAME_PATTERN = r'^[a-z0-9-]{1,25}$'
 DIND_PREFIX = 'hosting-users-dind-'
 
+# delete: how long a container may take to disappear after rm
+DELETE_WAIT_SECONDS = 10
+
 
 
 
@@ -80,6 +93,146 @@ def parse_vm_id(container_name):
 
 
 
+############################################################
+# start_vm / stop_vm
+############################################################
+#
+# The operations behind the routes — each returns None on
+# success or the error message. Names are validated by the
+# caller.
+#
+# Used by:
+#   - start_HTTPGET / stop_HTTPGET below
+#   - bulk/routes — the start/stop actions
+############################################################
+
+def start_vm(container_name):
+    try:
+        docker_engine.start_container(container_name)
+    except Exception:
+        return f'Failed to start {container_name}'
+    return None
+
+
+
+def stop_vm(container_name):
+    try:
+        docker_engine.stop_container(container_name)
+    except Exception:
+        return f'Failed to stop {container_name}'
+    return None
+
+
+
+
+
+
+
+
+############################################################
+# delete_vm
+############################################################
+#
+# The destructive end of a VM: stop, rm, wipe the inner
+# docker data, then archive the whole data directory as
+# SERVERS/<id>-deleted-<timestamp> — the student's files are
+# retained, only renamed out of the live namespace.
+#
+# Individual steps are TOLERANT (a half-broken VM — container
+# already gone, directory missing — must still be deletable);
+# what decides success is the OUTCOME: the operation fails
+# only if the container still exists afterwards.
+#
+# Used by:
+#   - delete_HTTPGET below
+#   - bulk/routes — the delete action
+############################################################
+
+def delete_vm(container_name, vm_id):
+
+    # STEP 1: Stop and remove the container (tolerant — it may
+    # not exist at all)
+    # ========================================================
+    for step in (docker_engine.stop_container, docker_engine.remove_container):
+        try:
+            step(container_name)
+        except Exception:
+            pass
+
+
+    # STEP 2: Wipe the inner docker data, then archive the VM
+    # directory as <id>-deleted-<timestamp>
+    # =======================================================
+    process = Popen(['rm', '-rf', f'{ROOT_DIR}/{USERS_VM_DIR}/{vm_id}/docker'])
+    output, error = process.communicate()
+
+    timeNow = datetime.now().strftime("%Y%m%d%H%M%S")
+    process = Popen(['mv', f'{ROOT_DIR}/{USERS_VM_DIR}/{vm_id}', f'{ROOT_DIR}/{USERS_VM_DIR}/{vm_id}-deleted-{timeNow}'])
+    output, error = process.communicate()
+
+
+    # STEP 3: Judge the OUTCOME, not the steps — the container
+    # must be gone (inspect answers 404, waited for a little
+    # while a removal is still in progress) for the delete to
+    # count as done; a daemon that cannot be asked proves
+    # nothing, so that fails too
+    # ========================================================
+    try:
+        still_exists = docker_engine.wait_for_state(container_name, {None}, timeout=DELETE_WAIT_SECONDS) is not None
+    except Exception:
+        still_exists = True
+    if still_exists:
+        return f'Failed to delete {container_name}'
+    return None
+
+
+
+
+
+
+
+
+############################################################
+# create_vm
+############################################################
+#
+# The physical birth of a VM: `docker run` of the sysbox dind
+# image, hostname server<id>, data bind-mounted from
+# SERVERS/<id> — what `docker run -d` did: Binds create the
+# missing host directories like -v does.
+#
+# Used by:
+#   - create_HTTPGET below
+#   - bulk/routes — the create action
+############################################################
+
+def create_vm(container_name, vm_id):
+    try:
+        docker_engine.create_container(container_name, {
+            'Image': 'hosting-dind-ubuntu',
+            'Hostname': f'server{vm_id}',
+            'HostConfig': {
+                'Runtime': 'sysbox-runc',
+                'Binds': [
+                    f'{ROOT_DIR}/{USERS_VM_DIR}/{vm_id}/apps:/apps',
+                    f'{ROOT_DIR}/{USERS_VM_DIR}/{vm_id}/docker:/var/lib/docker',
+                ],
+                'NetworkMode': 'filtered-users',
+                'RestartPolicy': {'Name': 'unless-stopped'},
+            },
+        })
+        docker_engine.start_container(container_name)
+    except Exception:
+        return f'Failed to create {container_name}'
+    return None
+
+
+
+
+
+
+
+
 ############################################################
 # start_HTTPGET
 ############################################################
@@ -100,12 +253,9 @@ def start_HTTPGET(container_name):
         return invalid_name_response()
 
     # Start the container
-    process = Popen(['docker', 'start', container_name])
-    output, error = process.communicate()
-
-    # Return the status of the container
-    if process.returncode != 0:
-        return Response(json.dumps({'error': f'Failed to start {container_name}'}), mimetype='application/json', status=500)
+    error = start_vm(container_name)
+    if error:
+        return Response(json.dumps({'error': error}), mimetype='application/json', status=500)
 
     return Response(json.dumps({'message': f'{container_name} started'}), mimetype='application/json')
 
@@ -136,12 +286,9 @@ def stop_HTTPGET(container_name):
         return invalid_name_response()
 
     # Stop the container
-    process = Popen(['docker', 'stop', container_name])
-    output, error = process.communicate()
-
-    # Return the status of the container
-    if process.returncode != 0:
-        return Response(json.dumps({'error': f'Failed to stop {container_name}'}), mimetype='application/json', status=500)
+    error = stop_vm(container_name)
+    if error:
+        return Response(json.dumps({'error': error}), mimetype='application/json', status=500)
 
     return Response(json.dumps({'message': f'{container_name} stopped'}), mimetype='application/json')
 
@@ -158,16 +305,7 @@ def stop_HTTPGET(container_name):
 #
 # GET /api/delete/<container_name>
 #
-# The destructive end of a VM: stop, rm, wipe the inner
-# docker data, then archive the whole data directory as
-# SERVERS/<id>-deleted-<timestamp> — the student's files are
-# retained, only renamed out of the live namespace.
-#
-# Individual steps are TOLERANT (a half-broken VM — container
-# already gone, directory missing — must still be deletable);
-# what decides success is the OUTCOME: the operation fails
-# only if the container still exists afterwards, or the live
-# data directory could not be archived while it exists.
+# delete_vm of one VM (stop, rm, archive the data dir).
 #
 # Used by:
 #   - control-backend vm_views — the delete action
@@ -187,35 +325,11 @@ def delete_HTTPGET(container_name):
         return Response(json.dumps({'error': f'{container_name} is not a VM container name'}), mimetype='application/json', status=400)
 
 
-    # STEP 2: Stop and remove the container (tolerant — it may
-    # not exist at all)
-    # ========================================================
-    process = Popen(['docker', 'stop', container_name])
-    output, error = process.communicate()
-
-    process = Popen(['docker', 'rm', container_name])
-    output, error = process.communicate()
-
-
-    # STEP 3: Wipe the inner docker data, then archive the VM
-    # directory as <id>-deleted-<timestamp>
-    # =======================================================
-    process = Popen(['rm', '-rf', f'{ROOT_DIR}/{USERS_VM_DIR}/{vm_id}/docker'])
-    output, error = process.communicate()
-
-    timeNow = datetime.now().strftime("%Y%m%d%H%M%S")
-    process = Popen(['mv', f'{ROOT_DIR}/{USERS_VM_DIR}/{vm_id}', f'{ROOT_DIR}/{USERS_VM_DIR}/{vm_id}-deleted-{timeNow}'])
-    output, error = process.communicate()
-
-
-    # STEP 4: Judge the OUTCOME, not the steps — the container
-    # must be gone (docker inspect fails) for the delete to
-    # count as done
-    # ========================================================
-    process = Popen(['docker', 'inspect', container_name], stdout=PIPE, stderr=PIPE)
-    output, error = process.communicate()
-    if process.returncode == 0:
-        return Response(json.dumps({'error': f'Failed to delete {container_name}'}), mimetype='application/json', status=500)
+    # STEP 2: Stop, remove, archive — judged by the outcome
+    # ======================================================
+    error = delete_vm(container_name, vm_id)
+    if error:
+        return Response(json.dumps({'error': error}), mimetype='application/json', status=500)
 
     return Response(json.dumps({'message': f'{container_name} deleted'}), mimetype='application/json')
 
@@ -232,10 +346,9 @@ def delete_HTTPGET(container_name):
 #
 # GET /api/create/<container_name>
 #
-# The physical birth of a VM: `docker run` of the sysbox dind
-# image, hostname server<id>, data bind-mounted from
-# SERVERS/<id>. The backend commits the VM row BEFORE calling
-# here and waits up to 120 s — a sysbox run takes a while.
+# create_vm of one VM. The backend commits the VM row BEFORE
+# calling here and waits up to 120 s — a sysbox run takes a
+# while.
 #
 # Used by:
 #   - control-backend vm_views — the create action
@@ -255,23 +368,11 @@ def create_HTTPGET(container_name):
         return Response(json.dumps({'error': f'{container_name} is not a VM container name'}), mimetype='application/json', status=400)
 
 
-    # STEP 2: Create the container (Create user virtual server)
-    # =========================================================
-    process = Popen([
-        'docker', 'run', '-d',
-        '--name', container_name,
-        '--hostname', f'server{vm_id}',
-        '--runtime=sysbox-runc',
-        '-v', f'{ROOT_DIR}/{USERS_VM_DIR}/{vm_id}/apps:/apps',
-        '-v', f'{ROOT_DIR}/{USERS_VM_DIR}/{vm_id}/docker:/var/lib/docker',
-        '--net', 'filtered-users',
-        '--restart', 'unless-stopped',
-        'hosting-dind-ubuntu'])
-    output, error = process.communicate()
-
-    if process.returncode != 0:
-        return Response(json.dumps({'error': f'Failed to create {container_name}'}), mimetype='application/json', status=500)
-
+    # STEP 2: Create and start the container
+    # ======================================
+    error = create_vm(container_name, vm_id)
+    if error:
+        return Response(json.dumps({'error': error}), mimetype='application/json', status=500)
 
     return Response(json.dumps({'message': f'{container_name} created'}), mimetype='application/json')
 
@@ -303,9 +404,12 @@ def cleanup_HTTPGET(container_name):
         return invalid_name_response()
 
     # Remove all unused images
-    process = Popen(['docker', 'exec', container_name, 'docker', 'system', 'prune', '-a', '-f', '--volumes'])
-    output, error = process.communicate()
-    if process.returncode != 0:
+    try:
+        exit_code, output = docker_engine.exec_run(
+            container_name, ['docker', 'system', 'prune', '-a', '-f', '--volumes'], timeout=600)
+    except Exception:
+        exit_code = None
+    if exit_code != 0:
         return Response(json.dumps({'error': f'Failed to cleanup {container_name}'}), mimetype='application/json', status=500)
 
     return Response(json.dumps({'message': f'{container_name} cleaned up'}), mimetype='application/json')
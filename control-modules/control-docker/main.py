@@ -5,8 +5,8 @@
 #  point: `python3 main.py --http` builds the Flask app from
 #  the app/ package and serves it on :8000. Flask's threaded
 #  dev server on purpose — one small internal service, and
-#  the threading lets a slow du overlap the 3-second status
-#  calls.
+#  the threading lets a slow disk sweep overlap the 3-second
+#  status calls.
 ############################################################
 
 
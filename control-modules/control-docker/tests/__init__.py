@@ -2,17 +2,26 @@
 #  [*] Docker controller tests — the sidecar's contract
 #
 #  Plain unittest + Flask's test client — no extra
-#  dependencies. Every external is mocked: the docker CLI
-#  (Popen), the host socket (requests_unixsocket), the
-#  dockersocket proxy (requests) and the filesystem — no
-#  test touches a real container or directory.
+#  dependencies. Every external is faked: the host daemon
+#  (a scripted FakeDockerSocket, or a mocked session), the
+#  dockersocket proxy (requests), the rm/mv processes (Popen)
+#  and the filesystem (mocks or temp dirs) — no test touches
+#  a real container or a real data directory.
 #
 #  Layout:
-#    helpers.py               — app client + fake processes
-#    test_status.py           — docker ps reshaping contract
+#    helpers.py               — app client, fake processes,
+#                               FakeDockerSocket
+#    test_status.py           — docker ps reshaping + batch,
+#                               keep-alive pool reuse
+#    test_events.py           — the container delta stream
+#    test_docker_engine.py    — the Engine API client
 #    test_virtual_servers.py  — lifecycle guards + outcomes
-#    test_usage.py            — the du sweep
+#    test_bulk.py             — bulk lifecycle jobs, the
+#                               concurrency bound
+#    test_usage.py            — the incremental disk sweep
 #    test_caddy.py            — Caddyfile rendering + reload
+#    test_regeneration.py     — coalesced render + reload
+#    test_staged_config.py    — validate, swap, roll back
 #
 #  Run inside the container:
 #    python3 -m unittest discover tests -v
@@ -1,15 +1,27 @@
 ############################################################
-#  [*] Test helpers — the client and the fake processes
+#  [*] Test helpers — the client, fake processes, fake daemon
 #
 #  make_client builds the real Flask app in testing mode;
 #  fake_process stands in for a finished Popen — routes only
-#  ever read .returncode and call .communicate().
+#  ever read .returncode and call .communicate(); the
+#  FakeDockerSocket is a real unix-socket HTTP server playing
+#  the host daemon's Engine API from a script.
 #
 #  Used by:
 #    - every suite in this package
 ############################################################
 
+import json
+import os
+import re
+import shutil
+import socketserver
+import tempfile
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler
 from types import SimpleNamespace
+from unittest.mock import patch
 
 from app import create_app
 
@@ -39,4 +51,99 @@ def fake_process(returncode=0, stdout=b''):
 
 
 def fake_response(status_code=200, text=''):
-    return SimpleNamespace(status_code=status_code, text=text)
+    return SimpleNamespace(status_code=status_code, text=text, json=lambda: json.loads(text))
+
+
+
+
+
+
+
+
+
+############################################################
+# FakeDockerSocket
+############################################################
+#
+# Context manager: serves HTTP on a temp unix socket and
+# points common/docker_engine at it, so the real client code
+# — session, pooling, status handling — runs end to end.
+#
+#   with FakeDockerSocket({
+#       ('POST', r'/containers/[^/]+/start'): (204, None),
+#       ('GET',  r'/containers/[^/]+/json'):  (404, {'message': 'No such container'}),
+#   }) as daemon:
+#       ...
+#   daemon.calls → [(method, path, query dict, json body)]
+#   daemon.socket_path — for clients configured with a socket
+#                        path (the users Caddy admin API)
+#
+# A route's answer is (status, JSON-able body | bytes | None)
+# or a LIST of them, consumed one per matching call (the last
+# one repeats). Unscripted requests answer 404.
+############################################################
+
+class FakeDockerSocket:
+
+    def __init__(self, routes):
+        self.routes = {key: list(answer) if isinstance(answer, list) else [answer] for key, answer in routes.items()}
+        self.calls = []
+
+    def answer(self, method, path):
+        for (route_method, pattern), answers in self.routes.items():
+            if route_method == method and re.fullmatch(pattern, path):
+                return answers.pop(0) if len(answers) > 1 else answers[0]
+        return 404, {'message': f'unscripted {method} {path}'}
+
+    def __enter__(self):
+        daemon = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def handle_any(self):
+                url = urllib.parse.urlsplit(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                raw = self.rfile.read(length) if length else b''
+                daemon.calls.append((self.command, url.path, dict(urllib.parse.parse_qsl(url.query)),
+                                     json.loads(raw) if raw else None))
+
+                status, body = daemon.answer(self.command, url.path)
+                payload = body if isinstance(body, bytes) else (b'' if body is None else json.dumps(body).encode())
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = handle_any
+
+            def log_message(self, *args):
+                pass
+
+        class Server(socketserver.ThreadingUnixStreamServer):
+            daemon_threads = True
+
+            def get_request(self):
+                request, _ = super().get_request()
+                return request, ('local', 0)
+
+        self.tmp = tempfile.mkdtemp()
+        socket_path = self.socket_path = os.path.join(self.tmp, 'docker.sock')
+        self.server = Server(socket_path, Handler)
+        threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.01}, daemon=True).start()
+
+        self.patcher = patch('app.common.docker_engine.HOST_API_URL',
+                             f'http+unix://{urllib.parse.quote(socket_path, safe="")}')
+        self.patcher.start()
+        return self
+
+    def __exit__(self, *args):
+        self.patcher.stop()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp)
+        return False
+
+    def paths(self, method=None):
+        return [path for call_method, path, _, _ in self.calls if method in (None, call_method)]
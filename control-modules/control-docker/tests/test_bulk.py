@@ -0,0 +1,103 @@
+############################################################
+#  [*] Bulk route tests — /api/bulk
+#
+#  The per-VM operations run for real against a
+#  FakeDockerSocket (the same single-VM code paths the
+#  lifecycle tests pin); the concurrency bound is checked
+#  with a stand-in action on a small executor.
+#
+#  Convention: one banner per test class; test methods carry
+#  descriptive names instead of banners.
+############################################################
+
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+from tests.helpers import FakeDockerSocket, make_client
+
+
+
+
+
+
+
+
+############################################################
+# BulkJobTests
+############################################################
+
+class BulkJobTests(unittest.TestCase):
+
+    def setUp(self):
+        self.client = make_client()
+
+    def wait_done(self, job_id, timeout=5):
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.client.get(f'/api/bulk/{job_id}').get_json()
+            if job['state'] == 'done' or time.monotonic() > deadline:
+                return job
+            time.sleep(0.02)
+
+    def test_validation_rejects_the_whole_job(self):
+        for body in [{'action': 'explode', 'vms': ['hosting-users-dind-1']},
+                     {'action': 'stop', 'vms': []},
+                     {'action': 'stop', 'vms': ['hosting-users-dind-1', 'host']},
+                     {'action': 'stop', 'vms': ['hosting-users-dind-1', 'BAD!']}]:
+            response = self.client.post('/api/bulk', json=body)
+            self.assertEqual(response.status_code, 400, body)
+
+    def test_stop_job_reports_per_vm_progress(self):
+        names = ['hosting-users-dind-1', 'hosting-users-dind-2', 'hosting-users-dind-3']
+        with FakeDockerSocket({
+            ('POST', r'/containers/hosting-users-dind-2/stop'): (500, {'message': 'boom'}),
+            ('POST', r'/containers/[^/]+/stop'): (204, None),
+        }) as daemon:
+            response = self.client.post('/api/bulk', json={'action': 'stop', 'vms': names + names[:1]})
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(response.get_json()['total'], 3)
+            job = self.wait_done(response.get_json()['job_id'])
+
+        self.assertEqual(job['state'], 'done')
+        self.assertEqual(job['counts'], {'queued': 0, 'running': 0, 'ok': 2, 'failed': 1})
+        self.assertEqual(job['vms']['hosting-users-dind-1']['state'], 'ok')
+        self.assertEqual(job['vms']['hosting-users-dind-2']['error'], 'Failed to stop hosting-users-dind-2')
+        self.assertIn('elapsed_ms', job['vms']['hosting-users-dind-3'])
+        self.assertEqual(sorted(daemon.paths()), [f'/containers/{name}/stop' for name in names])
+
+    def test_unknown_job_is_404(self):
+        self.assertEqual(self.client.get('/api/bulk/nope').status_code, 404)
+
+    def test_executor_bounds_concurrent_operations(self):
+        lock = threading.Lock()
+        active = {'now': 0, 'max': 0}
+
+        def slow_action(container_name, vm_id):
+            with lock:
+                active['now'] += 1
+                active['max'] = max(active['max'], active['now'])
+            time.sleep(0.05)
+            with lock:
+                active['now'] -= 1
+            return None
+
+        names = [f'hosting-users-dind-{i}' for i in range(1, 9)]
+        with patch('app.bulk.routes.bulk_executor', ThreadPoolExecutor(max_workers=2)), \
+             patch.dict('app.bulk.routes.ACTIONS', {'start': slow_action}):
+            response = self.client.post('/api/bulk', json={'action': 'start', 'vms': names})
+            job = self.wait_done(response.get_json()['job_id'])
+
+        self.assertEqual(job['counts']['ok'], 8)
+        self.assertEqual(active['max'], 2)
+
+    def test_finished_jobs_are_pruned_after_the_ttl(self):
+        with patch.dict('app.bulk.routes.ACTIONS', {'start': lambda name, vm_id: None}):
+            job_id = self.client.post('/api/bulk', json={'action': 'start', 'vms': ['hosting-users-dind-1']}).get_json()['job_id']
+            self.wait_done(job_id)
+            with patch('app.bulk.routes.BULK_JOB_TTL_SECONDS', -1):
+                self.client.post('/api/bulk', json={'action': 'start', 'vms': ['hosting-users-dind-2']})
+
+        self.assertEqual(self.client.get(f'/api/bulk/{job_id}').status_code, 404)
@@ -2,23 +2,45 @@
 #  [*] Caddy contract tests — rendering, saving, reloading
 #
 #  generate_caddyfile is tested as the pure function it is;
-#  the route tests pin the plain-JSON body contract and the
-#  reload-failure → 500 that drives the backend's rollback.
+#  the route tests pin the plain-JSON body contract, the
+#  reload-failure → 500 that drives the backend's undo,
+#  and that a render identical to the loaded one skips the
+#  reload. The admin API path (caddy_admin) is pinned as the
+#  calls it makes against a fake admin socket, and the delta
+#  protocol (domain_state) as the generations and 409s the
+#  route answers — out-of-order pushes included, and a
+#  concurrent burst counted in reloads.
 #
 #  Convention: one banner per test class; test methods carry
 #  descriptive names instead of banners.
 ############################################################
 
 import os
+import random
+import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import patch
 
+from app.caddy.caddy_admin import CONFIG_MARKER_ID, CaddyAdmin, domain_operations, render_config
+from app.caddy import domain_state
 from app.caddy.caddyfile_updater import CaddyfileUpdater
-from tests.helpers import fake_process, make_client
+from app.caddy.routes import caddy_coordinator
+from tests.helpers import FakeDockerSocket, make_client
 
 
 DOMAIN = {'id': 5, 'virtualserverid': 7, 'domainname': 'mano.test.lt', 'iscloudflare': 0, 'ssl': 0}
 
+# The Caddyfiles below all live in /dev/shm, so their
+# domain state does too — every test starts without one
+STATE_LOCATION = f'/dev/shm/{domain_state.DOMAIN_STATE_FILENAME}'
+
+
+def forget_domain_state():
+    domain_state.applied_state = None
+    if os.path.exists(STATE_LOCATION):
+        os.remove(STATE_LOCATION)
+
 
 
 
@@ -32,6 +54,9 @@ DOMAIN = {'id': 5, 'virtualserverid': 7, 'domainname': 'mano.test.lt', 'iscloudf
 
 class GenerateCaddyfileTests(unittest.TestCase):
 
+    def setUp(self):
+        CaddyfileUpdater.fragment_cache = {}
+
     def render(self, **overrides):
         return CaddyfileUpdater().generate_caddyfile([{**DOMAIN, **overrides}])
 
@@ -60,13 +85,26 @@ class GenerateCaddyfileTests(unittest.TestCase):
         self.assertIn(':80 {', content)                     # the catch-all
         self.assertIn('handle_errors 502', content)
 
-    def test_save_writes_to_the_configured_location(self):
+    def test_unchanged_rows_reuse_their_cached_blocks(self):
+        other = {**DOMAIN, 'id': 6, 'domainname': 'kitas.test.lt'}
+        first = CaddyfileUpdater().generate_caddyfile([DOMAIN, other])
+
+        with patch.object(CaddyfileUpdater, 'render_server_block', wraps=CaddyfileUpdater().render_server_block) as renderMock:
+            second = CaddyfileUpdater().generate_caddyfile([DOMAIN, {**other, 'ssl': 1}])
+        self.assertEqual(renderMock.call_count, 1)                  # only the edited row
+        self.assertEqual(second, first.replace('http://kitas.test.lt {\n', 'kitas.test.lt {\n    tls admin@knf.vu.lt'))
+        self.assertEqual(len(CaddyfileUpdater.fragment_cache), 2)   # the old version is dropped
+
+    def test_write_swaps_into_the_configured_location(self):
         target = '/dev/shm/test-caddyfile'
+        CaddyfileUpdater.written_hash = None
         with patch.dict(os.environ, {'CADDYFILE_LOCATION': target}):
-            CaddyfileUpdater().save_caddyfile('rendered content')
+            CaddyfileUpdater().write_caddyfile('rendered content')
         try:
             with open(target) as f:
                 self.assertEqual(f.read(), 'rendered content')
+            self.assertEqual(os.stat(target).st_mode & 0o777, 0o644)
+            self.assertFalse([name for name in os.listdir('/dev/shm') if name.startswith('.Caddyfile-')])     # no temp left behind
         finally:
             os.remove(target)
 
@@ -85,23 +123,240 @@ class UpdateCaddyConfigRouteTests(unittest.TestCase):
 
     def setUp(self):
         self.client = make_client()
+        CaddyfileUpdater.written_hash = CaddyfileUpdater.loaded_hash = None
+        CaddyfileUpdater.staged_config.last_good = None
+        forget_domain_state()
+        self.addCleanup(forget_domain_state)
+        self.addCleanup(lambda: os.path.exists('/dev/shm/test-caddyfile-route') and os.remove('/dev/shm/test-caddyfile-route'))
+
+    def post_domains(self, reloadReturncode, domains=(DOMAIN,)):
+        return self.post(reloadReturncode, {'domains': list(domains)})
 
-    def post_domains(self, reloadReturncode):
+    def post(self, reloadReturncode, body):
         with patch.dict(os.environ, {'CADDYFILE_LOCATION': '/dev/shm/test-caddyfile-route'}), \
-             patch('app.caddy.caddyfile_updater.Popen', return_value=fake_process(reloadReturncode)) as popenMock:
-            response = self.client.post('/api/updatecaddyconfig', json={'domains': [DOMAIN]})
-        if os.path.exists('/dev/shm/test-caddyfile-route'):
-            os.remove('/dev/shm/test-caddyfile-route')
-        return response, popenMock
+             FakeDockerSocket({
+                 ('POST', r'/containers/[^/]+/exec'): (201, {'Id': 'exec1'}),
+                 ('POST', r'/exec/exec1/start'): (200, b''),
+                 ('GET', r'/exec/exec1/json'): (200, {'ExitCode': reloadReturncode}),
+             }) as daemon:
+            response = self.client.post('/api/updatecaddyconfig', json=body)
+        return response, daemon
 
     def test_plain_json_body_renders_and_reloads(self):
-        response, popenMock = self.post_domains(reloadReturncode=0)
+        response, daemon = self.post_domains(reloadReturncode=0)
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.get_json()['message'], 'Caddy config updated')
-        popenMock.assert_called_once_with(
-            ['docker', 'exec', 'hosting-users-caddy', 'caddy', 'reload', '--config', '/etc/caddy/Caddyfile'])
+        self.assertIsInstance(response.get_json()['generation'], int)
+        _, path, _, body = daemon.calls[0]
+        self.assertEqual(path, '/containers/hosting-users-caddy/exec')
+        self.assertEqual(body['Cmd'], ['caddy', 'reload', '--config', '/etc/caddy/Caddyfile'])
 
-    def test_failed_reload_is_500_so_the_backend_rolls_back(self):
+    def test_failed_reload_is_500_so_the_backend_undoes_the_change(self):
         response, _ = self.post_domains(reloadReturncode=1)
         self.assertEqual(response.status_code, 500)
         self.assertEqual(response.get_json()['error'], 'Caddy reload failed')
+
+    def test_identical_render_skips_the_reload(self):
+        self.post_domains(reloadReturncode=0)
+        response, daemon = self.post_domains(reloadReturncode=0)
+        self.assertEqual((response.status_code, response.get_json()['message']), (200, 'Caddy config unchanged'))
+        self.assertEqual(daemon.calls, [])
+
+        response, daemon = self.post_domains(reloadReturncode=0, domains=[])       # a real change
+        self.assertEqual(response.get_json()['message'], 'Caddy config updated')
+        self.assertTrue(daemon.calls)
+
+    def test_failed_reload_keeps_the_loaded_config_and_restores_its_file(self):
+        self.post_domains(reloadReturncode=0)
+        with open('/dev/shm/test-caddyfile-route') as f:
+            loaded = f.read()
+        self.assertEqual(self.post_domains(reloadReturncode=1, domains=[])[0].status_code, 500)
+        with open('/dev/shm/test-caddyfile-route') as f:
+            self.assertEqual(f.read(), loaded)                                     # restored at once
+
+        response, daemon = self.post_domains(reloadReturncode=0)                   # the backend rolled back
+        self.assertEqual(response.get_json()['message'], 'Caddy config unchanged')
+        self.assertEqual(daemon.calls, [])
+        with open('/dev/shm/test-caddyfile-route') as f:
+            self.assertEqual(f.read(), loaded)
+
+    def test_a_render_that_does_not_parse_is_500_without_a_reload(self):
+        self.post_domains(reloadReturncode=0)
+        with open('/dev/shm/test-caddyfile-route') as f:
+            loaded = f.read()
+
+        response, daemon = self.post_domains(reloadReturncode=0, domains=[{**DOMAIN, 'domainname': 'mano.test.lt {'}])
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(daemon.calls, [])
+        with open('/dev/shm/test-caddyfile-route') as f:
+            self.assertEqual(f.read(), loaded)
+
+    def test_a_round_that_raises_is_a_json_500(self):
+        with patch.object(CaddyfileUpdater, 'apply_caddyfile', side_effect=OSError('disk full')):
+            response = self.client.post('/api/updatecaddyconfig', json={'domains': [DOMAIN]})
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.get_json()['error'], 'Caddy regeneration failed')
+        self.assertEqual(response.get_json()['generation'], 0)                  # nothing was committed
+
+    def test_deltas_apply_in_revision_order(self):
+        self.post(0, {'revision': 4, 'domains': [DOMAIN]})
+        other = {**DOMAIN, 'id': 6, 'domainname': 'kitas.test.lt'}
+
+        response, _ = self.post(0, {'revision': 5, 'operations': [{'op': 'add', 'domain': other}]})
+        self.assertEqual((response.status_code, response.get_json()['generation']), (200, 5))
+        response, _ = self.post(0, {'revision': 6, 'operations': [{'op': 'remove', 'id': 5}]})
+        self.assertEqual(response.get_json()['generation'], 6)
+        with open('/dev/shm/test-caddyfile-route') as f:
+            content = f.read()
+        self.assertIn('kitas.test.lt', content)
+        self.assertNotIn('mano.test.lt', content)
+
+    def test_a_gapped_or_unfitting_delta_is_409_and_changes_nothing(self):
+        self.post(0, {'revision': 4, 'domains': [DOMAIN]})
+
+        for body in [{'revision': 6, 'operations': []},                                             # 5 is missing
+                     {'revision': 5, 'operations': [{'op': 'add', 'domain': DOMAIN}]},               # already there
+                     {'revision': 5, 'operations': [{'op': 'remove', 'id': 99}]}]:
+            response, daemon = self.post(0, body)
+            self.assertEqual((response.status_code, response.get_json()), (409, {'error': 'Generation mismatch', 'generation': 4}))
+            self.assertEqual(daemon.calls, [])
+
+    def test_what_a_newer_table_carried_is_covered(self):
+        other = {**DOMAIN, 'id': 6, 'domainname': 'kitas.test.lt'}
+        self.post(0, {'revision': 4, 'domains': [DOMAIN]})
+        self.post(0, {'revision': 6, 'domains': [DOMAIN, other]})                                   # the resync overtook 5
+
+        response, daemon = self.post(0, {'revision': 5, 'operations': [{'op': 'add', 'domain': other}]})
+        self.assertEqual((response.status_code, response.get_json()['message']), (200, 'Caddy config unchanged'))
+        response, daemon = self.post(0, {'revision': 5, 'domains': [DOMAIN]})                       # an older table
+        self.assertEqual(response.get_json()['message'], 'Caddy config unchanged')
+        self.assertEqual(daemon.calls, [])
+        self.assertEqual(domain_state.current_state()[0], 6)
+
+    def test_a_restarted_sidecar_resumes_from_the_state_file(self):
+        self.post(0, {'revision': 4, 'domains': [DOMAIN]})
+        domain_state.applied_state = None
+
+        response, _ = self.post(0, {'revision': 5, 'operations': [{'op': 'update', 'domain': {**DOMAIN, 'ssl': 1}}]})
+        self.assertEqual(response.status_code, 200)
+
+        forget_domain_state()                                                        # no state at all
+        response, _ = self.post(0, {'revision': 6, 'operations': []})
+        self.assertEqual(response.status_code, 409)
+
+    def test_a_burst_of_out_of_order_deltas_costs_two_reloads(self):
+        self.post(0, {'revision': 1, 'domains': []})
+        submittedBefore = caddy_coordinator.stats['submitted']
+        reloads = []
+
+        def slow_reload(updater):
+            # The first reload lasts until the whole burst is parked
+            reloads.append(1)
+            deadline = time.monotonic() + 5
+            while caddy_coordinator.stats['submitted'] < submittedBefore + 20 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            return True
+
+        def push(revision):
+            domain = {**DOMAIN, 'id': revision, 'domainname': f'd{revision}.test.lt'}
+            return make_client().post('/api/updatecaddyconfig', json={'revision': revision, 'operations': [{'op': 'add', 'domain': domain}]})
+
+        revisions = [2] + random.Random(7).sample(range(3, 22), 19)                 # 3..21 arrive in any order
+        with patch.dict(os.environ, {'CADDYFILE_LOCATION': '/dev/shm/test-caddyfile-route'}), \
+             patch.object(CaddyfileUpdater, 'reload_caddy', new=slow_reload), \
+             ThreadPoolExecutor(max_workers=20) as executor:
+            first = executor.submit(push, revisions[0])
+            while not reloads:                                                       # the rest arrive while 2 reloads
+                time.sleep(0.005)
+            responses = [first] + [executor.submit(push, revision) for revision in revisions[1:]]
+            statuses = [future.result().status_code for future in responses]
+
+        self.assertEqual(statuses, [200] * 20)
+        self.assertEqual(len(reloads), 2)
+        self.assertEqual(domain_state.current_state()[0], 21)
+        self.assertEqual(len(domain_state.current_state()[1]), 20)
+
+
+
+
+
+
+
+
+############################################################
+# CaddyAdminTests
+############################################################
+
+class CaddyAdminTests(unittest.TestCase):
+
+    def setUp(self):
+        self.client = make_client()
+        CaddyAdmin.applied_rows = None
+        CaddyfileUpdater.written_hash = CaddyfileUpdater.loaded_hash = None
+        CaddyfileUpdater.staged_config.last_good = None
+        forget_domain_state()
+        self.addCleanup(forget_domain_state)
+        self.addCleanup(lambda: os.path.exists('/dev/shm/test-caddyfile-admin') and os.remove('/dev/shm/test-caddyfile-admin'))
+
+    def post_domains(self, domains, routes=None):
+        with FakeDockerSocket(routes or {
+                 ('GET', r'/id/.+'): (200, {}),
+                 ('POST', r'/load|/config/.+'): (200, None),
+                 ('PUT', r'/config/.+'): (200, None),
+                 ('PATCH', r'/id/.+'): (200, None),
+                 ('DELETE', r'/id/.+'): (200, None),
+             }) as caddy, \
+             patch.dict(os.environ, {'USERS_CADDY_ADMIN_SOCKET': caddy.socket_path, 'CADDYFILE_LOCATION': '/dev/shm/test-caddyfile-admin'}):
+            response = self.client.post('/api/updatecaddyconfig', json={'domains': domains})
+        return response, [(method, path) for method, path, _, _ in caddy.calls], caddy.calls
+
+    def test_config_carries_the_ids_and_keeps_the_admin_socket(self):
+        config = render_config([DOMAIN, {**DOMAIN, 'id': 6, 'domainname': 'saugus.test.lt', 'iscloudflare': 1, 'ssl': 1}])
+        servers = config['apps']['http']['servers']
+        self.assertEqual(config['admin']['listen'], 'unix//run/caddy-admin/admin.sock')
+        self.assertEqual([route.get('@id') for route in servers['http']['routes']], ['domain-5', CONFIG_MARKER_ID])   # catch-all last
+        self.assertEqual([route['@id'] for route in servers['https']['errors']['routes']], ['domain-6-errors'])
+        self.assertEqual(config['apps']['tls']['automation']['policies'],
+                         [{'@id': 'domain-6-tls', 'subjects': ['saugus.test.lt'], 'issuers': [{'module': 'internal'}]}])
+
+    def test_operations_touch_only_what_changed(self):
+        applied = {5: DOMAIN}
+        moved = domain_operations(applied, {5: {**DOMAIN, 'virtualserverid': 8}})
+        self.assertEqual([(method, path) for method, path, _ in moved], [('PATCH', '/id/domain-5')])
+        self.assertEqual(moved[0][2]['handle'][0]['routes'][0]['handle'][0]['upstreams'], [{'dial': 'hosting-users-dind-8:80'}])
+
+        self.assertEqual([(method, path) for method, path, _ in domain_operations(applied, {5: {**DOMAIN, 'ssl': 1}})], [
+            ('DELETE', '/id/domain-5'), ('DELETE', '/id/domain-5-errors'),
+            ('PUT', '/config/apps/http/servers/https/routes/0'), ('PUT', '/config/apps/http/servers/https/errors/routes/0'),
+            ('POST', '/config/apps/tls/automation/policies'),
+        ])
+        self.assertEqual(domain_operations(applied, {5: dict(DOMAIN)}), [])
+
+    def test_first_update_loads_then_later_ones_patch(self):
+        response, calls, _ = self.post_domains([DOMAIN])
+        self.assertEqual((response.status_code, calls), (200, [('POST', '/load')]))
+        self.assertTrue(os.path.exists('/dev/shm/test-caddyfile-admin'))     # for a Caddy restart
+
+        response, calls, _ = self.post_domains([DOMAIN, {**DOMAIN, 'id': 6, 'domainname': 'kitas.test.lt'}])
+        self.assertEqual(response.get_json()['message'], 'Caddy config updated')
+        self.assertEqual(calls, [('GET', f'/id/{CONFIG_MARKER_ID}'),
+                                 ('PUT', '/config/apps/http/servers/http/routes/0'),
+                                 ('PUT', '/config/apps/http/servers/http/errors/routes/0')])
+
+        response, calls, _ = self.post_domains([DOMAIN, {**DOMAIN, 'id': 6, 'domainname': 'kitas.test.lt'}])
+        self.assertEqual((response.get_json()['message'], calls), ('Caddy config unchanged', []))
+
+    def test_drift_falls_back_to_a_full_load(self):
+        self.post_domains([DOMAIN])
+        response, calls, raw = self.post_domains([], routes={
+            ('GET', r'/id/.+'): (404, {'error': 'unknown object ID'}),      # Caddy restarted from its Caddyfile
+            ('POST', r'/load'): (200, None),
+        })
+        self.assertEqual((response.status_code, calls), (200, [('GET', f'/id/{CONFIG_MARKER_ID}'), ('POST', '/load')]))
+        self.assertEqual([route.get('@id') for route in raw[-1][3]['apps']['http']['servers']['http']['routes']], [CONFIG_MARKER_ID])
+
+    def test_failed_load_is_500(self):
+        response, calls, _ = self.post_domains([DOMAIN], routes={('POST', r'/load'): (400, {'error': 'bad config'})})
+        self.assertEqual(response.status_code, 500)
+        self.assertIsNone(CaddyAdmin.applied_rows)
+        self.assertFalse(os.path.exists('/dev/shm/test-caddyfile-admin'))
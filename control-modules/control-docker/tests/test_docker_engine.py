@@ -0,0 +1,71 @@
+############################################################
+#  [*] Engine client tests — common/docker_engine
+#
+#  The client against a FakeDockerSocket: which answers count
+#  as success, how failures surface, the exec round trip and
+#  the state wait.
+#
+#  Convention: one banner per test class; test methods carry
+#  descriptive names instead of banners.
+############################################################
+
+import unittest
+
+from app.common import docker_engine
+from tests.helpers import FakeDockerSocket
+
+
+
+
+
+
+
+
+############################################################
+# EngineClientTests
+############################################################
+
+class EngineClientTests(unittest.TestCase):
+
+    def test_inspect_of_a_missing_container_is_none(self):
+        with FakeDockerSocket({('GET', r'/containers/gone/json'): (404, {'message': 'No such container: gone'})}):
+            self.assertIsNone(docker_engine.inspect_container('gone'))
+
+    def test_unexpected_answer_raises_with_the_daemon_message(self):
+        with FakeDockerSocket({('POST', r'/containers/x/start'): (500, {'message': 'cannot start'})}):
+            with self.assertRaises(docker_engine.EngineError) as raised:
+                docker_engine.start_container('x')
+
+        self.assertEqual(raised.exception.status_code, 500)
+        self.assertEqual(raised.exception.message, 'cannot start')
+
+    def test_stop_passes_the_grace_period(self):
+        with FakeDockerSocket({('POST', r'/containers/x/stop'): (204, None)}) as daemon:
+            docker_engine.stop_container('x', grace_seconds=3)
+        self.assertEqual(daemon.calls[0][2], {'t': '3'})
+
+    def test_exec_run_returns_the_exit_code_and_output(self):
+        with FakeDockerSocket({
+            ('POST', r'/containers/x/exec'): (201, {'Id': 'e1'}),
+            ('POST', r'/exec/e1/start'): (200, b'\x01\x00\x00\x00\x00\x00\x00\x02ok'),
+            ('GET', r'/exec/e1/json'): (200, {'ExitCode': 3}),
+        }) as daemon:
+            exit_code, output = docker_engine.exec_run('x', ['true'])
+
+        self.assertEqual(exit_code, 3)
+        self.assertTrue(output.endswith(b'ok'))
+        self.assertEqual(daemon.calls[1][3], {'Detach': False, 'Tty': False})
+
+    def test_wait_for_state_polls_until_the_status_is_reached(self):
+        with FakeDockerSocket({('GET', r'/containers/x/json'): [
+            (200, {'State': {'Status': 'created'}}),
+            (200, {'State': {'Status': 'running'}}),
+        ]}) as daemon:
+            status = docker_engine.wait_for_state('x', {'running'}, timeout=2, interval=0.01)
+
+        self.assertEqual(status, 'running')
+        self.assertEqual(len(daemon.calls), 2)
+
+    def test_wait_for_state_treats_none_as_gone(self):
+        with FakeDockerSocket({('GET', r'/containers/x/json'): (404, {'message': 'No such container'})}):
+            self.assertIsNone(docker_engine.wait_for_state('x', {None}, timeout=1, interval=0.01))
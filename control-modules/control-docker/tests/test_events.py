@@ -0,0 +1,155 @@
+############################################################
+#  [*] Events contract tests — the container delta stream
+#
+#  The raw Engine API events are fed straight into
+#  handle_event; api_get is mocked, so no daemon or proxy is
+#  ever contacted. The delta line shape is what the backend's
+#  monitor applies to its cache.
+#
+#  Convention: one banner per test class; test methods carry
+#  descriptive names instead of banners.
+############################################################
+
+import json
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from app.events import docker_events
+from app.events.docker_events import DockerEventStream
+from tests.helpers import fake_response, make_client
+
+
+API_CONTAINER = {
+    'Id': 'abc123', 'Names': ['/hosting-users-dind-7'], 'Image': 'hosting-dind-ubuntu',
+    'Command': 'entrypoint', 'Created': 0, 'State': 'running', 'Status': 'Up 1 second',
+    'Labels': {}, 'NetworkSettings': {'Networks': {}}, 'Ports': [], 'Mounts': [],
+}
+
+
+def raw_event(action, name='hosting-users-dind-7', docker_id='abc123'):
+    return {'Type': 'container', 'Action': action, 'Actor': {'ID': docker_id, 'Attributes': {'name': name}}}
+
+
+
+
+
+
+
+
+############################################################
+# HandleEventTests
+############################################################
+
+class HandleEventTests(unittest.TestCase):
+
+    def setUp(self):
+        self.stream = DockerEventStream()
+
+    def test_start_delta_carries_the_legacy_shape(self):
+        with patch('app.events.docker_events.api_get', return_value=fake_response(200, json.dumps([API_CONTAINER]))), \
+             patch.object(self.stream, 'watch') as watchMock:
+            self.stream.handle_event('host', raw_event('start'))
+
+        delta = self.stream.deltas.get_nowait()
+        self.assertEqual(delta['parent'], 'host')
+        self.assertEqual(delta['action'], 'start')
+        self.assertEqual(delta['id'], 'abc123')
+        self.assertEqual(delta['container']['Names'], 'hosting-users-dind-7')
+        self.assertEqual(delta['container']['State'], 'running')
+
+        # A started dind opens that VM's inner watcher
+        watchMock.assert_called_once_with('hosting-users-dind-7')
+
+    def test_destroy_needs_no_lookup_and_closes_the_vm_watcher(self):
+        self.stream.watchers['hosting-users-dind-7'] = stopEvent = docker_events.threading.Event()
+        with patch('app.events.docker_events.api_get') as apiMock:
+            self.stream.handle_event('host', raw_event('destroy'))
+
+        apiMock.assert_not_called()
+        self.assertEqual(self.stream.deltas.get_nowait()['container'], None)
+        self.assertTrue(stopEvent.is_set())
+        self.assertNotIn('hosting-users-dind-7', self.stream.watchers)
+
+    def test_inner_events_never_open_watchers(self):
+        with patch('app.events.docker_events.api_get', return_value=fake_response(200, json.dumps([]))), \
+             patch.object(self.stream, 'watch') as watchMock:
+            self.stream.handle_event('hosting-users-dind-7', raw_event('start', name='hosting-users-dind-9'))
+
+        watchMock.assert_not_called()
+        delta = self.stream.deltas.get_nowait()
+        self.assertEqual(delta['parent'], 'hosting-users-dind-7')
+        self.assertIsNone(delta['container'])       # already gone again
+
+    def test_unwatched_actions_are_ignored(self):
+        self.stream.handle_event('host', raw_event('exec_start: sh'))
+        self.assertTrue(self.stream.deltas.empty())
+
+
+
+
+
+
+
+
+############################################################
+# RunWatcherTests
+############################################################
+#
+# One round of run_watcher against a stream that ends at
+# once: which opens are announced with a resync.
+############################################################
+
+class RunWatcherTests(unittest.TestCase):
+
+    def setUp(self):
+        self.stream = DockerEventStream()
+        self.stop = docker_events.threading.Event()
+
+    def run_one_round(self, parent):
+        def end_of_stream():
+            self.stop.set()         # the round ends with the stream
+            yield from ()
+
+        def open_stream(*args, **kwargs):
+            return SimpleNamespace(iter_lines=end_of_stream, close=lambda: None)
+
+        with patch('app.events.docker_events.api_get', side_effect=open_stream):
+            self.stream.run_watcher(parent, self.stop)
+        return [self.stream.deltas.get_nowait() for _ in range(self.stream.deltas.qsize())]
+
+    def test_a_vm_watcher_resyncs_on_its_first_open(self):
+        self.assertEqual(self.run_one_round('hosting-users-dind-7'),
+                         [{'parent': 'hosting-users-dind-7', 'action': 'resync', 'id': None, 'container': None}])
+
+    def test_the_host_watcher_does_not_resync_on_its_first_open(self):
+        self.assertEqual(self.run_one_round('host'), [])
+
+
+
+
+
+
+
+
+############################################################
+# EventsRouteTests
+############################################################
+
+class EventsRouteTests(unittest.TestCase):
+
+    def setUp(self):
+        self.client = make_client()
+
+    def test_heartbeat_when_quiet(self):
+        stream = DockerEventStream()
+        with patch('app.events.docker_events.HEARTBEAT_SECONDS', 0.01):
+            self.assertEqual(json.loads(next(stream.lines())), {'action': 'heartbeat'})
+
+    def test_unreachable_host_daemon_is_500(self):
+        with patch('app.events.docker_events.api_get', side_effect=ConnectionError('socket gone')), \
+             patch.object(DockerEventStream, 'watch'):
+            response = self.client.get('/api/events')
+
+        self.assertEqual(response.status_code, 500)
+        self.assertIn('Failed to subscribe', response.get_json()['error'])
@@ -3,8 +3,9 @@
 #      reloading
 #
 #  generate_caddyfile is tested as the pure function it is;
-#  the route tests pin the plain-JSON body contract and the
-#  reload-failure → 500 that drives the backend's rollback.
+#  the route tests pin the plain-JSON body contract, the
+#  reload-failure → 500 that drives the backend's undo, and
+#  that a table older than the applied one is not reloaded.
 #
 #  Convention: one banner per test class; test methods carry
 #  descriptive names instead of banners.
@@ -14,8 +15,9 @@ import os
 import unittest
 from unittest.mock import patch
 
+from app.portforwarder import routes as portforwarder_routes
 from app.portforwarder.portforwarder_updater import PortforwarderUpdater
-from tests.helpers import fake_process, make_client
+from tests.helpers import FakeDockerSocket, make_client
 
 
 FORWARD = {'id': 5, 'virtualserverid': 7, 'publicport': 30005, 'internalport': 3000}
@@ -68,13 +70,15 @@ class GeneratePortforwarderConfigTests(unittest.TestCase):
         with self.assertRaises(ValueError):
             self.render([{**FORWARD, 'publicport': '30005 }\n:443 {'}])
 
-    def test_save_writes_to_the_configured_location(self):
+    def test_apply_swaps_into_the_configured_location(self):
         target = '/dev/shm/test-portforwarder-caddyfile'
-        with patch.dict(os.environ, {'PORTFORWARDER_CADDYFILE_LOCATION': target}):
-            PortforwarderUpdater().save_caddyfile('rendered content')
+        with patch.dict(os.environ, {'PORTFORWARDER_CADDYFILE_LOCATION': target}), \
+             patch.object(PortforwarderUpdater, 'reload_portforwarder', return_value=True):
+            self.assertEqual(PortforwarderUpdater().apply_caddyfile('rendered content'), 'reloaded')
         try:
             with open(target) as f:
                 self.assertEqual(f.read(), 'rendered content')
+            self.assertEqual(os.stat(target).st_mode & 0o777, 0o644)
         finally:
             os.remove(target)
 
@@ -93,23 +97,51 @@ class UpdatePortforwarderConfigRouteTests(unittest.TestCase):
 
     def setUp(self):
         self.client = make_client()
+        PortforwarderUpdater.staged_config.last_good = None
+        portforwarder_routes.applied_revision = 0
 
-    def post_forwards(self, reloadReturncode):
+    def post_forwards(self, reloadReturncode, revision=None):
         with patch.dict(os.environ, {'PORTFORWARDER_CADDYFILE_LOCATION': '/dev/shm/test-portforwarder-route'}), \
-             patch('app.portforwarder.portforwarder_updater.Popen', return_value=fake_process(reloadReturncode)) as popenMock:
-            response = self.client.post('/api/updateportforwarderconfig', json={'portforwards': [FORWARD]})
+             FakeDockerSocket({
+                 ('POST', r'/containers/[^/]+/exec'): (201, {'Id': 'exec1'}),
+                 ('POST', r'/exec/exec1/start'): (200, b''),
+                 ('GET', r'/exec/exec1/json'): (200, {'ExitCode': reloadReturncode}),
+             }) as daemon:
+            body = {'portforwards': [FORWARD]} if revision is None else {'revision': revision, 'portforwards': [FORWARD]}
+            response = self.client.post('/api/updateportforwarderconfig', json=body)
         if os.path.exists('/dev/shm/test-portforwarder-route'):
             os.remove('/dev/shm/test-portforwarder-route')
-        return response, popenMock
+        return response, daemon
 
     def test_plain_json_body_renders_and_reloads(self):
-        response, popenMock = self.post_forwards(reloadReturncode=0)
+        response, daemon = self.post_forwards(reloadReturncode=0)
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.get_json()['message'], 'Portforwarder config updated')
-        popenMock.assert_called_once_with(
-            ['docker', 'exec', 'hosting-users-portforwarder', 'caddy', 'reload', '--config', '/etc/caddy/Caddyfile'])
+        _, path, _, body = daemon.calls[0]
+        self.assertEqual(path, '/containers/hosting-users-portforwarder/exec')
+        self.assertEqual(body['Cmd'], ['caddy', 'reload', '--config', '/etc/caddy/Caddyfile'])
 
     def test_failed_reload_is_500_so_the_backend_rolls_back(self):
         response, _ = self.post_forwards(reloadReturncode=1)
         self.assertEqual(response.status_code, 500)
         self.assertEqual(response.get_json()['error'], 'Portforwarder reload failed')
+
+    def test_a_round_that_raises_is_a_json_500(self):
+        with patch.object(PortforwarderUpdater, 'apply_caddyfile', side_effect=OSError('disk full')):
+            response = self.client.post('/api/updateportforwarderconfig', json={'portforwards': [FORWARD]})
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.get_json()['error'], 'Portforwarder regeneration failed')
+
+    def test_a_table_older_than_the_applied_one_reloads_nothing(self):
+        response, _ = self.post_forwards(reloadReturncode=0, revision=7)
+        self.assertEqual(response.get_json()['generation'], 7)
+
+        response, daemon = self.post_forwards(reloadReturncode=0, revision=6)              # overtaken on the way
+        self.assertEqual(response.get_json(), {'message': 'Portforwarder config unchanged', 'generation': 7})
+        self.assertEqual(daemon.calls, [])
+
+        response, _ = self.post_forwards(reloadReturncode=1, revision=8)                   # a failed reload
+        self.assertEqual(response.status_code, 500)
+        response, daemon = self.post_forwards(reloadReturncode=0, revision=8)               # still to apply
+        self.assertEqual(response.get_json()['generation'], 8)
+        self.assertTrue(daemon.calls)
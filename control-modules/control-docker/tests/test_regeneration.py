@@ -0,0 +1,104 @@
+############################################################
+#  [*] Regeneration coordinator tests — common/regeneration
+#
+#  A burst behind a slow round is handed to apply as one
+#  round, in submission order; every caller gets its own
+#  answer from the round that covered it, failures and
+#  exceptions included. A lone call skips the debounce.
+#
+#  Convention: one banner per test class; test methods carry
+#  descriptive names instead of banners.
+############################################################
+
+import threading
+import time
+import unittest
+
+from app.common.regeneration import RegenerationCoordinator, RegenerationError
+
+
+
+
+
+
+
+
+############################################################
+# RegenerationCoordinatorTests
+############################################################
+
+class RegenerationCoordinatorTests(unittest.TestCase):
+
+    def setUp(self):
+        self.applied = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def slow_apply(self, submissions):
+        self.applied.append([payload for _, payload in submissions])
+        self.started.set()
+        self.release.wait(2)
+        outcome = 'failed' if any(payload == 'broken' for _, payload in submissions) else 'reloaded'
+        return [(number, outcome) for number, _ in submissions]
+
+    def submit_in_thread(self, coordinator, payload, answers):
+        thread = threading.Thread(target=lambda: answers.__setitem__(payload, coordinator.submit(payload)))
+        thread.start()
+        return thread
+
+    def wait_submitted(self, coordinator, count):
+        deadline = time.monotonic() + 2
+        while coordinator.stats['submitted'] < count and time.monotonic() < deadline:
+            time.sleep(0.005)
+
+    def test_a_burst_behind_a_running_round_is_applied_once(self):
+        coordinator = RegenerationCoordinator('test', self.slow_apply, debounce_seconds=0)
+        answers = {}
+        threads = [self.submit_in_thread(coordinator, 'table-1', answers)]
+        self.started.wait(2)
+        threads += [self.submit_in_thread(coordinator, f'table-{i}', answers) for i in range(2, 7)]
+        self.wait_submitted(coordinator, 6)
+
+        self.release.set()
+        for thread in threads:
+            thread.join(2)
+
+        self.assertEqual(self.applied[0], ['table-1'])
+        self.assertEqual(sorted(self.applied[1]), [f'table-{i}' for i in range(2, 7)])
+        self.assertEqual(coordinator.stats, {'submitted': 6, 'rounds': 2})
+        self.assertEqual(answers['table-1'], (1, 'reloaded'))
+        self.assertEqual(sorted(answers[payload] for payload in self.applied[1]), [(i, 'reloaded') for i in range(2, 7)])
+
+    def test_a_lone_call_is_not_debounced(self):
+        coordinator = RegenerationCoordinator('test', lambda submissions: [(number, 'reloaded') for number, _ in submissions], debounce_seconds=5)
+        started = time.monotonic()
+        self.assertEqual(coordinator.submit('table-1'), (1, 'reloaded'))
+        self.assertEqual(coordinator.submit('table-2'), (2, 'reloaded'))
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_a_failed_round_fails_every_caller_in_it(self):
+        coordinator = RegenerationCoordinator('test', self.slow_apply, debounce_seconds=0)
+        answers = {}
+        threads = [self.submit_in_thread(coordinator, 'table-1', answers)]
+        self.started.wait(2)
+        threads += [self.submit_in_thread(coordinator, payload, answers) for payload in ['table-2', 'broken']]
+        self.wait_submitted(coordinator, 3)
+
+        self.release.set()
+        for thread in threads:
+            thread.join(2)
+
+        self.assertEqual(answers['table-1'], (1, 'reloaded'))
+        self.assertEqual({answers['table-2'][1], answers['broken'][1]}, {'failed'})
+
+    def test_an_exception_reaches_the_caller_and_the_worker_survives(self):
+        def apply(submissions):
+            if any(payload == 'explode' for _, payload in submissions):
+                raise OSError('disk full')
+            return [(number, 'reloaded') for number, _ in submissions]
+        coordinator = RegenerationCoordinator('test', apply, debounce_seconds=0)
+
+        with self.assertRaises(RegenerationError) as raised:
+            coordinator.submit('explode')
+        self.assertIsInstance(raised.exception.__cause__, OSError)
+        self.assertEqual(coordinator.submit('table'), (2, 'reloaded'))
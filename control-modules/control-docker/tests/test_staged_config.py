@@ -0,0 +1,119 @@
+############################################################
+#  [*] Staged config tests — common/staged_config
+#
+#  The in-process syntax check against the real renders and
+#  broken ones; the pipeline against a temp directory and a
+#  fake daemon: a rejected candidate never reaches the live
+#  file or a reload, a refused reload puts the previous file
+#  back, and `caddy validate` runs once per content.
+#
+#  Convention: one banner per test class; test methods carry
+#  descriptive names instead of banners.
+############################################################
+
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from app.caddy.caddyfile_updater import CaddyfileUpdater
+from app.common.staged_config import StagedConfig, check_caddyfile_syntax
+from app.portforwarder.portforwarder_updater import PortforwarderUpdater
+from tests.helpers import FakeDockerSocket
+
+
+
+
+
+
+
+
+############################################################
+# CaddyfileSyntaxTests
+############################################################
+
+class CaddyfileSyntaxTests(unittest.TestCase):
+
+    def test_the_renders_pass(self):
+        domains = [
+            {'id': 5, 'virtualserverid': 7, 'domainname': 'mano.test.lt', 'iscloudflare': 0, 'ssl': 0},
+            {'id': 6, 'virtualserverid': 7, 'domainname': 'kitas.test.lt', 'iscloudflare': 1, 'ssl': 1},
+        ]
+        self.assertIsNone(check_caddyfile_syntax(CaddyfileUpdater().generate_caddyfile(domains)))
+        forward = {'id': 1, 'virtualserverid': 7, 'publicport': 30005, 'internalport': 3000}
+        self.assertIsNone(check_caddyfile_syntax(PortforwarderUpdater().generate_caddyfile([forward])))
+        self.assertIsNone(check_caddyfile_syntax(PortforwarderUpdater().generate_caddyfile([])))
+
+    def test_placeholders_comments_and_strings_are_not_blocks(self):
+        self.assertIsNone(check_caddyfile_syntax('a {\n    header_up X {remote_host}\n    respond "} {" 200  # }\n}\n'))
+
+    def test_broken_structure_names_the_line(self):
+        self.assertEqual(check_caddyfile_syntax('a {\n    b {\n}\n'), 'line 1: unclosed {')
+        self.assertEqual(check_caddyfile_syntax('a {\n}\n}\n'), 'line 3: unexpected }')
+        self.assertEqual(check_caddyfile_syntax('a {\n    respond "oops 200\n}\n'), 'line 2: unterminated " string')
+
+
+
+
+
+
+
+
+############################################################
+# StagedConfigTests
+############################################################
+
+class StagedConfigTests(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.location = os.path.join(self.directory, 'Caddyfile')
+        with open(self.location, 'w') as file:
+            file.write('good {\n}\n')
+        self.staged = StagedConfig('hosting-users-caddy', lambda: self.location)
+
+    def live(self):
+        with open(self.location) as file:
+            return file.read()
+
+    def test_a_rejected_candidate_touches_nothing(self):
+        reloads = []
+        self.assertEqual(self.staged.apply('broken {\n', lambda: reloads.append(1) or True), 'invalid')
+        self.assertEqual((self.live(), reloads), ('good {\n}\n', []))
+        self.assertEqual(os.listdir(self.directory), ['Caddyfile'])           # the candidate is gone
+
+    def test_a_refused_reload_restores_the_last_good_file(self):
+        self.assertEqual(self.staged.apply('other {\n}\n', lambda: False), 'failed')
+        self.assertEqual(self.live(), 'good {\n}\n')                          # the file it started from
+
+        self.assertEqual(self.staged.apply('next {\n}\n', lambda: True), 'reloaded')
+        self.assertEqual(self.staged.apply('last {\n}\n', lambda: False), 'failed')
+        self.assertEqual(self.live(), 'next {\n}\n')                          # what the last reload loaded
+
+    def test_caddy_validate_runs_once_per_content(self):
+        with patch.dict(os.environ, {'CADDY_VALIDATE': 'caddy'}), FakeDockerSocket({
+                 ('POST', r'/containers/[^/]+/exec'): (201, {'Id': 'exec1'}),
+                 ('POST', r'/exec/exec1/start'): (200, b''),
+                 ('GET', r'/exec/exec1/json'): (200, {'ExitCode': 0}),
+             }) as daemon:
+            for _ in range(3):
+                self.assertEqual(self.staged.apply('other {\n}\n', lambda: True), 'reloaded')
+
+        validations = [body['Cmd'] for method, path, _, body in daemon.calls if path.endswith('/exec')]
+        self.assertEqual(len(validations), 1)
+        self.assertEqual(validations[0][:4], ['caddy', 'validate', '--adapter', 'caddyfile'])
+        self.assertRegex(validations[0][5], r'^/etc/caddy/\.Caddyfile-')     # the candidate, as the container sees it
+
+    def test_a_config_caddy_rejects_is_remembered(self):
+        with patch.dict(os.environ, {'CADDY_VALIDATE': 'caddy'}), FakeDockerSocket({
+                 ('POST', r'/containers/[^/]+/exec'): (201, {'Id': 'exec1'}),
+                 ('POST', r'/exec/exec1/start'): (200, b'unrecognized directive: reverse_prixy'),
+                 ('GET', r'/exec/exec1/json'): (200, {'ExitCode': 1}),
+             }) as daemon:
+            self.assertEqual(self.staged.apply('typo {\n}\n', lambda: True), 'invalid')
+            self.assertEqual(self.staged.apply('typo {\n}\n', lambda: True), 'invalid')
+
+        self.assertEqual(len(daemon.calls), 3)                                # one exec: create, start, inspect
+        self.assertEqual(self.live(), 'good {\n}\n')
@@ -2,17 +2,29 @@
 #  [*] Status contract tests — the docker ps reshaping
 #
 #  The monitor stores these fields verbatim and the UI
-#  renders them — the legacy CLI shape is a contract.
+#  renders them — the legacy CLI shape is a contract, for
+#  the single-daemon route and the batch alike.
 #
 #  Convention: one banner per test class; test methods carry
 #  descriptive names instead of banners.
 ############################################################
 
 import json
+import os
+import shutil
+import socketserver
+import tempfile
+import threading
 import time
 import unittest
+import urllib.parse
+from http.server import BaseHTTPRequestHandler
 from unittest.mock import patch
 
+import requests
+
+from app.common import http_pool
+
 from tests.helpers import fake_response, make_client
 
 
@@ -53,9 +65,10 @@ class StatusValidationTests(unittest.TestCase):
 ############################################################
 #
 # One fake Docker-API container in, the legacy CLI fields
-# out. The fixtures pick values that pin every branch of the
-# reshaping: port notations, volume counting, label joining,
-# command quoting and the (real) UTC timestamp.
+# out (and their structured forms). The fixtures pick values
+# that pin every branch of the reshaping: port notations,
+# volume counting, label joining, command quoting and the
+# (real) UTC timestamp.
 ############################################################
 
 class StatusReshapingTests(unittest.TestCase):
@@ -89,8 +102,7 @@ class StatusReshapingTests(unittest.TestCase):
         return container
 
     def fetch_host(self, containers):
-        with patch('app.status.routes.requests_unixsocket.Session') as sessionMock:
-            sessionMock.return_value.get.return_value = fake_response(200, json.dumps(containers))
+        with patch('app.status.routes.host_session.get', return_value=fake_response(200, json.dumps(containers))):
             return self.client.get('/api/status/host')
 
     def test_legacy_shape(self):
@@ -108,6 +120,17 @@ class StatusReshapingTests(unittest.TestCase):
         self.assertEqual(container['Size'], 'N/A')
         self.assertEqual(container['CreatedAt'], '1970-01-01 00:00:00 +0000 UTC')   # real UTC
 
+    def test_structured_forms_ride_along(self):
+        container = self.fetch_host([self.api_container()]).get_json()['containers'][0]
+
+        self.assertEqual(container['LabelMap'], {'com.docker.compose.project': 'web', 'x': 'y'})
+        self.assertEqual(container['NetworkList'], ['net-a', 'net-b'])
+        self.assertEqual(container['PortList'], [
+            {'ip': '0.0.0.0', 'public': 8080, 'private': 80, 'type': 'tcp'},
+            {'ip': '::', 'public': 8080, 'private': 80, 'type': 'tcp'},
+            {'ip': '', 'public': None, 'private': 5432, 'type': 'tcp'},
+        ])
+
     def test_running_for_buckets(self):
         now = time.time()
         cases = [
@@ -121,7 +144,7 @@ class StatusReshapingTests(unittest.TestCase):
             self.assertIn(expected, payload['containers'][0]['RunningFor'])
 
     def test_vm_path_uses_the_dockersocket_proxy_with_the_id_cookie(self):
-        with patch('app.status.routes.requests.get') as getMock:
+        with patch('app.status.routes.proxy_session.get') as getMock:
             getMock.return_value = fake_response(200, json.dumps([]))
             response = self.client.get('/api/status/hosting-users-dind-133')
 
@@ -132,8 +155,143 @@ class StatusReshapingTests(unittest.TestCase):
         self.assertEqual(kwargs['cookies'], {'virtual-server-id': '133'})
 
     def test_upstream_error_passes_through(self):
-        with patch('app.status.routes.requests.get') as getMock:
+        with patch('app.status.routes.proxy_session.get') as getMock:
             getMock.return_value = fake_response(500, 'boom')
             response = self.client.get('/api/status/hosting-users-dind-133')
 
         self.assertIn('Error from hosting-users-dind-133: 500', response.get_json()['error'])
+
+
+
+
+
+
+
+
+############################################################
+# StatusBatchTests
+############################################################
+#
+# POST /api/status/batch: one document keyed by VM, every
+# failure confined to its own entry, "running" resolved on
+# the host daemon, and a malformed body the only 400.
+############################################################
+
+class StatusBatchTests(unittest.TestCase):
+
+    def setUp(self):
+        self.client = make_client()
+
+    @staticmethod
+    def fake_inner_daemon(url, cookies, timeout):
+        vm_id = cookies['virtual-server-id']
+        if vm_id == '2':
+            raise requests.Timeout('read timed out')
+        if vm_id == '3':
+            return fake_response(502, 'bad gateway')
+        return fake_response(200, json.dumps([StatusReshapingTests.api_container(Id=f'c{vm_id}')]))
+
+    def test_entries_are_keyed_by_vm_and_errors_stay_per_vm(self):
+        with patch('app.status.routes.proxy_session.get', side_effect=self.fake_inner_daemon):
+            response = self.client.post('/api/status/batch', json={'vms': [
+                'hosting-users-dind-1', 'hosting-users-dind-2', 'hosting-users-dind-3', 'abc',
+            ]})
+            payload = response.get_json()       # streamed — read while the patch is live
+
+        self.assertEqual(response.status_code, 200)
+        entries = payload['vms']
+        self.assertEqual(entries['hosting-users-dind-1']['containers'][0]['ID'], 'c1')
+        self.assertTrue(entries['hosting-users-dind-2']['timed_out'])
+        self.assertEqual(entries['hosting-users-dind-3']['error'], 'Error from hosting-users-dind-3: 502')
+        self.assertEqual(entries['abc']['error'], 'abc is not a VM container name')
+        self.assertIn('elapsed_ms', payload)
+
+    def test_a_slow_reader_loses_no_finished_entry(self):
+        names = [f'hosting-users-dind-{n}' for n in range(8)]
+        with patch('app.status.routes.proxy_session.get', side_effect=self.fake_inner_daemon), \
+             patch('app.status.routes.BATCH_VM_TIMEOUT', 0.05):
+            response = self.client.post('/api/status/batch', json={'vms': names}, buffered=False)
+            chunks = []
+            for chunk in response.response:
+                time.sleep(0.2)         # outlasts the 1.05 s budget over the batch
+                chunks.append(chunk if isinstance(chunk, str) else chunk.decode())
+
+        entries = json.loads(''.join(chunks))['vms']
+        self.assertEqual(sorted(entries), names)
+        self.assertFalse(any(entry.get('timed_out') for name, entry in entries.items() if name != 'hosting-users-dind-2'))
+
+    def test_running_lists_the_dinds_on_the_host_daemon(self):
+        host_list = [{'Names': ['/hosting-users-dind-1']}, {'Names': ['/hosting-users-dind-x']}]
+        with patch('app.status.routes.host_session.get', return_value=fake_response(200, json.dumps(host_list))) as hostMock, \
+             patch('app.status.routes.proxy_session.get', side_effect=self.fake_inner_daemon):
+            payload = self.client.post('/api/status/batch', json={'vms': 'running'}).get_json()
+
+        self.assertEqual(list(payload['vms']), ['hosting-users-dind-1'])
+        filters = json.loads(hostMock.call_args.kwargs['params']['filters'])
+        self.assertEqual(filters['status'], ['running'])
+
+    def test_malformed_body_is_400(self):
+        response = self.client.post('/api/status/batch', json={'vms': 'everything'})
+        self.assertEqual(response.status_code, 400)
+
+
+
+
+
+
+
+
+############################################################
+# PoolReuseTests
+############################################################
+#
+# The host-daemon session against a real unix socket: calls
+# to DIFFERENT paths share one kept-alive connection, and the
+# counters behind /api/poolstats say so.
+############################################################
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'[]')
+
+    def log_message(self, *args):
+        pass
+
+
+
+class UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ('local', 0)
+
+
+
+class PoolReuseTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.tmp, 'docker.sock')
+        self.server = UnixHTTPServer(self.socket_path, KeepAliveHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f'http+unix://{urllib.parse.quote(self.socket_path, safe="")}'
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp)
+
+    def test_host_calls_share_one_connection_across_paths(self):
+        before = http_pool.pool_stats()
+        for path in ['/containers/json', '/containers/abc/json', '/version']:
+            self.assertEqual(http_pool.host_session.get(f'{self.base_url}{path}', timeout=2).text, '[]')
+
+        payload = make_client().get('/api/poolstats').get_json()
+        self.assertEqual(payload['requests'] - before['requests'], 3)
+        self.assertEqual(payload['opened'] - before['opened'], 1)
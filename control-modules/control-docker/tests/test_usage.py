@@ -1,14 +1,31 @@
 ############################################################
-#  [*] Usage contract tests — the du sweep
+#  [*] Usage contract tests — the incremental disk sweep
+#
+#  Real directory trees in a temp dir: the totals must match
+#  what is on disk, and a second sweep must re-list only the
+#  directories that changed.
 #
 #  Convention: one banner per test class; test methods carry
 #  descriptive names instead of banners.
 ############################################################
 
+import json
+import os
+import shutil
+import tempfile
+import time
 import unittest
 from unittest.mock import patch
 
-from tests.helpers import fake_process, make_client
+from app.usage import disk_index
+from tests.helpers import make_client
+
+
+
+def write_file(path, size):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
 
 
 
@@ -20,39 +37,142 @@ from tests.helpers import fake_process, make_client
 ############################################################
 # DiskUsageTests
 ############################################################
+#
+# The route: mount guard, live-directory selection and the
+# NDJSON line per VM with its totals + split — measured
+# across real worker processes.
+############################################################
 
 class DiskUsageTests(unittest.TestCase):
 
     def setUp(self):
         self.client = make_client()
+        self.tmp = tempfile.mkdtemp()
+        self.servers = os.path.join(self.tmp, 'SERVERS')
+        self.index = os.path.join(self.tmp, 'index')
+        os.makedirs(self.index)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
 
     def test_unmounted_servers_dir_is_500(self):
-        with patch('app.usage.routes.os.path.isdir', return_value=False):
+        with patch('app.usage.routes.SERVERS_DIR', os.path.join(self.tmp, 'missing')):
             response = self.client.get('/api/usage/disk')
         self.assertEqual(response.status_code, 500)
         self.assertEqual(response.get_json()['message'], 'SERVERS is not mounted')
 
-    def test_only_live_numeric_dirs_are_measured(self):
-        # The route iterates sorted() names — STRING order, so
-        # '133' is measured before '7'
-        listing = ['7', '12-deleted-20260101120000', 'junk', '133']
-        duResults = [fake_process(0, b'99999\t/SERVERS/133\n'),
-                     fake_process(0, b'12345\t/SERVERS/7\n')]
-
-        with patch('app.usage.routes.os.path.isdir', return_value=True), \
-             patch('app.usage.routes.os.listdir', return_value=listing), \
-             patch('app.usage.routes.Popen', side_effect=duResults) as popenMock:
-            payload = self.client.get('/api/usage/disk').get_json()
-
-        self.assertEqual(payload['usage'], {'133': 99999, '7': 12345})
-        measured = [call.args[0][2] for call in popenMock.call_args_list]
-        self.assertEqual(measured, ['/SERVERS/133', '/SERVERS/7'])
-
-    def test_unreadable_du_output_is_skipped_not_fatal(self):
-        with patch('app.usage.routes.os.path.isdir', return_value=True), \
-             patch('app.usage.routes.os.listdir', return_value=['7', '8']), \
-             patch('app.usage.routes.Popen', side_effect=[fake_process(1, b''),
-                                                          fake_process(0, b'not-a-number\n')]):
-            payload = self.client.get('/api/usage/disk').get_json()
-
-        self.assertEqual(payload['usage'], {})
+    def stream(self):
+        with patch('app.usage.routes.SERVERS_DIR', self.servers), \
+             patch('app.usage.routes.iter_sweep',
+                   lambda servers_dir: disk_index.iter_sweep(servers_dir, self.index, workers=2)):
+            response = self.client.get('/api/usage/disk')
+            self.assertEqual(response.mimetype, 'application/x-ndjson')
+            return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+    def test_only_live_numeric_dirs_are_measured_with_the_split(self):
+        write_file(os.path.join(self.servers, '7', 'apps', 'site', 'index.html'), 1000)
+        write_file(os.path.join(self.servers, '7', 'docker', 'overlay2', 'l1', 'blob'), 5000)
+        write_file(os.path.join(self.servers, '12-deleted-20260101120000', 'apps', 'x'), 10)
+        os.makedirs(os.path.join(self.servers, 'junk'))
+
+        lines = self.stream()
+
+        self.assertEqual([line['id'] for line in lines], ['7'])
+        line = lines[0]
+        dir_bytes = lambda *parts: os.lstat(os.path.join(self.servers, '7', *parts)).st_size
+        self.assertEqual(line['apps'], 1000 + dir_bytes('apps') + dir_bytes('apps', 'site'))
+        self.assertEqual(line['docker'], 5000 + dir_bytes('docker') + dir_bytes('docker', 'overlay2')
+                         + dir_bytes('docker', 'overlay2', 'l1'))
+        self.assertEqual(line['bytes'], line['apps'] + line['docker'] + line['other'])
+        self.assertIn('elapsed_ms', line)
+        self.assertTrue(os.path.exists(os.path.join(self.index, '7.json')))
+
+    def test_one_line_per_vm_as_each_finishes(self):
+        for vm_id in ['3', '5', '9']:
+            write_file(os.path.join(self.servers, vm_id, 'apps', 'f'), int(vm_id))
+
+        lines = self.stream()
+        self.assertEqual(sorted(line['id'] for line in lines), ['3', '5', '9'])
+
+
+
+
+
+
+
+
+############################################################
+# DiskIndexTests
+############################################################
+#
+# The incremental part, in-process: unchanged trees are not
+# re-listed, a new file re-lists only its directory, a large
+# file growing in place is seen on the next sweep, the
+# periodic full rescan catches small ones, and index files
+# of vanished VMs are dropped.
+############################################################
+
+class DiskIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.servers = os.path.join(self.tmp, 'SERVERS')
+        self.index = os.path.join(self.tmp, 'index')
+        os.makedirs(self.index)
+        for n in range(3):
+            write_file(os.path.join(self.servers, '7', 'apps', f'd{n}', 'f'), 100)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def sweep_vm(self, vm_id='7'):
+        return disk_index.sweep(self.servers, self.index, workers=0)[vm_id]
+
+    def test_unchanged_tree_is_not_listed_again(self):
+        first = self.sweep_vm()
+        second = self.sweep_vm()
+
+        self.assertTrue(first['full'])
+        self.assertFalse(second['full'])
+        self.assertEqual(second['dirs_scanned'], 0)
+        self.assertEqual(second['dirs_reused'], first['dirs_scanned'])
+        self.assertEqual(second['bytes'], first['bytes'])
+
+    def test_new_file_relists_only_its_directory(self):
+        first = self.sweep_vm()
+        time.sleep(0.01)                                   # mtime_ns must move
+        write_file(os.path.join(self.servers, '7', 'apps', 'd1', 'g'), 50)
+        second = self.sweep_vm()
+
+        self.assertEqual(second['dirs_scanned'], 1)
+        self.assertEqual(second['apps'], first['apps'] + 50)
+
+    def test_full_rescan_catches_in_place_growth(self):
+        first = self.sweep_vm()
+        write_file(os.path.join(self.servers, '7', 'apps', 'd0', 'f'), 300)     # same name, bigger
+
+        stale = self.sweep_vm()
+        self.assertEqual((stale['dirs_scanned'], stale['apps']), (0, first['apps']))   # invisible to mtime...
+
+        rescanned = disk_index.measure_tree(os.path.join(self.servers, '7'),
+                                            os.path.join(self.index, '7.json'), full_rescan_seconds=0)
+        self.assertTrue(rescanned['full'])
+        self.assertEqual(rescanned['apps'], first['apps'] + 200)                      # ...until the full rescan
+
+    def test_a_large_file_growing_in_place_is_seen_next_sweep(self):
+        root, path = os.path.join(self.servers, '7'), os.path.join(self.index, '7.json')
+        first = disk_index.measure_tree(root, path, tracked_file_bytes=100)
+        with open(os.path.join(root, 'apps', 'd0', 'f'), 'ab') as f:           # appended, like a log
+            f.write(b'x' * 200)
+
+        second = disk_index.measure_tree(root, path, tracked_file_bytes=100)
+        self.assertEqual(second['dirs_scanned'], 0)                             # no directory re-listed...
+        self.assertEqual(second['apps'], first['apps'] + 200)                   # ...the growth still counted
+
+    def test_index_of_a_vanished_vm_is_dropped(self):
+        self.sweep_vm()
+        shutil.rmtree(os.path.join(self.servers, '7'))
+        os.makedirs(os.path.join(self.servers, '8'))
+        disk_index.sweep(self.servers, self.index, workers=0)
+
+        self.assertEqual(sorted(os.listdir(self.index)), ['8.json'])
@@ -1,10 +1,12 @@
 ############################################################
 #  [*] Lifecycle contract tests — start/stop/delete/create
 #
-#  Every docker/rm/mv invocation is a mocked Popen — the
-#  tests assert the exact argv the routes would run and the
-#  status codes the backend's callers key on (200 success,
-#  400 validation, 500 operation failure).
+#  The docker side runs against a FakeDockerSocket (the real
+#  Engine API client, a scripted daemon); the data-directory
+#  rm/mv of a delete are mocked Popens. The tests assert the
+#  exact calls the routes make and the status codes the
+#  backend's callers key on (200 success, 400 validation,
+#  500 operation failure).
 #
 #  Convention: one banner per test class; test methods carry
 #  descriptive names instead of banners.
@@ -13,7 +15,7 @@
 import unittest
 from unittest.mock import patch
 
-from tests.helpers import fake_process, make_client
+from tests.helpers import FakeDockerSocket, fake_process, make_client
 
 
 
@@ -55,31 +57,49 @@ class ValidationTests(unittest.TestCase):
 # StartStopTests
 ############################################################
 
+EXEC_ROUTES = {
+    ('POST', r'/containers/[^/]+/exec'): (201, {'Id': 'exec1'}),
+    ('POST', r'/exec/exec1/start'): (200, b''),
+}
+
+
+
 class StartStopTests(unittest.TestCase):
 
     def setUp(self):
         self.client = make_client()
 
-    def test_start_success_and_argv(self):
-        with patch('app.virtual_servers.routes.Popen', return_value=fake_process(0)) as popenMock:
+    def test_start_success_and_call(self):
+        with FakeDockerSocket({('POST', r'/containers/[^/]+/start'): (204, None)}) as daemon:
             response = self.client.get('/api/start/hosting-users-dind-7')
 
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.get_json()['message'], 'hosting-users-dind-7 started')
-        popenMock.assert_called_once_with(['docker', 'start', 'hosting-users-dind-7'])
+        self.assertEqual(daemon.paths(), ['/containers/hosting-users-dind-7/start'])
+
+    def test_already_running_or_stopped_is_success(self):
+        with FakeDockerSocket({('POST', r'/containers/[^/]+/(start|stop)'): (304, None)}):
+            self.assertEqual(self.client.get('/api/start/hosting-users-dind-7').status_code, 200)
+            self.assertEqual(self.client.get('/api/stop/hosting-users-dind-7').status_code, 200)
 
     def test_failures_are_500(self):
-        with patch('app.virtual_servers.routes.Popen', return_value=fake_process(1)):
+        with FakeDockerSocket({
+            ('POST', r'/containers/[^/]+/(start|stop)'): (500, {'message': 'boom'}),
+            **EXEC_ROUTES,
+            ('GET', r'/exec/exec1/json'): (200, {'ExitCode': 1}),
+        }):
             self.assertEqual(self.client.get('/api/start/hosting-users-dind-7').status_code, 500)
             self.assertEqual(self.client.get('/api/stop/hosting-users-dind-7').status_code, 500)
             self.assertEqual(self.client.get('/api/cleanup/hosting-users-dind-7').status_code, 500)
 
     def test_cleanup_prunes_inside_the_vm(self):
-        with patch('app.virtual_servers.routes.Popen', return_value=fake_process(0)) as popenMock:
-            self.client.get('/api/cleanup/hosting-users-dind-7')
+        with FakeDockerSocket({**EXEC_ROUTES, ('GET', r'/exec/exec1/json'): (200, {'ExitCode': 0})}) as daemon:
+            response = self.client.get('/api/cleanup/hosting-users-dind-7')
 
-        popenMock.assert_called_once_with(
-            ['docker', 'exec', 'hosting-users-dind-7', 'docker', 'system', 'prune', '-a', '-f', '--volumes'])
+        self.assertEqual(response.status_code, 200)
+        method, path, _, body = daemon.calls[0]
+        self.assertEqual(path, '/containers/hosting-users-dind-7/exec')
+        self.assertEqual(body['Cmd'], ['docker', 'system', 'prune', '-a', '-f', '--volumes'])
 
 
 
@@ -103,35 +123,48 @@ class DeleteTests(unittest.TestCase):
     def setUp(self):
         self.client = make_client()
 
-    def run_delete(self, stepReturncodes, inspectReturncode):
-        # Order: stop, rm, rm -rf, mv, docker inspect
-        processes = [fake_process(rc) for rc in stepReturncodes] + [fake_process(inspectReturncode)]
-        with patch('app.virtual_servers.routes.Popen', side_effect=processes) as popenMock:
+    def run_delete(self, stop, remove, inspect):
+        routes = {
+            ('POST', r'/containers/[^/]+/stop'): stop,
+            ('DELETE', r'/containers/[^/]+'): remove,
+            ('GET', r'/containers/[^/]+/json'): inspect,
+        }
+        # Popen order: rm -rf, mv
+        with FakeDockerSocket(routes) as daemon, \
+             patch('app.virtual_servers.routes.DELETE_WAIT_SECONDS', 0.05), \
+             patch('app.virtual_servers.routes.Popen', side_effect=[fake_process(0), fake_process(0)]) as popenMock:
             response = self.client.get('/api/delete/hosting-users-dind-7')
-        return response, popenMock
+        return response, daemon, popenMock
 
     def test_success_archives_the_data_directory(self):
-        response, popenMock = self.run_delete([0, 0, 0, 0], inspectReturncode=1)
+        response, daemon, popenMock = self.run_delete(
+            stop=(204, None), remove=(204, None), inspect=(404, {'message': 'No such container'}))
         self.assertEqual(response.status_code, 200)
 
+        self.assertEqual([(method, path) for method, path, _, _ in daemon.calls], [
+            ('POST', '/containers/hosting-users-dind-7/stop'),
+            ('DELETE', '/containers/hosting-users-dind-7'),
+            ('GET', '/containers/hosting-users-dind-7/json'),
+        ])
         argvs = [call.args[0] for call in popenMock.call_args_list]
-        self.assertEqual(argvs[0][:2], ['docker', 'stop'])
-        self.assertEqual(argvs[1][:2], ['docker', 'rm'])
-        self.assertEqual(argvs[2][:2], ['rm', '-rf'])
-        self.assertTrue(argvs[2][2].endswith('/SERVERS/7/docker'))
-        self.assertEqual(argvs[3][0], 'mv')
-        self.assertTrue(argvs[3][1].endswith('/SERVERS/7'))
-        self.assertIn('/SERVERS/7-deleted-', argvs[3][2])
-        self.assertEqual(argvs[4][:2], ['docker', 'inspect'])
+        self.assertEqual(argvs[0][:2], ['rm', '-rf'])
+        self.assertTrue(argvs[0][2].endswith('/SERVERS/7/docker'))
+        self.assertEqual(argvs[1][0], 'mv')
+        self.assertTrue(argvs[1][1].endswith('/SERVERS/7'))
+        self.assertIn('/SERVERS/7-deleted-', argvs[1][2])
 
     def test_half_broken_vm_is_still_deletable(self):
-        # Container already gone: stop and rm fail, inspect
-        # confirms absence → the delete still counts as done
-        response, _ = self.run_delete([1, 1, 0, 0], inspectReturncode=1)
+        # Container already gone: stop fails, rm answers 404,
+        # inspect confirms absence → the delete still counts
+        response, _, _ = self.run_delete(
+            stop=(404, {'message': 'No such container'}), remove=(404, {'message': 'No such container'}),
+            inspect=(404, {'message': 'No such container'}))
         self.assertEqual(response.status_code, 200)
 
     def test_surviving_container_fails_the_operation(self):
-        response, _ = self.run_delete([0, 1, 0, 0], inspectReturncode=0)
+        response, _, _ = self.run_delete(
+            stop=(204, None), remove=(409, {'message': 'removal in progress'}),
+            inspect=(200, {'State': {'Status': 'exited'}}))
         self.assertEqual(response.status_code, 500)
         self.assertIn('Failed to delete', response.get_json()['error'])
 
@@ -151,21 +184,26 @@ class CreateTests(unittest.TestCase):
     def setUp(self):
         self.client = make_client()
 
-    def test_create_argv_pins_the_platform_contract(self):
-        with patch('app.virtual_servers.routes.Popen', return_value=fake_process(0)) as popenMock:
+    def test_create_config_pins_the_platform_contract(self):
+        with FakeDockerSocket({
+            ('POST', r'/containers/create'): (201, {'Id': 'abc', 'Warnings': []}),
+            ('POST', r'/containers/[^/]+/start'): (204, None),
+        }) as daemon:
             response = self.client.get('/api/create/hosting-users-dind-42')
 
         self.assertEqual(response.status_code, 200)
-        argv = popenMock.call_args.args[0]
-        self.assertEqual(argv[:3], ['docker', 'run', '-d'])
-        self.assertIn('hosting-users-dind-42', argv)          # --name
-        self.assertIn('server42', argv)                       # --hostname
-        self.assertIn('--runtime=sysbox-runc', argv)
-        self.assertTrue(any(v.endswith('/SERVERS/42/apps:/apps') for v in argv))
-        self.assertTrue(any(v.endswith('/SERVERS/42/docker:/var/lib/docker') for v in argv))
-        self.assertIn('filtered-users', argv)
-        self.assertEqual(argv[-1], 'hosting-dind-ubuntu')
-
-    def test_failed_run_is_500(self):
-        with patch('app.virtual_servers.routes.Popen', return_value=fake_process(1)):
+        (_, createPath, query, config), (_, startPath, _, _) = daemon.calls
+        self.assertEqual(query, {'name': 'hosting-users-dind-42'})
+        self.assertEqual(config['Hostname'], 'server42')
+        self.assertEqual(config['Image'], 'hosting-dind-ubuntu')
+        host = config['HostConfig']
+        self.assertEqual(host['Runtime'], 'sysbox-runc')
+        self.assertTrue(any(b.endswith('/SERVERS/42/apps:/apps') for b in host['Binds']))
+        self.assertTrue(any(b.endswith('/SERVERS/42/docker:/var/lib/docker') for b in host['Binds']))
+        self.assertEqual(host['NetworkMode'], 'filtered-users')
+        self.assertEqual(host['RestartPolicy'], {'Name': 'unless-stopped'})
+        self.assertEqual(startPath, '/containers/hosting-users-dind-42/start')
+
+    def test_failed_create_is_500(self):
+        with FakeDockerSocket({('POST', r'/containers/create'): (409, {'message': 'name in use'})}):
             self.assertEqual(self.client.get('/api/create/hosting-users-dind-42').status_code, 500)
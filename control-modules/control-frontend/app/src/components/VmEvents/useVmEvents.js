@@ -0,0 +1,61 @@
+// -----------------------------------------------------------
+//  [*] useVmEvents — the VM state stream (SSE)
+//
+//    const streaming = useVmEvents(params, {
+//      snapshot: (cards) => ..., vm: (card) => ...,
+//      removed: ({ id }) => ...,
+//    })
+//
+//  Opens /api/vm/events (params become the query string —
+//  showOtherUsers / virtualServerID, like /api/vm) and hands
+//  every event to its handler: a snapshot of every card the
+//  caller may see on connect, then one card per change and
+//  a removal when a VM is gone. The backend's monitor sends
+//  a change within a pass of it happening.
+//
+//  Returns true while the stream is open — callers switch
+//  their polling off then and back on when it drops, so a
+//  browser without EventSource, a 503 (stream limit) or a
+//  monitor restart only means "back to polling". The browser
+//  reconnects by itself and resumes from the last event id.
+//
+//  Used by:
+//    - VirtualServersTable — the card grid
+//    - VirtualServer — the detail page
+// -----------------------------------------------------------
+
+import { useState, useRef, useEffect } from "react";
+
+
+export default function useVmEvents(params, handlers) {
+
+  const [streaming, setStreaming] = useState(false);
+
+  // The latest handlers without reopening the stream
+  const handlersRef = useRef(handlers);
+  handlersRef.current = handlers;
+
+  const query = new URLSearchParams(params).toString();
+
+  useEffect(() => {
+    if (typeof EventSource === "undefined") return;
+
+    const source = new EventSource(`/api/vm/events?${query}`, { withCredentials: true });
+    source.onopen = () => setStreaming(true);
+    source.onerror = () => setStreaming(false);
+
+    const listen = (eventName, handlerName) =>
+      source.addEventListener(eventName, (event) =>
+        handlersRef.current[handlerName]?.(JSON.parse(event.data)));
+    listen("snapshot", "snapshot");
+    listen("vm", "vm");
+    listen("vm-removed", "removed");
+
+    return () => {
+      source.close();
+      setStreaming(false);
+    };
+  }, [query]);
+
+  return streaming;
+}
@@ -9,8 +9,9 @@
 //  table (Domain Names) and the port forward table (Port
 //  Forwarding) — the open tab lives in the URL (?tab=domains
 //  / ?tab=ports). The data lives in useVirtualServer
-//  (5-second poll; 401 bounces to "/"); until it arrives the
-//  page renders as a skeleton.
+//  (the VM state stream, a 5-second poll while it is down;
+//  401 bounces to "/"); until it arrives the page renders as
+//  a skeleton.
 //
 //  The tool cards open the per-VM admin services (Dockge,
 //  File Browser, SSH terminal) on port 8443 — a
@@ -53,6 +54,7 @@ import toast from "react-hot-toast";
 
 import { useTranslations } from "@/i18n";
 import UsageStats from "@/components/UsageStats/UsageStats";
+import useVmEvents from "@/components/VmEvents/useVmEvents";
 import DomainsListTable from "./DomainsListTable/DomainsListTable";
 import PortForwardsListTable from "./PortForwardsListTable/PortForwardsListTable";
 
@@ -86,7 +88,8 @@ import CloseIcon from "@mui/icons-material/Close";
 //     useVirtualServer(virtualServerID)
 //
 // The backend side of the page: the VM record as a TanStack
-// query polled every 5 seconds, plus the start/stop and
+// query kept current by the VM state stream (polled every 5
+// seconds while the stream is down), plus the start/stop and
 // rename actions. Every action invalidates the query on
 // completion, so the page updates immediately instead of on
 // the next poll; action results land in toasts.
@@ -108,10 +111,18 @@ function useVirtualServer(virtualServerID) {
   const t = useTranslations("PAGES.vmDetail");
   const queryClient = useQueryClient();
 
+  // The stream writes the card straight into the query; a
+  // removal refetches, which answers the 401/404 below
+  const streaming = useVmEvents({ virtualServerID }, {
+    snapshot: (cards) => cards[0] && queryClient.setQueryData(['vm', virtualServerID], cards[0]),
+    vm: (card) => queryClient.setQueryData(['vm', virtualServerID], card),
+    removed: () => queryClient.invalidateQueries({ queryKey: ['vm', virtualServerID] }),
+  });
+
   const { data: vmData = null, error } = useQuery({
     queryKey: ['vm', virtualServerID],
     queryFn: async () => (await axios.get(`/api/vm/${virtualServerID}`)).data,
-    refetchInterval: 5000,
+    refetchInterval: streaming ? false : 5000,
     retry: false,
   });
 
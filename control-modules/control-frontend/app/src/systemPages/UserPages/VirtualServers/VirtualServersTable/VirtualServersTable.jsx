@@ -5,8 +5,9 @@
 //  admin-only "Show other users" switch, the search box and
 //  the New Server button, then one card per VM. The data and
 //  the start/stop/delete actions live in useVirtualServers
-//  (3-second poll, invalidation after every action); the
-//  first load renders skeleton cards.
+//  (the VM state stream, a 3-second poll while it is down,
+//  invalidation after every action); the first load renders
+//  skeleton cards.
 //
 //  Search matches VM name, owner email, VM id, domain names,
 //  public forward ports and container/stack names; the search
@@ -57,6 +58,7 @@ import IOSSwitch from "@/components/IOSSwitch/IOSSwitch";
 import { LongPressIconButton } from "@/components/LongPressButton";
 import PageTitle from "@/components/PageTitle/PageTitle";
 import UsageStats from "@/components/UsageStats/UsageStats";
+import useVmEvents from "@/components/VmEvents/useVmEvents";
 import AddNewVM from "./AddNewVM/AddNewVM";
 
 import AddCircleOutlinedIcon from "@mui/icons-material/AddCircleOutlined";
@@ -87,8 +89,11 @@ import ContentCopyIcon from "@mui/icons-material/ContentCopy";
 //     useVirtualServers(showOtherUsers)
 //
 // The backend side of the page: the VM list as a TanStack
-// query polled every 3 seconds (sorted by id), plus the
-// start/stop and delete actions. Actions fire the POST, toast
+// query (sorted by id) kept current by the VM state stream —
+// snapshot and per-VM changes are written straight into the
+// query data; only while the stream is down is the list
+// polled every 3 seconds — plus the start/stop and delete
+// actions. Actions fire the POST, toast
 // immediately, and invalidate the list once the backend
 // accepts — so the state flips as soon as possible instead of
 // on the next poll.
@@ -110,15 +115,26 @@ function useVirtualServers(showOtherUsers) {
   const t = useTranslations("PAGES.vmList");
   const queryClient = useQueryClient();
 
+  const queryKey = ['vms', showOtherUsers];
+  const sortById = (list) => list.sort((a, b) => a.id - b.id);
+
+  const streaming = useVmEvents({ showOtherUsers: showOtherUsers.toString() }, {
+    snapshot: (cards) => queryClient.setQueryData(queryKey, sortById(cards)),
+    vm: (card) => queryClient.setQueryData(queryKey, (old = []) =>
+      sortById([...old.filter((vm) => vm.id !== card.id), card])),
+    removed: ({ id }) => queryClient.setQueryData(queryKey, (old = []) =>
+      old.filter((vm) => vm.id !== id)),
+  });
+
   const { data: vms = [], isPending } = useQuery({
-    queryKey: ['vms', showOtherUsers],
+    queryKey,
     queryFn: async () => {
       const response = await axios.get("/api/vm", {
         params: { showOtherUsers: showOtherUsers.toString() },
       });
-      return response.data.sort((a, b) => a.id - b.id);
+      return sortById(response.data);
     },
-    refetchInterval: 3000,
+    refetchInterval: streaming ? false : 3000,
     placeholderData: keepPreviousData,
   });
 
@@ -130,7 +146,8 @@ function useVirtualServers(showOtherUsers) {
 
 
   // Fire the action and toast right away; the list refreshes
-  // as soon as the backend accepts (and keeps polling anyway)
+  // as soon as the backend accepts (and the stream or the
+  // poll keeps it current after that)
   const startStop = (vm) => {
     const action = vm.state === "running" ? "stop" : "start";
     axios.post("/api/vm/control", { virtualServerID: vm.id, action }).then(refreshVms);
@@ -7,6 +7,10 @@ mkdir -p _DATA/control-backend
 mkdir -p _LOGS/control-backend
 
 
+# Control docker disk index
+mkdir -p _DATA/control-docker/disk-index
+
+
 # Create Docs directories
 mkdir -p _DATA/control-docs/app_data
 mkdir -p _DATA/control-docs/db_data
@@ -25,12 +29,24 @@ mkdir -p _DATA/users-caddy/caddy_config
 mkdir -p _DATA/users-caddy/caddy_data
 mkdir -p _DATA/users-caddy/caddy_logs
 mkdir -p _DATA/users-caddy/certs
-touch _DATA/users-caddy/Caddyfile
+mkdir -p _DATA/users-caddy/etc
+mkdir -p _DATA/users-caddy/admin
+sudo chown 1000:1000 _DATA/users-caddy/admin
+# The Caddyfile moved into etc/ (mounted as a directory)
+if [ -f _DATA/users-caddy/Caddyfile ] && [ ! -f _DATA/users-caddy/etc/Caddyfile ]; then
+    mv _DATA/users-caddy/Caddyfile _DATA/users-caddy/etc/Caddyfile
+fi
+touch _DATA/users-caddy/etc/Caddyfile
 
 # Create users-portforwarder directories
 mkdir -p _DATA/users-portforwarder/caddy_config
 mkdir -p _DATA/users-portforwarder/caddy_data
-touch _DATA/users-portforwarder/Caddyfile
+mkdir -p _DATA/users-portforwarder/etc
+# The Caddyfile moved into etc/ (mounted as a directory)
+if [ -f _DATA/users-portforwarder/Caddyfile ] && [ ! -f _DATA/users-portforwarder/etc/Caddyfile ]; then
+    mv _DATA/users-portforwarder/Caddyfile _DATA/users-portforwarder/etc/Caddyfile
+fi
+touch _DATA/users-portforwarder/etc/Caddyfile
 
 # Create users-dockerhub-cache directory
 mkdir -p _DATA/users-dockerhub-cache